@@ -2,18 +2,39 @@
 Optimized Flask application for Kaong fruit ripeness detection.
 Uses service-oriented architecture for better maintainability and performance.
 """
+import math
 import logging
 from typing import Dict, Any
 from datetime import datetime
 
-from flask import Flask, render_template, request, jsonify
+import time
+
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context, redirect
 from flask_socketio import SocketIO, emit
 
-from config import FLASK_CONFIG, LOGGING_CONFIG, DATABASE_SAVE_CONFIDENCE_LEVEL, CONFIDENCE_THRESHOLD, ensure_directories
-from services.detection_service import DetectionService
+from config import (
+    ADMISSION_CONFIG, ANALYTICS_CONFIG, DB_CONFIG, DEADLINE_CONFIG, DERIVATIVE_CONFIG, FLASK_CONFIG, LOGGING_CONFIG, DATABASE_SAVE_CONFIDENCE_LEVEL,
+    JOB_QUEUE_CONFIG, MODEL_REGISTRY_CONFIG, PROFILING_CONFIG, RETENTION_CONFIG, SAMPLE_MINER_CONFIG, SERVER_CONFIG, STATIC_FILES_CONFIG,
+    ensure_directories
+)
+from services.detection_service import DetectionService, summarize_detections
+from services.model_registry import ModelFileWatcher, ModelRegistryError
+from services.profiling import profiler
+from services.metrics import metrics, HTTP_REQUESTS, HTTP_LATENCY, SOCKETIO_EVENTS, SOCKETIO_LATENCY, JOB_QUEUE_DEPTH
 from services.database_service import DatabaseService, Assessment
+from services.export_service import ExportService, EXPORT_FORMATS
+from services.analytics_service import AnalyticsService, AnalyticsError
+from services.sample_miner import SampleMiner
+from services.retention_service import RetentionService
 from services.image_service import ImageService, ImageValidationError
+from services.derivative_service import DerivativeService, DerivativeError
 from services.bounding_box_service import BoundingBoxService
+from services.storage_backend import validate_key
+from services.static_files import send_image_file
+from services.offload import is_patched, run_before_deadline, run_blocking
+from services.deadline import AFTER_INFERENCE, TIMEOUT_ERROR, Deadline, DeadlineExceeded
+from services.job_queue import JobQueueError, JobResult, ResultRouter, create_job_queue
+from services.admission import AdmissionController, Ticket
 from db_config import init_db
 
 # Configure logging
@@ -30,18 +51,70 @@ ensure_directories()
 # Initialize Flask app
 app = Flask(__name__)
 app.config["SECRET_KEY"] = FLASK_CONFIG['SECRET_KEY']
-socketio = SocketIO(app)
+socketio = SocketIO(
+    app,
+    async_mode=SERVER_CONFIG['async_mode'],
+    # Lets several server processes emit to each other's clients (requires the redis package)
+    message_queue=SERVER_CONFIG['message_queue'] or None,
+    channel=SERVER_CONFIG['channel']
+)
+if SERVER_CONFIG['async_mode'] == 'gevent' and not is_patched():
+    logger.warning("SERVER_ASYNC_MODE=gevent without monkey patching; start the server with serve.py")
+
+
+def emit_job_result(result: JobResult) -> None:
+    """Send a queued camera frame's result to the Socket.IO session it came from."""
+    event = "detection_results" if result.status == 200 else "detection_error"
+    socketio.emit(event, result.body, to=result.sid)
+
 
 # Initialize services
 try:
-    detection_service = DetectionService()
+    # Stateless web node in queue mode: inference_worker.py processes own the model
+    detection_service = None
+    job_router = None
+    if JOB_QUEUE_CONFIG['mode'] == 'queue':
+        job_router = ResultRouter(create_job_queue(), emit_job_result, event_factory=socketio.server.eio.create_event)
+        JOB_QUEUE_DEPTH.set_callback(lambda: {(): job_router.queue.depth()})
+        socketio.start_background_task(job_router.run)
+        logger.info(f"Detection jobs go to the {job_router.queue.name} queue as node {job_router.node_id}")
+    else:
+        detection_service = DetectionService()
+    # Refuse detections early when a client or the node is over its limits
+    admission = AdmissionController(queue_depth=job_router.queue.depth if job_router is not None else None)
     database_service = DatabaseService()
     image_service = ImageService()
-    bounding_box_service = BoundingBoxService()
+    derivative_service = DerivativeService(image_service)
+    bounding_box_service = BoundingBoxService(image_service.storage)
+    export_service = ExportService(database_service)
+    analytics_service = AnalyticsService(ExportService(database_service, chunk_size=ANALYTICS_CONFIG['chunk_size']))
     
-    # Initialize database tables
-    init_db()
+    # Initialize database tables (db_config migrations only apply to MySQL)
+    if DB_CONFIG['backend'] == 'mysql':
+        init_db()
     database_service.create_tables()
+
+    # Watch for retrained models so they can be hot-swapped without a restart
+    model_watcher = None
+    if MODEL_REGISTRY_CONFIG['watch_dir'] and detection_service is not None:
+        model_watcher = ModelFileWatcher(
+            detection_service.registry,
+            MODEL_REGISTRY_CONFIG['watch_dir'],
+            interval=MODEL_REGISTRY_CONFIG['watch_interval'],
+            auto_activate=MODEL_REGISTRY_CONFIG['auto_activate']
+        )
+        model_watcher.start()
+
+    # Collect uncertain production images for the next labelling round
+    sample_miner = None
+    if SAMPLE_MINER_CONFIG['enabled']:
+        sample_miner = SampleMiner(database_service, image_service)
+        sample_miner.start()
+
+    # Expire old assessments and reconcile uploads with the database (manual runs via /admin/retention/run)
+    retention_service = RetentionService(database_service, image_service, derivative_service)
+    if RETENTION_CONFIG['enabled']:
+        retention_service.start()
     
     logger.info("Application services initialized successfully")
     
@@ -50,6 +123,54 @@ except Exception as e:
     raise RuntimeError(f"Service initialization failed: {str(e)}")
 
 
+@app.before_request
+def start_request_trace() -> None:
+    """Start a profiling trace for the request (no-op when profiling is disabled)."""
+    g.request_start = time.perf_counter()
+    g.trace_token = profiler.start_trace(request.endpoint or "unknown")
+
+
+@app.after_request
+def finish_request_trace(response):
+    """Fold the trace into the histograms and expose it as a Server-Timing header."""
+    trace = profiler.finish_trace(g.pop("trace_token", None))
+    if trace is not None and PROFILING_CONFIG['server_timing']:
+        response.headers["Server-Timing"] = trace.server_timing_header()
+
+    # Static assets would swamp the route metrics
+    route = request.endpoint or "unknown"
+    if route != "static":
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+        HTTP_LATENCY.observe(time.perf_counter() - g.pop("request_start", time.perf_counter()), route=route)
+    return response
+
+
+@app.teardown_request
+def release_admission(error=None) -> None:
+    """Free the in-flight slot of an admitted upload, however the request ended."""
+    ticket = g.pop("admission_ticket", None)
+    if ticket is not None:
+        ticket.release()
+
+
+def _client_address() -> str:
+    """Client IP for per-client limits; X-Forwarded-For is only trusted behind a known proxy."""
+    if ADMISSION_CONFIG['trust_forwarded_for']:
+        forwarded = ",".join(request.headers.getlist("X-Forwarded-For"))
+        if forwarded.strip():
+            # The rightmost entry is the one our proxy appended; anything before it came from the client
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.remote_addr or "unknown"
+
+
+def _refusal_response(ticket: Ticket):
+    """429 with a Retry-After hint for a refused upload."""
+    response = jsonify(ticket.to_dict())
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(ticket.retry_after)))
+    return response
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -79,8 +200,25 @@ def detect_frame() -> Dict[str, Any]:
         JSON response with detection results or error message
     """
     try:
-        # Validate request
-        if "image" not in request.files:
+        # Refuse work until the model has finished warming up
+        if detection_service is not None and not detection_service.is_ready:
+            return jsonify({"error": "Model is warming up, please retry shortly"}), 503
+
+        # The whole request, including waits for a slot or a worker, must finish by this time
+        deadline = Deadline.after("upload", DEADLINE_CONFIG['upload_timeout'])
+
+        # Admit before the body is parsed, so refusals stay cheap
+        client = _client_address()
+        ticket = admission.admit("upload", client)
+        if not ticket.allowed:
+            logger.debug(f"Upload from {client} refused: {ticket.reason}")
+            return _refusal_response(ticket)
+        g.admission_ticket = ticket
+
+        # Validate request (request.files parses the multipart body lazily)
+        with profiler.span("upload_parse"):
+            has_image = "image" in request.files
+        if not has_image:
             logger.warning("No image file provided in request")
             return jsonify({"error": "No image file provided"}), 400
 
@@ -91,46 +229,37 @@ def detect_frame() -> Dict[str, Any]:
 
         logger.info(f"Processing upload: {file.filename}, type: {file.content_type}")
 
+        if job_router is not None:
+            return _detect_upload_via_queue(file, deadline)
+
         # Validate and process image
         try:
-            image, original_filename, original_dimensions = image_service.validate_and_process_upload(file)
+            image, original_filename, original_dimensions = run_blocking(image_service.validate_and_process_upload, file)
         except ImageValidationError as e:
             logger.error(f"Image validation failed: {str(e)}")
             return jsonify({"error": str(e)}), 400
 
-        # Perform detection
-        detections, has_valid_detections = detection_service.detect_objects(image)
+        # Perform detection, unless the request has expired while waiting for a thread
+        detections, has_valid_detections = run_before_deadline(deadline, detection_service.detect_objects, image)
 
         # Save grouped assessment for all valid detections
         if has_valid_detections and detections:
+            # The client has been answered with 504 if the deadline passed during inference
+            deadline.check(AFTER_INFERENCE)
+
             # Save image once for all detections
-            filename = image_service.save_image(image, prefix="kaong", source="upload")
+            filename = run_blocking(image_service.save_image, image, prefix="kaong", source="upload")
+            derivative_service.schedule(filename)
             image_url = image_service.get_image_url(filename)
             
-            # Count detections by label
-            label_counts = {}
-            total_confidence = 0
-            valid_detections = [d for d in detections if d.score > CONFIDENCE_THRESHOLD]
-            
-            for detection in valid_detections:
-                label = detection.label
-                label_counts[label] = label_counts.get(label, 0) + 1
-                total_confidence += detection.score
-            
-            # Create summary assessment
-            if label_counts:
-                # Create summary text like "3 Ripe, 2 Unripe, 1 Rotten"
-                summary_parts = []
-                for label, count in label_counts.items():
-                    summary_parts.append(f"{count} {label}")
-                summary_text = ", ".join(summary_parts)
-                
-                # Calculate average confidence
-                avg_confidence = total_confidence / len(valid_detections) if valid_detections else 0
+            # Summary text like "3 Ripe, 2 Unripe, 1 Rotten", shared with batch_assess.py and the worker
+            summary = summarize_detections(detections)
+            if summary is not None:
+                summary_text, avg_confidence, _ = summary
                 
                 # Create category-specific images with bounding boxes
-                category_urls = bounding_box_service.create_category_images(
-                    image, detections, filename, "upload"
+                category_urls = run_blocking(
+                    bounding_box_service.create_category_images, image, detections, filename, "upload"
                 )
                 
                 assessment = Assessment(
@@ -138,7 +267,10 @@ def detect_frame() -> Dict[str, Any]:
                     assessment=summary_text,  # Summary of all detections
                     confidence=avg_confidence,
                     source="upload",
-                    detection_data={"detections": [d.to_dict() for d in detections]},
+                    detection_data={
+                        "detections": [d.to_dict() for d in detections],
+                        "model_version": detections[0].model_version
+                    },
                     ripe_image_url=category_urls.get('Ripe'),
                     unripe_image_url=category_urls.get('Unripe'),
                     rotten_image_url=category_urls.get('Rotten'),
@@ -166,11 +298,56 @@ def detect_frame() -> Dict[str, Any]:
             
         return jsonify(response_data)
 
+    except DeadlineExceeded as e:
+        logger.warning(f"Upload dropped: {str(e)}")
+        return jsonify(e.to_dict()), 504
     except Exception as e:
         logger.error(f"Unexpected error in detect_frame: {str(e)}", exc_info=True)
         return jsonify({"error": "Internal server error occurred"}), 500
 
 
+def _detect_upload_via_queue(file, deadline: Deadline):
+    """Queue mode: hand an upload to an inference worker and answer with its result."""
+    try:
+        image_bytes = image_service.read_upload(file)
+    except ImageValidationError as e:
+        logger.error(f"Image validation failed: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        result = job_router.detect("upload", image_bytes, deadline)
+    except JobQueueError as e:
+        logger.error(f"Could not enqueue upload: {str(e)}")
+        return jsonify({"error": "Detection is unavailable, please retry shortly"}), 503
+    if result is None:
+        logger.warning(f"No inference worker answered within {DEADLINE_CONFIG['upload_timeout']}s")
+        return jsonify({"error": TIMEOUT_ERROR, "reason": "expired"}), 504
+    return jsonify(result.body), result.status
+
+
+def _queue_video_frame(image_data_url: str, deadline: Deadline) -> str:
+    """
+    Queue mode: enqueue a camera frame; the worker's result is emitted to this session later.
+
+    Returns:
+        Outcome for the Socket.IO event metrics
+    """
+    try:
+        image_bytes = image_service.decode_data_url(image_data_url)
+    except ImageValidationError as e:
+        logger.error(f"Base64 image processing failed: {str(e)}")
+        emit("detection_error", {"error": str(e)})
+        return "invalid"
+
+    try:
+        job_router.submit("camera", image_bytes, sid=request.sid, deadline=deadline)
+    except JobQueueError as e:
+        logger.error(f"Could not enqueue video frame: {str(e)}")
+        emit("detection_error", {"error": "Detection is unavailable, please retry shortly"})
+        return "unavailable"
+    return "queued"
+
+
 @socketio.on("detect_video_frame")
 def handle_video_frame(data: Dict[str, Any]) -> None:
     """
@@ -179,52 +356,65 @@ def handle_video_frame(data: Dict[str, Any]) -> None:
     Args:
         data: Dictionary containing 'image_data_url' key with base64 image data
     """
+    trace_token = profiler.start_trace("detect_video_frame")
+    event_start = time.perf_counter()
+    outcome = "ok"
+    ticket = None
     try:
+        if detection_service is not None and not detection_service.is_ready:
+            emit("detection_error", {"error": "Model is warming up, please retry shortly"})
+            outcome = "not_ready"
+            return
+
         if "image_data_url" not in data:
             logger.error("No image_data_url provided in WebSocket data")
             emit("detection_error", {"error": "No image data provided"})
+            outcome = "invalid"
+            return
+
+        # Shed frames before decoding; the client pauses for retry_after_ms
+        ticket = admission.admit("camera", request.sid)
+        if not ticket.allowed:
+            emit("detection_busy", ticket.to_dict())
+            outcome = ticket.reason
+            return
+
+        # A frame is stale after DETECT_FRAME_TIMEOUT, and unwanted once its session disconnects
+        sid = request.sid
+        deadline = Deadline.after("camera", DEADLINE_CONFIG['frame_timeout'],
+                                  is_cancelled=lambda: not socketio.server.manager.is_connected(sid, "/"))
+
+        if job_router is not None:
+            outcome = _queue_video_frame(data["image_data_url"], deadline)
             return
 
         try:
-            image = image_service.process_base64_image(data["image_data_url"])
+            image = run_blocking(image_service.process_base64_image, data["image_data_url"])
         except ImageValidationError as e:
             logger.error(f"Base64 image processing failed: {str(e)}")
             emit("detection_error", {"error": str(e)})
+            outcome = "invalid"
             return
 
-        detections, has_valid_detections = detection_service.detect_objects(image)
+        detections, has_valid_detections = run_before_deadline(deadline, detection_service.detect_objects, image)
 
         if has_valid_detections and detections:
+            deadline.check(AFTER_INFERENCE)
             import base64
             image_data = data["image_data_url"].split(",")[1]
             image_bytes = base64.b64decode(image_data)
-            filename = image_service.save_raw_image_data(image_bytes, prefix="kaong", source="camera")
+            filename = run_blocking(image_service.save_raw_image_data, image_bytes, prefix="kaong", source="camera")
+            derivative_service.schedule(filename)
             image_url = image_service.get_image_url(filename)
             
-            # Count detections by label
-            label_counts = {}
-            total_confidence = 0
-            valid_detections = [d for d in detections if d.score > CONFIDENCE_THRESHOLD]
-            
-            for detection in valid_detections:
-                label = detection.label
-                label_counts[label] = label_counts.get(label, 0) + 1
-                total_confidence += detection.score
-            
-            # Create summary assessment
-            if label_counts:
-                # Create summary text like "3 Ripe, 2 Unripe, 1 Rotten"
-                summary_parts = []
-                for label, count in label_counts.items():
-                    summary_parts.append(f"{count} {label}")
-                summary_text = ", ".join(summary_parts)
-                
-                # Calculate average confidence
-                avg_confidence = total_confidence / len(valid_detections) if valid_detections else 0
+            # Summary text like "3 Ripe, 2 Unripe, 1 Rotten", shared with batch_assess.py and the worker
+            summary = summarize_detections(detections)
+            if summary is not None:
+                summary_text, avg_confidence, _ = summary
                 
                 # Create category-specific images with bounding boxes
-                category_urls = bounding_box_service.create_category_images(
-                    image, detections, filename, "camera_ws"
+                category_urls = run_blocking(
+                    bounding_box_service.create_category_images, image, detections, filename, "camera_ws"
                 )
                 
                 assessment = Assessment(
@@ -232,7 +422,10 @@ def handle_video_frame(data: Dict[str, Any]) -> None:
                     assessment=summary_text,  # Summary of all detections
                     confidence=avg_confidence,
                     source="camera_ws",
-                    detection_data={"detections": [d.to_dict() for d in detections]},
+                    detection_data={
+                        "detections": [d.to_dict() for d in detections],
+                        "model_version": detections[0].model_version
+                    },
                     ripe_image_url=category_urls.get('Ripe'),
                     unripe_image_url=category_urls.get('Unripe'),
                     rotten_image_url=category_urls.get('Rotten'),
@@ -260,9 +453,30 @@ def handle_video_frame(data: Dict[str, Any]) -> None:
         emit("detection_results", response_data)
         
         logger.debug(f"WebSocket detection complete: {len(detections_dict)} objects")
+    except DeadlineExceeded as e:
+        logger.debug(f"Video frame dropped: {str(e)}")
+        if e.reason == "expired":
+            emit("detection_error", e.to_dict())
+        outcome = e.reason
     except Exception as e:
         logger.error(f"Unexpected error in handle_video_frame: {str(e)}", exc_info=True)
         emit("detection_error", {"error": "Internal server error occurred"})
+        outcome = "error"
+    finally:
+        if ticket is not None:
+            ticket.release()
+        profiler.finish_trace(trace_token)
+        SOCKETIO_EVENTS.inc(event="detect_video_frame", outcome=outcome)
+        SOCKETIO_LATENCY.observe(time.perf_counter() - event_start, event="detect_video_frame")
+
+
+@socketio.on("disconnect")
+def handle_disconnect(reason=None) -> None:
+    """Withdraw the session's queued frames; in local mode their deadlines see the disconnect."""
+    if job_router is not None:
+        cancelled = job_router.cancel_session(request.sid)
+        if cancelled:
+            logger.debug(f"Cancelled {cancelled} queued frames of disconnected session {request.sid}")
 
 
 @app.route("/save_assessment", methods=["POST"])
@@ -293,7 +507,7 @@ def save_assessment() -> Dict[str, Any]:
 
         # Validate and process image
         try:
-            image, original_filename, original_dimensions = image_service.validate_and_process_upload(file)
+            image, original_filename, original_dimensions = run_blocking(image_service.validate_and_process_upload, file)
         except ImageValidationError as e:
             logger.error(f"Image validation failed in save_assessment: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 400
@@ -308,7 +522,8 @@ def save_assessment() -> Dict[str, Any]:
             return jsonify({"success": False, "error": "Invalid form data"}), 400
 
         # Save image
-        filename = image_service.save_image(image, prefix="kaong", source="manual")
+        filename = run_blocking(image_service.save_image, image, prefix="kaong", source="manual")
+        derivative_service.schedule(filename)
         
         # Create assessment record
         assessment = Assessment(
@@ -353,8 +568,13 @@ def get_assessment_data() -> Dict[str, Any]:
         else:
             assessments = database_service.get_all_assessments(limit)
         
-        # Convert to dictionary format for JSON response
-        data = [assessment.to_dict() for assessment in assessments]
+        # Convert to dictionary format for JSON response; cards use the small variants
+        data = []
+        for assessment in assessments:
+            item = assessment.to_dict()
+            item['thumbnail_url'] = derivative_service.get_derivative_url(assessment.image_url, 'thumb')
+            item['preview_url'] = derivative_service.get_derivative_url(assessment.image_url, 'preview')
+            data.append(item)
         
         logger.info(f"Retrieved {len(data)} assessments (source: {source}, limit: {limit})")
         return jsonify(data)
@@ -382,6 +602,126 @@ def get_assessment_stats() -> Dict[str, Any]:
         return jsonify({"error": "Failed to retrieve statistics"}), 500
 
 
+@app.route("/export/assessments")
+def export_assessments() -> Response:
+    """
+    Stream assessments flattened to one row per detection.
+
+    Query parameters:
+        format: parquet, csv or ndjson (default parquet)
+        source: Optional source filter
+        since: Optional ISO timestamp lower bound
+
+    Returns:
+        Chunked file download or JSON error message
+    """
+    export_format = request.args.get('format', 'parquet').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({"error": "Invalid 'since' timestamp, expected ISO 8601"}), 400
+
+    source = request.args.get('source', type=str)
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"kaong_assessments_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    logger.info(f"Starting {export_format} export (source: {source}, since: {since})")
+
+    return Response(
+        stream_with_context(export_service.stream(export_format, source=source, since=since)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+def _analytics_filters() -> Dict[str, Any]:
+    """Parse the source/since/until query parameters shared by the analytics routes."""
+    filters = {'source': request.args.get('source', type=str), 'since': None, 'until': None}
+    for key in ('since', 'until'):
+        if request.args.get(key):
+            try:
+                filters[key] = datetime.fromisoformat(request.args[key])
+            except ValueError:
+                raise AnalyticsError(f"Invalid '{key}' timestamp, expected ISO 8601")
+    return filters
+
+
+@app.route("/analytics")
+def analytics_status() -> Dict[str, Any]:
+    """Refresh the analytics snapshot if due and report its size and freshness."""
+    try:
+        analytics_service.refresh()
+        return jsonify(analytics_service.status())
+    except Exception as e:
+        logger.error(f"Error refreshing analytics snapshot: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to refresh analytics snapshot"}), 500
+
+
+@app.route("/analytics/ripeness")
+def analytics_ripeness() -> Dict[str, Any]:
+    """
+    Ripe/unripe/rotten ratios per time bucket.
+
+    Query parameters:
+        bucket: hour, day, week or month (default day)
+        by_source: 'true' to also group by source
+        min_score: Ignore detections below this confidence
+        source, since, until: Optional filters
+    """
+    try:
+        analytics_service.refresh()
+        data = analytics_service.ripeness(
+            bucket=request.args.get('bucket', 'day'),
+            by_source=request.args.get('by_source', 'false').lower() == 'true',
+            min_score=request.args.get('min_score', 0.0, type=float),
+            **_analytics_filters()
+        )
+        return jsonify(data)
+    except AnalyticsError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error computing ripeness analytics: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to compute ripeness analytics"}), 500
+
+
+@app.route("/analytics/confidence")
+def analytics_confidence() -> Dict[str, Any]:
+    """Detection confidence histogram per label (bands=N equal-width bands)."""
+    try:
+        analytics_service.refresh()
+        data = analytics_service.confidence_distribution(
+            bands=request.args.get('bands', 10, type=int),
+            **_analytics_filters()
+        )
+        return jsonify(data)
+    except AnalyticsError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error computing confidence analytics: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to compute confidence analytics"}), 500
+
+
+@app.route("/analytics/throughput")
+def analytics_throughput() -> Dict[str, Any]:
+    """Assessments and detections per source per time bucket (default hour)."""
+    try:
+        analytics_service.refresh()
+        data = analytics_service.throughput(
+            bucket=request.args.get('bucket', 'hour'),
+            **_analytics_filters()
+        )
+        return jsonify(data)
+    except AnalyticsError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error computing throughput analytics: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to compute throughput analytics"}), 500
+
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error) -> Dict[str, Any]:
@@ -438,6 +778,198 @@ def delete_assessment(assessment_id: int) -> Dict[str, Any]:
         }), 500
 
 
+def _is_admin_request() -> bool:
+    """Check the admin token, or allow only local callers when no token is configured."""
+    admin_token = MODEL_REGISTRY_CONFIG['admin_token']
+    if admin_token:
+        return request.headers.get("X-Admin-Token") == admin_token
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+def _models_on_workers():
+    """Response of the model administration routes on a queue-mode web node."""
+    return jsonify({"success": False, "error": "Models are loaded by the inference workers (INFERENCE_MODE=queue)"}), 409
+
+
+@app.route("/admin/models", methods=["GET"])
+def list_models() -> Dict[str, Any]:
+    """List loaded model versions and the current traffic split."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    if detection_service is None:
+        return _models_on_workers()
+    return jsonify(detection_service.registry.describe())
+
+
+@app.route("/admin/models", methods=["POST"])
+def load_model() -> Dict[str, Any]:
+    """
+    Load and warm up a model version without interrupting traffic.
+
+    Expects JSON: {"path": "...", "version": optional, "activate": optional bool}
+    """
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    if detection_service is None:
+        return _models_on_workers()
+
+    payload = request.get_json(silent=True) or {}
+    path = payload.get("path")
+    if not path:
+        return jsonify({"success": False, "error": "Missing path"}), 400
+
+    try:
+        model_version = detection_service.registry.load(
+            path, version=payload.get("version"), activate=bool(payload.get("activate", False))
+        )
+        return jsonify({"success": True, "model": model_version.to_dict()})
+    except ModelRegistryError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+
+@app.route("/admin/models/<version>/activate", methods=["POST"])
+def activate_model(version: str) -> Dict[str, Any]:
+    """Atomically route all traffic to one model version."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    if detection_service is None:
+        return _models_on_workers()
+
+    try:
+        detection_service.registry.activate(version)
+        return jsonify({"success": True, **detection_service.registry.describe()})
+    except ModelRegistryError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+
+@app.route("/admin/models/traffic", methods=["PUT"])
+def set_model_traffic() -> Dict[str, Any]:
+    """
+    Split traffic between model versions for A/B comparison.
+
+    Expects JSON: {"weights": {"best_2-20251008": 90, "best_3-20251020": 10}}
+    """
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    if detection_service is None:
+        return _models_on_workers()
+
+    payload = request.get_json(silent=True) or {}
+    weights = payload.get("weights")
+    if not isinstance(weights, dict):
+        return jsonify({"success": False, "error": "Missing weights"}), 400
+
+    try:
+        detection_service.registry.set_traffic_split(weights)
+        return jsonify({"success": True, **detection_service.registry.describe()})
+    except (ModelRegistryError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+
+@app.route("/admin/models/<version>", methods=["DELETE"])
+def unload_model(version: str) -> Dict[str, Any]:
+    """Unload a model version that no longer receives traffic."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    if detection_service is None:
+        return _models_on_workers()
+
+    try:
+        detection_service.registry.unload(version)
+        return jsonify({"success": True})
+    except ModelRegistryError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+
+@app.route("/admin/analytics/rebuild", methods=["POST"])
+def rebuild_analytics() -> Dict[str, Any]:
+    """Re-read every assessment into the analytics snapshot (drops deleted assessments)."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    rows = analytics_service.rebuild()
+    return jsonify({"success": True, "rows": rows, **analytics_service.status()})
+
+
+@app.route("/admin/retention", methods=["GET"])
+def retention_status() -> Dict[str, Any]:
+    """Retention job progress and the result of the last run."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    return jsonify(retention_service.status())
+
+
+@app.route("/admin/retention/run", methods=["POST"])
+def run_retention() -> Dict[str, Any]:
+    """Start a retention and reconciliation run in the background."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    if not retention_service.trigger():
+        return jsonify({"success": False, "error": "A retention run is already in progress"}), 409
+    return jsonify({"success": True, **retention_service.status()}), 202
+
+
+@app.route("/static/uploads/<path:filename>")
+def uploaded_image(filename: str):
+    """Serve an upload from image storage; object storage answers through a signed redirect."""
+    try:
+        key = image_service.resolve_filename(validate_key(filename))
+        path = image_service.storage.local_path(key)
+        if path is None:
+            # URLs saved before the move to object storage still point here
+            return redirect(image_service.storage.signed_url(key))
+        return send_image_file(request.environ, path, image_service.storage.root,
+                               STATIC_FILES_CONFIG['x_accel_uploads'])
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found"}), 404
+
+
+@app.route("/derivatives/<variant>/<path:filename>")
+def image_derivative(variant: str, filename: str):
+    """Serve a thumbnail/preview of an upload, generating it on first request."""
+    if variant not in derivative_service.variants:
+        return jsonify({"error": "Unknown variant"}), 404
+    try:
+        path = run_blocking(derivative_service.ensure, filename, variant)
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found"}), 404
+    except DerivativeError as e:
+        # The original still renders, just heavier
+        logger.warning(f"Serving original instead of {variant} derivative: {str(e)}")
+        return redirect(image_service.get_image_url(filename))
+    return send_image_file(request.environ, path, derivative_service.cache_dir,
+                           STATIC_FILES_CONFIG['x_accel_derivatives'], mimetype=derivative_service.mimetype,
+                           max_age=DERIVATIVE_CONFIG['max_age'])
+
+
+@app.route("/metrics")
+def metrics_endpoint() -> Response:
+    """Prometheus text exposition of request, inference, database and process metrics."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/debug/profile")
+def profile_snapshot() -> Dict[str, Any]:
+    """Per-stage latency histograms and sampled slow requests."""
+    if not _is_admin_request():
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    return jsonify(profiler.snapshot())
+
+
+# Readiness endpoint for load balancers: only ready once the model is warmed up
+def _detection_readiness() -> Dict[str, Any]:
+    """Model readiness, or in queue mode whether the job queue is reachable."""
+    if job_router is not None:
+        return job_router.readiness()
+    return detection_service.readiness()
+
+
+@app.route("/ready")
+def readiness_check() -> Dict[str, Any]:
+    """Report whether this instance can serve detection traffic."""
+    model_status = _detection_readiness()
+    return jsonify(model_status), 200 if model_status['ready'] else 503
+
+
 # Health check endpoint
 @app.route("/health")
 def health_check() -> Dict[str, Any]:
@@ -445,10 +977,12 @@ def health_check() -> Dict[str, Any]:
     try:
         # Test database connection
         db_status = database_service.test_connection()
+        model_status = _detection_readiness()
         
         return jsonify({
-            "status": "healthy" if db_status else "degraded",
+            "status": "healthy" if db_status and model_status['ready'] else "degraded",
             "database": "connected" if db_status else "disconnected",
+            "model": model_status,
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -0,0 +1,449 @@
+"""
+Offline batch assessment of kaong photos.
+
+Walks a directory or archive (.zip, .tar, .tar.gz), decodes images in a process
+pool, runs DetectionService in batches and writes assessments through the bulk
+database path. Progress is checkpointed so an interrupted run resumes where it
+stopped. Does not need the Flask app to be running.
+
+Usage:
+    python batch_assess.py /media/sdcard/DCIM --output sdcard_summary.csv
+    python batch_assess.py grower_photos.zip --output summary.parquet --batch-size 16 --workers 6
+    python batch_assess.py photos/ --no-db --no-store-images --output dry_run.csv
+"""
+import os
+import sys
+import csv
+import time
+import hashlib
+import logging
+import zipfile
+import tarfile
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from PIL import Image
+
+from config import ALLOWED_EXTENSIONS, LOGGING_CONFIG
+
+logger = logging.getLogger("batch_assess")
+
+SUMMARY_COLUMNS = [
+    "source_key", "status", "assessment", "confidence", "ripe", "unripe", "rotten",
+    "detections", "width", "height", "model_version", "image_url", "error"
+]
+
+# Parquet column types, so summaries appended across runs keep one schema
+SUMMARY_DTYPES = {
+    "source_key": "str", "status": "str", "assessment": "str", "confidence": "float",
+    "ripe": "int", "unripe": "int", "rotten": "int", "detections": "int", "width": "int",
+    "height": "int", "model_version": "str", "image_url": "str", "error": "str"
+}
+
+# (key, filesystem path or None, archive member name or None)
+WorkItem = Tuple[str, Optional[str], Optional[str]]
+
+
+def key_hash(value: str) -> str:
+    """Fixed-length digest of a source key or checkpoint path for the batch_checkpoints table."""
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def summary_keys(csv_path: str) -> Set[str]:
+    """Source keys that already have a row in a summary CSV."""
+    if not os.path.exists(csv_path):
+        return set()
+    with open(csv_path, newline="") as f:
+        return {row["source_key"] for row in csv.DictReader(f)}
+
+
+def _is_image(name: str) -> bool:
+    return "." in name and name.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def discover_items(input_path: str) -> List[WorkItem]:
+    """List the images in a directory tree or archive, in a stable order."""
+    if os.path.isdir(input_path):
+        items = []
+        for root, dirs, files in os.walk(input_path):
+            dirs.sort()
+            for name in sorted(files):
+                if _is_image(name):
+                    path = os.path.join(root, name)
+                    items.append((os.path.relpath(path, input_path), path, None))
+        return items
+
+    if zipfile.is_zipfile(input_path):
+        with zipfile.ZipFile(input_path) as archive:
+            return [(name, None, name) for name in sorted(archive.namelist()) if _is_image(name)]
+
+    if tarfile.is_tarfile(input_path):
+        with tarfile.open(input_path) as archive:
+            return [(member.name, None, member.name)
+                    for member in archive.getmembers() if member.isfile() and _is_image(member.name)]
+
+    raise SystemExit(f"Unsupported input (expected a directory, .zip or .tar archive): {input_path}")
+
+
+class ArchiveReader:
+    """Reads member bytes from the input archive in the main process (workers only decode)."""
+
+    def __init__(self, input_path: str):
+        self._zip = zipfile.ZipFile(input_path) if zipfile.is_zipfile(input_path) else None
+        self._tar = tarfile.open(input_path) if self._zip is None and tarfile.is_tarfile(input_path) else None
+
+    def read(self, member: str) -> bytes:
+        if self._zip is not None:
+            return self._zip.read(member)
+        extracted = self._tar.extractfile(member)
+        return extracted.read() if extracted else b""
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+
+_worker_image_service = None
+
+
+def _init_worker() -> None:
+    """Process pool initializer: one ImageService per worker."""
+    global _worker_image_service
+    from services.image_service import ImageService
+    _worker_image_service = ImageService()
+
+
+def _decode(key: str, path: Optional[str], data: Optional[bytes]) -> Tuple[str, Optional[Image.Image], Optional[str]]:
+    """Decode, orient and resize one image in a worker process."""
+    try:
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        return key, _worker_image_service.decode_image_bytes(data), None
+    except Exception as e:
+        return key, None, str(e)
+
+
+class Checkpoint:
+    """
+    Append-only record of completed keys, flushed after every committed batch.
+
+    With the database enabled, the keys of a batch are also recorded in batch_checkpoints
+    in the same transaction as its assessments. A run interrupted between the commit and
+    the file write therefore resumes without inserting the batch twice.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self._file = open(path, "a")
+
+    def mark(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            self._file.write(key + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Progress:
+    """Live images/sec and ETA on stderr."""
+
+    def __init__(self, total: int, already_done: int):
+        self._total = total
+        self._done = already_done
+        self._processed = 0
+        self._start = time.perf_counter()
+        self._last_render = 0.0
+
+    def advance(self, count: int) -> None:
+        self._done += count
+        self._processed += count
+        now = time.perf_counter()
+        if now - self._last_render >= 0.5 or self._done >= self._total:
+            self._last_render = now
+            elapsed = now - self._start
+            rate = self._processed / elapsed if elapsed > 0 else 0.0
+            remaining = self._total - self._done
+            eta = time.strftime("%H:%M:%S", time.gmtime(remaining / rate)) if rate > 0 else "--:--:--"
+            sys.stderr.write(f"\r{self._done}/{self._total} images  {rate:6.1f} img/s  ETA {eta}   ")
+            sys.stderr.flush()
+
+    def finish(self) -> float:
+        sys.stderr.write("\n")
+        elapsed = time.perf_counter() - self._start
+        return self._processed / elapsed if elapsed > 0 else 0.0
+
+
+class BatchAssessor:
+    """Runs detection on decoded images and persists assessments and summary rows."""
+
+    def __init__(self, args: argparse.Namespace, writer: "csv.DictWriter", run_id: str):
+        from services.detection_service import DetectionService, summarize_detections
+        from services.image_service import ImageService
+        from services.bounding_box_service import BoundingBoxService
+        from services.database_service import DatabaseService
+
+        self._args = args
+        self._writer = writer
+        self._run_id = run_id
+        self._summarize = summarize_detections
+        self.detection_service = DetectionService()
+        self.image_service = ImageService() if args.store_images else None
+        self.bounding_box_service = BoundingBoxService() if args.category_images else None
+        self.database_service = None
+        if not args.no_db:
+            self.database_service = DatabaseService()
+            self.database_service.create_tables()
+
+    def committed_keys(self, keys: Iterable[str]) -> Set[str]:
+        """Keys whose batch was committed to the database by this run (empty without a database)."""
+        if self.database_service is None:
+            return set()
+        committed = self.database_service.get_batch_checkpoint(self._run_id)
+        return {key for key in keys if key_hash(key) in committed}
+
+    def write_committed_rows(self, keys: Iterable[str]) -> List[str]:
+        """
+        Rebuild summary rows from the database for keys committed before the checkpoint file caught up.
+
+        Keys of the batch without a stored assessment (decode errors, no kaong) get status "committed".
+
+        Returns:
+            Keys written to the summary
+        """
+        keys = sorted(keys)
+        stored = {assessment.detection_data.get("source_key"): assessment
+                  for assessment in self.database_service.get_batch_assessments(self._args.source, keys)
+                  if assessment.detection_data}
+
+        rows: List[Dict[str, Any]] = []
+        for key in keys:
+            row: Dict[str, Any] = {"source_key": key}
+            assessment = stored.get(key)
+            if assessment is None:
+                row.update(status="committed")
+                rows.append(row)
+                continue
+
+            detections = assessment.detection_data.get("detections", [])
+            # Summary text is "3 Ripe, 2 Unripe"; see summarize_detections
+            label_counts = {label: int(count) for count, label in
+                            (part.split(" ", 1) for part in assessment.assessment.split(", "))}
+            row.update(status="ok", assessment=assessment.assessment, confidence=round(assessment.confidence, 4),
+                       ripe=label_counts.get("Ripe", 0), unripe=label_counts.get("Unripe", 0),
+                       rotten=label_counts.get("Rotten", 0), detections=len(detections),
+                       width=detections[0].get("image_width") if detections else None,
+                       height=detections[0].get("image_height") if detections else None,
+                       model_version=assessment.detection_data.get("model_version"),
+                       image_url="" if assessment.image_url.startswith("batch://") else assessment.image_url)
+            rows.append(row)
+
+        self._writer.writerows(rows)
+        return keys
+
+    def process(self, batch: List[Tuple[str, Optional[Image.Image], Optional[str]]]) -> List[str]:
+        """
+        Assess one batch and persist it.
+
+        Returns:
+            Keys that are complete (written to the summary and, if enabled, the database)
+        """
+        from services.database_service import Assessment
+
+        decoded = [(key, image) for key, image, error in batch if image is not None]
+        results = self.detection_service.detect_objects_batch([image for _, image in decoded])
+        result_by_key = {key: (image, result) for (key, image), result in zip(decoded, results)}
+
+        rows: List[Dict[str, Any]] = []
+        assessments: List[Assessment] = []
+        for key, image, error in batch:
+            row: Dict[str, Any] = {"source_key": key}
+            if image is None:
+                row.update(status="error", error=error)
+                rows.append(row)
+                continue
+
+            _, (detections, has_valid_detections) = result_by_key[key]
+            model_version = detections[0].model_version if detections else None
+            row.update(width=image.width, height=image.height, model_version=model_version,
+                       detections=len(detections) if has_valid_detections else 0)
+
+            summary = self._summarize(detections) if has_valid_detections else None
+            if summary is None:
+                row.update(status="no_kaong")
+                rows.append(row)
+                continue
+
+            summary_text, avg_confidence, label_counts = summary
+            row.update(status="ok", assessment=summary_text, confidence=round(avg_confidence, 4),
+                       ripe=label_counts.get("Ripe", 0), unripe=label_counts.get("Unripe", 0),
+                       rotten=label_counts.get("Rotten", 0))
+
+            image_url, category_urls = "", {}
+            if self.image_service is not None:
+                filename = self.image_service.save_image(image, prefix="kaong", source=self._args.source)
+                image_url = self.image_service.get_image_url(filename)
+                if self.bounding_box_service is not None:
+                    category_urls = self.bounding_box_service.create_category_images(
+                        image, detections, filename, self._args.source
+                    )
+            row["image_url"] = image_url
+
+            assessments.append(Assessment(
+                image_url=image_url or f"batch://{key}",
+                assessment=summary_text,
+                confidence=avg_confidence,
+                source=self._args.source,
+                detection_data={
+                    "detections": [d.to_dict() for d in detections],
+                    "model_version": model_version,
+                    "source_key": key
+                },
+                ripe_image_url=category_urls.get('Ripe'),
+                unripe_image_url=category_urls.get('Unripe'),
+                rotten_image_url=category_urls.get('Rotten'),
+                timestamp=datetime.now()
+            ))
+            rows.append(row)
+
+        if self.database_service is not None and assessments:
+            checkpoint = (self._run_id, [key_hash(key) for key, _, _ in batch])
+            if self.database_service.save_assessments_bulk(assessments, checkpoint) != len(assessments):
+                # Leave the batch out of the checkpoint so a resumed run retries it
+                raise RuntimeError("Bulk insert failed; batch not checkpointed")
+
+        self._writer.writerows(rows)
+        return [key for key, _, _ in batch]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline batch assessment of kaong photos")
+    parser.add_argument("input", help="Directory, .zip or .tar(.gz) archive of images")
+    parser.add_argument("--output", default="batch_summary.csv", help="Summary file (.csv or .parquet)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per model predict call")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Decode processes")
+    parser.add_argument("--source", default="batch", help="Source recorded on each assessment")
+    parser.add_argument("--no-db", action="store_true", help="Only write the summary file")
+    parser.add_argument("--no-store-images", dest="store_images", action="store_false",
+                        help="Do not copy originals into the upload folder")
+    parser.add_argument("--category-images", action="store_true",
+                        help="Also render per-category bounding box images")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    parquet_output = args.output.lower().endswith(".parquet")
+    csv_path = args.output + ".partial.csv" if parquet_output else args.output
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    checkpoint = Checkpoint(checkpoint_path)
+    items = discover_items(args.input)
+
+    write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    archive = None if os.path.isdir(args.input) else ArchiveReader(args.input)
+
+    with open(csv_path, "a", newline="") as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_COLUMNS)
+        if write_header:
+            writer.writeheader()
+        assessor = BatchAssessor(args, writer, run_id=key_hash(os.path.abspath(checkpoint_path)))
+
+        committed = assessor.committed_keys(key for key, _, _ in items if key not in checkpoint.done)
+        if committed:
+            # Interrupted between the database commit and the summary write: the rows may be missing
+            recovered = assessor.write_committed_rows(committed - summary_keys(csv_path))
+            summary_file.flush()
+            checkpoint.mark(committed)
+            print(f"{len(committed)} images recovered from the database checkpoint, "
+                  f"{len(recovered)} summary rows rebuilt")
+        done = checkpoint.done | committed
+        pending = [item for item in items if item[0] not in done]
+        print(f"{len(items)} images found, {len(items) - len(pending)} already done, {len(pending)} to process")
+        progress = Progress(len(items), len(items) - len(pending))
+
+        # Bounded window of in-flight decodes keeps memory flat for huge inputs
+        window = max(args.workers, 1) * 4
+        in_flight: Deque[Future] = deque()
+        batch: List[Tuple[str, Optional[Image.Image], Optional[str]]] = []
+        item_iter = iter(pending)
+
+        def flush(current_batch):
+            done_keys = assessor.process(current_batch)
+            summary_file.flush()
+            checkpoint.mark(done_keys)
+            progress.advance(len(done_keys))
+
+        try:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool:
+                exhausted = False
+                while True:
+                    while not exhausted and len(in_flight) < window:
+                        item = next(item_iter, None)
+                        if item is None:
+                            exhausted = True
+                            break
+                        key, path, member = item
+                        data = archive.read(member) if member is not None else None
+                        in_flight.append(pool.submit(_decode, key, path, data))
+
+                    if not in_flight:
+                        break
+
+                    batch.append(in_flight.popleft().result())
+                    if len(batch) >= args.batch_size:
+                        flush(batch)
+                        batch = []
+
+                if batch:
+                    flush(batch)
+        except KeyboardInterrupt:
+            print("\nInterrupted; rerun the same command to resume from the checkpoint")
+            return 130
+        finally:
+            checkpoint.close()
+            if archive is not None:
+                archive.close()
+
+    rate = progress.finish()
+    print(f"Processed {len(pending)} images at {rate:.1f} img/s")
+
+    if parquet_output:
+        import polars as pl
+        schema = {column: {"str": pl.Utf8, "int": pl.Int64, "float": pl.Float64}[dtype]
+                  for column, dtype in SUMMARY_DTYPES.items()}
+        rows = pl.scan_csv(csv_path, schema=schema)
+        if rows.select(pl.len()).collect().item() == 0 and os.path.exists(args.output):
+            # Nothing new since the last conversion; keep the finished summary as it is
+            os.remove(csv_path)
+        else:
+            if os.path.exists(args.output):
+                # The partial CSV only holds rows since the last conversion; append them
+                rows = pl.concat([pl.scan_parquet(args.output), rows], how="diagonal_relaxed")
+            rows.sink_parquet(args.output + ".tmp")
+            os.replace(args.output + ".tmp", args.output)
+            os.remove(csv_path)
+    print(f"Summary written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
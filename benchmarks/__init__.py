@@ -0,0 +1,4 @@
+"""
+Offline performance benchmarks for the Kaong Detection Application.
+Run with `python -m benchmarks.run`; see README.md for options.
+"""
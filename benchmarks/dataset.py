@@ -0,0 +1,89 @@
+"""
+Training input pipeline benchmark: batches/sec through a DataLoader for
+per-epoch JPEG decode, the per-image .npz cache and the compiled memmap.
+"""
+import os
+import time
+import random
+import logging
+from typing import List, Optional, Tuple
+
+from benchmarks.harness import BenchResult, summarize
+
+logger = logging.getLogger(__name__)
+
+
+def build_synthetic_dataset(root: str, samples: List[Tuple[str, bytes]], count: int) -> str:
+    """Write count labelled JPEGs (the sample images, repeated) in the YOLO layout."""
+    images_dir = os.path.join(root, "images", "train")
+    labels_dir = os.path.join(root, "labels", "train")
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+    rng = random.Random(0)
+    for i in range(count):
+        _, data = samples[i % len(samples)]
+        with open(os.path.join(images_dir, f"img_{i:05d}.jpg"), "wb") as f:
+            f.write(data)
+        with open(os.path.join(labels_dir, f"img_{i:05d}.txt"), "w") as f:
+            for _ in range(rng.randint(1, 6)):
+                f.write(f"{rng.randint(0, 2)} {rng.uniform(0.2, 0.8):.4f} {rng.uniform(0.2, 0.8):.4f} "
+                        f"{rng.uniform(0.05, 0.3):.4f} {rng.uniform(0.05, 0.3):.4f}\n")
+    return root
+
+
+def _time_loader(name: str, dataset, batch_size: int, workers: int, epochs: int) -> BenchResult:
+    """Time every batch of each epoch after the first (the first also pays for cache fills)."""
+    from torch.utils.data import DataLoader
+    from training.dataset import collate_batch
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers,
+                        persistent_workers=workers > 0, prefetch_factor=4 if workers > 0 else None,
+                        collate_fn=collate_batch)
+    for _ in loader:
+        pass
+
+    batch_ms = []
+    start = time.perf_counter()
+    for _ in range(epochs):
+        fetch_start = time.perf_counter()
+        for _ in loader:
+            batch_ms.append((time.perf_counter() - fetch_start) * 1000)
+            fetch_start = time.perf_counter()
+    wall_seconds = time.perf_counter() - start
+
+    result = summarize(name, batch_ms, wall_seconds)
+    samples_per_sec = len(dataset) * epochs / wall_seconds if wall_seconds > 0 else 0.0
+    logger.info(f"{name}: {samples_per_sec:.1f} samples/s")
+    return result
+
+
+def run_dataset_benchmark(dataset_dir: Optional[str], workdir: str, samples: List[Tuple[str, bytes]],
+                          imgsz: int = 640, batch_size: int = 16, workers: int = 2,
+                          epochs: int = 2, synthetic_count: int = 256) -> List[BenchResult]:
+    """
+    Compare the three input pipelines on the same split.
+
+    Without dataset_dir a synthetic dataset is built from the sample images. ops_per_sec
+    in the results is batches/sec; multiply by batch_size for samples/sec.
+    """
+    from training.dataset import DecodedImageCache, KaongDataset, find_samples
+    from training.dataset_cache import CompiledKaongDataset, compile_dataset
+
+    if not dataset_dir:
+        dataset_dir = build_synthetic_dataset(os.path.join(workdir, "dataset"), samples, synthetic_count)
+    split_samples = find_samples(dataset_dir, "train")
+    cache_dir = os.path.join(workdir, "dataset_cache")
+
+    results = [
+        _time_loader("dataset.decode_every_epoch", KaongDataset(split_samples, imgsz),
+                     batch_size, workers, epochs),
+        _time_loader("dataset.npz_cache", KaongDataset(split_samples, imgsz, cache=DecodedImageCache(cache_dir, imgsz)),
+                     batch_size, workers, epochs)
+    ]
+
+    start = time.perf_counter()
+    compiled = compile_dataset(split_samples, imgsz, cache_dir, "train", workers=workers)
+    compile_ms = (time.perf_counter() - start) * 1000
+    results.append(summarize("dataset.memmap_compile", [compile_ms]))
+    results.append(_time_loader("dataset.memmap", CompiledKaongDataset(compiled), batch_size, workers, epochs))
+    return results
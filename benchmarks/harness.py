@@ -0,0 +1,177 @@
+"""
+Timing harness, sample data and baseline comparison shared by the benchmarks.
+"""
+import os
+import gc
+import glob
+import json
+import time
+import platform
+import statistics
+from io import BytesIO
+from datetime import datetime
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+# Real kaong photos shipped with the repo; synthetic frames are used if they are missing
+SAMPLE_IMAGE_GLOBS = ["static/image/kaong*.jpg", "static/uploads/**/kaong_camera_*.jpg"]
+
+
+@dataclass
+class BenchResult:
+    """Summary statistics for one benchmark."""
+    name: str
+    iterations: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    ops_per_sec: float
+    errors: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an unsorted sample list."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(name: str, samples_ms: List[float], wall_seconds: Optional[float] = None,
+              errors: int = 0) -> BenchResult:
+    """
+    Build a BenchResult from per-call latencies.
+
+    Args:
+        wall_seconds: Elapsed wall time for concurrent runs; throughput is derived
+            from it instead of the summed latencies when provided
+    """
+    total_seconds = wall_seconds if wall_seconds is not None else sum(samples_ms) / 1000
+    return BenchResult(
+        name=name,
+        iterations=len(samples_ms),
+        mean_ms=round(statistics.fmean(samples_ms), 3) if samples_ms else 0.0,
+        p50_ms=round(percentile(samples_ms, 0.50), 3),
+        p95_ms=round(percentile(samples_ms, 0.95), 3),
+        p99_ms=round(percentile(samples_ms, 0.99), 3),
+        ops_per_sec=round(len(samples_ms) / total_seconds, 2) if total_seconds > 0 else 0.0,
+        errors=errors
+    )
+
+
+def measure(name: str, func: Callable[[], Any], iterations: int = 50, warmup: int = 3,
+            setup: Optional[Callable[[], None]] = None) -> BenchResult:
+    """
+    Time repeated calls of a function.
+
+    Args:
+        name: Benchmark name used in the JSON report
+        func: Zero-argument callable to time
+        iterations: Timed calls
+        warmup: Untimed calls to populate caches first
+        setup: Optional untimed callable run before every call
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()  # keep collector pauses out of the per-call numbers
+    try:
+        for _ in range(iterations):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return summarize(name, samples)
+
+
+def load_sample_images(limit: int = 8) -> List[Tuple[str, bytes]]:
+    """
+    Load sample JPEGs as (filename, bytes).
+
+    Falls back to synthetic 1280x720 frames so the suite runs on a bare checkout.
+    """
+    paths: List[str] = []
+    for pattern in SAMPLE_IMAGE_GLOBS:
+        paths.extend(sorted(glob.glob(pattern, recursive=True)))
+    samples = []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            samples.append((os.path.basename(path), f.read()))
+
+    while len(samples) < min(limit, 2):
+        buffer = BytesIO()
+        shade = 60 + 40 * len(samples)
+        Image.new("RGB", (1280, 720), (shade, 90, 40)).save(buffer, "JPEG", quality=90)
+        samples.append((f"synthetic_{len(samples)}.jpg", buffer.getvalue()))
+    return samples
+
+
+def environment_info() -> Dict[str, Any]:
+    """Describe the machine so results are only compared like-for-like."""
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def write_report(path: str, results: List[BenchResult], skipped: Dict[str, str]) -> Dict[str, Any]:
+    """Write the JSON report and return it."""
+    report = {
+        'environment': environment_info(),
+        'results': {result.name: result.to_dict() for result in results},
+        'skipped': skipped
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline_path: str,
+                        tolerance: float) -> List[str]:
+    """
+    Compare p50 latencies against a baseline report.
+
+    Args:
+        tolerance: Allowed relative slowdown (0.2 = 20%)
+
+    Returns:
+        Human-readable regression descriptions; empty when nothing regressed
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline p50':>14} {'current p50':>14} {'change':>9}")
+    for name, current in sorted(report['results'].items()):
+        previous = baseline.get('results', {}).get(name)
+        if not previous or not previous.get('p50_ms'):
+            print(f"{name:<40} {'-':>14} {current['p50_ms']:>13.2f}ms {'new':>9}")
+            continue
+        change = current['p50_ms'] / previous['p50_ms'] - 1.0
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:<40} {previous['p50_ms']:>12.2f}ms {current['p50_ms']:>12.2f}ms {change:>+8.1%}{flag}")
+        if change > tolerance:
+            regressions.append(
+                f"{name}: p50 {previous['p50_ms']:.2f}ms -> {current['p50_ms']:.2f}ms ({change:+.1%})"
+            )
+        if current.get('errors', 0) > previous.get('errors', 0):
+            regressions.append(f"{name}: errors increased {previous.get('errors', 0)} -> {current['errors']}")
+    return regressions
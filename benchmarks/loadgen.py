@@ -0,0 +1,431 @@
+"""
+Load generator simulating a packing-shed camera fleet.
+
+Replays a directory of kaong images as concurrent Socket.IO camera clients
+(detect_video_frame) and HTTP uploaders (/detect_frame), and reports achieved
+throughput, latency percentiles, error and drop rates, and server resource
+usage over time.
+
+Usage:
+    # Spawn a local app instance with a SQLite database and temporary uploads
+    python -m benchmarks.loadgen --spawn --images static/uploads --cameras 20 --fps 2 --duration 60
+
+    # Drive an already running server
+    python -m benchmarks.loadgen --target http://127.0.0.1:5000 --server-pid 12345 --cameras 10
+
+A camera keeps at most one frame in flight, like the browser client; frames that
+come due while the previous one is still being processed are counted as drops.
+Requests refused by admission control (HTTP 429, detection_busy) are counted as shed
+and kept out of the latency percentiles; requests the server dropped at their deadline
+(HTTP 504, detection_error with reason 'expired') count as timeouts.
+"""
+import os
+import sys
+import json
+import time
+import glob
+import base64
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+import psutil
+import requests
+import socketio
+from PIL import Image
+
+from benchmarks.harness import percentile, environment_info
+
+logger = logging.getLogger(__name__)
+
+
+class ClientStats:
+    """Thread-safe latency, error, drop and shed counters for one client type."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies_ms: List[float] = []
+        self.completions: List[float] = []  # completion timestamps for the throughput timeline
+        self.sent = 0
+        self.errors = 0
+        self.drops = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    def record(self, latency_ms: float, ok: bool) -> None:
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.completions.append(time.time())
+            if not ok:
+                self.errors += 1
+
+    def count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        with self._lock:
+            latencies = list(self.latencies_ms)
+            sent, errors, drops, shed, timeouts = self.sent, self.errors, self.drops, self.shed, self.timeouts
+        completed = len(latencies)
+        attempted = sent + drops
+        return {
+            'sent': sent,
+            'completed': completed,
+            'throughput_per_sec': round(completed / duration, 2) if duration else 0.0,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50), 1),
+                'p90': round(percentile(latencies, 0.90), 1),
+                'p95': round(percentile(latencies, 0.95), 1),
+                'p99': round(percentile(latencies, 0.99), 1),
+                'max': round(max(latencies), 1) if latencies else 0.0
+            },
+            'errors': errors,
+            'timeouts': timeouts,
+            'error_rate': round((errors + timeouts) / sent, 4) if sent else 0.0,
+            'drops': drops,
+            'drop_rate': round(drops / attempted, 4) if attempted else 0.0,
+            'shed': shed,
+            'shed_rate': round(shed / sent, 4) if sent else 0.0
+        }
+
+
+def prepare_frames(image_dir: str, width: int, height: int, quality: int, limit: int) -> List[bytes]:
+    """Decode, resize and re-encode the source images once so clients only replay bytes."""
+    paths = []
+    for extension in ("jpg", "jpeg", "png"):
+        # Uploads may be sharded into subdirectories (UPLOAD_LAYOUT)
+        paths.extend(glob.glob(os.path.join(image_dir, "**", f"*.{extension}"), recursive=True))
+    paths = sorted(paths)[:limit]
+    if not paths:
+        raise SystemExit(f"No images found in {image_dir}")
+
+    frames = []
+    for path in paths:
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            if width and height:
+                image = image.resize((width, height), Image.Resampling.BILINEAR)
+            buffer = BytesIO()
+            image.save(buffer, "JPEG", quality=quality)
+            frames.append(buffer.getvalue())
+    logger.info(f"Prepared {len(frames)} frames from {image_dir} ({width}x{height} q{quality})")
+    return frames
+
+
+class CameraClient(threading.Thread):
+    """One phone streaming frames over Socket.IO at a fixed frame rate."""
+
+    def __init__(self, index: int, target: str, frames: List[bytes], fps: float,
+                 deadline: float, timeout: float, stats: ClientStats):
+        super().__init__(name=f"camera-{index}", daemon=True)
+        self._index = index
+        self._target = target
+        self._data_urls = ["data:image/jpeg;base64," + base64.b64encode(frame).decode() for frame in frames]
+        self._interval = 1.0 / fps
+        self._deadline = deadline
+        self._timeout = timeout
+        self._stats = stats
+        self._in_flight_since: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _on_result(self, ok: bool) -> None:
+        with self._lock:
+            sent_at, self._in_flight_since = self._in_flight_since, None
+        if sent_at is not None:
+            self._stats.record((time.perf_counter() - sent_at) * 1000, ok)
+
+    def _on_busy(self) -> None:
+        with self._lock:
+            sent_at, self._in_flight_since = self._in_flight_since, None
+        if sent_at is not None:
+            self._stats.count("shed")
+
+    def _on_error(self, data: Dict[str, Any]) -> None:
+        if data.get("reason") != "expired":
+            self._on_result(False)
+            return
+        with self._lock:
+            sent_at, self._in_flight_since = self._in_flight_since, None
+        if sent_at is not None:
+            self._stats.count("timeouts")
+
+    def run(self) -> None:
+        client = socketio.Client(reconnection=False)
+        client.on("detection_results", lambda data: self._on_result(True))
+        client.on("detection_error", self._on_error)
+        client.on("detection_busy", lambda data: self._on_busy())
+        try:
+            client.connect(self._target, wait_timeout=10)
+        except Exception as e:
+            logger.error(f"Camera {self._index} failed to connect: {str(e)}")
+            self._stats.count("errors")
+            return
+
+        frame_index = self._index  # stagger the replayed images between cameras
+        next_tick = time.perf_counter()
+        try:
+            while time.perf_counter() < self._deadline:
+                now = time.perf_counter()
+                with self._lock:
+                    in_flight_since = self._in_flight_since
+                    if in_flight_since is not None and now - in_flight_since > self._timeout:
+                        self._in_flight_since = in_flight_since = None
+                        self._stats.count("timeouts")
+                    busy = in_flight_since is not None
+                    if not busy:
+                        self._in_flight_since = now
+
+                if busy:
+                    self._stats.count("drops")
+                else:
+                    client.emit("detect_video_frame",
+                                {"image_data_url": self._data_urls[frame_index % len(self._data_urls)]})
+                    self._stats.count("sent")
+                    frame_index += 1
+
+                next_tick += self._interval
+                time.sleep(max(0.0, next_tick - time.perf_counter()))
+        finally:
+            client.disconnect()
+
+
+class Uploader(threading.Thread):
+    """One client uploading images to /detect_frame over a keep-alive session."""
+
+    def __init__(self, index: int, target: str, frames: List[bytes], rate: float,
+                 deadline: float, timeout: float, stats: ClientStats):
+        super().__init__(name=f"uploader-{index}", daemon=True)
+        self._index = index
+        self._url = target.rstrip("/") + "/detect_frame"
+        self._frames = frames
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._deadline = deadline
+        self._timeout = timeout
+        self._stats = stats
+
+    def run(self) -> None:
+        session = requests.Session()
+        frame_index = self._index
+        next_tick = time.perf_counter()
+        while time.perf_counter() < self._deadline:
+            frame = self._frames[frame_index % len(self._frames)]
+            frame_index += 1
+            self._stats.count("sent")
+            start = time.perf_counter()
+            try:
+                response = session.post(
+                    self._url,
+                    files={"image": (f"loadgen_{frame_index}.jpg", frame, "image/jpeg")},
+                    timeout=self._timeout
+                )
+                if response.status_code == 429:
+                    self._stats.count("shed")
+                elif response.status_code == 504:
+                    self._stats.count("timeouts")
+                else:
+                    self._stats.record((time.perf_counter() - start) * 1000, response.status_code == 200)
+            except requests.Timeout:
+                self._stats.count("timeouts")
+            except requests.RequestException:
+                self._stats.record((time.perf_counter() - start) * 1000, False)
+
+            if self._interval:
+                next_tick += self._interval
+                time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+
+class ResourceSampler(threading.Thread):
+    """Samples server CPU and memory once per interval."""
+
+    def __init__(self, pid: Optional[int], interval: float, stop_event: threading.Event):
+        super().__init__(name="resource-sampler", daemon=True)
+        self._process = psutil.Process(pid) if pid else None
+        self._interval = interval
+        self._stop_event = stop_event
+        self.samples: List[Dict[str, Any]] = []
+
+    def _tree_usage(self) -> Dict[str, float]:
+        processes = [self._process] + self._process.children(recursive=True)
+        cpu, rss, threads = 0.0, 0, 0
+        for process in processes:
+            try:
+                cpu += process.cpu_percent(interval=None)
+                rss += process.memory_info().rss
+                threads += process.num_threads()
+            except psutil.Error:
+                continue
+        return {'cpu_percent': round(cpu, 1), 'rss_mb': round(rss / 1024 / 1024, 1), 'threads': threads}
+
+    def run(self) -> None:
+        if self._process is None:
+            return
+        self._tree_usage()  # prime cpu_percent counters
+        while not self._stop_event.wait(self._interval):
+            try:
+                sample = {'time': time.time(), **self._tree_usage()}
+            except psutil.Error:
+                break
+            self.samples.append(sample)
+
+
+def local_env(workdir: str, upload_folder: Optional[str] = None) -> Dict[str, str]:
+    """Environment of a local instance backed by SQLite and a temporary upload folder (unless one is given)."""
+    env = dict(os.environ)
+    env.update({
+        "DB_BACKEND": "sqlite",
+        "DB_SQLITE_PATH": os.path.join(workdir, "loadgen.db"),
+        "UPLOAD_FOLDER": upload_folder or os.path.join(workdir, "uploads"),
+        "FLASK_DEBUG": "False",
+        "LOG_FILE": os.path.join(workdir, "server.log"),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING")
+    })
+    return env
+
+
+def spawn_server(port: int, workdir: str, upload_folder: Optional[str] = None,
+                 extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """Start a local app instance backed by SQLite and a temporary upload folder (unless one is given)."""
+    env = local_env(workdir, upload_folder)
+    env.update(extra_env or {})
+    env["FLASK_PORT"] = str(port)
+    bootstrap = (
+        "import app; "
+        f"app.socketio.run(app.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)"
+    )
+    return subprocess.Popen([sys.executable, "-c", bootstrap], env=env)
+
+
+def wait_until_ready(target: str, timeout: float) -> None:
+    """Poll /ready until the model is warmed up."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(target.rstrip("/") + "/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise SystemExit(f"Server at {target} did not become ready within {timeout}s")
+
+
+def throughput_timeline(stats: Dict[str, ClientStats], start: float, duration: float) -> List[Dict[str, Any]]:
+    """Completed requests per second, per client type."""
+    buckets = int(duration) + 1
+    timeline = [{'second': second} for second in range(buckets)]
+    for name, client_stats in stats.items():
+        counts = [0] * buckets
+        for completed_at in client_stats.completions:
+            second = int(completed_at - start)
+            if 0 <= second < buckets:
+                counts[second] += 1
+        for second, count in enumerate(counts):
+            timeline[second][name] = count
+    return timeline
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Simulated camera fleet load generator")
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--spawn", action="store_true", help="Start a local app instance (SQLite, temp uploads)")
+    parser.add_argument("--port", type=int, default=5055, help="Port for the spawned instance")
+    parser.add_argument("--server-pid", type=int, help="PID of an already running server to sample")
+    parser.add_argument("--images", default="static/uploads", help="Directory of images to replay")
+    parser.add_argument("--image-limit", type=int, default=50)
+    parser.add_argument("--cameras", type=int, default=10, help="Concurrent Socket.IO camera clients")
+    parser.add_argument("--uploaders", type=int, default=2, help="Concurrent HTTP uploaders")
+    parser.add_argument("--fps", type=float, default=2.0, help="Frames per second per camera")
+    parser.add_argument("--upload-rate", type=float, default=0.5, help="Uploads per second per uploader (0 = flat out)")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--jpeg-quality", type=int, default=80, help="Matches the browser's toDataURL quality")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before an in-flight request counts as lost")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--output", default="loadgen_report.json")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    frames = prepare_frames(args.images, args.width, args.height, args.jpeg_quality, args.image_limit)
+
+    workdir = None
+    server = None
+    target, server_pid = args.target, args.server_pid
+    if args.spawn:
+        workdir = tempfile.mkdtemp(prefix="kaong_loadgen_")
+        server = spawn_server(args.port, workdir)
+        target, server_pid = f"http://127.0.0.1:{args.port}", server.pid
+
+    try:
+        wait_until_ready(target, timeout=300)
+
+        stats = {'camera': ClientStats(), 'upload': ClientStats()}
+        stop_event = threading.Event()
+        sampler = ResourceSampler(server_pid, args.sample_interval, stop_event)
+
+        start = time.time()
+        deadline = time.perf_counter() + args.duration
+        clients: List[threading.Thread] = [
+            CameraClient(i, target, frames, args.fps, deadline, args.timeout, stats['camera'])
+            for i in range(args.cameras)
+        ] + [
+            Uploader(i, target, frames, args.upload_rate, deadline, args.timeout, stats['upload'])
+            for i in range(args.uploaders)
+        ]
+
+        sampler.start()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(args.duration + args.timeout + 10)
+        duration = time.time() - start
+        stop_event.set()
+        sampler.join()
+
+        report = {
+            'environment': environment_info(),
+            'config': {key: value for key, value in vars(args).items()},
+            'duration_seconds': round(duration, 2),
+            'camera': stats['camera'].summary(duration),
+            'upload': stats['upload'].summary(duration),
+            'throughput_timeline': throughput_timeline(stats, start, duration),
+            'server_resources': sampler.samples
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+        for name in ('camera', 'upload'):
+            summary = report[name]
+            latency = summary['latency_ms']
+            print(f"{name:<7} {summary['throughput_per_sec']:>7.2f}/s  p50 {latency['p50']:>8.1f}ms  "
+                  f"p95 {latency['p95']:>8.1f}ms  p99 {latency['p99']:>8.1f}ms  "
+                  f"errors {summary['error_rate']:.1%}  drops {summary['drop_rate']:.1%}  "
+                  f"shed {summary['shed_rate']:.1%}")
+        if sampler.samples:
+            peak_cpu = max(sample['cpu_percent'] for sample in sampler.samples)
+            peak_rss = max(sample['rss_mb'] for sample in sampler.samples)
+            print(f"server  peak CPU {peak_cpu:.0f}%  peak RSS {peak_rss:.0f}MB")
+        print(f"Report written to {args.output}")
+        return 0
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Macro load test: drives /detect_frame and detect_video_frame concurrently
+through the in-process Flask and Socket.IO test clients.
+"""
+import time
+import base64
+import logging
+import threading
+from io import BytesIO
+from typing import List, Tuple
+
+from benchmarks.harness import BenchResult, summarize
+
+logger = logging.getLogger(__name__)
+
+
+def _upload_worker(app, samples: List[Tuple[str, bytes]], deadline: float,
+                   latencies: List[float], errors: List[int]) -> None:
+    client = app.test_client()
+    index = 0
+    while time.perf_counter() < deadline:
+        filename, data = samples[index % len(samples)]
+        index += 1
+        start = time.perf_counter()
+        response = client.post(
+            "/detect_frame",
+            data={"image": (BytesIO(data), filename)},
+            content_type="multipart/form-data"
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+def _video_worker(app, socketio, samples: List[Tuple[str, bytes]], deadline: float,
+                  latencies: List[float], errors: List[int]) -> None:
+    client = socketio.test_client(app)
+    data_urls = ["data:image/jpeg;base64," + base64.b64encode(data).decode() for _, data in samples]
+    index = 0
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            client.emit("detect_video_frame", {"image_data_url": data_urls[index % len(data_urls)]})
+            index += 1
+            received = client.get_received()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if not any(message["name"] == "detection_results" for message in received):
+                errors.append(1)
+    finally:
+        client.disconnect()
+
+
+def run_macro(samples: List[Tuple[str, bytes]], duration: float,
+              upload_clients: int, video_clients: int) -> List[BenchResult]:
+    """
+    Run uploads and video frames concurrently for a fixed duration.
+
+    Importing app loads the model and creates tables, so callers must configure
+    DB_BACKEND/UPLOAD_FOLDER before calling this.
+    """
+    import app as app_module
+
+    upload_latencies: List[float] = []
+    upload_errors: List[int] = []
+    video_latencies: List[float] = []
+    video_errors: List[int] = []
+
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=_upload_worker,
+                         args=(app_module.app, samples, deadline, upload_latencies, upload_errors))
+        for _ in range(upload_clients)
+    ] + [
+        threading.Thread(target=_video_worker,
+                         args=(app_module.app, app_module.socketio, samples, deadline, video_latencies, video_errors))
+        for _ in range(video_clients)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    logger.info(f"Macro load test finished: {len(upload_latencies)} uploads, {len(video_latencies)} frames")
+    results = []
+    if upload_clients:
+        results.append(summarize(f"load.detect_frame_x{upload_clients}", upload_latencies,
+                                 wall_seconds, len(upload_errors)))
+    if video_clients:
+        results.append(summarize(f"load.detect_video_frame_x{video_clients}", video_latencies,
+                                 wall_seconds, len(video_errors)))
+    return results
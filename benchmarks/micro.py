@@ -0,0 +1,199 @@
+"""
+Micro-benchmarks for the individual services.
+"""
+import base64
+import logging
+import functools
+import itertools
+import random
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from benchmarks.harness import BenchResult, measure
+from services.image_service import ImageService, ArchivePolicy, archive_codec_available, encode_archival
+from services.detection_service import DetectionService
+from services.bounding_box_service import BoundingBoxService
+from services.database_service import DatabaseService, Assessment
+from services.admission import AdmissionController
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_model_results(count: int, width: int, height: int, seed: int = 7) -> List[SimpleNamespace]:
+    """
+    Build an object shaped like ultralytics predict() output.
+
+    Only the attributes read by DetectionService._process_model_results are provided.
+    """
+    rng = np.random.default_rng(seed)
+    x1 = rng.uniform(0, width * 0.8, count)
+    y1 = rng.uniform(0, height * 0.8, count)
+    xyxy = np.stack([x1, y1, x1 + width * 0.15, y1 + height * 0.15], axis=1)
+    boxes = SimpleNamespace(
+        xyxy=xyxy,
+        conf=rng.uniform(0.3, 0.99, count),
+        cls=rng.integers(0, 3, count).astype(float)
+    )
+    return [SimpleNamespace(boxes=boxes, speed={})]
+
+
+def bench_image_service(samples: List[Tuple[str, bytes]], iterations: int) -> List[BenchResult]:
+    image_service = ImageService()
+    filename, data = samples[0]
+    data_url = "data:image/jpeg;base64," + base64.b64encode(data).decode()
+    large_image = Image.new("RGB", (4000, 3000), (120, 80, 40))
+    decoded = Image.open(BytesIO(data)).convert("RGB")
+
+    def decode_upload():
+        image_service.validate_and_process_upload(
+            FileStorage(stream=BytesIO(data), filename=filename, content_type="image/jpeg")
+        )
+
+    return [
+        measure("image.decode_upload", decode_upload, iterations),
+        measure("image.decode_base64", lambda: image_service.process_base64_image(data_url), iterations),
+        measure("image.resize_4000x3000", lambda: image_service._resize_image_if_needed(large_image), iterations),
+        measure("image.save_jpeg", lambda: image_service.save_image(decoded, source="bench"), iterations)
+    ]
+
+
+def bench_archive_encoding(samples: List[Tuple[str, bytes]], iterations: int) -> List[BenchResult]:
+    """Encode cost and size of the previous quality-100 JPEG setting against the archival formats."""
+    image = Image.open(BytesIO(samples[0][1])).convert("RGB")
+
+    def legacy_jpeg() -> bytes:
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=100, optimize=True)
+        return buffer.getvalue()
+
+    encoders = {"encode.jpeg_q100_optimize": legacy_jpeg}
+    for archive_format, quality in (("jpeg", 85), ("webp", 80), ("avif", 60)):
+        if archive_codec_available(archive_format):
+            policy = ArchivePolicy("bench", archive_format, quality)
+            encoders[f"encode.{archive_format}_q{quality}"] = functools.partial(encode_archival, image, policy)
+
+    results = [measure(name, encode, iterations) for name, encode in encoders.items()]
+    sizes = {name: len(encode()) for name, encode in encoders.items()}
+    logger.info(f"Encoded size of the {image.size[0]}x{image.size[1]} sample in bytes: {sizes}")
+    return results
+
+
+def bench_process_results(iterations: int) -> List[BenchResult]:
+    # Post-processing needs no model: bypass __init__ so the benchmark runs without weights
+    detection_service = DetectionService.__new__(DetectionService)
+
+    results = []
+    for count in (5, 50, 300):
+        model_results = synthetic_model_results(count, 1280, 720)
+        results.append(measure(
+            f"detection.process_results_{count}",
+            lambda model_results=model_results: detection_service._process_model_results(model_results, 1280, 720),
+            iterations
+        ))
+    return results
+
+
+def bench_detect_objects(samples: List[Tuple[str, bytes]], iterations: int) -> List[BenchResult]:
+    detection_service = DetectionService()
+    images = [Image.open(BytesIO(data)).convert("RGB") for _, data in samples]
+    counter = itertools.count()
+
+    def detect():
+        detection_service.detect_objects(images[next(counter) % len(images)])
+
+    return [measure("detection.detect_objects", detect, iterations, warmup=2)]
+
+
+def bench_bounding_boxes(samples: List[Tuple[str, bytes]], iterations: int) -> List[BenchResult]:
+    detection_service = DetectionService.__new__(DetectionService)
+    bounding_box_service = BoundingBoxService()
+
+    image = Image.open(BytesIO(samples[0][1])).convert("RGB")
+    width, height = image.size
+    detections = detection_service._process_model_results(synthetic_model_results(12, width, height), width, height)
+
+    return [measure(
+        "bounding_box.create_category_images",
+        lambda: bounding_box_service.create_category_images(image, detections, "bench.jpg", "bench"),
+        iterations
+    )]
+
+
+def bench_database(iterations: int) -> List[BenchResult]:
+    database_service = DatabaseService()
+    database_service.create_tables()
+    detection_data = {
+        "detections": [
+            {"label": random.choice(["Ripe", "Unripe", "Rotten"]), "score": 0.9,
+             "box": [10.0, 10.0, 120.0, 120.0], "box_relative": [0.01, 0.01, 0.1, 0.1]}
+            for _ in range(8)
+        ]
+    }
+
+    def insert():
+        database_service.save_assessment(Assessment(
+            image_url="/static/uploads/bench.jpg", assessment="3 Ripe, 2 Unripe",
+            confidence=0.87, source="bench", detection_data=detection_data
+        ))
+
+    # Seed enough rows for the read benchmarks to be meaningful
+    for _ in range(500):
+        insert()
+
+    return [
+        measure("database.insert", insert, iterations),
+        measure("database.recent_100", lambda: database_service.get_all_assessments(100), iterations),
+        measure("database.by_source_100", lambda: database_service.get_assessments_by_source("bench", 100), iterations),
+        measure("database.stats", database_service.get_assessment_stats, iterations)
+    ]
+
+
+def bench_admission(iterations: int) -> List[BenchResult]:
+    # Per-request cost of admission control, spread over many clients as in production
+    admission = AdmissionController({'enabled': True, 'backend': 'memory', 'upload_rate': 1e6, 'upload_burst': 1e6,
+                                     'frame_rate': 1e6, 'frame_burst': 1e6})
+    clients = [f"10.0.{index // 256}.{index % 256}" for index in range(1000)]
+    counter = itertools.count()
+
+    def admit(kind: str):
+        admission.admit(kind, clients[next(counter) % len(clients)]).release()
+
+    return [
+        measure("admission.admit_upload", lambda: admit("upload"), iterations),
+        measure("admission.admit_camera", lambda: admit("camera"), iterations)
+    ]
+
+
+def run_micro(samples: List[Tuple[str, bytes]], iterations: int,
+              include_model: bool = True) -> Tuple[List[BenchResult], Dict[str, str]]:
+    """
+    Run all micro-benchmarks.
+
+    Returns:
+        Tuple of (results, skipped benchmark -> reason)
+    """
+    results: List[BenchResult] = []
+    skipped: Dict[str, str] = {}
+
+    results.extend(bench_image_service(samples, iterations))
+    results.extend(bench_archive_encoding(samples, iterations))
+    results.extend(bench_process_results(iterations))
+    results.extend(bench_bounding_boxes(samples, max(5, iterations // 5)))
+    results.extend(bench_database(iterations))
+    results.extend(bench_admission(iterations))
+
+    if include_model:
+        try:
+            results.extend(bench_detect_objects(samples, max(5, iterations // 5)))
+        except RuntimeError as e:
+            # No weights available offline (best_2.pt missing and yolo11n.pt not cached)
+            skipped["detection.detect_objects"] = str(e)
+            logger.warning(f"Skipping detect_objects benchmark: {str(e)}")
+    else:
+        skipped["detection.detect_objects"] = "disabled with --no-model"
+    return results, skipped
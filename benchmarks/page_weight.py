@@ -0,0 +1,164 @@
+"""
+Dashboard page weight: bytes and time to load the data grid with full-size
+images versus thumbnails.
+
+A page load is GET /get_assessment_data followed by every card image, fetched
+over six connections like a browser. The thumbnail run is repeated so the first
+(cold) pass includes lazy generation and the second shows the cached cost.
+
+--spawn seeds images into a temporary upload folder, which the spawned app serves
+at /static/uploads/, and removes it afterwards.
+
+Usage:
+    # Spawn a local app instance seeded with 200 assessments
+    python -m benchmarks.page_weight --spawn --cards 200
+
+    # Measure an already running server
+    python -m benchmarks.page_weight --target http://127.0.0.1:5000
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image
+
+from benchmarks.harness import percentile, environment_info, load_sample_images
+from benchmarks.loadgen import spawn_server, wait_until_ready
+
+# Browsers open about six connections per host
+BROWSER_CONNECTIONS = 6
+SEED_PREFIX = "pageweight"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Data grid page weight, full-size images vs thumbnails")
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--spawn", action="store_true", help="Start a seeded local app instance (SQLite, temp uploads)")
+    parser.add_argument("--port", type=int, default=5056, help="Port for the spawned instance")
+    parser.add_argument("--cards", type=int, default=200, help="Assessments to seed with --spawn")
+    parser.add_argument("--limit", type=int, help="limit parameter passed to /get_assessment_data")
+    parser.add_argument("--output", default="page_weight_report.json")
+    return parser.parse_args()
+
+
+def seed_assessments(workdir: str, count: int) -> None:
+    """Save count full-size images and assessments into the spawned instance's storage."""
+    # Same storage as spawn_server, set before config is imported
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["DB_SQLITE_PATH"] = os.path.join(workdir, "loadgen.db")
+    os.environ["UPLOAD_FOLDER"] = os.path.join(workdir, "uploads")
+    os.environ["DERIVATIVE_CACHE_DIR"] = os.path.join(workdir, "derivatives")
+    from services.database_service import DatabaseService, Assessment
+    from services.image_service import ImageService
+
+    database_service = DatabaseService()
+    database_service.create_tables()
+    image_service = ImageService()
+    # Uploads are stored at up to 1920x1080 (MAX_IMAGE_WIDTH x MAX_IMAGE_HEIGHT)
+    images = [Image.open(BytesIO(data)).convert("RGB").resize((1920, 1080)) for _, data in load_sample_images()]
+
+    for i in range(count):
+        filename = image_service.save_image(images[i % len(images)], prefix=SEED_PREFIX, source="upload")
+        database_service.save_assessment(Assessment(
+            image_url=image_service.get_image_url(filename), assessment="1 Ripe", confidence=0.9,
+            source="upload", timestamp=datetime.now()
+        ))
+
+
+def load_page(target: str, field: str, limit: Optional[int] = None) -> Dict[str, Any]:
+    """Fetch the grid data and every card image named by field."""
+    local = threading.local()
+
+    def fetch(url: str) -> Tuple[int, float, int]:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.get(target + url, timeout=60)
+        return len(response.content), (time.perf_counter() - start) * 1000, response.status_code
+
+    start = time.perf_counter()
+    params = {"limit": limit} if limit else None
+    data_response = requests.get(target + "/get_assessment_data", params=params, timeout=60)
+    data_response.raise_for_status()
+    items = data_response.json()
+    urls = [item.get(field) or item["image_url"] for item in items]
+    with ThreadPoolExecutor(max_workers=BROWSER_CONNECTIONS) as executor:
+        fetched = list(executor.map(fetch, urls))
+    seconds = time.perf_counter() - start
+
+    image_bytes = sum(size for size, _, _ in fetched)
+    latencies: List[float] = [latency for _, latency, _ in fetched]
+    return {
+        'cards': len(items),
+        'json_bytes': len(data_response.content),
+        'image_bytes': image_bytes,
+        'total_bytes': len(data_response.content) + image_bytes,
+        'load_seconds': round(seconds, 3),
+        'image_latency_ms': {'p50': round(percentile(latencies, 0.50), 2),
+                             'p95': round(percentile(latencies, 0.95), 2)},
+        'errors': sum(1 for _, _, status in fetched if status != 200)
+    }
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    workdir = None
+    server = None
+    target = args.target.rstrip("/")
+    if args.spawn:
+        workdir = tempfile.mkdtemp(prefix="kaong_pageweight_")
+        seed_assessments(workdir, args.cards)
+        server = spawn_server(args.port, workdir)
+        target = f"http://127.0.0.1:{args.port}"
+
+    try:
+        wait_until_ready(target, timeout=300)
+        runs = {
+            'full_size': load_page(target, "image_url", args.limit),
+            'thumbnail_cold': load_page(target, "thumbnail_url", args.limit),
+            'thumbnail_warm': load_page(target, "thumbnail_url", args.limit)
+        }
+        report = {
+            'environment': environment_info(),
+            'config': {key: value for key, value in vars(args).items()},
+            'runs': runs
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+        for name, run in runs.items():
+            print(f"{name:<15} {run['cards']:>5} cards  {run['total_bytes'] / 1024 / 1024:>9.2f}MB  "
+                  f"{run['load_seconds']:>7.2f}s  image p50 {run['image_latency_ms']['p50']:>8.1f}ms  "
+                  f"errors {run['errors']}")
+        full, thumb = runs['full_size'], runs['thumbnail_warm']
+        if thumb['total_bytes']:
+            print(f"Thumbnails cut page weight {full['total_bytes'] / thumb['total_bytes']:.1f}x")
+        print(f"Report written to {args.output}")
+        return 0
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
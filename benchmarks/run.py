@@ -0,0 +1,111 @@
+"""
+Benchmark runner.
+
+Usage:
+    python -m benchmarks.run                                  # micro + macro, writes benchmark_results.json
+    python -m benchmarks.run --suite micro --iterations 100
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.15
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --suite dataset --dataset-dir dataset --workers 4
+
+Runs fully offline: the database is a throwaway SQLite file and images are written to a
+temporary upload folder. Exits with status 1 when any benchmark regresses beyond the
+tolerance relative to the baseline.
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Kaong detection performance benchmarks")
+    parser.add_argument("--suite", choices=["micro", "macro", "dataset", "all"], default="all")
+    parser.add_argument("--iterations", type=int, default=50, help="Timed iterations per micro-benchmark")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run the macro load test")
+    parser.add_argument("--upload-clients", type=int, default=4)
+    parser.add_argument("--video-clients", type=int, default=4)
+    parser.add_argument("--dataset-dir", help="YOLO dataset for --suite dataset (default: synthetic)")
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader workers for --suite dataset")
+    parser.add_argument("--no-model", action="store_true", help="Skip benchmarks that need model weights")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Allowed p50 slowdown (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", help="Also copy the results to this baseline path")
+    return parser.parse_args()
+
+
+def configure_offline_environment(workdir: str) -> None:
+    """Point the services at throwaway storage before config is imported."""
+    os.environ.setdefault("DB_BACKEND", "sqlite")
+    os.environ.setdefault("DB_SQLITE_PATH", os.path.join(workdir, "benchmark.db"))
+    os.environ.setdefault("UPLOAD_FOLDER", os.path.join(workdir, "uploads"))
+    os.environ.setdefault("LOG_FILE", "")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def main() -> int:
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="kaong_bench_")
+    configure_offline_environment(workdir)
+    logging.basicConfig(level=os.environ["LOG_LEVEL"], format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    # Imported after the environment is configured
+    from benchmarks.harness import load_sample_images, write_report, compare_to_baseline
+
+    try:
+        samples = load_sample_images()
+        results, skipped = [], {}
+
+        if args.suite in ("micro", "all"):
+            from benchmarks.micro import run_micro
+            micro_results, micro_skipped = run_micro(samples, args.iterations, include_model=not args.no_model)
+            results.extend(micro_results)
+            skipped.update(micro_skipped)
+
+        if args.suite in ("macro", "all"):
+            if args.no_model:
+                skipped["load"] = "disabled with --no-model"
+            else:
+                from benchmarks.macro import run_macro
+                try:
+                    results.extend(run_macro(samples, args.duration, args.upload_clients, args.video_clients))
+                except RuntimeError as e:
+                    skipped["load"] = str(e)
+
+        # Training input pipeline; only run when asked for since it needs torch and takes a while
+        if args.suite == "dataset":
+            from benchmarks.dataset import run_dataset_benchmark
+            results.extend(run_dataset_benchmark(args.dataset_dir, workdir, samples, workers=args.workers))
+
+        report = write_report(args.output, results, skipped)
+        for result in results:
+            print(f"{result.name:<40} p50 {result.p50_ms:>9.2f}ms  p95 {result.p95_ms:>9.2f}ms  "
+                  f"{result.ops_per_sec:>9.1f} ops/s  errors {result.errors}")
+        for name, reason in skipped.items():
+            print(f"{name:<40} skipped: {reason}")
+        print(f"\nResults written to {args.output}")
+
+        if args.save_baseline:
+            with open(args.save_baseline, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Baseline saved to {args.save_baseline}")
+
+        if args.baseline:
+            regressions = compare_to_baseline(report, args.baseline, args.tolerance)
+            if regressions:
+                print("\nPERFORMANCE REGRESSIONS:")
+                for regression in regressions:
+                    print(f"  {regression}")
+                return 1
+            print("\nNo regressions beyond tolerance")
+        return 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Horizontal scale-out of INFERENCE_MODE=queue on one machine.
+
+For each worker count, starts a stateless web node and that many
+inference_worker.py processes sharing a fresh job queue, drives the web node with
+benchmarks/loadgen.py, and reports throughput and latency per worker count. The
+offered load stays the same, so throughput grows with workers until the clients,
+the web node or the machine's cores become the limit.
+
+Usage:
+    python -m benchmarks.scaleout --workers 1 2 4 --cameras 24 --fps 4 --duration 30
+
+    # Redis instead of the SQLite stand-in
+    python -m benchmarks.scaleout --backend redis --redis-url redis://127.0.0.1:6379/0
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+import requests
+
+from benchmarks.harness import environment_info
+from benchmarks.loadgen import local_env, prepare_frames, spawn_server, wait_until_ready
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Throughput of queue mode by number of inference workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to measure")
+    parser.add_argument("--backend", choices=("sqlite", "redis"), default="sqlite")
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/0")
+    parser.add_argument("--batch-size", type=int, default=8, help="JOB_BATCH_SIZE of the workers")
+    parser.add_argument("--batch-window-ms", type=float, default=10, help="JOB_BATCH_WINDOW_MS of the workers")
+    parser.add_argument("--port", type=int, default=5058, help="Port of the web node")
+    parser.add_argument("--settle", type=float, default=10.0,
+                        help="Seconds to let the workers load their models before measuring")
+    parser.add_argument("--images", default="static/uploads", help="Directory of images to replay")
+    parser.add_argument("--cameras", type=int, default=24)
+    parser.add_argument("--uploaders", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=4.0)
+    parser.add_argument("--upload-rate", type=float, default=1.0)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per worker count")
+    parser.add_argument("--output", default="scaleout_report.json")
+    return parser.parse_args()
+
+
+def warm_up(target: str, images: str, timeout: float) -> None:
+    """Send one upload through the queue so a worker has answered before measuring."""
+    frame = prepare_frames(images, 640, 480, 80, 1)[0]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = requests.post(target + "/detect_frame", files={"image": ("warmup.jpg", frame, "image/jpeg")},
+                                     timeout=max(1.0, deadline - time.time()))
+            if response.status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    raise SystemExit(f"No inference worker answered within {timeout:.0f}s")
+
+
+def stop_processes(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_step(args: argparse.Namespace, worker_count: int) -> Dict[str, Any]:
+    """Measure one worker count on a fresh queue, database and upload folder."""
+    workdir = tempfile.mkdtemp(prefix="kaong_scaleout_")
+    queue_env = {
+        "INFERENCE_MODE": "queue",
+        "JOB_QUEUE_BACKEND": args.backend,
+        "JOB_QUEUE_SQLITE_PATH": os.path.join(workdir, "jobs.db"),
+        "JOB_QUEUE_REDIS_URL": args.redis_url,
+        # A fresh namespace, so jobs left in Redis by an earlier step are not counted
+        "JOB_QUEUE_PREFIX": f"scaleout_{os.getpid()}_{worker_count}",
+        "JOB_BATCH_SIZE": str(args.batch_size),
+        "JOB_BATCH_WINDOW_MS": str(args.batch_window_ms)
+    }
+    target = f"http://127.0.0.1:{args.port}"
+    processes: List[subprocess.Popen] = []
+    try:
+        processes.append(spawn_server(args.port, workdir, extra_env=queue_env))
+        for index in range(worker_count):
+            env = local_env(workdir)
+            env.update(queue_env)
+            env["LOG_FILE"] = os.path.join(workdir, f"worker_{index}.log")
+            processes.append(subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "inference_worker.py")],
+                                              env=env, cwd=REPO_ROOT))
+
+        wait_until_ready(target, timeout=60)
+        warm_up(target, args.images, timeout=300)
+        time.sleep(args.settle)
+
+        report_path = os.path.join(workdir, "loadgen.json")
+        subprocess.run([
+            sys.executable, "-m", "benchmarks.loadgen", "--target", target,
+            "--server-pid", str(processes[0].pid), "--images", args.images,
+            "--cameras", str(args.cameras), "--uploaders", str(args.uploaders),
+            "--fps", str(args.fps), "--upload-rate", str(args.upload_rate),
+            "--width", str(args.width), "--height", str(args.height),
+            "--duration", str(args.duration), "--output", report_path
+        ], check=True, cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+        with open(report_path) as f:
+            report = json.load(f)
+    finally:
+        stop_processes(processes)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    camera, upload = report['camera'], report['upload']
+    return {
+        'workers': worker_count,
+        'throughput_per_sec': round(camera['throughput_per_sec'] + upload['throughput_per_sec'], 2),
+        'camera': camera,
+        'upload': upload
+    }
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    steps = []
+    for worker_count in args.workers:
+        logger.info(f"Measuring {worker_count} inference worker(s)")
+        steps.append(run_step(args, worker_count))
+
+    report = {
+        'environment': environment_info(),
+        'config': {key: value for key, value in vars(args).items()},
+        'steps': steps
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = steps[0]['throughput_per_sec'] or 1.0
+    print(f"{'workers':>7} {'images/s':>9} {'speedup':>8} {'camera p50':>11} {'camera p95':>11} "
+          f"{'upload p95':>11} {'errors':>7} {'drops':>6}")
+    for step in steps:
+        camera, upload = step['camera'], step['upload']
+        print(f"{step['workers']:>7} {step['throughput_per_sec']:>9.2f} "
+              f"{step['throughput_per_sec'] / baseline:>7.2f}x "
+              f"{camera['latency_ms']['p50']:>9.1f}ms {camera['latency_ms']['p95']:>9.1f}ms "
+              f"{upload['latency_ms']['p95']:>9.1f}ms {camera['error_rate']:>7.1%} {camera['drop_rate']:>6.1%}")
+    print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
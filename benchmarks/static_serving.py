@@ -0,0 +1,189 @@
+"""
+Image serving throughput: requests/sec for /static/uploads and /derivatives.
+
+Each scenario runs for a fixed time over keep-alive connections, cycling through
+the image URLs of the data grid:
+
+- full: plain GETs of full-size uploads (200 with the body)
+- revalidate: GETs with If-None-Match, as a browser revalidating its cache (304)
+- range: the first 64 KiB of each upload (206)
+- thumbnail: warm card thumbnails (200)
+
+Usage:
+    # Spawn a local app instance seeded with 200 assessments
+    python -m benchmarks.static_serving --spawn --cards 200 --concurrency 8
+
+    # Measure an already running server, e.g. behind nginx with STATIC_OFFLOAD=x-accel
+    python -m benchmarks.static_serving --target http://127.0.0.1:8080 --duration 20
+"""
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from benchmarks.harness import percentile, environment_info
+from benchmarks.loadgen import spawn_server, wait_until_ready
+from benchmarks.page_weight import seed_assessments
+
+RANGE_BYTES = 64 * 1024
+SCENARIOS = ("full", "revalidate", "range", "thumbnail")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Requests/sec for stored image serving")
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--spawn", action="store_true", help="Start a seeded local app instance (SQLite, temp uploads)")
+    parser.add_argument("--port", type=int, default=5057, help="Port for the spawned instance")
+    parser.add_argument("--cards", type=int, default=200, help="Assessments to seed with --spawn")
+    parser.add_argument("--limit", type=int, help="limit parameter passed to /get_assessment_data")
+    parser.add_argument("--concurrency", type=int, default=8, help="Client connections")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--output", default="static_serving_report.json")
+    return parser.parse_args()
+
+
+def collect_urls(target: str, limit: Optional[int]) -> Tuple[List[str], List[str]]:
+    """Full-size and thumbnail URLs of the data grid."""
+    params = {"limit": limit} if limit else None
+    response = requests.get(target + "/get_assessment_data", params=params, timeout=60)
+    response.raise_for_status()
+    items = response.json()
+    originals = [item["image_url"] for item in items if item.get("image_url")]
+    thumbnails = [item["thumbnail_url"] for item in items if item.get("thumbnail_url")]
+    return originals, thumbnails
+
+
+def prepare(target: str, urls: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Fetch every URL once: generates missing derivatives and returns ETags and sample headers."""
+    etags: Dict[str, str] = {}
+    headers: Dict[str, str] = {}
+    with requests.Session() as session:
+        for url in urls:
+            response = session.get(target + url, timeout=60)
+            if response.status_code == 200:
+                etags[url] = response.headers.get("ETag", "")
+                if not headers:
+                    headers = {name: response.headers.get(name, "") for name in
+                               ("Cache-Control", "ETag", "Accept-Ranges", "X-Accel-Redirect", "X-Sendfile")}
+    return etags, headers
+
+
+def run_scenario(target: str, urls: List[str], scenario: str, etags: Dict[str, str],
+                 concurrency: int, duration: float) -> Dict[str, Any]:
+    """Request urls round-robin from concurrency connections for duration seconds."""
+    expected = {"full": 200, "revalidate": 304, "range": 206, "thumbnail": 200}[scenario]
+    lock = threading.Lock()
+    latencies: List[float] = []
+    totals = {'requests': 0, 'bytes': 0, 'errors': 0}
+    deadline = time.perf_counter() + duration
+
+    def client(offset: int) -> None:
+        local_latencies: List[float] = []
+        requests_done = body_bytes = errors = 0
+        with requests.Session() as session:
+            index = offset
+            while time.perf_counter() < deadline:
+                url = urls[index % len(urls)]
+                index += concurrency
+                headers = {}
+                if scenario == "revalidate":
+                    headers["If-None-Match"] = etags.get(url, "")
+                elif scenario == "range":
+                    headers["Range"] = f"bytes=0-{RANGE_BYTES - 1}"
+                start = time.perf_counter()
+                try:
+                    response = session.get(target + url, headers=headers, timeout=60)
+                    body_bytes += len(response.content)
+                    errors += response.status_code != expected
+                except requests.RequestException:
+                    errors += 1
+                local_latencies.append((time.perf_counter() - start) * 1000)
+                requests_done += 1
+        with lock:
+            latencies.extend(local_latencies)
+            totals['requests'] += requests_done
+            totals['bytes'] += body_bytes
+            totals['errors'] += errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    return {
+        'requests': totals['requests'],
+        'requests_per_second': round(totals['requests'] / seconds, 1),
+        'megabytes_per_second': round(totals['bytes'] / seconds / 1024 / 1024, 2),
+        'latency_ms': {'p50': round(percentile(latencies, 0.50), 2),
+                       'p95': round(percentile(latencies, 0.95), 2),
+                       'p99': round(percentile(latencies, 0.99), 2)},
+        'errors': totals['errors']
+    }
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    workdir = None
+    server = None
+    target = args.target.rstrip("/")
+    if args.spawn:
+        workdir = tempfile.mkdtemp(prefix="kaong_static_")
+        seed_assessments(workdir, args.cards)
+        server = spawn_server(args.port, workdir)
+        target = f"http://127.0.0.1:{args.port}"
+
+    try:
+        wait_until_ready(target, timeout=300)
+        originals, thumbnails = collect_urls(target, args.limit)
+        if not originals:
+            raise SystemExit(f"{target} has no assessments with images to serve")
+        etags, sample_headers = prepare(target, originals + thumbnails)
+
+        runs = {}
+        for scenario in args.scenarios:
+            urls = thumbnails if scenario == "thumbnail" else originals
+            if not urls:
+                continue
+            runs[scenario] = run_scenario(target, urls, scenario, etags, args.concurrency, args.duration)
+
+        report = {
+            'environment': environment_info(),
+            'config': {key: value for key, value in vars(args).items()},
+            'response_headers': sample_headers,
+            'runs': runs
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print(f"Cache-Control: {sample_headers.get('Cache-Control') or '(none)'}")
+        for name, run in runs.items():
+            print(f"{name:<11} {run['requests_per_second']:>9.1f} req/s  {run['megabytes_per_second']:>8.2f}MB/s  "
+                  f"p50 {run['latency_ms']['p50']:>7.2f}ms  p95 {run['latency_ms']['p95']:>7.2f}ms  "
+                  f"errors {run['errors']}")
+        print(f"Report written to {args.output}")
+        return 0
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Delete expired assessments with their images and reconcile the upload folder with the database.
+
+Usage:
+    python cleanup_uploads.py --days 180 --dry-run         # count what would be deleted
+    python cleanup_uploads.py --days 180 --rate 100        # throttled, safe next to the running app
+    python cleanup_uploads.py --delete-orphan-files        # also remove files no assessment references
+
+Defaults come from RETENTION_* in config.py; the same job runs inside the app when
+RETENTION_ENABLED=true.
+"""
+import sys
+import json
+import logging
+import argparse
+
+from config import LOGGING_CONFIG
+from services.database_service import DatabaseService
+from services.image_service import ImageService
+from services.derivative_service import DerivativeService
+from services.retention_service import RetentionService
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Expire old assessments and clean up orphaned uploads")
+    parser.add_argument("--dry-run", action="store_true", help="Count expired assessments and orphans only")
+    parser.add_argument("--days", type=int, help="Retention period in days (default RETENTION_DAYS)")
+    parser.add_argument("--no-reconcile", action="store_true", help="Skip the orphan scan")
+    parser.add_argument("--delete-orphan-files", action="store_true", help="Remove files no assessment references")
+    parser.add_argument("--delete-orphan-rows", action="store_true",
+                        help="Remove assessments whose original image is missing")
+    parser.add_argument("--rate", type=float, help="Deletions per second (default RETENTION_MAX_DELETES_PER_SECOND)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    overrides = {}
+    if args.days is not None:
+        overrides['retention_days'] = args.days
+    if args.rate is not None:
+        overrides['max_deletes_per_second'] = args.rate
+    if args.delete_orphan_files:
+        overrides['delete_orphan_files'] = True
+    if args.delete_orphan_rows:
+        overrides['delete_orphan_rows'] = True
+
+    image_service = ImageService()
+    retention = RetentionService(DatabaseService(), image_service, DerivativeService(image_service, {'eager': False}),
+                                 config=overrides)
+    result = retention.run_once(dry_run=args.dry_run, reconcile=False if args.no_reconcile else None)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,10 +8,70 @@ from typing import Dict, Any
 # Device configuration
 INFERENCE_DEVICE = "cpu" # 'cuda' if nvidia and cuda is installed.
 
-# Model configuration  
+# Model configuration
 DEFAULT_MODEL_PATH = "yolo11n.pt"
 CUSTOM_MODEL_PATH = "best_2.pt"
 
+# Model registry configuration (hot swap and A/B routing)
+MODEL_REGISTRY_CONFIG = {
+    # Directory polled for new/updated *.pt files; empty string disables the watcher
+    'watch_dir': os.getenv('MODEL_WATCH_DIR', ''),
+    'watch_interval': float(os.getenv('MODEL_WATCH_INTERVAL', 10)),
+    # Route all traffic to a newly discovered model once it has been warmed up
+    'auto_activate': os.getenv('MODEL_AUTO_ACTIVATE', 'False').lower() == 'true',
+    # Token required in the X-Admin-Token header; when unset only localhost may call admin routes
+    'admin_token': os.getenv('MODEL_ADMIN_TOKEN', '')
+}
+
+# Model warm-up configuration, applied whenever a model version is loaded
+MODEL_WARMUP_CONFIG = {
+    'enabled': os.getenv('MODEL_WARMUP', 'True').lower() == 'true',
+    # Expected input sizes (WxH): camera frames and uploads letterbox to different shapes
+    'shapes': [
+        tuple(int(dim) for dim in shape.split('x'))
+        for shape in os.getenv('MODEL_WARMUP_SHAPES', '640x480,1280x720,1920x1080').split(',') if shape
+    ],
+    'batch_sizes': [int(size) for size in os.getenv('MODEL_WARMUP_BATCH_SIZES', '1').split(',') if size],
+    'iterations': int(os.getenv('MODEL_WARMUP_ITERATIONS', 2)),
+    # Graph compilation: 'none', 'torch_compile' or 'torchscript'
+    'compile': os.getenv('MODEL_COMPILE', 'none').lower(),
+    # torch intra-op threads; 0 keeps the torch default
+    'num_threads': int(os.getenv('TORCH_NUM_THREADS', 0)),
+    # Load and warm up in a background thread; detection routes report 503 until ready
+    'background': os.getenv('MODEL_WARMUP_BACKGROUND', 'False').lower() == 'true'
+}
+
+# Active-learning sample mining configuration
+SAMPLE_MINER_CONFIG = {
+    # Run the miner in a background thread of the web app
+    'enabled': os.getenv('SAMPLE_MINER_ENABLED', 'False').lower() == 'true',
+    'interval': float(os.getenv('SAMPLE_MINER_INTERVAL', 300)),
+    'state_dir': os.getenv('SAMPLE_MINER_STATE_DIR', 'data/active_learning'),
+    # Maximum number of candidates kept between exports
+    'pool_size': int(os.getenv('SAMPLE_MINER_POOL_SIZE', 500)),
+    # Detection scores within this distance above CONFIDENCE_THRESHOLD count as uncertain
+    'uncertainty_band': float(os.getenv('SAMPLE_MINER_UNCERTAINTY_BAND', 0.15)),
+    'min_uncertainty': float(os.getenv('SAMPLE_MINER_MIN_UNCERTAINTY', 0.2)),
+    # Weight of diversity vs uncertainty in the candidate score
+    'diversity_weight': float(os.getenv('SAMPLE_MINER_DIVERSITY_WEIGHT', 0.4)),
+    # Cosine similarity above which two images count as duplicates
+    'duplicate_similarity': float(os.getenv('SAMPLE_MINER_DUPLICATE_SIMILARITY', 0.97)),
+    # 'thumbnail' (cheap pixel embedding) or 'model' (YOLO backbone features, separate model instance)
+    'embedding': os.getenv('SAMPLE_MINER_EMBEDDING', 'thumbnail').lower(),
+    'chunk_size': int(os.getenv('SAMPLE_MINER_CHUNK_SIZE', 1000))
+}
+
+# Training configuration (train_model.py)
+TRAINING_CONFIG = {
+    # YOLO layout: <dataset_dir>/images/{train,val}/*.jpg with matching <dataset_dir>/labels/{train,val}/*.txt
+    'dataset_dir': os.getenv('TRAINING_DATASET_DIR', 'dataset'),
+    # Each run writes models/<version>/ and publishes models/<version>.pt (point MODEL_WATCH_DIR here)
+    'output_dir': os.getenv('TRAINING_OUTPUT_DIR', 'models'),
+    # Decoded, letterboxed images are cached here so later epochs skip JPEG decode
+    'cache_dir': os.getenv('TRAINING_CACHE_DIR', '.cache/training'),
+    'imgsz': int(os.getenv('TRAINING_IMGSZ', 640))
+}
+
 # Detection thresholds
 CONFIDENCE_THRESHOLD = 0.6
 DATABASE_SAVE_CONFIDENCE_LEVEL = 0.8
@@ -19,15 +79,117 @@ DATABASE_SAVE_CONFIDENCE_LEVEL = 0.8
 # Image processing configuration
 MAX_IMAGE_WIDTH = 1920
 MAX_IMAGE_HEIGHT = 1080
-IMAGE_QUALITY = 100
+
+# Archival encoding of stored images, per source. Formats: 'jpeg', 'webp', 'avif' (falls back to
+# JPEG when Pillow lacks the codec) or 'original' (keep the received bytes). Camera frames arrive
+# encoded and are always saved as received; their policy only applies to recompress_uploads.py.
+ARCHIVE_ENCODING_CONFIG = {
+    'policies': {
+        source: {
+            'format': os.getenv(f'ARCHIVE_FORMAT_{source.upper()}', default_format).lower(),
+            'quality': int(os.getenv(f'ARCHIVE_QUALITY_{source.upper()}', default_quality))
+        }
+        for source, default_format, default_quality in (
+            ('upload', 'jpeg', 85),
+            ('manual', 'jpeg', 85),
+            ('camera_ws', 'original', 80),
+            # Annotated per-category renders
+            ('category', 'jpeg', 80)
+        )
+    },
+    # recompress_uploads.py only replaces a file when the re-encode is at least this much smaller
+    'recompress_min_savings': float(os.getenv('ARCHIVE_RECOMPRESS_MIN_SAVINGS', 0.1))
+}
 
 # File and directory configuration
-UPLOAD_FOLDER = "static/uploads"
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', "static/uploads")
+# Subdirectories for new uploads: 'date' (YYYY/MM/DD), 'hash' (two 256-way levels) or 'flat'.
+# Existing flat files still resolve; migrate_uploads.py moves them into the layout.
+UPLOAD_LAYOUT = os.getenv('UPLOAD_LAYOUT', 'date').lower()
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+
+# Where stored images live. 'local' writes under UPLOAD_FOLDER; 's3' writes to an S3-compatible
+# bucket (AWS S3, MinIO, ...) so any number of app instances share one image store
+STORAGE_CONFIG = {
+    'backend': os.getenv('STORAGE_BACKEND', 'local').lower(),
+    's3_bucket': os.getenv('STORAGE_S3_BUCKET', 'kaong-images'),
+    # Key prefix inside the bucket; image keys are the paths relative to UPLOAD_FOLDER
+    's3_prefix': os.getenv('STORAGE_S3_PREFIX', 'uploads/'),
+    # e.g. http://127.0.0.1:9000 for a local MinIO; empty for AWS
+    's3_endpoint_url': os.getenv('STORAGE_S3_ENDPOINT_URL', ''),
+    's3_region': os.getenv('STORAGE_S3_REGION', 'us-east-1'),
+    # Empty uses the boto3 credential chain (environment, instance role, ~/.aws)
+    's3_access_key': os.getenv('STORAGE_S3_ACCESS_KEY', ''),
+    's3_secret_key': os.getenv('STORAGE_S3_SECRET_KEY', ''),
+    # 'path' for MinIO and most self-hosted stand-ins, 'auto' for AWS
+    's3_addressing_style': os.getenv('STORAGE_S3_ADDRESSING_STYLE', 'auto'),
+    # Objects larger than this are written as multipart uploads of multipart_chunk_size parts
+    'multipart_threshold': int(os.getenv('STORAGE_MULTIPART_THRESHOLD', 8 * 1024 * 1024)),
+    'multipart_chunk_size': int(os.getenv('STORAGE_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024)),
+    # Parallel part uploads per object, and parallel objects in save_many
+    'max_concurrency': int(os.getenv('STORAGE_MAX_CONCURRENCY', 4)),
+    # CDN or public bucket base URL stored in assessments; empty keeps /static/uploads/ URLs,
+    # which the app redirects to short-lived signed URLs
+    'public_url': os.getenv('STORAGE_PUBLIC_URL', '').rstrip('/'),
+    'signed_url_ttl': int(os.getenv('STORAGE_SIGNED_URL_TTL', 3600)),
+    # Stored images never change under the same key
+    'cache_control': os.getenv('STORAGE_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Thumbnail/preview derivatives of uploaded images (served from /derivatives/<variant>/<filename>)
+DERIVATIVE_CONFIG = {
+    # Disk cache, next to the upload folder by default
+    'cache_dir': os.getenv('DERIVATIVE_CACHE_DIR', os.path.join(os.path.dirname(UPLOAD_FOLDER) or '.', 'derivatives')),
+    # Longest edge in pixels per variant
+    'variants': {
+        'thumb': int(os.getenv('DERIVATIVE_THUMB_SIZE', 320)),
+        'preview': int(os.getenv('DERIVATIVE_PREVIEW_SIZE', 1024))
+    },
+    'quality': int(os.getenv('DERIVATIVE_QUALITY', 75)),
+    # Generate variants in background threads right after an image is saved; otherwise on first request
+    'eager': os.getenv('DERIVATIVE_EAGER', 'True').lower() == 'true',
+    'workers': int(os.getenv('DERIVATIVE_WORKERS', 2)),
+    # Browser cache lifetime; derivatives of an upload never change
+    'max_age': int(os.getenv('DERIVATIVE_MAX_AGE', 30 * 24 * 3600))
+}
+
+# Serving of stored images at /static/uploads/<key> and /derivatives/<variant>/<key> (services/static_files.py)
+STATIC_FILES_CONFIG = {
+    # Upload names carry a timestamp and are never reused, so browsers may cache them without revalidating
+    'max_age': int(os.getenv('STATIC_MAX_AGE', 365 * 24 * 3600)),
+    'immutable': os.getenv('STATIC_IMMUTABLE', 'True').lower() == 'true',
+    # '' sends the body from the app; 'x-sendfile' (Apache, lighttpd) or 'x-accel' (nginx) lets the front proxy send it
+    'offload': os.getenv('STATIC_OFFLOAD', '').lower(),
+    # nginx internal locations aliased to UPLOAD_FOLDER and DERIVATIVE_CACHE_DIR, for 'x-accel'
+    'x_accel_uploads': os.getenv('STATIC_X_ACCEL_UPLOADS', '/_protected/uploads/'),
+    'x_accel_derivatives': os.getenv('STATIC_X_ACCEL_DERIVATIVES', '/_protected/derivatives/')
+}
+
+# Upload retention and orphan reconciliation (services/retention_service.py, cleanup_uploads.py)
+RETENTION_CONFIG = {
+    # Assessments older than this many days are deleted with their images; 0 keeps everything
+    'retention_days': int(os.getenv('RETENTION_DAYS', 0)),
+    # Run in a background thread of the web app every interval seconds
+    'enabled': os.getenv('RETENTION_ENABLED', 'False').lower() == 'true',
+    'interval': float(os.getenv('RETENTION_INTERVAL', 3600)),
+    'batch_size': int(os.getenv('RETENTION_BATCH_SIZE', 500)),
+    # Upper bound on row and file deletions per second, so cleanup does not starve request I/O
+    'max_deletes_per_second': float(os.getenv('RETENTION_MAX_DELETES_PER_SECOND', 200)),
+    # Compare the upload folder with the database on every run
+    'reconcile': os.getenv('RETENTION_RECONCILE', 'True').lower() == 'true',
+    # Newer files are never orphans: their assessment may not be committed yet
+    'orphan_grace': float(os.getenv('RETENTION_ORPHAN_GRACE', 3600)),
+    # Orphans are only counted unless these are enabled
+    'delete_orphan_files': os.getenv('RETENTION_DELETE_ORPHAN_FILES', 'False').lower() == 'true',
+    'delete_orphan_rows': os.getenv('RETENTION_DELETE_ORPHAN_ROWS', 'False').lower() == 'true'
+}
+
 # Database configuration
 DB_CONFIG = {
+    # 'mysql' in production; 'sqlite' is an offline stand-in for benchmarks, load tests and tools
+    'backend': os.getenv('DB_BACKEND', 'mysql').lower(),
+    'sqlite_path': os.getenv('DB_SQLITE_PATH', 'kaong_assessment.db'),
     'host': os.getenv('DB_HOST', 'localhost'),
     'user': os.getenv('DB_USER', 'root'), 
     'password': os.getenv('DB_PASSWORD', ''),
@@ -70,6 +232,124 @@ FLASK_CONFIG = {
     'PORT': int(os.getenv('FLASK_PORT', 5000))
 }
 
+# Serving mode (serve.py): 'threading' is the development server, 'gevent' the production event loop
+SERVER_CONFIG = {
+    'async_mode': os.getenv('SERVER_ASYNC_MODE', 'threading').lower(),
+    # Native threads running inference and image decode/encode under gevent (each uses TORCH_NUM_THREADS)
+    'blocking_workers': int(os.getenv('SERVER_BLOCKING_WORKERS', 2)),
+    # Socket.IO manager shared by several server processes, e.g. redis://127.0.0.1:6379/0 ('' = single process)
+    'message_queue': os.getenv('SOCKETIO_MESSAGE_QUEUE', ''),
+    'channel': os.getenv('SOCKETIO_CHANNEL', 'kaong-socketio')
+}
+
+# Where detection runs. 'local' runs the model in every web process; 'queue' makes web nodes
+# stateless: they enqueue detection jobs and inference_worker.py processes consume them in batches
+JOB_QUEUE_CONFIG = {
+    'mode': os.getenv('INFERENCE_MODE', 'local').lower(),
+    # 'redis' for several machines, 'sqlite' for web nodes and workers sharing one machine
+    'backend': os.getenv('JOB_QUEUE_BACKEND', 'sqlite').lower(),
+    'redis_url': os.getenv('JOB_QUEUE_REDIS_URL', 'redis://127.0.0.1:6379/0'),
+    'sqlite_path': os.getenv('JOB_QUEUE_SQLITE_PATH', 'data/job_queue.db'),
+    # Key/table namespace, so several deployments can share one Redis
+    'prefix': os.getenv('JOB_QUEUE_PREFIX', 'kaong'),
+    # Jobs per model predict call, and how long a worker waits to fill a batch once it has one job
+    'batch_size': int(os.getenv('JOB_BATCH_SIZE', 8)),
+    'batch_window_ms': float(os.getenv('JOB_BATCH_WINDOW_MS', 10)),
+    # Port on which each inference worker serves /metrics (0 = off)
+    'worker_metrics_port': int(os.getenv('JOB_WORKER_METRICS_PORT', 0)),
+    # Seconds undelivered results are kept (e.g. for a web node that has gone away)
+    'result_ttl': int(os.getenv('JOB_RESULT_TTL', 60)),
+    # SQLite backend: seconds between polls of an empty queue
+    'poll_interval': float(os.getenv('JOB_QUEUE_POLL_INTERVAL', 0.01))
+}
+
+# Deadlines for detection requests, carried from the request to the inference queue. Work whose
+# deadline has passed, or whose Socket.IO session has disconnected, is dropped instead of run
+DEADLINE_CONFIG = {
+    # Seconds an upload may take until its inference has run; /detect_frame answers 504 when it
+    # expires (JOB_RESULT_TIMEOUT is still read for deployments that set it for queue mode)
+    'upload_timeout': float(os.getenv('DETECT_UPLOAD_TIMEOUT', os.getenv('JOB_RESULT_TIMEOUT', 30))),
+    # Seconds after which a camera frame is stale (0 = never); keep it above the slowest inference
+    'frame_timeout': float(os.getenv('DETECT_FRAME_TIMEOUT', 5))
+}
+
+# Admission control for /detect_frame and detect_video_frame: excess work is refused at once
+# (HTTP 429 / Socket.IO detection_busy, with a retry hint) instead of queueing until it times out
+ADMISSION_CONFIG = {
+    'enabled': os.getenv('ADMISSION_ENABLED', 'True').lower() == 'true',
+    # Token buckets: sustained requests per second and burst size, per Socket.IO session for
+    # camera frames and per client IP for uploads (0 rate disables the limit)
+    'frame_rate': float(os.getenv('ADMISSION_FRAME_RATE', 5)),
+    'frame_burst': float(os.getenv('ADMISSION_FRAME_BURST', 10)),
+    'upload_rate': float(os.getenv('ADMISSION_UPLOAD_RATE', 2)),
+    'upload_burst': float(os.getenv('ADMISSION_UPLOAD_BURST', 10)),
+    # Detections in progress on this node (0 = unlimited); camera frames may not use the last
+    # upload_reserved slots, so manual uploads still get through while cameras saturate the node
+    'max_in_flight': int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 8)),
+    'upload_reserved': int(os.getenv('ADMISSION_UPLOAD_RESERVED', 2)),
+    # Milliseconds an upload waits for a free slot before it is refused; frames never wait
+    'upload_wait_ms': float(os.getenv('ADMISSION_UPLOAD_WAIT_MS', 1000)),
+    # INFERENCE_MODE=queue: refuse camera frames while this many jobs wait for a worker (0 = off)
+    'max_queue_depth': int(os.getenv('ADMISSION_MAX_QUEUE_DEPTH', 64)),
+    # 'memory' keeps buckets per node; 'redis' shares them between nodes behind one balancer
+    'backend': os.getenv('ADMISSION_BACKEND', 'memory').lower(),
+    'redis_url': os.getenv('ADMISSION_REDIS_URL', 'redis://127.0.0.1:6379/0'),
+    'prefix': os.getenv('ADMISSION_PREFIX', 'kaong:admission'),
+    # Key uploads by the rightmost X-Forwarded-For address, the one added by the proxy in front
+    # (frontend.py appends it). Leave off without a proxy: clients could pick their own bucket.
+    # Behind the gateway with it off, every upload arrives from the gateway's address and all
+    # clients share one upload_rate/upload_burst bucket.
+    'trust_forwarded_for': os.getenv('ADMISSION_TRUST_FORWARDED_FOR', 'False').lower() == 'true'
+}
+
+# Upload gateway configuration (frontend.py)
+GATEWAY_CONFIG = {
+    # Comma-separated backend detection URLs, balanced round-robin
+    'backends': [url.strip() for url in os.getenv('GATEWAY_BACKENDS', 'http://localhost:8000/predict/').split(',')
+                 if url.strip()],
+    # Multipart field name the backend expects ('image' for this app's /detect_frame)
+    'upload_field': os.getenv('GATEWAY_UPLOAD_FIELD', 'file'),
+    'host': os.getenv('GATEWAY_HOST', '0.0.0.0'),
+    'port': int(os.getenv('GATEWAY_PORT', 8001)),
+    # Uploads forwarded at once; further requests wait up to queue_timeout, then get 503
+    'max_concurrency': int(os.getenv('GATEWAY_MAX_CONCURRENCY', 32)),
+    'queue_timeout': float(os.getenv('GATEWAY_QUEUE_TIMEOUT', 5)),
+    'max_connections': int(os.getenv('GATEWAY_MAX_CONNECTIONS', 64)),
+    'max_keepalive': int(os.getenv('GATEWAY_MAX_KEEPALIVE', 32)),
+    'connect_timeout': float(os.getenv('GATEWAY_CONNECT_TIMEOUT', 2)),
+    'read_timeout': float(os.getenv('GATEWAY_READ_TIMEOUT', 30)),
+    # Retries go to the next backend; only for failures where the backend did not process the upload
+    'retries': int(os.getenv('GATEWAY_RETRIES', 2)),
+    'backoff_base': float(os.getenv('GATEWAY_BACKOFF_BASE', 0.1)),
+    'backoff_max': float(os.getenv('GATEWAY_BACKOFF_MAX', 2.0)),
+    # Seconds a backend is skipped after a connection failure
+    'backend_cooldown': float(os.getenv('GATEWAY_BACKEND_COOLDOWN', 10)),
+    # Successful results for identical image bytes are reused for this many seconds (0 disables)
+    'cache_ttl': float(os.getenv('GATEWAY_CACHE_TTL', 300)),
+    'cache_max_entries': int(os.getenv('GATEWAY_CACHE_MAX_ENTRIES', 1024))
+}
+
+# Request profiling configuration
+PROFILING_CONFIG = {
+    'enabled': os.getenv('PROFILING_ENABLED', 'False').lower() == 'true',
+    # Return the stage breakdown in a Server-Timing response header
+    'server_timing': os.getenv('PROFILING_SERVER_TIMING', 'True').lower() == 'true',
+    'slow_threshold_ms': float(os.getenv('PROFILING_SLOW_MS', 1000)),
+    'slow_sample_rate': float(os.getenv('PROFILING_SLOW_SAMPLE_RATE', 1.0)),
+    'slow_log_size': int(os.getenv('PROFILING_SLOW_LOG_SIZE', 200))
+}
+
+# Analytics snapshot configuration
+ANALYTICS_CONFIG = {
+    # Parquet snapshot of assessments/detections; only ids newer than the snapshot are appended
+    'snapshot_dir': os.getenv('ANALYTICS_SNAPSHOT_DIR', 'data/analytics'),
+    # Minimum seconds between incremental refreshes triggered by /analytics requests
+    'refresh_interval': float(os.getenv('ANALYTICS_REFRESH_INTERVAL', 60)),
+    # Merge part files into one once there are more than this many
+    'compact_threshold': int(os.getenv('ANALYTICS_COMPACT_THRESHOLD', 50)),
+    'chunk_size': int(os.getenv('ANALYTICS_CHUNK_SIZE', 5000))
+}
+
 # Logging configuration
 LOGGING_CONFIG = {
     'level': os.getenv('LOG_LEVEL', 'INFO'),
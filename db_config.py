@@ -47,7 +47,8 @@ def init_db():
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     INDEX idx_timestamp (timestamp),
                     INDEX idx_source (source),
-                    INDEX idx_assessment (assessment)
+                    INDEX idx_assessment (assessment),
+                    INDEX idx_image_url (image_url)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             """)
 
@@ -79,6 +80,12 @@ def init_db():
                     cursor.execute(f"ALTER TABLE assessments ADD COLUMN {column_name} VARCHAR(255)")
                     print(f"✅ Added {column_name} column")
             
+            # Image URL lookups (retention, recompression renames) need an index
+            cursor.execute("SHOW INDEX FROM assessments WHERE Key_name = 'idx_image_url'")
+            if not cursor.fetchall():
+                cursor.execute("CREATE INDEX idx_image_url ON assessments (image_url)")
+                print("✅ Added idx_image_url index")
+            
             connection.commit()
             print("Database initialized successfully")
         except Error as e:
@@ -88,4 +95,5 @@ def init_db():
                 cursor.close()
                 connection.close()
 
-init_db()
\ No newline at end of file
+if __name__ == "__main__":
+    init_db()
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Evaluate a detection model on a labelled holdout set.
+
+Runs images through the same path the app serves (ImageService decode/orient/resize,
+then DetectionService.detect_objects_batch) and reports per-class precision, recall,
+mAP@0.5 and mAP@0.5:0.95 together with inference latency percentiles and throughput,
+so accuracy and speed are always judged together.
+
+mAP is computed over every prediction down to --min-score (0.001, as the ultralytics
+validator does), so it is comparable with training runs. Precision and recall are
+reported at CONFIDENCE_THRESHOLD, i.e. for the detections users actually see.
+
+Usage:
+    python evaluate_model.py                                   # served model on dataset/images/val
+    python evaluate_model.py --model models/kaong-20250101120000.pt --batch-size 8
+    python evaluate_model.py --split test --output reports/eval_test.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from typing import List
+
+import numpy as np
+
+from config import CONFIDENCE_THRESHOLD, KAONG_LABELS_MAP, LOGGING_CONFIG, TRAINING_CONFIG, get_model_path
+from training.dataset import find_samples, read_yolo_labels
+from training.metrics import DetectionEvaluator
+
+LABEL_IDS = {label: class_id for class_id, label in KAONG_LABELS_MAP.items()}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Evaluate kaong detection accuracy and latency")
+    parser.add_argument("--data", default=TRAINING_CONFIG['dataset_dir'], help="YOLO-format dataset directory")
+    parser.add_argument("--split", default="val", help="Dataset split to evaluate")
+    parser.add_argument("--model", default=get_model_path(), help="Weights to evaluate (default: served model)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per predict call")
+    parser.add_argument("--limit", type=int, help="Only evaluate the first N images")
+    parser.add_argument("--min-score", type=float, default=0.001,
+                        help="Lowest prediction score used for mAP")
+    parser.add_argument("--output", default="eval_report.json", help="JSON report path")
+    return parser.parse_args()
+
+
+def yolo_to_xyxy(labels: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Normalised cx, cy, w, h to absolute xyxy in a width x height image."""
+    cx, cy, w, h = labels[:, 1] * width, labels[:, 2] * height, labels[:, 3] * width, labels[:, 4] * height
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    from benchmarks.harness import environment_info, summarize
+    from services.detection_service import DetectionService
+    from services.image_service import ImageService
+
+    samples = find_samples(args.data, args.split)[:args.limit]
+    if not samples:
+        print(f"No images found under {args.data}/images/{args.split}")
+        return 1
+
+    image_service = ImageService()
+    detection_service = DetectionService(model_path=args.model)
+    evaluator = DetectionEvaluator(KAONG_LABELS_MAP)
+
+    batch_ms: List[float] = []
+    decode_ms: List[float] = []
+    errors = 0
+    start = time.perf_counter()
+
+    for offset in range(0, len(samples), args.batch_size):
+        batch = samples[offset:offset + args.batch_size]
+
+        decode_start = time.perf_counter()
+        images, labels = [], []
+        for image_path, label_path in batch:
+            try:
+                # Append only once both succeed, so images and labels stay paired
+                image_labels = read_yolo_labels(label_path)
+                with open(image_path, "rb") as f:
+                    image = image_service.decode_image_bytes(f.read())
+                images.append(image)
+                labels.append(image_labels)
+            except Exception as e:
+                logging.error(f"Skipping {image_path}: {str(e)}")
+                errors += 1
+        decode_ms.append((time.perf_counter() - decode_start) * 1000)
+        if not images:
+            continue
+
+        predict_start = time.perf_counter()
+        results = detection_service.detect_objects_batch(images, min_score=args.min_score)
+        batch_ms.append((time.perf_counter() - predict_start) * 1000)
+
+        for image, image_labels, (detections, _) in zip(images, labels, results):
+            # The placeholder returned when nothing is found is labelled Unknown and dropped here
+            kept = [d for d in detections if d.label in LABEL_IDS]
+            evaluator.add(
+                np.array([d.box for d in kept], dtype=np.float64).reshape(-1, 4),
+                np.array([d.score for d in kept], dtype=np.float64),
+                np.array([LABEL_IDS[d.label] for d in kept]),
+                yolo_to_xyxy(image_labels, image.width, image.height),
+                image_labels[:, 0].astype(int)
+            )
+
+        sys.stderr.write(f"\r{min(offset + args.batch_size, len(samples))}/{len(samples)} images")
+        sys.stderr.flush()
+    sys.stderr.write("\n")
+
+    wall_seconds = time.perf_counter() - start
+    inference_seconds = sum(batch_ms) / 1000
+    accuracy = evaluator.compute(score_threshold=CONFIDENCE_THRESHOLD)
+    predict_latency = summarize("predict_batch", batch_ms)
+    report = {
+        'model': args.model,
+        'model_version': detection_service.registry.primary.version,
+        'dataset': os.path.abspath(args.data),
+        'split': args.split,
+        'batch_size': args.batch_size,
+        'confidence_threshold': CONFIDENCE_THRESHOLD,
+        'min_score': args.min_score,
+        'accuracy': accuracy,
+        'latency': {
+            'predict_batch_ms': {key: getattr(predict_latency, key)
+                                 for key in ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms')},
+            'predict_per_image_ms': round(sum(batch_ms) / max(evaluator.images, 1), 3),
+            'decode_batch_p50_ms': summarize("decode_batch", decode_ms).p50_ms,
+            'inference_images_per_sec': round(evaluator.images / inference_seconds, 2) if inference_seconds else 0.0,
+            'end_to_end_images_per_sec': round(evaluator.images / wall_seconds, 2) if wall_seconds else 0.0
+        },
+        'errors': errors,
+        'environment': environment_info(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'class':<10} {'gt':>6} {'pred':>6} {'P':>7} {'R':>7} {'AP50':>7} {'AP50-95':>8}")
+    for name, metrics in accuracy['per_class'].items():
+        print(f"{name:<10} {metrics['ground_truth']:>6} {metrics['predictions']:>6} {metrics['precision']:>7.3f} "
+              f"{metrics['recall']:>7.3f} {metrics['ap50']:>7.3f} {metrics['ap50_95']:>8.3f}")
+    print(f"{'all':<10} {'':>6} {'':>6} {accuracy['precision']:>7.3f} {accuracy['recall']:>7.3f} "
+          f"{accuracy['map50']:>7.3f} {accuracy['map50_95']:>8.3f}")
+    print(f"predict p50 {predict_latency.p50_ms:.1f}ms  p95 {predict_latency.p95_ms:.1f}ms per batch of "
+          f"{args.batch_size}; {report['latency']['inference_images_per_sec']} img/s inference, "
+          f"{report['latency']['end_to_end_images_per_sec']} img/s end to end")
+    print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
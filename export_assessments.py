@@ -0,0 +1,55 @@
+"""
+Export assessments and their detections to Parquet, CSV or NDJSON.
+
+Reads the assessments table in keyset-paginated chunks, so memory use does not
+grow with the size of the table. Does not need the Flask app to be running.
+
+Usage:
+    python export_assessments.py --output assessments.parquet
+    python export_assessments.py --output camera.csv --source camera --since 2024-06-01
+    python export_assessments.py --output all.ndjson --chunk-size 5000
+"""
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime
+
+from config import LOGGING_CONFIG
+from services.database_service import DatabaseService
+from services.export_service import ExportService, EXPORT_FORMATS
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Export kaong assessments and detections")
+    parser.add_argument("--output", required=True, help="Output file (.parquet, .csv or .ndjson)")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS),
+                        help="Output format (default: inferred from the output extension)")
+    parser.add_argument("--source", help="Only export assessments from this source")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="Only export assessments at or after this ISO timestamp")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Assessments read per query")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    export_format = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if export_format not in EXPORT_FORMATS:
+        print(f"Cannot infer format from {args.output}; pass --format ({', '.join(EXPORT_FORMATS)})")
+        return 2
+
+    export_service = ExportService(DatabaseService(), chunk_size=args.chunk_size)
+    written = export_service.export_to_file(args.output, export_format, source=args.source, since=args.since)
+    print(f"Wrote {written} bytes to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
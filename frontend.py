@@ -1,27 +1,342 @@
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
-import requests
+"""
+Async upload gateway in front of one or more detection backends.
+
+Uploads are streamed from the (disk-spooled) request file to a backend over a
+pooled keep-alive HTTP client, so the event loop never blocks and large images
+are never held in memory in full. Backends are balanced round-robin; a backend
+that refuses connections is skipped for a cooldown period. Connection failures
+and 502/503/504 responses are retried on the next backend with jittered
+exponential backoff.
+
+Uploads are keyed by the SHA-256 of their bytes: concurrent identical uploads
+(e.g. a phone retrying on a flaky connection) share one backend call, and recent
+successful results are served from a TTL cache.
+"""
+import time
+import random
+import hashlib
+import asyncio
+import logging
+import itertools
+from uuid import uuid4
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
 import uvicorn
+from fastapi import FastAPI, File, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+from config import GATEWAY_CONFIG, LOGGING_CONFIG
+from services.metrics import MetricsRegistry
+
+logger = logging.getLogger("frontend")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+RETRY_STATUSES = {502, 503, 504}
+
+# (status, body, media type) of a backend answer, shared by coalesced and cached requests
+Result = Tuple[int, bytes, str]
+
+# Answer for uploads coalesced onto a call that raised or was cancelled; never carries error details
+FAILED_RESULT: Result = (502, b'{"error":"Upload could not be processed, retry shortly"}', "application/json")
+
+# Gateway metrics are kept apart from the detection service's registry
+gateway_metrics = MetricsRegistry()
+GATEWAY_UPLOADS = gateway_metrics.counter(
+    "kaong_gateway_uploads_total", "Uploads received, by how they were answered", ("outcome",))
+GATEWAY_BACKEND_CALLS = gateway_metrics.counter(
+    "kaong_gateway_backend_calls_total", "Uploads forwarded to a backend, by final status", ("status",))
+GATEWAY_LATENCY = gateway_metrics.histogram(
+    "kaong_gateway_upload_duration_seconds", "Upload handling time", ("outcome",))
+
+
+class Backend:
+    """One detection backend and its passive health state."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.down_until = 0.0
+        self.failures = 0
+
+    def is_available(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def mark_failed(self, cooldown: float) -> None:
+        self.failures += 1
+        self.down_until = time.monotonic() + cooldown
+
+    def mark_ok(self) -> None:
+        self.down_until = 0.0
+
+
+class BackendPool:
+    """Round-robin over backends, preferring ones that are not cooling down."""
+
+    def __init__(self, urls: List[str]):
+        if not urls:
+            raise ValueError("At least one backend URL is required (GATEWAY_BACKENDS)")
+        self.backends = [Backend(url) for url in urls]
+        self._cycle = itertools.cycle(self.backends)
+
+    def next(self) -> Backend:
+        for _ in range(len(self.backends)):
+            backend = next(self._cycle)
+            if backend.is_available():
+                return backend
+        # Everything is cooling down; trying one beats failing outright
+        return next(self._cycle)
+
+
+class MultipartUpload:
+    """
+    Streaming multipart/form-data body for a single file field.
+
+    The body is produced chunk by chunk from the UploadFile, and can be replayed
+    for a retry because the spooled file is rewound first.
+    """
+
+    def __init__(self, file: UploadFile, field: str):
+        self._file = file
+        boundary = uuid4().hex
+        filename = (file.filename or "upload").replace('"', "")
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {file.content_type or 'application/octet-stream'}\r\n\r\n"
+        ).encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+
+    def content_length(self) -> Optional[int]:
+        size = getattr(self._file, "size", None)
+        return None if size is None else len(self._head) + size + len(self._tail)
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        await self._file.seek(0)
+        yield self._head
+        while True:
+            chunk = await self._file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+
+class ResultCache:
+    """LRU cache of successful results with a fixed time-to-live."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Result]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Result]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: Result) -> None:
+        if self._ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self._ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
 
-app = FastAPI()
 
-# Backend URL
-BACKEND_URL = "http://localhost:8000/predict/"
+async def hash_upload(file: UploadFile) -> str:
+    """SHA-256 of the upload, read in chunks from the spooled file."""
+    digest = hashlib.sha256()
+    await file.seek(0)
+    while True:
+        chunk = await file.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Gateway:
+    """Pooled HTTP client, concurrency limit, retry policy, request coalescing and result cache."""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.pool = BackendPool(config['backends'])
+        self.client: Optional[httpx.AsyncClient] = None
+        self.semaphore = asyncio.Semaphore(config['max_concurrency'])
+        self.cache = ResultCache(config['cache_ttl'], config['cache_max_entries'])
+        self._in_flight: Dict[str, "asyncio.Future[Result]"] = {}
+        gateway_metrics.gauge("kaong_gateway_cache_entries", "Results held in the gateway cache",
+                              callback=lambda: {(): len(self.cache)})
+        gateway_metrics.gauge("kaong_gateway_in_flight_keys", "Distinct uploads currently being forwarded",
+                              callback=lambda: {(): len(self._in_flight)})
+        gateway_metrics.gauge("kaong_gateway_backend_calls_saved_ratio",
+                              "Share of uploads answered without a backend call", callback=self._saved_ratio)
+
+    def _saved_ratio(self) -> Dict[Tuple[str, ...], float]:
+        counts = GATEWAY_UPLOADS.collect()
+        total = sum(counts.values())
+        saved = counts.get(("cache_hit",), 0) + counts.get(("coalesced",), 0)
+        return {(): saved / total if total else 0.0}
+
+    async def start(self) -> None:
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.config['max_connections'],
+                                max_keepalive_connections=self.config['max_keepalive']),
+            timeout=httpx.Timeout(self.config['read_timeout'], connect=self.config['connect_timeout'],
+                                  pool=self.config['queue_timeout'])
+        )
+        logger.info(f"Gateway forwarding to {', '.join(b.url for b in self.pool.backends)}")
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        ceiling = min(self.config['backoff_max'], self.config['backoff_base'] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def forward(self, file: UploadFile, request: Request) -> Response:
+        """Forward one upload, retrying on the next backend when it was not processed."""
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.config['queue_timeout'])
+        except asyncio.TimeoutError:
+            return JSONResponse(content={"error": "Gateway busy, retry shortly"}, status_code=503,
+                                headers={"Retry-After": "1"})
+
+        try:
+            body = MultipartUpload(file, self.config['upload_field'])
+            headers = {"Content-Type": body.content_type}
+            length = body.content_length()
+            if length is not None:
+                headers["Content-Length"] = str(length)
+            if request.client is not None:
+                # The backend's upload limiter keys on the rightmost entry, which we add
+                forwarded_for = request.headers.get("x-forwarded-for")
+                headers["X-Forwarded-For"] = (f"{forwarded_for}, {request.client.host}" if forwarded_for
+                                              else request.client.host)
+
+            last_error = "no backend attempted"
+            for attempt in range(self.config['retries'] + 1):
+                if attempt:
+                    await asyncio.sleep(self.backoff(attempt))
+                backend = self.pool.next()
+                try:
+                    response = await self.client.post(backend.url, content=body.stream(), headers=headers)
+                except httpx.PoolTimeout:
+                    # Our own connection pool is exhausted; the backend has not failed
+                    logger.warning(f"Gateway connection pool exhausted while forwarding to {backend.url}")
+                    return JSONResponse(content={"error": "Gateway busy, retry shortly"}, status_code=503,
+                                        headers={"Retry-After": "1"})
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    # The upload never reached this backend, so another one can safely take it
+                    backend.mark_failed(self.config['backend_cooldown'])
+                    last_error = f"{backend.url}: {type(e).__name__}"
+                    logger.warning(f"Backend unreachable, attempt {attempt + 1}: {last_error}")
+                    continue
+                except httpx.TimeoutException:
+                    return JSONResponse(content={"error": "Backend timed out"}, status_code=504)
+
+                if response.status_code in RETRY_STATUSES and attempt < self.config['retries']:
+                    last_error = f"{backend.url}: HTTP {response.status_code}"
+                    logger.warning(f"Backend unavailable, attempt {attempt + 1}: {last_error}")
+                    continue
+
+                backend.mark_ok()
+                return Response(content=response.content, status_code=response.status_code,
+                                media_type=response.headers.get("content-type", "application/json"))
+
+            return JSONResponse(content={"error": f"No backend available ({last_error})"}, status_code=502)
+        finally:
+            self.semaphore.release()
+
+    async def handle(self, file: UploadFile, request: Request) -> Response:
+        """Answer from the cache, join an identical in-flight upload, or forward to a backend."""
+        start = time.perf_counter()
+        key = await hash_upload(file)
+
+        result = self.cache.get(key)
+        if result is not None:
+            outcome = "cache_hit"
+        elif key in self._in_flight:
+            outcome = "coalesced"
+            # Shielded so a client disconnect here does not cancel the shared call
+            result = await asyncio.shield(self._in_flight[key])
+        else:
+            outcome = "backend"
+            future: "asyncio.Future[Result]" = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            try:
+                response = await self.forward(file, request)
+                result = (response.status_code, bytes(response.body),
+                          response.media_type or "application/json")
+            finally:
+                # Also reached on cancellation (a BaseException), when result is still None
+                del self._in_flight[key]
+                future.set_result(result if result is not None else FAILED_RESULT)
+                GATEWAY_BACKEND_CALLS.inc(status=str(result[0]) if result is not None else "error")
+            if result[0] == 200:
+                self.cache.put(key, result)
+
+        GATEWAY_UPLOADS.inc(outcome=outcome)
+        GATEWAY_LATENCY.observe(time.perf_counter() - start, outcome=outcome)
+        status, body, media_type = result
+        return Response(content=body, status_code=status, media_type=media_type,
+                        headers={"X-Gateway-Cache": outcome})
+
+
+gateway = Gateway(GATEWAY_CONFIG)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await gateway.start()
+    yield
+    await gateway.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
 
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request, file: UploadFile = File(...)):
     """Uploads an image and sends it to the backend for prediction."""
     try:
-        image_bytes = await file.read()
-        files = {"file": (file.filename, image_bytes, file.content_type)}
-        response = requests.post(BACKEND_URL, files=files)
-
-        if response.status_code == 200:
-            return JSONResponse(content=response.json())
-        else:
-            return JSONResponse(content={"error": "Backend error"}, status_code=response.status_code)
+        return await gateway.handle(file, request)
     except Exception as e:
+        logger.error(f"Gateway error: {str(e)}", exc_info=True)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+
+@app.get("/healthz")
+async def health() -> Dict:
+    """Backend availability as seen by the gateway."""
+    return {
+        "backends": [
+            {"url": b.url, "available": b.is_available(), "failures": b.failures}
+            for b in gateway.pool.backends
+        ]
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> Response:
+    """Prometheus text exposition of gateway cache, coalescing and backend metrics."""
+    return Response(content=gateway_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)  # Use different port than backend
+    logging.basicConfig(level=getattr(logging, LOGGING_CONFIG['level']), format=LOGGING_CONFIG['format'])
+    uvicorn.run(app, host=GATEWAY_CONFIG['host'], port=GATEWAY_CONFIG['port'])  # Use different port than backend
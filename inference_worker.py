@@ -0,0 +1,301 @@
+"""
+Inference worker for INFERENCE_MODE=queue.
+
+Takes detection jobs from the shared queue in batches of up to JOB_BATCH_SIZE, waiting
+at most JOB_BATCH_WINDOW_MS to fill a batch once the first job is in hand, and less when
+waiting would make the most urgent job miss its deadline. Each batch is one model predict
+call. Jobs whose deadline has passed, or whose camera session has disconnected, are
+dropped before the predict call and again before anything is stored. Images and
+assessments are stored as the web routes do, and each result goes back to the web node
+that enqueued the job. Start as many
+workers as the hardware allows, on any machine that reaches the queue, the database
+and image storage.
+
+Usage:
+    INFERENCE_MODE=queue python inference_worker.py
+    JOB_QUEUE_BACKEND=redis JOB_QUEUE_REDIS_URL=redis://10.0.0.2:6379/0 python inference_worker.py --batch-size 16
+"""
+import sys
+import math
+import time
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from config import JOB_QUEUE_CONFIG, LOGGING_CONFIG, MODEL_REGISTRY_CONFIG
+from services.detection_service import Detection, DetectionService, summarize_detections
+from services.database_service import DatabaseService, Assessment
+from services.image_service import ImageService, ImageValidationError
+from services.derivative_service import DerivativeService
+from services.bounding_box_service import BoundingBoxService
+from services.model_registry import ModelFileWatcher
+from services.job_queue import DetectionJob, JobQueue, JobQueueError, JobResult, create_job_queue
+from services.deadline import AFTER_INFERENCE, BEFORE_INFERENCE, Deadline, DeadlineExceeded
+from services.metrics import metrics, JOB_QUEUE_WAIT
+
+logger = logging.getLogger("inference_worker")
+
+# Assessment source and stored-image source per job kind, as recorded by the web routes
+JOB_SOURCES = {
+    'upload': ("upload", "upload"),
+    'camera': ("camera_ws", "camera")
+}
+
+
+class InferenceWorker:
+    """Runs detection for batches of queued jobs and publishes their results."""
+
+    def __init__(self, job_queue: JobQueue, batch_size: int, batch_window_ms: float):
+        self.queue = job_queue
+        self.batch_size = max(1, batch_size)
+        self.batch_window = max(0.0, batch_window_ms) / 1000
+        self.detection_service = DetectionService()
+        self.image_service = ImageService()
+        self.derivative_service = DerivativeService(self.image_service)
+        self.bounding_box_service = BoundingBoxService(self.image_service.storage)
+        self.database_service = DatabaseService()
+        self.database_service.create_tables()
+        self.processed = 0
+        # Moving average of predict seconds per batch, to leave room for it before a deadline
+        self._predict_seconds = 0.0
+
+    def next_batch(self, timeout: float) -> List[DetectionJob]:
+        """Wait up to timeout for a job, then keep taking jobs until the batch is full or the window closes."""
+        jobs = self.queue.take(self.batch_size, timeout)
+        if not jobs:
+            return jobs
+        window_end = time.perf_counter() + self.batch_window
+        while len(jobs) < self.batch_size:
+            remaining = min(window_end - time.perf_counter(), self._slack(jobs))
+            if remaining <= 0:
+                break
+            more = self.queue.take(self.batch_size - len(jobs), remaining)
+            if not more:
+                break
+            jobs.extend(more)
+        return jobs
+
+    def _slack(self, jobs: List[DetectionJob]) -> float:
+        """Seconds the batch can still wait before its most urgent job would miss its deadline."""
+        deadlines = [job.deadline for job in jobs if job.deadline is not None]
+        if not deadlines:
+            return math.inf
+        return min(deadlines) - time.time() - self._predict_seconds
+
+    def _drop_late(self, jobs: List[DetectionJob], stage: str, results: Dict[str, JobResult]) -> List[DetectionJob]:
+        """
+        Return the jobs still worth working on.
+
+        Expired jobs get an 'expired' result (an upload's web node may still be waiting);
+        cancelled ones get none, as their session is gone.
+        """
+        frame_ids = [job.id for job in jobs if job.sid is not None]
+        cancelled = set()
+        if frame_ids:
+            try:
+                cancelled = self.queue.cancelled(frame_ids)
+            except JobQueueError as e:
+                # Deadlines still apply
+                logger.warning(f"Could not check for cancelled jobs: {str(e)}")
+
+        live = []
+        for job in jobs:
+            try:
+                Deadline(job.kind, job.deadline, lambda: job.id in cancelled).check(stage)
+                live.append(job)
+            except DeadlineExceeded as e:
+                logger.debug(f"Dropping job {job.id}: {str(e)}")
+                if e.reason == "expired":
+                    results[job.id] = JobResult.for_job(job, e.to_dict(), status=504, outcome="expired")
+        return live
+
+    def process(self, jobs: List[DetectionJob]) -> None:
+        """Decode, detect and persist one batch, then publish the result of every job still wanted."""
+        taken_at = time.time()
+        decoded: List[DetectionJob] = []
+        images: List[Image.Image] = []
+        results: Dict[str, JobResult] = {}
+        for job in jobs:
+            JOB_QUEUE_WAIT.observe(max(0.0, taken_at - job.enqueued_at))
+
+        for job in self._drop_late(jobs, BEFORE_INFERENCE, results):
+            try:
+                images.append(self.image_service.decode_image_bytes(job.image))
+                decoded.append(job)
+            except ImageValidationError as e:
+                results[job.id] = JobResult.for_job(job, {"error": str(e)}, status=400, outcome="invalid")
+
+        outputs: Dict[str, Tuple[Image.Image, Tuple[List[Detection], bool]]] = {}
+        if images:
+            start = time.perf_counter()
+            detected = self.detection_service.detect_objects_batch(images)
+            self._predict_seconds += 0.2 * (time.perf_counter() - start - self._predict_seconds)
+            outputs = {job.id: (image, output) for job, image, output in zip(decoded, images, detected)}
+
+        for job in self._drop_late(decoded, AFTER_INFERENCE, results):
+            image, (detections, has_valid_detections) = outputs[job.id]
+            try:
+                body = self._complete(job, image, detections, has_valid_detections)
+                results[job.id] = JobResult.for_job(job, body)
+            except Exception as e:
+                logger.error(f"Failed to complete job {job.id}: {str(e)}", exc_info=True)
+                results[job.id] = JobResult.for_job(job, {"error": "Internal server error occurred"},
+                                                    status=500, outcome="error")
+
+        for job in jobs:
+            if job.id not in results:
+                continue
+            try:
+                self.queue.put_result(job.reply_to, results[job.id])
+            except JobQueueError as e:
+                logger.error(f"Could not publish result of job {job.id}: {str(e)}")
+        self.processed += len(jobs)
+
+    def _complete(self, job: DetectionJob, image: Image.Image, detections: List[Detection],
+                  has_valid_detections: bool) -> Dict[str, Any]:
+        """Store the image and grouped assessment of a job with kaong in it, and build its response."""
+        source, image_source = JOB_SOURCES[job.kind]
+        summary = summarize_detections(detections) if has_valid_detections else None
+        if summary is not None:
+            summary_text, avg_confidence, _ = summary
+            if job.kind == "camera":
+                # Camera frames are stored as captured, like the Socket.IO route does
+                filename = self.image_service.save_raw_image_data(job.image, prefix="kaong", source=image_source)
+            else:
+                filename = self.image_service.save_image(image, prefix="kaong", source=image_source)
+            self.derivative_service.schedule(filename)
+            category_urls = self.bounding_box_service.create_category_images(image, detections, filename, source)
+
+            assessment = Assessment(
+                image_url=self.image_service.get_image_url(filename),
+                assessment=summary_text,
+                confidence=avg_confidence,
+                source=source,
+                detection_data={
+                    "detections": [d.to_dict() for d in detections],
+                    "model_version": detections[0].model_version
+                },
+                ripe_image_url=category_urls.get('Ripe'),
+                unripe_image_url=category_urls.get('Unripe'),
+                rotten_image_url=category_urls.get('Rotten'),
+                timestamp=datetime.now()
+            )
+            assessment_id = self.database_service.save_assessment(assessment)
+            if assessment_id:
+                logger.debug(f"Saved grouped assessment {assessment_id} for job {job.id}: {summary_text}")
+            else:
+                logger.error(f"Failed to save grouped assessment for job {job.id}")
+
+        response_data: Dict[str, Any] = {"detections": [d.to_dict() for d in detections]}
+        if not has_valid_detections:
+            response_data["warning"] = ("Warning: No kaong fruits detected in this image. "
+                                        "Please ensure you are scanning kaong fruits.")
+        return response_data
+
+    def run(self, stop_event: threading.Event, poll_timeout: float = 1.0) -> None:
+        """Process batches until stop_event is set; the batch in progress is finished first."""
+        while not stop_event.is_set() and not self.detection_service.wait_until_ready(poll_timeout):
+            pass
+        logger.info(f"Inference worker taking jobs from the {self.queue.name} queue "
+                    f"(batch size {self.batch_size}, window {self.batch_window * 1000:.0f}ms)")
+        while not stop_event.is_set():
+            try:
+                jobs = self.next_batch(poll_timeout)
+            except JobQueueError as e:
+                logger.error(f"Job queue unavailable, retrying: {str(e)}")
+                stop_event.wait(poll_timeout)
+                continue
+            if jobs:
+                self.process(jobs)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the worker's metrics (queue wait, inference, dropped jobs) for scraping."""
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Scrapes every few seconds would flood the log
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics on port from a daemon thread."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="worker-metrics", daemon=True).start()
+    logger.info(f"Serving worker metrics on port {port}")
+    return server
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Consume detection jobs from the shared job queue")
+    parser.add_argument("--batch-size", type=int, default=JOB_QUEUE_CONFIG['batch_size'],
+                        help="Jobs per model predict call (default JOB_BATCH_SIZE)")
+    parser.add_argument("--batch-window-ms", type=float, default=JOB_QUEUE_CONFIG['batch_window_ms'],
+                        help="Milliseconds to wait for a batch to fill (default JOB_BATCH_WINDOW_MS)")
+    parser.add_argument("--metrics-port", type=int, default=JOB_QUEUE_CONFIG['worker_metrics_port'],
+                        help="Serve /metrics on this port, 0 for off (default JOB_WORKER_METRICS_PORT)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    try:
+        worker = InferenceWorker(create_job_queue(), args.batch_size, args.batch_window_ms)
+    except JobQueueError as e:
+        print(f"Cannot start inference worker: {e}", file=sys.stderr)
+        return 1
+
+    metrics_server: Optional[ThreadingHTTPServer] = None
+    if args.metrics_port:
+        metrics_server = start_metrics_server(args.metrics_port)
+
+    model_watcher: Optional[ModelFileWatcher] = None
+    if MODEL_REGISTRY_CONFIG['watch_dir']:
+        model_watcher = ModelFileWatcher(
+            worker.detection_service.registry,
+            MODEL_REGISTRY_CONFIG['watch_dir'],
+            interval=MODEL_REGISTRY_CONFIG['watch_interval'],
+            auto_activate=MODEL_REGISTRY_CONFIG['auto_activate']
+        )
+        model_watcher.start()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    try:
+        worker.run(stop_event)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if model_watcher is not None:
+            model_watcher.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        worker.derivative_service.shutdown()
+    logger.info(f"Inference worker stopped after {worker.processed} jobs")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
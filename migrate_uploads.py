@@ -0,0 +1,58 @@
+"""
+Move uploads from the flat static/uploads layout into shard directories (UPLOAD_LAYOUT).
+
+Usage:
+    python migrate_uploads.py --dry-run                    # count what would move
+    python migrate_uploads.py --layout date --rate 200     # throttled, safe next to the running app
+
+Each batch of assessments is rewritten in one transaction; files are hard-linked into
+their shard before the commit and the flat names removed after it. The run can be
+interrupted and repeated.
+"""
+import sys
+import json
+import logging
+import argparse
+
+from config import LOGGING_CONFIG, UPLOAD_LAYOUT
+from services.database_service import DatabaseService
+from services.image_service import ImageService
+from services.derivative_service import DerivativeService
+from services.upload_migration_service import UploadMigrator
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Migrate flat uploads into the sharded directory layout")
+    parser.add_argument("--layout", choices=("date", "hash"),
+                        default=UPLOAD_LAYOUT if UPLOAD_LAYOUT in ("date", "hash") else "date",
+                        help="Target layout (default UPLOAD_LAYOUT); should match the app's setting")
+    parser.add_argument("--dry-run", action="store_true", help="Count files and rows without changing anything")
+    parser.add_argument("--batch-size", type=int, default=500, help="Assessments per transaction")
+    parser.add_argument("--rate", type=float, default=0, help="Files moved per second (0 = unthrottled)")
+    parser.add_argument("--min-age", type=float, default=3600, help="Skip files modified more recently (seconds)")
+    parser.add_argument("--keep-unreferenced", action="store_true",
+                        help="Leave files that no assessment references in the flat folder")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    image_service = ImageService()
+    migrator = UploadMigrator(
+        DatabaseService(), image_service, DerivativeService(image_service, {'eager': False}),
+        layout=args.layout, batch_size=args.batch_size, min_age=args.min_age, max_per_second=args.rate,
+        move_unreferenced=not args.keep_unreferenced, dry_run=args.dry_run
+    )
+    stats = migrator.run()
+    print(json.dumps(stats, indent=2))
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
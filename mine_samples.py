@@ -0,0 +1,54 @@
+"""
+Active-learning sample mining from stored assessments.
+
+Usage:
+    python mine_samples.py                                  # score assessments added since the last run
+    python mine_samples.py --export labelling/batch_01 --size 200
+    python mine_samples.py --status
+
+Do not run this while the web app's background miner (SAMPLE_MINER_ENABLED=true)
+uses the same SAMPLE_MINER_STATE_DIR.
+"""
+import sys
+import json
+import logging
+import argparse
+
+from config import LOGGING_CONFIG
+from services.database_service import DatabaseService
+from services.sample_miner import SampleMiner
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Mine uncertain, diverse images for labelling")
+    parser.add_argument("--export", metavar="DIR", help="Export a labelling batch to this directory")
+    parser.add_argument("--size", type=int, default=100, help="Images per exported batch")
+    parser.add_argument("--status", action="store_true", help="Only print the pool status")
+    parser.add_argument("--no-mine", action="store_true", help="Export from the pool without mining first")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    miner = SampleMiner(DatabaseService())
+    if not args.status and not args.no_mine:
+        stats = miner.mine_once()
+        print(f"Scanned {stats['scanned']} new assessments, embedded {stats['embedded']}, "
+              f"added {stats['added']} to the pool")
+
+    if args.export:
+        manifest = miner.export_batch(args.export, args.size)
+        print(f"Exported {manifest['count']} images with pseudo-labels to {args.export}")
+
+    print(json.dumps(miner.status(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
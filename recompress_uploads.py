@@ -0,0 +1,54 @@
+"""
+Re-encode the existing upload backlog under the archival encoding policy (ARCHIVE_FORMAT_*/ARCHIVE_QUALITY_*).
+
+Usage:
+    python recompress_uploads.py --dry-run                 # report the bytes that would be saved
+    python recompress_uploads.py --workers 2 --rate 5      # throttled, safe next to the running app
+
+Files modified within --min-age seconds are skipped because their assessment may not be
+saved yet. Renamed files (format changes) have their assessment URLs updated first.
+"""
+import sys
+import json
+import logging
+import argparse
+
+from config import LOGGING_CONFIG
+from services.database_service import DatabaseService
+from services.image_service import ImageService
+from services.recompression_service import UploadRecompressor
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Recompress stored uploads under the archival encoding policy")
+    parser.add_argument("--dry-run", action="store_true", help="Measure savings without writing anything")
+    parser.add_argument("--workers", type=int, default=2, help="Encoder threads")
+    parser.add_argument("--rate", type=float, default=0, help="Files started per second (0 = unthrottled)")
+    parser.add_argument("--min-age", type=float, default=3600, help="Skip files modified more recently (seconds)")
+    parser.add_argument("--min-savings", type=float, help="Required size reduction (default ARCHIVE_RECOMPRESS_MIN_SAVINGS)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+
+    recompressor = UploadRecompressor(
+        DatabaseService(), ImageService(), min_savings=args.min_savings, min_age=args.min_age,
+        workers=args.workers, max_per_second=args.rate, dry_run=args.dry_run
+    )
+    stats = recompressor.run()
+    print(json.dumps(stats, indent=2))
+    if stats['bytes_before']:
+        print(f"{'Would save' if args.dry_run else 'Saved'} {stats['bytes_saved'] / 1024 / 1024:.1f}MB "
+              f"({stats['bytes_saved'] / stats['bytes_before']:.0%}) across {stats['recompressed']} files, "
+              f"{stats['encode_cpu_seconds']:.1f}s encode CPU")
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
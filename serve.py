@@ -0,0 +1,49 @@
+"""
+Production entry point: gevent event loop with CPU work on native threads.
+
+Usage:
+    SERVER_ASYNC_MODE=gevent python serve.py
+    # One of several processes behind a sticky load balancer, sharing Socket.IO through Redis
+    SERVER_ASYNC_MODE=gevent SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6379/0 python serve.py --port 5001
+
+Sockets, select and time are monkey-patched before the app is imported, so requests
+and Socket.IO events are greenlets on one event loop. Inference, image decoding and
+encoding run on SERVER_BLOCKING_WORKERS native threads (services/offload.py), so a
+slow frame never blocks the other sockets. The Werkzeug debugger and reloader are never enabled here.
+"""
+import sys
+import argparse
+
+# Only config may be imported before monkey patching: it loads nothing but os
+from config import FLASK_CONFIG, SERVER_CONFIG
+
+ASYNC_MODES = ("threading", "gevent")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the Kaong detection server in production mode")
+    parser.add_argument("--host", default=FLASK_CONFIG['HOST'])
+    parser.add_argument("--port", type=int, default=FLASK_CONFIG['PORT'])
+    parser.add_argument("--async-mode", choices=ASYNC_MODES, default=SERVER_CONFIG['async_mode'],
+                        help="Event loop (default SERVER_ASYNC_MODE); gevent is the production mode")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    if args.async_mode == "gevent":
+        from gevent import monkey
+        # Threads stay native: the services' workers and the blocking pool must not share gevent locks
+        monkey.patch_all(thread=False)
+    # The app reads the mode when it creates its Socket.IO server
+    SERVER_CONFIG["async_mode"] = args.async_mode
+
+    import app
+    app.logger.info(f"Starting Kaong Detection server ({args.async_mode}) on {args.host}:{args.port}")
+    app.socketio.run(app.app, host=args.host, port=args.port, debug=False, use_reloader=False,
+                     log_output=False, allow_unsafe_werkzeug=args.async_mode == "threading")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
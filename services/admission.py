@@ -0,0 +1,305 @@
+"""
+Admission control for the detection entry points.
+
+Each upload and camera frame is admitted or refused before any image work is done:
+
+- Token buckets limit every client: camera frames per Socket.IO session, uploads per IP.
+- A cap on detections in progress protects the node. Camera frames cannot take the last
+  ADMISSION_UPLOAD_RESERVED slots, and uploads may wait briefly for a slot while frames
+  never do, so a manual upload still gets through while the cameras saturate the node.
+- In queue mode, frames only cost the node an enqueue; they are refused instead while
+  more than ADMISSION_MAX_QUEUE_DEPTH jobs wait for the inference workers.
+
+A refusal carries the seconds after which a retry can succeed. The routes answer it with
+HTTP 429 and Retry-After, or a Socket.IO detection_busy event.
+
+Buckets live in process memory by default. ADMISSION_BACKEND=redis shares them between
+nodes through an atomic script, so a client cannot multiply its allowance by reaching
+several nodes; while Redis is unreachable each node falls back to its own buckets.
+"""
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from config import ADMISSION_CONFIG
+from services.metrics import ADMISSION_REFUSED, ADMISSION_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks while an upload waits for an in-flight slot
+SLOT_POLL_INTERVAL = 0.005
+
+# Retry hint when the shared queue is too deep
+QUEUE_RETRY_AFTER = 1.0
+
+# Token bucket shared through Redis: refill by elapsed server time, take one token or
+# return the seconds until one is available
+REDIS_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+-- tostring() keeps only 14 significant digits, too few for the timestamp
+redis.call('HSET', KEYS[1], 'tokens', string.format('%.6f', tokens), 'updated', string.format('%.6f', now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return string.format('%.6f', wait)
+"""
+
+
+class AdmissionError(Exception):
+    """Raised when admission control cannot be configured."""
+    pass
+
+
+@dataclass
+class Ticket:
+    """Admission decision; an admitted ticket holds its in-flight slot until released."""
+    allowed: bool
+    kind: str
+    reason: str = ""  # 'rate_limited' or 'busy' when refused
+    retry_after: float = 0.0
+    _release: Optional[Callable[[], None]] = field(default=None, repr=False)
+
+    def release(self) -> None:
+        """Free the slot (idempotent)."""
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Body of the 429 response / detection_busy event."""
+        if self.reason == "rate_limited":
+            message = f"Too many detection requests, retry in {self.retry_after:.1f}s"
+        else:
+            message = f"Detection is busy, retry in {self.retry_after:.1f}s"
+        return {'error': message, 'reason': self.reason, 'retry_after_ms': int(self.retry_after * 1000)}
+
+
+class MemoryBuckets:
+    """Token buckets in process memory. Buckets that have refilled are dropped when space runs out."""
+
+    def __init__(self, max_keys: int = 10000):
+        self._max_keys = max_keys
+        self._buckets: Dict[str, List[float]] = {}  # key -> [tokens, updated, rate, burst]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """
+        Take one token from a client's bucket.
+
+        Returns:
+            0.0 if a token was taken, otherwise seconds until one is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self._max_keys:
+                    self._evict(now)
+                bucket = self._buckets[key] = [burst, now, rate, burst]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def _evict(self, now: float) -> None:
+        # A refilled bucket behaves exactly like a new one
+        full = [key for key, (tokens, updated, rate, burst) in self._buckets.items()
+                if tokens + (now - updated) * rate >= burst]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self._max_keys:
+            # Every client is active: forget the least recently seen half
+            by_age = sorted(self._buckets, key=lambda key: self._buckets[key][1])
+            for key in by_age[:len(by_age) // 2]:
+                del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RedisBuckets:
+    """Token buckets shared by every node through Redis (requires the redis package)."""
+
+    def __init__(self, config: Dict[str, Any]):
+        try:
+            import redis
+        except ImportError:
+            raise AdmissionError("ADMISSION_BACKEND=redis requires the redis package (pip install redis)")
+        self._error = redis.RedisError
+        # Admission must stay fast: a slow Redis counts as unreachable
+        self._redis = redis.Redis.from_url(config['redis_url'], socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._script = self._redis.register_script(REDIS_BUCKET_SCRIPT)
+        self._prefix = config['prefix']
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """
+        Take one token from a client's shared bucket.
+
+        Raises:
+            AdmissionError: If Redis cannot be reached
+        """
+        try:
+            return float(self._script(keys=[f"{self._prefix}:{key}"], args=[rate, burst]))
+        except self._error as e:
+            raise AdmissionError(f"Shared rate limit state unavailable: {str(e)}")
+
+
+class InFlightSlots:
+    """Detections in progress on this node, with the last slots reserved for uploads."""
+
+    def __init__(self, capacity: int, reserved: int):
+        self.capacity = capacity
+        self.reserved = max(0, min(reserved, capacity - 1))
+        self.in_use = 0
+        self._hold_seconds = 0.5  # moving average of slot hold time, the retry hint when full
+        self._lock = threading.Lock()
+
+    def try_acquire(self, reserved_ok: bool) -> bool:
+        limit = self.capacity if reserved_ok else self.capacity - self.reserved
+        with self._lock:
+            if self.in_use < limit:
+                self.in_use += 1
+                return True
+            return False
+
+    def release(self, held_seconds: float) -> None:
+        with self._lock:
+            self.in_use -= 1
+            self._hold_seconds += 0.1 * (held_seconds - self._hold_seconds)
+
+    @property
+    def retry_after(self) -> float:
+        return min(5.0, max(0.1, self._hold_seconds))
+
+
+class AdmissionController:
+    """Admits or refuses detection requests; see the module docstring."""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 queue_depth: Optional[Callable[[], int]] = None):
+        """
+        Initialize admission control.
+
+        Args:
+            config: Overrides for ADMISSION_CONFIG
+            queue_depth: Returns the shared job queue's depth (INFERENCE_MODE=queue only)
+
+        Raises:
+            AdmissionError: For an unknown backend or a missing dependency
+        """
+        self._config = {**ADMISSION_CONFIG, **(config or {})}
+        self.enabled = self._config['enabled']
+        self._limits = {
+            'upload': (self._config['upload_rate'], self._config['upload_burst']),
+            'camera': (self._config['frame_rate'], self._config['frame_burst'])
+        }
+        self._local = MemoryBuckets()
+        self._shared: Optional[RedisBuckets] = None
+        if self._config['backend'] == 'redis':
+            self._shared = RedisBuckets(self._config)
+        elif self._config['backend'] != 'memory':
+            raise AdmissionError(f"Unknown admission backend '{self._config['backend']}' (use 'memory' or 'redis')")
+        self._shared_failed_at = 0.0
+
+        self._slots = None
+        if self._config['max_in_flight'] > 0:
+            self._slots = InFlightSlots(self._config['max_in_flight'], self._config['upload_reserved'])
+            ADMISSION_IN_FLIGHT.set_callback(lambda: {(): self._slots.in_use})
+        self._queue_depth = queue_depth
+        self._depth = (0.0, 0)  # (checked at, depth): one queue query per 100ms at most
+
+    def admit(self, kind: str, client: str) -> Ticket:
+        """
+        Decide on one detection request.
+
+        Args:
+            kind: 'upload' or 'camera'
+            client: Client IP for uploads, Socket.IO session id for camera frames
+
+        Returns:
+            Ticket; release() it when the detection is done
+        """
+        if not self.enabled:
+            return Ticket(True, kind)
+
+        rate, burst = self._limits[kind]
+        if rate > 0:
+            wait = self._take_token(f"{kind}:{client}", rate, max(burst, 1.0))
+            if wait > 0:
+                return self._refuse(kind, "rate_limited", wait)
+
+        if self._queue_depth is not None and kind == "camera":
+            # The work happens on the inference workers; their backlog is the limit
+            if self._config['max_queue_depth'] > 0 and self._current_depth() >= self._config['max_queue_depth']:
+                return self._refuse(kind, "busy", QUEUE_RETRY_AFTER)
+            return Ticket(True, kind)
+
+        if self._slots is None:
+            return Ticket(True, kind)
+        is_upload = kind == "upload"
+        acquired = self._slots.try_acquire(is_upload)
+        if not acquired and is_upload and self._config['upload_wait_ms'] > 0:
+            deadline = time.monotonic() + self._config['upload_wait_ms'] / 1000
+            while not acquired and time.monotonic() < deadline:
+                # time.sleep yields to other greenlets under gevent
+                time.sleep(SLOT_POLL_INTERVAL)
+                acquired = self._slots.try_acquire(True)
+        if not acquired:
+            return self._refuse(kind, "busy", self._slots.retry_after)
+
+        admitted_at = time.perf_counter()
+        slots = self._slots
+        return Ticket(True, kind, _release=lambda: slots.release(time.perf_counter() - admitted_at))
+
+    def _take_token(self, key: str, rate: float, burst: float) -> float:
+        if self._shared is not None and time.monotonic() - self._shared_failed_at > 10:
+            try:
+                return self._shared.take(key, rate, burst)
+            except AdmissionError as e:
+                # Per-node buckets still stop a single misbehaving client
+                self._shared_failed_at = time.monotonic()
+                logger.warning(f"{str(e)}; using per-node rate limits for 10s")
+        return self._local.take(key, rate, burst)
+
+    def _current_depth(self) -> int:
+        checked_at, depth = self._depth
+        now = time.monotonic()
+        if now - checked_at > 0.1:
+            try:
+                depth = self._queue_depth()
+            except Exception as e:
+                # An unreachable queue fails the enqueue itself with a clear error
+                logger.debug(f"Queue depth unavailable for admission: {str(e)}")
+                depth = 0
+            self._depth = (now, depth)
+        return depth
+
+    def _refuse(self, kind: str, reason: str, retry_after: float) -> Ticket:
+        ADMISSION_REFUSED.inc(kind=kind, reason=reason)
+        return Ticket(False, kind, reason=reason, retry_after=retry_after)
+
+    def status(self) -> Dict[str, Any]:
+        """Current limits and usage, for diagnostics."""
+        return {
+            'enabled': self.enabled,
+            'backend': self._config['backend'],
+            'in_flight': self._slots.in_use if self._slots is not None else None,
+            'max_in_flight': self._slots.capacity if self._slots is not None else None,
+            'tracked_clients': len(self._local)
+        }
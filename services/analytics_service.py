@@ -0,0 +1,300 @@
+"""
+Analytics service over a local Parquet snapshot of assessments and detections.
+The snapshot is refreshed incrementally (only ids newer than the last refresh are
+read from the database) and queried with lazy polars plans, so trend queries never
+scan the assessments table.
+"""
+import os
+import json
+import glob
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import polars as pl
+
+from config import ANALYTICS_CONFIG
+from services.export_service import ExportService, EXPORT_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = {
+    'hour': '1h',
+    'day': '1d',
+    'week': '1w',
+    'month': '1mo'
+}
+
+MANIFEST_NAME = "manifest.json"
+
+
+class AnalyticsError(Exception):
+    """Custom exception for analytics errors."""
+    pass
+
+
+class AnalyticsService:
+    """
+    Maintains the Parquet snapshot and answers time-bucketed analytics queries.
+
+    The snapshot is append-only: each refresh writes new part files for assessments
+    with an id above the manifest's last_id, and parts are compacted once there are
+    more than compact_threshold of them. Assessments deleted from the database stay
+    in the snapshot until rebuild() is called.
+    """
+
+    def __init__(self, export_service: ExportService, snapshot_dir: Optional[str] = None,
+                 refresh_interval: Optional[float] = None, compact_threshold: Optional[int] = None):
+        self._export_service = export_service
+        self._snapshot_dir = snapshot_dir or ANALYTICS_CONFIG['snapshot_dir']
+        self._refresh_interval = (ANALYTICS_CONFIG['refresh_interval']
+                                  if refresh_interval is None else refresh_interval)
+        self._compact_threshold = compact_threshold or ANALYTICS_CONFIG['compact_threshold']
+        self._lock = threading.RLock()
+        self._last_refresh = 0.0
+        os.makedirs(self._snapshot_dir, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    # Snapshot maintenance
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self._snapshot_dir, MANIFEST_NAME)
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path()) as f:
+                manifest = json.load(f)
+            # Parts missing on disk would make every scan fail; drop them and re-read from the database
+            if all(os.path.exists(os.path.join(self._snapshot_dir, part)) for part in manifest['parts']):
+                return manifest
+            logger.warning("Analytics snapshot is missing part files; rebuilding")
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Unreadable analytics manifest, rebuilding: {str(e)}")
+        return {'last_id': 0, 'rows': 0, 'parts': [], 'refreshed_at': None}
+
+    def _save_manifest(self) -> None:
+        # Write-then-rename so a crash never leaves a half-written manifest
+        tmp_path = self._manifest_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _write_part(self, frame: pl.DataFrame) -> str:
+        first_id = frame['assessment_id'].min()
+        last_id = frame['assessment_id'].max()
+        name = f"part_{first_id:012d}_{last_id:012d}.parquet"
+        tmp_path = os.path.join(self._snapshot_dir, name + ".tmp")
+        frame.write_parquet(tmp_path)
+        os.replace(tmp_path, os.path.join(self._snapshot_dir, name))
+        return name
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Append assessments newer than the snapshot.
+
+        Args:
+            force: Refresh even if the last refresh was within refresh_interval
+
+        Returns:
+            Number of detection rows appended
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < self._refresh_interval:
+                return 0
+
+            appended = 0
+            start = time.perf_counter()
+            for frame in self._export_service.iter_frames(after_id=self._manifest['last_id']):
+                self._manifest['parts'].append(self._write_part(frame))
+                self._manifest['last_id'] = int(frame['assessment_id'].max())
+                self._manifest['rows'] += frame.height
+                appended += frame.height
+                # Persist after every part so an interrupted refresh resumes from here
+                self._save_manifest()
+
+            if len(self._manifest['parts']) > self._compact_threshold:
+                self._compact()
+
+            self._manifest['refreshed_at'] = datetime.now().isoformat()
+            self._save_manifest()
+            self._last_refresh = time.monotonic()
+
+            if appended:
+                logger.info(f"Analytics snapshot refreshed: {appended} rows appended in "
+                            f"{time.perf_counter() - start:.2f}s (last id {self._manifest['last_id']})")
+            return appended
+
+    def _compact(self) -> None:
+        """Merge all part files into one with polars' streaming Parquet writer."""
+        old_parts = list(self._manifest['parts'])
+        first_id = old_parts[0].split("_")[1]
+        name = f"part_{first_id}_{self._manifest['last_id']:012d}.parquet"
+        tmp_path = os.path.join(self._snapshot_dir, name + ".tmp")
+        pl.scan_parquet([os.path.join(self._snapshot_dir, part) for part in old_parts]).sink_parquet(tmp_path)
+        os.replace(tmp_path, os.path.join(self._snapshot_dir, name))
+
+        self._manifest['parts'] = [name]
+        self._save_manifest()
+        for part in old_parts:
+            if part != name:
+                os.remove(os.path.join(self._snapshot_dir, part))
+        logger.info(f"Compacted {len(old_parts)} analytics parts into {name}")
+
+    def rebuild(self) -> int:
+        """Discard the snapshot and re-read every assessment (picks up deletions)."""
+        with self._lock:
+            for path in glob.glob(os.path.join(self._snapshot_dir, "part_*.parquet*")):
+                os.remove(path)
+            self._manifest = {'last_id': 0, 'rows': 0, 'parts': [], 'refreshed_at': None}
+            self._save_manifest()
+            return self.refresh(force=True)
+
+    def status(self) -> Dict[str, Any]:
+        """Snapshot size and freshness."""
+        with self._lock:
+            return {
+                'last_id': self._manifest['last_id'],
+                'rows': self._manifest['rows'],
+                'parts': len(self._manifest['parts']),
+                'refreshed_at': self._manifest['refreshed_at'],
+                'snapshot_dir': self._snapshot_dir
+            }
+
+    # Queries
+
+    def _scan(self, source: Optional[str] = None, since: Optional[datetime] = None,
+              until: Optional[datetime] = None) -> pl.LazyFrame:
+        if not self._manifest['parts']:
+            frame = pl.DataFrame(schema=EXPORT_SCHEMA).lazy()
+        else:
+            frame = pl.scan_parquet([os.path.join(self._snapshot_dir, part) for part in self._manifest['parts']])
+        if source:
+            frame = frame.filter(pl.col('source') == source)
+        if since:
+            frame = frame.filter(pl.col('timestamp') >= since)
+        if until:
+            frame = frame.filter(pl.col('timestamp') < until)
+        return frame
+
+    @staticmethod
+    def _bucket_expr(bucket: str) -> pl.Expr:
+        if bucket not in BUCKETS:
+            raise AnalyticsError(f"Unsupported bucket '{bucket}'. Use one of: {', '.join(BUCKETS)}")
+        return pl.col('timestamp').dt.truncate(BUCKETS[bucket]).alias('bucket')
+
+    @staticmethod
+    def _collect(query: pl.LazyFrame) -> List[Dict[str, Any]]:
+        frame = query.collect()
+        if 'bucket' in frame.columns:
+            frame = frame.with_columns(pl.col('bucket').dt.strftime('%Y-%m-%dT%H:%M:%S'))
+        return frame.to_dicts()
+
+    def ripeness(self, bucket: str = 'day', by_source: bool = False, source: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Ripe/unripe/rotten detection counts and ratios per time bucket.
+
+        Args:
+            bucket: 'hour', 'day', 'week' or 'month'
+            by_source: Also group by source
+            source: Optional source filter
+            since: Optional lower bound on timestamp
+            until: Optional exclusive upper bound on timestamp
+            min_score: Ignore detections below this confidence
+
+        Returns:
+            One dictionary per bucket (and source) with counts and ratios
+        """
+        keys = ['bucket', 'source'] if by_source else ['bucket']
+        bucket_expr = self._bucket_expr(bucket)
+        # Held from plan to collect so compaction cannot remove the scanned parts in between
+        with self._lock:
+            query = (
+                self._scan(source, since, until)
+                .filter(pl.col('label').is_not_null() & (pl.col('score') >= min_score))
+                .with_columns(bucket_expr)
+                .group_by(keys)
+                .agg(
+                    (pl.col('label') == 'Ripe').sum().alias('ripe'),
+                    (pl.col('label') == 'Unripe').sum().alias('unripe'),
+                    (pl.col('label') == 'Rotten').sum().alias('rotten'),
+                    pl.len().alias('detections'),
+                    pl.col('assessment_id').n_unique().alias('assessments')
+                )
+                .with_columns(
+                    (pl.col(label) / pl.col('detections')).round(4).alias(f'{label}_ratio')
+                    for label in ('ripe', 'unripe', 'rotten')
+                )
+                .sort(keys)
+            )
+            return self._collect(query)
+
+    def confidence_distribution(self, bands: int = 10, source: Optional[str] = None,
+                                since: Optional[datetime] = None,
+                                until: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Detection confidence histogram and summary statistics per label.
+
+        Args:
+            bands: Number of equal-width confidence bands between 0 and 1
+
+        Returns:
+            Dictionary with 'bands' (label, band_start, count) and 'summary' per label
+        """
+        if bands < 1 or bands > 100:
+            raise AnalyticsError("bands must be between 1 and 100")
+
+        with self._lock:
+            detections = self._scan(source, since, until).filter(pl.col('label').is_not_null())
+            histogram = (
+                detections
+                .with_columns(
+                    ((pl.col('score') * bands).floor().clip(0, bands - 1) / bands).round(4).alias('band_start')
+                )
+                .group_by(['label', 'band_start'])
+                .agg(pl.len().alias('count'))
+                .sort(['label', 'band_start'])
+            )
+            summary = (
+                detections
+                .group_by('label')
+                .agg(
+                    pl.len().alias('count'),
+                    pl.col('score').mean().round(4).alias('mean'),
+                    pl.col('score').median().round(4).alias('median'),
+                    pl.col('score').quantile(0.1).round(4).alias('p10'),
+                    pl.col('score').quantile(0.9).round(4).alias('p90')
+                )
+                .sort('label')
+            )
+            return {'bands': self._collect(histogram), 'summary': self._collect(summary)}
+
+    def throughput(self, bucket: str = 'hour', source: Optional[str] = None,
+                   since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        Assessments and detections per source per time bucket.
+
+        Returns:
+            One dictionary per bucket and source
+        """
+        bucket_expr = self._bucket_expr(bucket)
+        with self._lock:
+            query = (
+                self._scan(source, since, until)
+                .with_columns(bucket_expr)
+                .group_by(['bucket', 'source'])
+                .agg(
+                    pl.col('assessment_id').n_unique().alias('assessments'),
+                    pl.col('label').is_not_null().sum().alias('detections'),
+                    # One row per detection repeats the assessment confidence; count each assessment once
+                    pl.col('confidence').filter(pl.col('detection_index').fill_null(0) == 0)
+                    .mean().round(4).alias('mean_confidence')
+                )
+                .sort(['bucket', 'source'])
+            )
+            return self._collect(query)
@@ -8,19 +8,29 @@ import os
 from datetime import datetime
 
 from services.detection_service import Detection
-from config import UPLOAD_FOLDER
+from services.profiling import profiler
+from services.metrics import UPLOAD_BYTES
+from services.image_service import get_archive_policy, encode_archival
+from services.storage_backend import StorageBackend, content_type_for, get_storage
 
 logger = logging.getLogger(__name__)
 
 class BoundingBoxService:
     """Service for creating images with category-specific bounding boxes."""
     
-    def __init__(self):
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        """
+        Initialize the bounding box service.
+
+        Args:
+            storage: Image storage backend (default: the one selected by STORAGE_BACKEND)
+        """
         self.colors = {
             'Ripe': (76, 175, 80),      # Green
             'Unripe': (255, 152, 0),    # Orange  
             'Rotten': (244, 67, 54)     # Red
         }
+        self._storage = storage or get_storage()
         
     def create_category_images(self, original_image: Image.Image, detections: List[Detection], 
                              base_filename: str, source: str) -> Dict[str, str]:
@@ -37,40 +47,47 @@ class BoundingBoxService:
             Dictionary with category -> image_url mappings
         """
         category_urls = {}
+        policy = get_archive_policy("category")
+        rendered = []
         
         # Create images for each category
         for category in ['Ripe', 'Unripe', 'Rotten']:
             try:
-                # Create a copy of the original image
-                image_copy = original_image.copy()
-                
-                # Filter detections for this category
-                category_detections = [d for d in detections if d.label == category]
-                
-                if category_detections:
-                    # Draw bounding boxes for this category
-                    self._draw_bounding_boxes(image_copy, category_detections)
+                with profiler.span(f"render_{category.lower()}"):
+                    # Create a copy of the original image
+                    image_copy = original_image.copy()
+                    
+                    # Filter detections for this category
+                    category_detections = [d for d in detections if d.label == category]
+                    
+                    if category_detections:
+                        # Draw bounding boxes for this category
+                        self._draw_bounding_boxes(image_copy, category_detections)
                 
-                # Save the category-specific image
-                category_filename = self._generate_category_filename(base_filename, category, source)
-                category_path = os.path.join(UPLOAD_FOLDER, category_filename)
-                
-                # Ensure directory exists
-                os.makedirs(os.path.dirname(category_path), exist_ok=True)
-                
-                # Save image
-                image_copy.save(category_path, quality=95)
-                
-                # Generate URL
-                category_url = f"/static/uploads/{category_filename}"
-                category_urls[category] = category_url
-                
-                logger.info(f"Created {category} image: {category_filename}")
+                category_filename = self._generate_category_filename(base_filename, category, source,
+                                                                     policy.extension)
+                with profiler.span(f"encode_{category.lower()}"):
+                    data = encode_archival(image_copy, policy)
+                rendered.append((category, category_filename, data))
                 
             except Exception as e:
                 logger.error(f"Failed to create {category} image: {str(e)}")
                 category_urls[category] = None
         
+        # Store the renders together: remote backends upload them in parallel
+        with profiler.span("save_categories"):
+            errors = self._storage.save_many(
+                [(filename, data, content_type_for(filename)) for _, filename, data in rendered]
+            )
+        for (category, category_filename, data), error in zip(rendered, errors):
+            if error is not None:
+                logger.error(f"Failed to save {category} image: {str(error)}")
+                category_urls[category] = None
+                continue
+            UPLOAD_BYTES.inc(len(data), kind="category")
+            category_urls[category] = self._storage.url(category_filename)
+            logger.info(f"Created {category} image: {category_filename}")
+        
         return category_urls
     
     def _draw_bounding_boxes(self, image: Image.Image, detections: List[Detection]) -> None:
@@ -114,11 +131,12 @@ class BoundingBoxService:
             # Draw label text
             draw.text((label_x + 5, label_y + 2), label_text, fill=(255, 255, 255), font=font)
     
-    def _generate_category_filename(self, base_filename: str, category: str, source: str) -> str:
-        """Generate filename for category-specific image."""
-        # Remove extension from base filename
-        name, ext = os.path.splitext(base_filename)
+    def _generate_category_filename(self, base_filename: str, category: str, source: str,
+                                    extension: str) -> str:
+        """Generate filename for category-specific image, in the same upload subdirectory as the original."""
+        # Remove extension from base filename (keeping its shard directory)
+        name, _ = os.path.splitext(base_filename)
         
         # Add category and timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        return f"{name}_{category.lower()}_{timestamp}{ext}"
+        return f"{name}_{category.lower()}_{timestamp}.{extension}"
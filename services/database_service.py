@@ -2,8 +2,10 @@
 Database service for handling all database operations.
 Provides connection pooling, proper error handling, and data access methods.
 """
+import time
+import sqlite3
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Set, Tuple
 from datetime import datetime
 from contextlib import contextmanager
 import mysql.connector
@@ -11,6 +13,15 @@ from mysql.connector import pooling, Error
 from dataclasses import dataclass
 
 from config import DB_CONFIG
+from services.profiling import profiler
+from services.metrics import DB_POOL_SIZE, DB_POOL_IN_USE, DB_POOL_WAIT
+from services.sqlite_backend import SQLiteConnectionPool
+
+# Errors raised by either backend (MySQL in production, SQLite offline)
+DB_ERRORS = (Error, sqlite3.Error)
+
+# Columns holding /static/uploads/ URLs of an assessment's images
+IMAGE_URL_COLUMNS = ('image_url', 'ripe_image_url', 'unripe_image_url', 'rotten_image_url')
 
 logger = logging.getLogger(__name__)
 
@@ -49,10 +60,25 @@ class DatabaseService:
     def __init__(self):
         """Initialize the database service with connection pooling."""
         self._pool = None
+        self._backend = DB_CONFIG['backend']
         self._initialize_pool()
     
+    @property
+    def backend(self) -> str:
+        """The configured backend: 'mysql' or 'sqlite'."""
+        return self._backend
+    
     def _initialize_pool(self) -> None:
         """Initialize the database connection pool."""
+        if self._backend == 'sqlite':
+            try:
+                self._pool = SQLiteConnectionPool(DB_CONFIG['sqlite_path'], pool_size=DB_CONFIG['pool_size'])
+                DB_POOL_SIZE.set(DB_CONFIG['pool_size'])
+                return
+            except sqlite3.Error as e:
+                logger.error(f"Failed to create SQLite connection pool: {str(e)}")
+                raise RuntimeError(f"Database pool initialization failed: {str(e)}")
+
         try:
             pool_config = {
                 'pool_name': 'kaong_detection_pool',
@@ -68,9 +94,10 @@ class DatabaseService:
             }
             
             self._pool = mysql.connector.pooling.MySQLConnectionPool(**pool_config)
+            DB_POOL_SIZE.set(DB_CONFIG['pool_size'])
             logger.info("Database connection pool initialized successfully")
             
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to create database connection pool: {str(e)}")
             raise RuntimeError(f"Database pool initialization failed: {str(e)}")
     
@@ -81,15 +108,23 @@ class DatabaseService:
         Ensures proper connection cleanup.
         """
         connection = None
+        checked_out = False
         try:
-            connection = self._pool.get_connection()
+            start = time.perf_counter()
+            with profiler.span("db_acquire"):
+                connection = self._pool.get_connection()
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+            DB_POOL_IN_USE.inc()
+            checked_out = True
             yield connection
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Database connection error: {str(e)}")
             if connection and connection.is_connected():
                 connection.rollback()
             raise
         finally:
+            if checked_out:
+                DB_POOL_IN_USE.dec()
             if connection and connection.is_connected():
                 connection.close()
     
@@ -119,20 +154,39 @@ class DatabaseService:
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             INDEX idx_timestamp (timestamp),
             INDEX idx_source (source),
-            INDEX idx_assessment (assessment)
+            INDEX idx_assessment (assessment),
+            INDEX idx_image_url (image_url)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         """
+        # Source keys committed by batch_assess.py, written in the same transaction as the assessments
+        create_checkpoint_sql = """
+        CREATE TABLE IF NOT EXISTS batch_checkpoints (
+            run_id CHAR(40) NOT NULL,
+            key_hash CHAR(40) NOT NULL,
+            PRIMARY KEY (run_id, key_hash)
+        ) ENGINE=InnoDB
+        """
+        
+        if self._backend == 'sqlite':
+            try:
+                self._pool.create_schema()
+                logger.info("Assessments table created/verified successfully (SQLite)")
+                return True
+            except sqlite3.Error as e:
+                logger.error(f"Failed to create assessments table: {str(e)}")
+                return False
         
         try:
             with self.get_connection() as connection:
                 cursor = connection.cursor()
                 cursor.execute(create_table_sql)
+                cursor.execute(create_checkpoint_sql)
                 connection.commit()
                 cursor.close()
                 logger.info("Assessments table created/verified successfully")
                 return True
                 
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to create assessments table: {str(e)}")
             return False
     
@@ -176,8 +230,9 @@ class DatabaseService:
                     timestamp
                 )
                 
-                cursor.execute(insert_sql, values)
-                connection.commit()
+                with profiler.span("db_insert"):
+                    cursor.execute(insert_sql, values)
+                    connection.commit()
                 
                 # Get the inserted ID
                 assessment_id = cursor.lastrowid
@@ -186,10 +241,127 @@ class DatabaseService:
                 logger.info(f"Assessment saved successfully with ID: {assessment_id}")
                 return assessment_id
                 
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to save assessment: {str(e)}")
             return None
     
+    def save_assessments_bulk(self, assessments: List[Assessment],
+                              checkpoint: Optional[Tuple[str, List[str]]] = None) -> int:
+        """
+        Save many assessments in a single transaction.
+        
+        Args:
+            assessments: Assessment objects to save
+            checkpoint: Optional (run_id, key_hashes) recorded in batch_checkpoints in the same
+                transaction, so a resumed batch run knows exactly which keys were committed
+            
+        Returns:
+            Number of records inserted (0 if the transaction failed and was rolled back)
+        """
+        if not assessments:
+            return 0
+        
+        insert_sql = """
+        INSERT INTO assessments (image_url, assessment, confidence, source, detection_data, ripe_image_url, unripe_image_url, rotten_image_url, timestamp)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        
+        import json
+        rows = [
+            (
+                assessment.image_url,
+                assessment.assessment,
+                assessment.confidence,
+                assessment.source,
+                json.dumps(assessment.detection_data) if assessment.detection_data else None,
+                assessment.ripe_image_url,
+                assessment.unripe_image_url,
+                assessment.rotten_image_url,
+                assessment.timestamp or datetime.now()
+            )
+            for assessment in assessments
+        ]
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    with profiler.span("db_bulk_insert"):
+                        cursor.executemany(insert_sql, rows)
+                        if checkpoint is not None:
+                            run_id, key_hashes = checkpoint
+                            cursor.executemany(
+                                "INSERT INTO batch_checkpoints (run_id, key_hash) VALUES (%s, %s)",
+                                [(run_id, key_hash) for key_hash in key_hashes]
+                            )
+                        connection.commit()
+                except DB_ERRORS:
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+                
+                logger.info(f"Bulk saved {len(rows)} assessments")
+                return len(rows)
+                
+        except DB_ERRORS as e:
+            logger.error(f"Failed to bulk save assessments: {str(e)}")
+            return 0
+    
+    def get_batch_checkpoint(self, run_id: str) -> Set[str]:
+        """
+        Key hashes committed by a batch run through save_assessments_bulk.
+        
+        Args:
+            run_id: Batch run identifier
+            
+        Returns:
+            Set of key hashes
+        """
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT key_hash FROM batch_checkpoints WHERE run_id = %s", (run_id,))
+                key_hashes = {row[0] for row in cursor.fetchall()}
+                cursor.close()
+                return key_hashes
+        except DB_ERRORS as e:
+            logger.error(f"Failed to read batch checkpoint {run_id}: {str(e)}")
+            raise
+
+    def get_batch_assessments(self, source: str, source_keys: List[str]) -> List[Assessment]:
+        """
+        Assessments written by batch_assess.py for the given source keys.
+        
+        Matches detection_data.source_key (->> needs MySQL 5.7.13 or SQLite 3.38).
+        
+        Args:
+            source: Source recorded by the batch run
+            source_keys: Source keys to look up
+            
+        Returns:
+            List of Assessment objects in id order
+        """
+        if not source_keys:
+            return []
+        select_sql = f"""
+        SELECT id, image_url, assessment, confidence, source, detection_data,
+               ripe_image_url, unripe_image_url, rotten_image_url, timestamp
+        FROM assessments
+        WHERE source = %s AND detection_data->>'$.source_key' IN ({', '.join(['%s'] * len(source_keys))})
+        ORDER BY id
+        """
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute(select_sql, (source, *source_keys))
+                rows = cursor.fetchall()
+                cursor.close()
+                return [self._row_to_assessment(row) for row in rows]
+        except DB_ERRORS as e:
+            logger.error(f"Failed to read batch assessments for source '{source}': {str(e)}")
+            raise
+    
     def get_all_assessments(self, limit: Optional[int] = None) -> List[Assessment]:
         """
         Retrieve all assessments from the database.
@@ -248,7 +420,7 @@ class DatabaseService:
                 logger.debug(f"Retrieved {len(assessments)} assessments from database")
                 return assessments
                 
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to retrieve assessments: {str(e)}")
             return []
     
@@ -312,10 +484,93 @@ class DatabaseService:
                 logger.debug(f"Retrieved {len(assessments)} assessments for source '{source}'")
                 return assessments
                 
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to retrieve assessments by source: {str(e)}")
             return []
     
+    def _row_to_assessment(self, row: Dict[str, Any]) -> Assessment:
+        """Build an Assessment from a dictionary cursor row, parsing detection_data JSON."""
+        import json
+        detection_data = row.get('detection_data')
+        if isinstance(detection_data, (str, bytes)):
+            try:
+                detection_data = json.loads(detection_data)
+            except json.JSONDecodeError:
+                logger.warning(f"Failed to parse detection_data for assessment {row['id']}")
+                detection_data = None
+        
+        return Assessment(
+            id=row['id'],
+            image_url=row['image_url'],
+            assessment=row['assessment'],
+            confidence=float(row['confidence']),
+            source=row['source'],
+            detection_data=detection_data,
+            ripe_image_url=row.get('ripe_image_url'),
+            unripe_image_url=row.get('unripe_image_url'),
+            rotten_image_url=row.get('rotten_image_url'),
+            timestamp=row['timestamp']
+        )
+    
+    def iter_assessments(self, after_id: int = 0, chunk_size: int = 1000,
+                         source: Optional[str] = None,
+                         since: Optional[datetime] = None) -> Iterator[List[Assessment]]:
+        """
+        Iterate over assessments in id order using keyset pagination.
+        
+        Each chunk is a separate query (WHERE id > last_id ORDER BY id LIMIT n) on the
+        primary key, so memory stays constant and deep pages cost the same as the first.
+        A connection is only held while a chunk is fetched.
+        
+        Args:
+            after_id: Only return assessments with a larger id
+            chunk_size: Rows per query
+            source: Optional source filter
+            since: Optional lower bound on timestamp
+            
+        Yields:
+            Lists of up to chunk_size Assessment objects
+        """
+        conditions = ["id > %s"]
+        filters: List[Any] = []
+        if source:
+            conditions.append("source = %s")
+            filters.append(source)
+        if since:
+            conditions.append("timestamp >= %s")
+            filters.append(since)
+        
+        select_sql = f"""
+        SELECT id, image_url, assessment, confidence, source, detection_data,
+               ripe_image_url, unripe_image_url, rotten_image_url, timestamp
+        FROM assessments
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id
+        LIMIT %s
+        """
+        
+        last_id = after_id
+        while True:
+            try:
+                with self.get_connection() as connection:
+                    cursor = connection.cursor(dictionary=True)
+                    cursor.execute(select_sql, (last_id, *filters, int(chunk_size)))
+                    rows = cursor.fetchall()
+                    cursor.close()
+            except DB_ERRORS as e:
+                logger.error(f"Failed to read assessments after id {last_id}: {str(e)}")
+                raise
+            
+            if not rows:
+                return
+            
+            chunk = [self._row_to_assessment(row) for row in rows]
+            last_id = chunk[-1].id
+            yield chunk
+            
+            if len(rows) < chunk_size:
+                return
+    
     def get_assessment_stats(self) -> Dict[str, Any]:
         """
         Get statistics about assessments in the database.
@@ -354,7 +609,7 @@ class DatabaseService:
                 logger.debug(f"Retrieved assessment statistics: {stats}")
                 return stats
                 
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to retrieve assessment statistics: {str(e)}")
             return {'total_assessments': 0, 'assessment_breakdown': []}
     
@@ -394,7 +649,7 @@ class DatabaseService:
                     logger.warning(f"Assessment {assessment_id} not found")
                     return None
                     
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to retrieve assessment {assessment_id}: {str(e)}")
             return None
     
@@ -417,6 +672,170 @@ class DatabaseService:
                     logger.warning(f"No assessment found with ID {assessment_id}")
                     return False
                     
-        except Error as e:
+        except DB_ERRORS as e:
             logger.error(f"Failed to delete assessment {assessment_id}: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    def replace_image_url(self, old_url: str, new_url: str) -> Optional[int]:
+        """
+        Point every reference to an image at a new URL, e.g. after it was re-encoded under a new name.
+        
+        Args:
+            old_url: Current image URL
+            new_url: Replacement image URL
+            
+        Returns:
+            Number of column references updated, or None if the update failed
+        """
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    updated = 0
+                    for column in IMAGE_URL_COLUMNS:
+                        cursor.execute(f"UPDATE assessments SET {column} = %s WHERE {column} = %s", (new_url, old_url))
+                        updated += cursor.rowcount
+                    connection.commit()
+                    return updated
+                finally:
+                    cursor.close()
+                
+        except DB_ERRORS as e:
+            logger.error(f"Failed to replace image URL {old_url}: {str(e)}")
+            return None
+
+    def update_image_urls(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """
+        Rewrite the image URL columns of many assessments in one transaction, by primary key.
+
+        Args:
+            rows: Dicts with id and every column in IMAGE_URL_COLUMNS
+
+        Returns:
+            Number of assessments updated, or None if the transaction failed (nothing is changed)
+        """
+        if not rows:
+            return 0
+        update_sql = f"""
+        UPDATE assessments SET {', '.join(f'{column} = %s' for column in IMAGE_URL_COLUMNS)}
+        WHERE id = %s
+        """
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.executemany(update_sql, [
+                        tuple(row[column] for column in IMAGE_URL_COLUMNS) + (row['id'],) for row in rows
+                    ])
+                    connection.commit()
+                    return len(rows)
+                finally:
+                    cursor.close()
+
+        except DB_ERRORS as e:
+            logger.error(f"Failed to update image URLs of {len(rows)} assessments: {str(e)}")
+            return None
+
+    def get_expired_assessments(self, before: datetime, limit: int = 500) -> List[Dict[str, Any]]:
+        """
+        Oldest assessments saved before a cutoff, as an idx_timestamp range scan.
+        
+        Args:
+            before: Timestamp cutoff (exclusive)
+            limit: Maximum rows to return
+            
+        Returns:
+            Rows with id and the image URL columns, oldest first
+        """
+        select_sql = f"""
+        SELECT id, {', '.join(IMAGE_URL_COLUMNS)}
+        FROM assessments
+        WHERE timestamp < %s
+        ORDER BY timestamp
+        LIMIT %s
+        """
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute(select_sql, (before, int(limit)))
+                rows = cursor.fetchall()
+                cursor.close()
+                return rows
+        except DB_ERRORS as e:
+            logger.error(f"Failed to read assessments before {before}: {str(e)}")
+            raise
+
+    def count_assessments_before(self, before: datetime) -> int:
+        """Number of assessments saved before a cutoff (index-only count on idx_timestamp)."""
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT COUNT(*) FROM assessments WHERE timestamp < %s", (before,))
+                count = cursor.fetchone()[0]
+                cursor.close()
+                return int(count)
+        except DB_ERRORS as e:
+            logger.error(f"Failed to count assessments before {before}: {str(e)}")
+            raise
+
+    def delete_assessments(self, assessment_ids: List[int]) -> int:
+        """
+        Delete several assessments in one statement.
+        
+        Args:
+            assessment_ids: Assessment IDs
+            
+        Returns:
+            Number of rows deleted
+        """
+        if not assessment_ids:
+            return 0
+        placeholders = ", ".join(["%s"] * len(assessment_ids))
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"DELETE FROM assessments WHERE id IN ({placeholders})", tuple(assessment_ids))
+                deleted = cursor.rowcount
+                connection.commit()
+                cursor.close()
+                return deleted
+        except DB_ERRORS as e:
+            logger.error(f"Failed to delete {len(assessment_ids)} assessments: {str(e)}")
+            raise
+
+    def iter_image_references(self, chunk_size: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Iterate over the id and image URL columns of every assessment, keyset-paginated on id.
+        
+        Args:
+            chunk_size: Rows per query
+            
+        Yields:
+            Lists of up to chunk_size rows
+        """
+        select_sql = f"""
+        SELECT id, {', '.join(IMAGE_URL_COLUMNS)}
+        FROM assessments
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+        """
+        last_id = 0
+        while True:
+            try:
+                with self.get_connection() as connection:
+                    cursor = connection.cursor(dictionary=True)
+                    cursor.execute(select_sql, (last_id, int(chunk_size)))
+                    rows = cursor.fetchall()
+                    cursor.close()
+            except DB_ERRORS as e:
+                logger.error(f"Failed to read image references after id {last_id}: {str(e)}")
+                raise
+            
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield rows
+            
+            if len(rows) < chunk_size:
+                return
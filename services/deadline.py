@@ -0,0 +1,88 @@
+"""
+Deadlines for detection requests.
+
+A Deadline is created when an upload or camera frame arrives and travels with it: through
+the native-thread pool in local mode, and inside the DetectionJob in queue mode. Work is
+checked against it before inference, so a request nobody is waiting for no longer costs
+a model call, and again before results are stored and sent.
+
+Deadlines are wall-clock times, so web nodes and inference workers on other machines
+agree on them as far as their clocks do (keep them NTP-synchronised).
+"""
+import time
+from typing import Any, Callable, Dict, Optional
+
+from services.metrics import DETECTIONS_DROPPED
+
+# Error sent to clients whose request expired
+TIMEOUT_ERROR = "Detection timed out, please retry"
+
+# Stages at which work is dropped, for kaong_detections_dropped_total
+BEFORE_INFERENCE = "before_inference"
+AFTER_INFERENCE = "after_inference"
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a detection is dropped because its deadline passed or its client went away."""
+
+    def __init__(self, kind: str, reason: str, stage: str):
+        self.kind = kind
+        self.reason = reason  # 'expired' or 'cancelled'
+        self.stage = stage
+        super().__init__(f"{kind} detection {reason} {stage.replace('_', ' ')}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Error body for the client; only expired requests still have one listening."""
+        return {'error': TIMEOUT_ERROR, 'reason': self.reason}
+
+
+class Deadline:
+    """Point in time after which nobody waits for a detection, plus an optional cancellation check."""
+
+    def __init__(self, kind: str, at: Optional[float] = None,
+                 is_cancelled: Optional[Callable[[], bool]] = None):
+        """
+        Initialize a deadline.
+
+        Args:
+            kind: 'upload' or 'camera', for the metrics
+            at: Epoch seconds, or None for no deadline
+            is_cancelled: Returns True once the client has gone away
+        """
+        self.kind = kind
+        self.at = at
+        self._is_cancelled = is_cancelled
+
+    @classmethod
+    def after(cls, kind: str, seconds: float, is_cancelled: Optional[Callable[[], bool]] = None) -> "Deadline":
+        """Deadline seconds from now (no deadline if seconds <= 0)."""
+        return cls(kind, time.time() + seconds if seconds > 0 else None, is_cancelled)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (negative once expired), or None without a deadline."""
+        return None if self.at is None else self.at - time.time()
+
+    @property
+    def expired(self) -> bool:
+        return self.at is not None and time.time() >= self.at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._is_cancelled is not None and self._is_cancelled()
+
+    def exceeded(self, reason: str, stage: str) -> DeadlineExceeded:
+        """Count a dropped detection and build the exception that reports it."""
+        DETECTIONS_DROPPED.inc(kind=self.kind, reason=reason, stage=stage)
+        return DeadlineExceeded(self.kind, reason, stage)
+
+    def check(self, stage: str) -> None:
+        """
+        Raise if the work should be dropped at this stage.
+
+        Raises:
+            DeadlineExceeded: If the client went away or the deadline has passed
+        """
+        if self.cancelled:
+            raise self.exceeded("cancelled", stage)
+        if self.expired:
+            raise self.exceeded("expired", stage)
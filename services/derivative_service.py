@@ -0,0 +1,223 @@
+"""
+Thumbnail and preview derivatives of uploaded images.
+
+Full-size uploads are saved at up to 1920x1080, far more than a dashboard card
+needs. Each variant is a downscaled WebP cached on local disk next to the
+upload folder, also when the originals live in object storage. Variants are
+generated in background threads right after an image is saved (eager mode) and,
+for older images or when eager mode is off, on first request.
+"""
+import os
+import time
+import zlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set
+
+from PIL import Image, ImageOps, features
+
+from config import DERIVATIVE_CONFIG
+from services.image_service import ImageService
+from services.metrics import DERIVATIVES_GENERATED, DERIVATIVE_BYTES, DERIVATIVE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Lock stripes serialising generation of the same derivative by eager and lazy callers
+_LOCK_STRIPES = 64
+
+
+class DerivativeError(Exception):
+    """Raised when a derivative cannot be generated from its source image."""
+    pass
+
+
+class DerivativeService:
+    """Generates, caches and locates downscaled variants of uploaded images."""
+
+    def __init__(self, image_service: ImageService, config: Optional[Dict] = None):
+        """
+        Initialize the derivative service.
+
+        Args:
+            image_service: Resolves upload filenames and URLs
+            config: Overrides for DERIVATIVE_CONFIG
+        """
+        self._image_service = image_service
+        self._config = {**DERIVATIVE_CONFIG, **(config or {})}
+        self.variants: Dict[str, int] = dict(self._config['variants'])
+        self.cache_dir: str = self._config['cache_dir']
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        # Worker threads are only started once the first job is submitted
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if self._config['eager']:
+            self._executor = ThreadPoolExecutor(max_workers=self._config['workers'], thread_name_prefix="derivatives")
+
+        if features.check('webp'):
+            self.format, self.extension, self.mimetype = "WEBP", "webp", "image/webp"
+        else:
+            logger.warning("Pillow was built without WebP support; derivatives fall back to JPEG")
+            self.format, self.extension, self.mimetype = "JPEG", "jpg", "image/jpeg"
+        os.makedirs(self._config['cache_dir'], exist_ok=True)
+
+    def get_derivative_url(self, image_url: str, variant: str) -> Optional[str]:
+        """
+        Get the URL of a variant of an uploaded image.
+
+        Args:
+            image_url: URL returned by ImageService.get_image_url
+            variant: Variant name, e.g. 'thumb' or 'preview'
+
+        Returns:
+            Derivative URL, or None if image_url is not an upload URL
+        """
+        filename = self._image_service.get_filename_from_url(image_url)
+        if filename is None or variant not in self.variants:
+            return None
+        return f"/derivatives/{variant}/{filename}"
+
+    def get_derivative_path(self, filename: str, variant: str) -> str:
+        """Cache path of one variant of an upload."""
+        return os.path.join(self._config['cache_dir'], variant, f"{filename}.{self.extension}")
+
+    def ensure(self, filename: str, variant: str, trigger: str = "lazy") -> str:
+        """
+        Return the cached variant of an upload, generating it if missing or stale.
+
+        Args:
+            filename: Upload filename relative to the upload folder
+            variant: Variant name
+            trigger: 'eager' or 'lazy', for metrics
+
+        Returns:
+            Path of the derivative file
+
+        Raises:
+            FileNotFoundError: If the source image does not exist or lies outside the upload folder
+            DerivativeError: If the variant is unknown or the source cannot be decoded
+        """
+        if variant not in self.variants:
+            raise DerivativeError(f"Unknown variant: {variant}")
+        # Never resolve outside the upload folder
+        if os.path.isabs(filename) or ".." in filename.replace("\\", "/").split("/"):
+            raise FileNotFoundError(filename)
+
+        source_mtime = self._image_service.stat_image(filename).mtime  # FileNotFoundError for unknown uploads
+        path = self.get_derivative_path(filename, variant)
+        if self._is_fresh(path, source_mtime):
+            DERIVATIVE_REQUESTS.inc(variant=variant, outcome="hit")
+            return path
+
+        with self._locks[zlib.crc32(path.encode()) % _LOCK_STRIPES]:
+            # Another thread may have produced it while we waited
+            if not self._is_fresh(path, source_mtime):
+                self._generate(filename, path, self.variants[variant])
+                DERIVATIVES_GENERATED.inc(variant=variant, trigger=trigger)
+                DERIVATIVE_BYTES.inc(os.path.getsize(path), variant=variant)
+                logger.debug(f"Generated {variant} derivative of {filename} ({trigger})")
+        DERIVATIVE_REQUESTS.inc(variant=variant, outcome="generated")
+        return path
+
+    def schedule(self, filename: str) -> None:
+        """Generate every variant of a freshly saved upload in the background (eager mode only)."""
+        if self._executor is not None:
+            self._executor.submit(self._generate_all, filename)
+
+    def _generate_all(self, filename: str) -> None:
+        for variant in self.variants:
+            try:
+                self.ensure(filename, variant, trigger="eager")
+            except Exception as e:
+                # The lazy path retries on first request
+                logger.warning(f"Failed to generate {variant} derivative of {filename}: {str(e)}")
+
+    @staticmethod
+    def _is_fresh(path: str, source_mtime: float) -> bool:
+        try:
+            return os.stat(path).st_mtime >= source_mtime
+        except FileNotFoundError:
+            return False
+
+    def _generate(self, filename: str, path: str, size: int) -> None:
+        """Downscale a stored upload to fit size x size and write it atomically to path."""
+        try:
+            with self._image_service.open_image_file(filename) as source, Image.open(source) as image:
+                # JPEG decoders can scale by 1/2..1/8 during decode, far cheaper than a full decode
+                image.draft("RGB", (size, size))
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        except (OSError, ValueError) as e:
+            raise DerivativeError(f"Cannot decode {filename}: {str(e)}")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            image.save(temp_path, self.format, quality=self._config['quality'], method=4)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def delete(self, filename: str) -> int:
+        """
+        Remove every cached variant of an upload.
+
+        Args:
+            filename: Upload filename relative to the upload folder
+
+        Returns:
+            Number of derivative files removed
+        """
+        removed = 0
+        for variant in self.variants:
+            try:
+                os.remove(self.get_derivative_path(filename, variant))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def prune(self, keep: Set[str], grace: float = 0) -> int:
+        """
+        Remove derivatives whose source upload is not in keep.
+
+        Args:
+            keep: Upload filenames (relative to the upload folder, '/'-separated) that still exist
+            grace: Leave derivatives modified less than this many seconds ago
+
+        Returns:
+            Number of derivative files removed
+        """
+        suffix = f".{self.extension}"
+        cutoff = time.time() - grace
+        removed = 0
+        for variant in self.variants:
+            # Derivatives mirror the upload layout, so walk the shard subdirectories too
+            pending = [""]
+            while pending:
+                relative_dir = pending.pop()
+                try:
+                    entries = os.scandir(os.path.join(self._config['cache_dir'], variant, relative_dir))
+                except FileNotFoundError:
+                    continue
+                with entries:
+                    for entry in entries:
+                        relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                        if entry.is_dir():
+                            pending.append(relative)
+                            continue
+                        if not entry.is_file() or not entry.name.endswith(suffix):
+                            continue
+                        if relative[:-len(suffix)] in keep or entry.stat().st_mtime > cutoff:
+                            continue
+                        try:
+                            os.remove(entry.path)
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+        return removed
+
+    def shutdown(self) -> None:
+        """Wait for scheduled generations to finish."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -2,19 +2,28 @@
 Detection service for YOLO-based kaong fruit detection.
 Handles all model loading and inference operations.
 """
+import time
 import logging
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 from PIL import Image
+import torch
 import ultralytics
 from dataclasses import dataclass
 
+from services.profiling import profiler
+from services.metrics import (
+    INFERENCE_BATCH_SIZE, INFERENCE_IN_FLIGHT, INFERENCE_LATENCY, MODEL_LOAD_SECONDS, DETECTIONS
+)
+from services.model_registry import ModelRegistry, ModelRegistryError, ModelVersion
 from config import (
     get_model_path,
     CONFIDENCE_THRESHOLD,
     KAONG_LABELS_MAP,
     ASSESSMENT_MAP,
     DEFAULT_BOX_COORDS,
-    INFERENCE_DEVICE
+    INFERENCE_DEVICE,
+    MODEL_WARMUP_CONFIG
 )
 
 logger = logging.getLogger(__name__)
@@ -30,6 +39,7 @@ class Detection:
     assessment: str
     image_width: int  # Width of image that coordinates are based on
     image_height: int  # Height of image that coordinates are based on
+    model_version: Optional[str] = None  # Registry version of the model that produced this detection
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert detection to dictionary format for JSON serialization."""
@@ -40,33 +50,170 @@ class Detection:
             'score': self.score,
             'assessment': self.assessment,
             'image_width': self.image_width,
-            'image_height': self.image_height
+            'image_height': self.image_height,
+            'model_version': self.model_version
         }
 class DetectionService:
     """Service class for handling YOLO model operations and kaong detection."""
 
-    def __init__(self):
-        """Initialize the detection service with YOLO model."""
-        self._model = None
-        self._load_model()
+    def __init__(self, registry: Optional[ModelRegistry] = None, model_path: Optional[str] = None):
+        """
+        Initialize the detection service with YOLO model.
+
+        Args:
+            registry: Optional shared model registry; a private one is created otherwise
+            model_path: Weights to serve initially (default: get_model_path())
+        """
+        self._registry = registry or ModelRegistry(self._create_model, on_unload=self._forget_version)
+        self._model_path = model_path
+        self._ready = threading.Event()
+        self._load_error: Optional[str] = None
+        self._warmup_reports: Dict[str, Dict[str, float]] = {}
+        self._configure_threads()
+        MODEL_LOAD_SECONDS.set_callback(self._model_load_seconds)
+
+        if MODEL_WARMUP_CONFIG['background']:
+            # Accept connections immediately; detection routes check is_ready until warm-up completes
+            threading.Thread(target=self._load_model_in_background, name="model-warmup", daemon=True).start()
+        else:
+            self._load_model()
+
+    def _configure_threads(self) -> None:
+        """Pin the torch intra-op thread pool so inference does not oversubscribe the CPU."""
+        num_threads = MODEL_WARMUP_CONFIG['num_threads']
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+            logger.info(f"Torch intra-op threads pinned to {num_threads}")
+
+    def _create_model(self, model_path: str) -> ultralytics.YOLO:
+        """Load a YOLO model, optionally compile it, and warm it up so it is ready to receive traffic."""
+        logger.info(f"Loading YOLO model from: {model_path}")
+        model = ultralytics.YOLO(model_path)
+        model = self._compile_model(model, model_path)
+        if MODEL_WARMUP_CONFIG['enabled']:
+            self._warmup_reports[model_path] = self._warm_up_model(model)
+        return model
+
+    def _forget_version(self, model_version: ModelVersion) -> None:
+        """Drop the warm-up report of an unloaded version, unless another version was loaded from the same file."""
+        remaining_paths = {version['path'] for version in self._registry.describe()['versions']}
+        if model_version.path not in remaining_paths:
+            self._warmup_reports.pop(model_version.path, None)
+
+    def _compile_model(self, model: ultralytics.YOLO, model_path: str) -> ultralytics.YOLO:
+        """
+        Apply the configured graph compilation.
+
+        'torchscript' exports traced weights next to the original and serves those;
+        'torch_compile' wraps the fused network inside the ultralytics predictor.
+        """
+        mode = MODEL_WARMUP_CONFIG['compile']
+        if mode == 'none':
+            return model
+
+        try:
+            if mode == 'torchscript':
+                exported_path = model.export(format="torchscript", device=INFERENCE_DEVICE)
+                logger.info(f"Exported TorchScript model for {model_path}: {exported_path}")
+                return ultralytics.YOLO(exported_path, task="detect")
+
+            if mode == 'torch_compile':
+                # The predictor (and its fused AutoBackend) only exists after the first predict
+                model.predict(source=Image.new("RGB", (640, 640)), verbose=False, device=INFERENCE_DEVICE)
+                backend = model.predictor.model
+                backend.model = torch.compile(backend.model)
+                logger.info(f"Applied torch.compile to {model_path}")
+                return model
+
+            logger.warning(f"Unknown MODEL_COMPILE mode '{mode}', serving eager model")
+        except Exception as e:
+            # Compilation is an optimisation only; fall back to the eager model
+            logger.warning(f"Model compilation ({mode}) failed for {model_path}, serving eager model: {str(e)}")
+        return model
+
+    def _warm_up_model(self, model: ultralytics.YOLO) -> Dict[str, float]:
+        """
+        Run dummy inferences at each expected input shape and batch size.
+
+        Returns:
+            Dictionary of "WxH@batch" -> steady-state milliseconds per call
+        """
+        report = {}
+        total_start = time.perf_counter()
+        for width, height in MODEL_WARMUP_CONFIG['shapes']:
+            for batch_size in MODEL_WARMUP_CONFIG['batch_sizes']:
+                images = [Image.new("RGB", (width, height)) for _ in range(batch_size)]
+                source = images[0] if batch_size == 1 else images
+
+                timings = []
+                for _ in range(max(1, MODEL_WARMUP_CONFIG['iterations'])):
+                    start = time.perf_counter()
+                    model.predict(source=source, verbose=False, device=INFERENCE_DEVICE)
+                    timings.append((time.perf_counter() - start) * 1000)
+
+                key = f"{width}x{height}@{batch_size}"
+                report[key] = round(timings[-1], 2)
+                logger.info(f"Warm-up {key}: first {timings[0]:.1f}ms, last {timings[-1]:.1f}ms")
+
+        report['total'] = round((time.perf_counter() - total_start) * 1000, 2)
+        logger.info(f"Model warm-up completed in {report['total']:.1f}ms")
+        return report
 
     def _load_model(self) -> None:
         """Load the YOLO model with error handling."""
         try:
-            model_path = get_model_path()
-            logger.info(f"Loading YOLO model from: {model_path}")
-            self._model = ultralytics.YOLO(model_path)
+            model_path = self._model_path or get_model_path()
+            self._registry.load(model_path, activate=True)
+            self._ready.set()
             logger.info("YOLO model loaded successfully")
         except Exception as e:
+            self._load_error = str(e)
             logger.error(f"Failed to load YOLO model: {str(e)}")
             raise RuntimeError(f"Model loading failed: {str(e)}")
 
+    def _load_model_in_background(self) -> None:
+        """Background variant of _load_model; failures are reported through readiness."""
+        try:
+            self._load_model()
+        except RuntimeError:
+            pass
+
+    def _model_load_seconds(self) -> Dict[Tuple[str, ...], float]:
+        """Load plus warm-up seconds per registered version, for the metrics endpoint."""
+        return {
+            (version['version'],): version['load_seconds']
+            for version in self._registry.describe()['versions']
+        }
+
+    @property
+    def is_ready(self) -> bool:
+        """True once a model has been loaded and warmed up."""
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until the model is ready or the timeout expires."""
+        return self._ready.wait(timeout)
+
+    def readiness(self) -> Dict[str, Any]:
+        """Describe model readiness and warm-up timings for health checks."""
+        return {
+            'ready': self.is_ready,
+            'error': self._load_error,
+            'warmup_ms': dict(self._warmup_reports)
+        }
+
+    @property
+    def registry(self) -> ModelRegistry:
+        """Get the model registry backing this service."""
+        return self._registry
+
     @property
     def model(self) -> ultralytics.YOLO:
-        """Get the loaded YOLO model."""
-        if self._model is None:
+        """Get the primary (largest traffic share) YOLO model."""
+        try:
+            return self._registry.primary.model
+        except ModelRegistryError:
             raise RuntimeError("Model not loaded. Call _load_model() first.")
-        return self._model
 
     def _get_kaong_label(self, label_id: int) -> str:
         """Map numeric label ID to kaong label string."""
@@ -76,7 +223,8 @@ class DetectionService:
         """Map kaong label to assessment string."""
         return ASSESSMENT_MAP.get(label, "Unknown Assessment")
 
-    def _create_default_detection(self, img_width: int, img_height: int) -> Detection:
+    def _create_default_detection(self, img_width: int, img_height: int,
+                                  model_version: Optional[str] = None) -> Detection:
         """Create a default detection when no objects are detected."""
         # Calculate absolute coordinates
         x1 = img_width * DEFAULT_BOX_COORDS['x1_fraction']
@@ -101,16 +249,19 @@ class DetectionService:
             score=0.0,
             assessment="Not Ready for Harvesting",
             image_width=img_width,
-            image_height=img_height
+            image_height=img_height,
+            model_version=model_version
         )
 
-    def _process_model_results(self, results: List[Any], img_width: int, img_height: int) -> List[Detection]:
-        """Process raw YOLO model results into Detection objects."""
+    def _process_model_results(self, results: List[Any], img_width: int, img_height: int,
+                               model_version: Optional[str] = None,
+                               min_score: float = CONFIDENCE_THRESHOLD) -> List[Detection]:
+        """Process raw YOLO model results into Detection objects scoring above min_score."""
         detections = []
 
         if not results or len(results) == 0:
             logger.warning("Model prediction returned no results")
-            return [self._create_default_detection(img_width, img_height)]
+            return [self._create_default_detection(img_width, img_height, model_version)]
 
         result = results[0]
 
@@ -126,7 +277,7 @@ class DetectionService:
         for i in range(len(conf_scores)):
             score = conf_scores[i]
             
-            if score > CONFIDENCE_THRESHOLD:
+            if score > min_score:
                 label_id = class_indices[i]
                 label = self._get_kaong_label(label_id)
                 assessment = self._get_assessment(label)
@@ -148,14 +299,24 @@ class DetectionService:
                     score=score,
                     assessment=assessment,
                     image_width=img_width,
-                    image_height=img_height
+                    image_height=img_height,
+                    model_version=model_version
                 ))        # Return default detection if no high-confidence detections found
         if not detections:
             logger.info("No high confidence detections found, using default")
-            detections = [self._create_default_detection(img_width, img_height)]
+            detections = [self._create_default_detection(img_width, img_height, model_version)]
 
         return detections
 
+    def _record_predict_stages(self, results: List[Any]) -> None:
+        """Split the predict span using the per-stage timings ultralytics reports (ms)."""
+        if not results or profiler.current_trace() is None:
+            return
+        speed = getattr(results[0], 'speed', None) or {}
+        for key, stage in (('preprocess', 'model_preprocess'), ('inference', 'forward'), ('postprocess', 'nms')):
+            if speed.get(key) is not None:
+                profiler.record(stage, speed[key], parent="predict")
+
     def detect_objects(self, image: Image.Image) -> Tuple[List[Detection], bool]:
         """
         Perform object detection on an image.
@@ -173,19 +334,35 @@ class DetectionService:
 
             logger.debug(f"Processing image: size={image.size}, mode={image.mode}")
 
+            # Pick the serving model version (A/B split) for this request
+            serving = self._registry.select()
+
             # Perform prediction
-            results = self.model.predict(
-                source=image,
-                verbose=True,
-                device=INFERENCE_DEVICE
-            )
+            INFERENCE_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            try:
+                with profiler.span("predict"):
+                    results = serving.model.predict(
+                        source=image,
+                        verbose=True,
+                        device=INFERENCE_DEVICE
+                    )
+            finally:
+                INFERENCE_IN_FLIGHT.dec()
+            INFERENCE_LATENCY.observe(time.perf_counter() - start, model_version=serving.version)
+            INFERENCE_BATCH_SIZE.observe(1)
+            self._record_predict_stages(results)
 
             # Process results
             img_width, img_height = image.size
-            detections = self._process_model_results(results, img_width, img_height)
+            with profiler.span("process_results"):
+                detections = self._process_model_results(results, img_width, img_height, serving.version)
 
             # Check if we have valid detections (score > threshold)
             has_valid_detections = any(d.score > CONFIDENCE_THRESHOLD for d in detections)
+            for detection in detections:
+                if detection.score > CONFIDENCE_THRESHOLD:
+                    DETECTIONS.inc(label=detection.label)
 
             logger.info(f"Detection complete: {len(detections)} objects found, valid: {has_valid_detections}")
             return detections, has_valid_detections
@@ -195,6 +372,62 @@ class DetectionService:
             default_detection = self._create_default_detection(img_width, img_height)
             return [default_detection], False
 
+    def detect_objects_batch(self, images: List[Image.Image],
+                             min_score: Optional[float] = None) -> List[Tuple[List[Detection], bool]]:
+        """
+        Perform object detection on several images with a single predict call.
+
+        Args:
+            images: PIL Image objects to analyze
+            min_score: Keep detections above this score instead of CONFIDENCE_THRESHOLD
+                (evaluation uses a low value to get the full precision/recall curve);
+                has_valid_detections is still judged at CONFIDENCE_THRESHOLD
+            
+        Returns:
+            One (detections_list, has_valid_detections) tuple per input image, in order
+        """
+        if not images:
+            return []
+
+        try:
+            serving = self._registry.select()
+
+            INFERENCE_IN_FLIGHT.inc(len(images))
+            start = time.perf_counter()
+            predict_options = {} if min_score is None else {'conf': min_score}
+            try:
+                with profiler.span("predict"):
+                    results = serving.model.predict(
+                        source=list(images),
+                        verbose=False,
+                        device=INFERENCE_DEVICE,
+                        **predict_options
+                    )
+            finally:
+                INFERENCE_IN_FLIGHT.dec(len(images))
+            INFERENCE_LATENCY.observe(time.perf_counter() - start, model_version=serving.version)
+            INFERENCE_BATCH_SIZE.observe(len(images))
+        except Exception as e:
+            # Fall back to per-image inference so one bad image does not fail the whole batch
+            logger.error(f"Batch detection failed, retrying images individually: {str(e)}")
+            return [self.detect_objects(image) for image in images]
+
+        outputs = []
+        for image, result in zip(images, results):
+            img_width, img_height = image.size
+            detections = self._process_model_results(
+                [result], img_width, img_height, serving.version,
+                CONFIDENCE_THRESHOLD if min_score is None else min_score
+            )
+            has_valid_detections = any(d.score > CONFIDENCE_THRESHOLD for d in detections)
+            for detection in detections:
+                if detection.score > CONFIDENCE_THRESHOLD:
+                    DETECTIONS.inc(label=detection.label)
+            outputs.append((detections, has_valid_detections))
+
+        logger.info(f"Batch detection complete: {len(images)} images")
+        return outputs
+
     def detect_objects_dict(self, image: Image.Image) -> Dict[str, Any]:
         """
         Convenience method that returns detections in dictionary format.
@@ -209,3 +442,26 @@ class DetectionService:
         return {
             'detections': [detection.to_dict() for detection in detections]
         }
+
+
+def summarize_detections(detections: List[Detection]) -> Optional[Tuple[str, float, Dict[str, int]]]:
+    """
+    Summarize detections above CONFIDENCE_THRESHOLD for an assessment record.
+
+    Returns:
+        Tuple of (summary text like "3 Ripe, 2 Unripe", average confidence, label counts),
+        or None when no detection passes the threshold
+    """
+    label_counts: Dict[str, int] = {}
+    total_confidence = 0.0
+    valid_detections = [d for d in detections if d.score > CONFIDENCE_THRESHOLD]
+
+    for detection in valid_detections:
+        label_counts[detection.label] = label_counts.get(detection.label, 0) + 1
+        total_confidence += detection.score
+
+    if not label_counts:
+        return None
+
+    summary_text = ", ".join(f"{count} {label}" for label, count in label_counts.items())
+    return summary_text, total_confidence / len(valid_detections), label_counts
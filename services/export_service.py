@@ -0,0 +1,188 @@
+"""
+Export service for streaming assessments and detections out of the database.
+Reads keyset-paginated chunks and writes Parquet, CSV or NDJSON with memory
+bounded by the chunk size rather than the table size.
+"""
+import os
+import shutil
+import logging
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import polars as pl
+
+from services.database_service import DatabaseService, Assessment
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson')
+}
+
+# One row per detection; assessments without detection data produce a single row with null detection fields
+EXPORT_SCHEMA: Dict[str, Any] = {
+    'assessment_id': pl.Int64,
+    'timestamp': pl.Datetime('us'),
+    'source': pl.Utf8,
+    'assessment': pl.Utf8,
+    'confidence': pl.Float64,
+    'image_url': pl.Utf8,
+    'model_version': pl.Utf8,
+    'detection_index': pl.Int32,
+    'label': pl.Utf8,
+    'score': pl.Float64,
+    'x1': pl.Float64,
+    'y1': pl.Float64,
+    'x2': pl.Float64,
+    'y2': pl.Float64,
+    'x1_rel': pl.Float64,
+    'y1_rel': pl.Float64,
+    'x2_rel': pl.Float64,
+    'y2_rel': pl.Float64,
+    'image_width': pl.Int32,
+    'image_height': pl.Int32
+}
+EXPORT_COLUMNS = list(EXPORT_SCHEMA)
+
+STREAM_BLOCK_SIZE = 256 * 1024
+
+
+class ExportError(Exception):
+    """Custom exception for export errors."""
+    pass
+
+
+def flatten_assessment(assessment: Assessment) -> List[Dict[str, Any]]:
+    """Flatten an assessment's detection_data into one row per detection."""
+    base = {
+        'assessment_id': assessment.id,
+        'timestamp': assessment.timestamp,
+        'source': assessment.source,
+        'assessment': assessment.assessment,
+        'confidence': assessment.confidence,
+        'image_url': assessment.image_url,
+        'model_version': None
+    }
+
+    detection_data = assessment.detection_data if isinstance(assessment.detection_data, dict) else {}
+    base['model_version'] = detection_data.get('model_version')
+    detections = detection_data.get('detections') or []
+    if not detections:
+        return [{**{column: None for column in EXPORT_COLUMNS}, **base}]
+
+    rows = []
+    for index, detection in enumerate(detections):
+        box = detection.get('box') or [None] * 4
+        box_relative = detection.get('box_relative') or [None] * 4
+        rows.append({
+            **base,
+            'model_version': detection.get('model_version') or base['model_version'],
+            'detection_index': index,
+            'label': detection.get('label'),
+            'score': detection.get('score'),
+            'x1': box[0], 'y1': box[1], 'x2': box[2], 'y2': box[3],
+            'x1_rel': box_relative[0], 'y1_rel': box_relative[1],
+            'x2_rel': box_relative[2], 'y2_rel': box_relative[3],
+            'image_width': detection.get('image_width'),
+            'image_height': detection.get('image_height')
+        })
+    return rows
+
+
+def rows_to_frame(rows: List[Dict[str, Any]]) -> pl.DataFrame:
+    """Build a DataFrame with the fixed export schema (stable types across chunks)."""
+    return pl.DataFrame(rows, schema=EXPORT_SCHEMA, orient="row") if rows else pl.DataFrame(schema=EXPORT_SCHEMA)
+
+
+class ExportService:
+    """Service class for streaming exports of assessments and detections."""
+
+    def __init__(self, database_service: DatabaseService, chunk_size: int = 1000):
+        self._database_service = database_service
+        self._chunk_size = chunk_size
+
+    def iter_frames(self, source: Optional[str] = None, since: Optional[datetime] = None,
+                    after_id: int = 0) -> Iterator[pl.DataFrame]:
+        """Yield one flattened DataFrame per keyset-paginated chunk."""
+        for chunk in self._database_service.iter_assessments(
+                after_id=after_id, chunk_size=self._chunk_size, source=source, since=since):
+            rows = [row for assessment in chunk for row in flatten_assessment(assessment)]
+            yield rows_to_frame(rows)
+
+    def stream(self, export_format: str, source: Optional[str] = None,
+               since: Optional[datetime] = None) -> Iterator[bytes]:
+        """
+        Stream an export as byte blocks.
+
+        Args:
+            export_format: 'parquet', 'csv' or 'ndjson'
+            source: Optional source filter
+            since: Optional lower bound on timestamp
+
+        Raises:
+            ExportError: If the format is not supported
+        """
+        frames = self.iter_frames(source=source, since=since)
+        if export_format == 'csv':
+            return self._stream_csv(frames)
+        if export_format == 'ndjson':
+            return self._stream_ndjson(frames)
+        if export_format == 'parquet':
+            return self._stream_parquet(frames)
+        raise ExportError(f"Unsupported export format: {export_format}")
+
+    def _stream_csv(self, frames: Iterator[pl.DataFrame]) -> Iterator[bytes]:
+        yield (",".join(EXPORT_COLUMNS) + "\n").encode()
+        for frame in frames:
+            yield frame.write_csv(include_header=False).encode()
+
+    def _stream_ndjson(self, frames: Iterator[pl.DataFrame]) -> Iterator[bytes]:
+        for frame in frames:
+            if frame.height:
+                yield frame.write_ndjson().encode()
+
+    def _stream_parquet(self, frames: Iterator[pl.DataFrame]) -> Iterator[bytes]:
+        """
+        Parquet needs a footer describing every row group, so it cannot be emitted chunk
+        by chunk. Chunks are spilled to Arrow IPC files, combined with polars' streaming
+        sink_parquet, and the finished file is streamed from disk.
+        """
+        workdir = tempfile.mkdtemp(prefix="kaong_export_")
+        try:
+            part = 0
+            for frame in frames:
+                frame.write_ipc(os.path.join(workdir, f"part_{part:06d}.arrow"))
+                part += 1
+            if part == 0:
+                rows_to_frame([]).write_ipc(os.path.join(workdir, "part_000000.arrow"))
+
+            output_path = os.path.join(workdir, "export.parquet")
+            pl.scan_ipc(os.path.join(workdir, "part_*.arrow")).sink_parquet(output_path)
+
+            with open(output_path, "rb") as f:
+                while True:
+                    block = f.read(STREAM_BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def export_to_file(self, path: str, export_format: str, source: Optional[str] = None,
+                       since: Optional[datetime] = None) -> int:
+        """
+        Write an export to a file.
+
+        Returns:
+            Number of bytes written
+        """
+        written = 0
+        with open(path, "wb") as f:
+            for block in self.stream(export_format, source=source, since=since):
+                f.write(block)
+                written += len(block)
+        logger.info(f"Exported assessments to {path} ({written} bytes, {export_format})")
+        return written
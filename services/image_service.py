@@ -3,25 +3,173 @@ Image service for handling image processing, validation, and file operations.
 Provides image resizing, validation, and file management capabilities.
 """
 import os
+import re
+import time
+import hashlib
 import logging
-from typing import Optional, Tuple, Union, BinaryIO
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterator, Optional, Tuple, Union, BinaryIO
 from datetime import datetime
-from PIL import Image, ImageOps
+from PIL import Image, ImageOps, features
 import base64
 from io import BytesIO
 from werkzeug.datastructures import FileStorage
 
+from services.profiling import profiler
+from services.metrics import UPLOAD_BYTES, ARCHIVE_ENCODE_CPU
+from services.storage_backend import StorageBackend, StorageError, StoredObject, content_type_for, get_storage
+
 from config import (
-    UPLOAD_FOLDER,
+    UPLOAD_LAYOUT,
     ALLOWED_EXTENSIONS,
     MAX_FILE_SIZE,
     MAX_IMAGE_WIDTH,
     MAX_IMAGE_HEIGHT,
-    IMAGE_QUALITY
+    ARCHIVE_ENCODING_CONFIG
 )
 
 logger = logging.getLogger(__name__)
 
+# Archival formats: Pillow format name, file extension and encoder options.
+# Baseline JPEG: optimize=True and progressive=True each cost 2-5x the encode CPU for 2-5% fewer bytes.
+ARCHIVE_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {}),
+    'webp': ('WEBP', 'webp', {'method': 4}),
+    'avif': ('AVIF', 'avif', {'speed': 6})
+}
+
+# Filename source tags that use another source's policy
+ARCHIVE_SOURCE_ALIASES = {'camera': 'camera_ws'}
+
+# Leading bytes of encoded images, used to name raw camera frames
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", 'jpg'),
+    (b"\x89PNG\r\n\x1a\n", 'png'),
+    (b"GIF87a", 'gif'),
+    (b"GIF89a", 'gif'),
+    (b"BM", 'bmp')
+)
+
+
+@dataclass(frozen=True)
+class ArchivePolicy:
+    """How images from one source are stored."""
+    source: str
+    format: str  # key of ARCHIVE_FORMATS, or 'original'
+    quality: int
+
+    @property
+    def extension(self) -> str:
+        return ARCHIVE_FORMATS.get(self.format, ARCHIVE_FORMATS['jpeg'])[1]
+
+
+def archive_codec_available(archive_format: str) -> bool:
+    """Whether Pillow can write the format (WebP/AVIF depend on how Pillow was built)."""
+    if archive_format == 'jpeg':
+        return True
+    try:
+        return bool(features.check(archive_format))
+    except ValueError:
+        # Pillow versions that predate the codec do not know the feature name
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_archive_policy(source: str) -> ArchivePolicy:
+    """
+    Resolve the archival encoding policy for a source.
+
+    Args:
+        source: Source tag (upload, manual, camera_ws, category; unknown tags use 'upload')
+
+    Returns:
+        ArchivePolicy with a format this Pillow build can write
+    """
+    source = ARCHIVE_SOURCE_ALIASES.get(source, source)
+    policies = ARCHIVE_ENCODING_CONFIG['policies']
+    policy = policies.get(source, policies['upload'])
+    archive_format = policy['format']
+    if archive_format != 'original' and archive_format not in ARCHIVE_FORMATS:
+        logger.warning(f"Unknown archive format '{archive_format}' for {source}, using JPEG")
+        archive_format = 'jpeg'
+    elif archive_format in ARCHIVE_FORMATS and not archive_codec_available(archive_format):
+        logger.warning(f"Pillow cannot write {archive_format.upper()}, storing {source} images as JPEG")
+        archive_format = 'jpeg'
+    return ArchivePolicy(source=source, format=archive_format, quality=policy['quality'])
+
+
+def encode_archival(image: Image.Image, policy: ArchivePolicy) -> bytes:
+    """
+    Encode an image for storage according to a policy.
+
+    A decoded image has no original bytes left to keep, so 'original' encodes as JPEG.
+
+    Args:
+        image: PIL Image object
+        policy: Policy from get_archive_policy
+
+    Returns:
+        Encoded image bytes
+    """
+    archive_format = policy.format if policy.format in ARCHIVE_FORMATS else 'jpeg'
+    pil_format, _, options = ARCHIVE_FORMATS[archive_format]
+    buffer = BytesIO()
+    # Thread CPU time: wall time would also count waiting on other request threads
+    start = time.thread_time()
+    image.save(buffer, pil_format, quality=policy.quality, **options)
+    ARCHIVE_ENCODE_CPU.observe(time.thread_time() - start, source=policy.source, format=archive_format)
+    return buffer.getvalue()
+
+
+def detect_image_extension(data: bytes) -> Optional[str]:
+    """
+    Identify encoded image bytes by their signature.
+
+    Args:
+        data: Encoded image data
+
+    Returns:
+        File extension without the dot, or None if the format is not recognised
+    """
+    for signature, extension in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return 'webp'
+    if data[4:8] == b"ftyp" and data[8:12] in (b"avif", b"avis"):
+        return 'avif'
+    return None
+
+
+# First _YYYYmmdd_HHMMSS[_micro] in a stored filename; category renders repeat the original's
+# name before their own timestamp, so they shard next to the original
+FILENAME_TIMESTAMP = re.compile(r"_(\d{4})(\d{2})(\d{2})_\d{6}(?:_\d+)?")
+
+
+def upload_shard(filename: str, layout: str = UPLOAD_LAYOUT) -> Optional[str]:
+    """
+    Subdirectory a stored file belongs in, derived from its name alone.
+
+    Args:
+        filename: Bare filename (any directory part is ignored)
+        layout: 'date', 'hash' or 'flat'
+
+    Returns:
+        Relative directory with '/' separators, '' for the flat layout, or None if a date
+        layout is requested for a name without a timestamp
+    """
+    name = filename.replace("\\", "/").rsplit("/", 1)[-1]
+    match = FILENAME_TIMESTAMP.search(name)
+    if layout == 'date':
+        return "/".join(match.groups()) if match else None
+    if layout == 'hash':
+        key = name[:match.end()] if match else name
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}"
+    return ''
+
+
 class ImageValidationError(Exception):
     """Custom exception for image validation errors."""
     pass
@@ -29,18 +177,18 @@ class ImageValidationError(Exception):
 class ImageService:
     """Service class for handling image processing and file operations."""
     
-    def __init__(self):
-        """Initialize the image service."""
-        self._ensure_upload_directory()
-    
-    def _ensure_upload_directory(self) -> None:
-        """Ensure the upload directory exists."""
+    def __init__(self, storage: Optional[StorageBackend] = None):
+        """
+        Initialize the image service.
+
+        Args:
+            storage: Image storage backend (default: the one selected by STORAGE_BACKEND)
+        """
         try:
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            logger.debug(f"Upload directory ensured: {UPLOAD_FOLDER}")
-        except Exception as e:
-            logger.error(f"Failed to create upload directory: {str(e)}")
-            raise RuntimeError(f"Upload directory creation failed: {str(e)}")
+            self.storage = storage or get_storage()
+        except StorageError as e:
+            logger.error(f"Failed to initialize image storage: {str(e)}")
+            raise RuntimeError(f"Image storage initialization failed: {str(e)}")
     
     def _is_allowed_file(self, filename: str) -> bool:
         """Check if the file extension is allowed."""
@@ -116,7 +264,8 @@ class ImageService:
             
             # Try to open as image
             try:
-                image = Image.open(file.stream).convert("RGB")
+                with profiler.span("decode"):
+                    image = Image.open(file.stream).convert("RGB")
             except Exception as e:
                 raise ImageValidationError(f"Invalid image file: {str(e)}")
             
@@ -124,10 +273,12 @@ class ImageService:
             original_dimensions = image.size  # (width, height)
             
             # Auto-orient the image (handle EXIF rotation)
-            image = ImageOps.exif_transpose(image)
+            with profiler.span("exif_transpose"):
+                image = ImageOps.exif_transpose(image)
             
             # Resize if needed
-            image = self._resize_image_if_needed(image)
+            with profiler.span("resize"):
+                image = self._resize_image_if_needed(image)
             
             logger.info(f"Successfully processed upload: {file.filename}, original: {original_dimensions}, processed: {image.size}")
             return image, file.filename, original_dimensions
@@ -138,45 +289,103 @@ class ImageService:
             logger.error(f"Unexpected error processing upload: {str(e)}")
             raise ImageValidationError(f"Failed to process image: {str(e)}")
     
-    def process_base64_image(self, data_url: str) -> Image.Image:
+    def read_upload(self, file: FileStorage) -> bytes:
         """
-        Process a base64-encoded image from a data URL.
+        Validate an uploaded file's name and size and return its bytes undecoded.
+
+        Used by web nodes that hand decoding to an inference worker (INFERENCE_MODE=queue).
+
+        Args:
+            file: Flask FileStorage object from request.files
+
+        Returns:
+            Encoded image bytes as uploaded
+
+        Raises:
+            ImageValidationError: If validation fails
+        """
+        if not file or not file.filename:
+            raise ImageValidationError("No file provided or empty filename")
+        if not self._is_allowed_file(file.filename):
+            raise ImageValidationError(
+                f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+            )
+        self._validate_file_size(file)
+        with profiler.span("upload_read"):
+            return file.read()
+
+    def decode_image_bytes(self, image_bytes: bytes) -> Image.Image:
+        """
+        Decode raw image bytes into an oriented, size-limited RGB image.
         
         Args:
-            data_url: Base64 data URL string (e.g., "data:image/jpeg;base64,...")
+            image_bytes: Encoded image data (JPEG, PNG, ...)
             
         Returns:
             Processed PIL Image object
             
         Raises:
-            ImageValidationError: If processing fails
+            ImageValidationError: If the data is not a decodable image
         """
         try:
-            # Extract base64 data
-            if "," not in data_url:
-                raise ImageValidationError("Invalid data URL format")
-            
-            image_data = data_url.split(",")[1]
-            
-            # Decode base64
-            try:
-                image_bytes = base64.b64decode(image_data)
-            except Exception as e:
-                raise ImageValidationError(f"Failed to decode base64 data: {str(e)}")
-            
-            # Validate size
-            if len(image_bytes) > MAX_FILE_SIZE:
-                raise ImageValidationError("Image data exceeds maximum size limit")
-            
-            # Create PIL Image
-            try:
+            with profiler.span("decode"):
                 image = Image.open(BytesIO(image_bytes)).convert("RGB")
-            except Exception as e:
-                raise ImageValidationError(f"Invalid image data: {str(e)}")
-            
-            # Auto-orient and resize if needed
+        except Exception as e:
+            raise ImageValidationError(f"Invalid image data: {str(e)}")
+        
+        # Auto-orient and resize if needed
+        with profiler.span("exif_transpose"):
             image = ImageOps.exif_transpose(image)
+        with profiler.span("resize"):
             image = self._resize_image_if_needed(image)
+        return image
+    
+    def decode_data_url(self, data_url: str) -> bytes:
+        """
+        Extract the encoded image bytes from a base64 data URL.
+
+        Args:
+            data_url: Base64 data URL string (e.g., "data:image/jpeg;base64,...")
+
+        Returns:
+            Encoded image bytes
+
+        Raises:
+            ImageValidationError: If the URL is malformed or the data exceeds MAX_FILE_SIZE
+        """
+        # Extract base64 data
+        if "," not in data_url:
+            raise ImageValidationError("Invalid data URL format")
+
+        image_data = data_url.split(",")[1]
+
+        # Decode base64
+        try:
+            with profiler.span("base64_decode"):
+                image_bytes = base64.b64decode(image_data)
+        except Exception as e:
+            raise ImageValidationError(f"Failed to decode base64 data: {str(e)}")
+
+        # Validate size
+        if len(image_bytes) > MAX_FILE_SIZE:
+            raise ImageValidationError("Image data exceeds maximum size limit")
+        return image_bytes
+
+    def process_base64_image(self, data_url: str) -> Image.Image:
+        """
+        Process a base64-encoded image from a data URL.
+
+        Args:
+            data_url: Base64 data URL string (e.g., "data:image/jpeg;base64,...")
+
+        Returns:
+            Processed PIL Image object
+
+        Raises:
+            ImageValidationError: If processing fails
+        """
+        try:
+            image = self.decode_image_bytes(self.decode_data_url(data_url))
             
             logger.debug(f"Successfully processed base64 image, size: {image.size}")
             return image
@@ -190,24 +399,28 @@ class ImageService:
     def save_image(self, image: Image.Image, prefix: str = "kaong", 
                    source: str = "upload") -> str:
         """
-        Save a PIL Image to the upload directory with a unique filename.
+        Save a PIL Image to image storage with a unique filename.
         
         Args:
             image: PIL Image object to save
             prefix: Filename prefix
-            source: Source identifier for filename
+            source: Source identifier for filename; also selects the archival encoding policy
             
         Returns:
-            The saved filename (relative to upload folder)
+            The saved filename (storage key, relative to the upload folder)
         """
         try:
+            policy = get_archive_policy(source)
+            
             # Generate unique filename
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            filename = f"{prefix}_{source}_{timestamp}.jpg"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            filename = self.new_upload_filename(f"{prefix}_{source}_{timestamp}.{policy.extension}")
             
-            # Save with high quality
-            image.save(filepath, "JPEG", quality=IMAGE_QUALITY, optimize=True)
+            with profiler.span("image_encode"):
+                data = encode_archival(image, policy)
+            with profiler.span("image_write"):
+                self.storage.save(filename, data, content_type_for(filename))
+            UPLOAD_BYTES.inc(len(data), kind="original")
             
             logger.info(f"Image saved successfully: {filename}")
             return filename
@@ -219,7 +432,7 @@ class ImageService:
     def save_raw_image_data(self, image_data: bytes, prefix: str = "kaong", 
                            source: str = "camera") -> str:
         """
-        Save raw image bytes to the upload directory.
+        Save raw image bytes to image storage as received, without re-encoding.
         
         Args:
             image_data: Raw image bytes
@@ -227,17 +440,18 @@ class ImageService:
             source: Source identifier for filename
             
         Returns:
-            The saved filename (relative to upload folder)
+            The saved filename (storage key, relative to the upload folder)
         """
         try:
-            # Generate unique filename
+            # Name the file after what the client actually sent (browsers may send WebP or PNG)
+            extension = detect_image_extension(image_data) or "jpg"
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            filename = f"{prefix}_{source}_{timestamp}.jpg"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            filename = self.new_upload_filename(f"{prefix}_{source}_{timestamp}.{extension}")
             
             # Save raw data
-            with open(filepath, "wb") as f:
-                f.write(image_data)
+            with profiler.span("raw_save"):
+                self.storage.save(filename, image_data, content_type_for(filename))
+            UPLOAD_BYTES.inc(len(image_data), kind="original")
             
             logger.info(f"Raw image data saved successfully: {filename}")
             return filename
@@ -246,33 +460,128 @@ class ImageService:
             logger.error(f"Failed to save raw image data: {str(e)}")
             raise RuntimeError(f"Raw image saving failed: {str(e)}")
     
-    def get_image_path(self, filename: str) -> str:
+    def new_upload_filename(self, name: str) -> str:
+        """
+        Place a new bare filename in the configured layout.
+
+        Args:
+            name: Bare filename containing a _YYYYmmdd_HHMMSS timestamp
+
+        Returns:
+            Filename relative to the upload folder, e.g. 2025/10/19/kaong_upload_....jpg
+        """
+        shard = upload_shard(name)
+        return f"{shard}/{name}" if shard else name
+
+    def resolve_filename(self, filename: str) -> str:
+        """
+        Find where a stored file currently lives.
+
+        Bare names from the flat layout are looked up in their shard once migrate_uploads.py
+        has moved them, so URLs saved before the migration keep working.
+
+        Args:
+            filename: Filename relative to the upload folder, in either layout
+
+        Returns:
+            Filename relative to the upload folder (unchanged if the file is not found elsewhere)
+        """
+        if "/" in filename or self.storage.exists(filename):
+            return filename
+        shard = upload_shard(filename)
+        if shard and self.storage.exists(f"{shard}/{filename}"):
+            return f"{shard}/{filename}"
+        return filename
+
+    def get_image_path(self, filename: str) -> Optional[str]:
         """
         Get the full file path for a given filename.
         
         Args:
-            filename: The filename
+            filename: Filename relative to the upload folder, flat or sharded
             
         Returns:
-            Full file path
+            Full file path, or None when images are not stored on the local filesystem
         """
-        return os.path.join(UPLOAD_FOLDER, filename)
+        return self.storage.local_path(self.resolve_filename(filename))
     
     def get_image_url(self, filename: str) -> str:
         """
         Get the web-accessible URL for a given filename.
         
         Args:
-            filename: The filename
+            filename: Filename relative to the upload folder, flat or sharded
             
         Returns:
-            Web-accessible URL path
+            Web-accessible URL (/static/uploads/..., or the CDN URL when STORAGE_PUBLIC_URL is set)
         """
-        return f"/static/uploads/{filename}"
-    
+        return self.storage.url(self.resolve_filename(filename))
+
+    def open_image_file(self, filename: str) -> BinaryIO:
+        """
+        Open a stored image for reading, from whichever backend holds it.
+
+        Raises:
+            FileNotFoundError: If the image does not exist
+        """
+        return self.storage.open(self.resolve_filename(filename))
+
+    def stat_image(self, filename: str) -> StoredObject:
+        """
+        Size and modification time of a stored image.
+
+        Raises:
+            FileNotFoundError: If the image does not exist
+        """
+        return self.storage.stat(self.resolve_filename(filename))
+
+    def image_exists(self, filename: str) -> bool:
+        """Whether a stored image exists, in either layout."""
+        return self.storage.exists(self.resolve_filename(filename))
+
+    def iter_upload_files(self) -> Iterator[StoredObject]:
+        """
+        List stored images in both layouts without loading the listing into memory.
+
+        Yields:
+            StoredObject per image; key is the filename relative to the upload folder
+        """
+        return self.storage.iter_objects()
+
+    def get_filename_from_url(self, image_url: str) -> Optional[str]:
+        """
+        Map a URL returned by get_image_url back to its filename.
+
+        Args:
+            image_url: Web-accessible URL
+
+        Returns:
+            Filename relative to the upload folder, or None if the URL is not an upload URL
+        """
+        filename = self.storage.key_from_url(image_url)
+        if not filename:
+            return None
+        # Never resolve outside the upload folder
+        if os.path.isabs(filename) or ".." in filename.replace("\\", "/").split("/"):
+            return None
+        return filename
+
+    def get_image_path_from_url(self, image_url: str) -> Optional[str]:
+        """
+        Map a URL returned by get_image_url back to its file path.
+
+        Args:
+            image_url: Web-accessible URL
+
+        Returns:
+            Full file path, or None if the URL is not an upload URL or images are not stored locally
+        """
+        filename = self.get_filename_from_url(image_url)
+        return None if filename is None else self.get_image_path(filename)
+
     def delete_image(self, filename: str) -> bool:
         """
-        Delete an image file from the upload directory.
+        Delete an image from image storage.
         
         Args:
             filename: The filename to delete
@@ -281,9 +590,7 @@ class ImageService:
             True if successful, False otherwise
         """
         try:
-            filepath = self.get_image_path(filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            if self.storage.delete(self.resolve_filename(filename)):
                 logger.info(f"Image deleted successfully: {filename}")
                 return True
             else:
@@ -293,42 +600,3 @@ class ImageService:
         except Exception as e:
             logger.error(f"Failed to delete image {filename}: {str(e)}")
             return False
-    
-    def cleanup_old_images(self, days_old: int = 30) -> int:
-        """
-        Clean up old image files from the upload directory.
-        
-        Args:
-            days_old: Delete files older than this many days
-            
-        Returns:
-            Number of files deleted
-        """
-        try:
-            if not os.path.exists(UPLOAD_FOLDER):
-                return 0
-            
-            import time
-            current_time = time.time()
-            cutoff_time = current_time - (days_old * 24 * 60 * 60)
-            
-            deleted_count = 0
-            for filename in os.listdir(UPLOAD_FOLDER):
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                
-                if os.path.isfile(filepath):
-                    file_time = os.path.getctime(filepath)
-                    
-                    if file_time < cutoff_time:
-                        try:
-                            os.remove(filepath)
-                            deleted_count += 1
-                        except Exception as e:
-                            logger.warning(f"Failed to delete old file {filename}: {str(e)}")
-            
-            logger.info(f"Cleanup completed: {deleted_count} old files deleted")
-            return deleted_count
-            
-        except Exception as e:
-            logger.error(f"Error during image cleanup: {str(e)}")
-            return 0
\ No newline at end of file
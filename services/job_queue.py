@@ -0,0 +1,554 @@
+"""
+Shared detection job queue for INFERENCE_MODE=queue.
+
+Web nodes validate uploads and camera frames, enqueue them as DetectionJobs and never
+load the model. inference_worker.py processes, on any machine that reaches the queue,
+take jobs in batches and publish each result to the web node named in the job's
+reply_to. That node's ResultRouter hands the result to the upload request waiting
+for it, or emits it to the Socket.IO session the frame came from. Capacity grows by
+starting more workers.
+
+RedisJobQueue is the backend for several machines. SQLiteJobQueue keeps the queue in
+one database file, a stand-in for web nodes and workers sharing a single machine.
+
+Jobs are taken in JOB_KINDS order: a waiting upload, which a person is watching, goes to
+the next batch ahead of any queued camera frame.
+
+Every job carries the deadline of its request. Workers drop jobs whose deadline has
+passed, answering them with an 'expired' result, and jobs of Socket.IO sessions that
+have disconnected, which the web node reports through cancel().
+
+Delivery is at most once: jobs a worker has taken are lost if it dies, and their
+upload requests time out at their deadline (DETECT_UPLOAD_TIMEOUT).
+"""
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from config import JOB_QUEUE_CONFIG
+from services.metrics import JOBS, JOB_ROUND_TRIP
+from services.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# In priority order
+JOB_KINDS = ('upload', 'camera')
+
+# Results fetched by a web node per call
+RESULT_BATCH = 64
+
+
+class JobQueueError(Exception):
+    """Raised when the job queue cannot be configured or reached."""
+    pass
+
+
+@dataclass
+class DetectionJob:
+    """One image to detect, and where its result goes."""
+    kind: str  # 'upload' (an HTTP request waits for it) or 'camera' (Socket.IO frame)
+    image: bytes  # Encoded image as received
+    reply_to: str  # Node id of the web node that owns the request
+    sid: Optional[str] = None  # Socket.IO session of a camera frame
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    enqueued_at: float = field(default_factory=time.time)
+    deadline: Optional[float] = None  # Epoch seconds after which nobody waits for the result
+
+    def to_bytes(self) -> bytes:
+        """A JSON header line followed by the raw image bytes, which are not base64-inflated."""
+        header = {'kind': self.kind, 'reply_to': self.reply_to, 'sid': self.sid,
+                  'id': self.id, 'enqueued_at': self.enqueued_at, 'deadline': self.deadline}
+        return json.dumps(header).encode() + b"\n" + self.image
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DetectionJob":
+        header, _, image = data.partition(b"\n")
+        return cls(image=image, **json.loads(header))
+
+
+@dataclass
+class JobResult:
+    """Outcome of a detection job: the JSON body and HTTP status the web node answers with."""
+    job_id: str
+    kind: str
+    body: Dict[str, Any]
+    status: int = 200
+    outcome: str = "ok"  # ok, invalid, error or expired
+    sid: Optional[str] = None
+    enqueued_at: float = 0.0  # Web node clock, for the round-trip metric
+
+    def to_bytes(self) -> bytes:
+        return json.dumps(asdict(self)).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "JobResult":
+        return cls(**json.loads(data))
+
+    @classmethod
+    def for_job(cls, job: DetectionJob, body: Dict[str, Any], status: int = 200, outcome: str = "ok") -> "JobResult":
+        return cls(job_id=job.id, kind=job.kind, body=body, status=status, outcome=outcome, sid=job.sid,
+                   enqueued_at=job.enqueued_at)
+
+
+class JobQueue:
+    """Interface shared by the queue backends."""
+
+    name = "base"
+
+    def put(self, job: DetectionJob) -> None:
+        """
+        Enqueue a job.
+
+        Raises:
+            JobQueueError: If the queue cannot be reached
+        """
+        raise NotImplementedError
+
+    def take(self, max_jobs: int, timeout: float) -> List[DetectionJob]:
+        """
+        Wait up to timeout seconds for a job, then return it with up to max_jobs - 1 more that are
+        already queued, uploads before camera frames and oldest first. Returns an empty list on timeout.
+        """
+        raise NotImplementedError
+
+    def put_result(self, node: str, result: JobResult) -> None:
+        """Publish a result for the web node that enqueued the job."""
+        raise NotImplementedError
+
+    def cancel(self, job_ids: Iterable[str]) -> None:
+        """Mark queued jobs as no longer wanted, e.g. frames of a disconnected camera."""
+        raise NotImplementedError
+
+    def cancelled(self, job_ids: Iterable[str]) -> Set[str]:
+        """Return which of job_ids have been cancelled."""
+        raise NotImplementedError
+
+    def take_results(self, node: str, timeout: float) -> List[JobResult]:
+        """Wait up to timeout seconds for results addressed to node."""
+        raise NotImplementedError
+
+    def depth(self) -> int:
+        """Jobs waiting for a worker."""
+        raise NotImplementedError
+
+    def ping(self) -> bool:
+        """Whether the queue is reachable."""
+        try:
+            self.depth()
+            return True
+        except JobQueueError:
+            return False
+
+
+class RedisJobQueue(JobQueue):
+    """Jobs in a Redis list, results in one list per web node (requires the redis package)."""
+
+    name = "redis"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the Redis backend.
+
+        Args:
+            config: Overrides for JOB_QUEUE_CONFIG
+
+        Raises:
+            JobQueueError: If the redis package is not installed
+        """
+        self._config = {**JOB_QUEUE_CONFIG, **(config or {})}
+        try:
+            import redis
+        except ImportError:
+            raise JobQueueError("JOB_QUEUE_BACKEND=redis requires the redis package (pip install redis)")
+        self._error = redis.RedisError
+        self._redis = redis.Redis.from_url(self._config['redis_url'], health_check_interval=30)
+        prefix = self._config['prefix']
+        # One list per job kind, in priority order
+        self._jobs_keys = {kind: f"{prefix}:jobs:{kind}" for kind in JOB_KINDS}
+        self._results_prefix = f"{prefix}:results:"
+        self._cancelled_prefix = f"{prefix}:cancelled:"
+
+    def _pop(self, keys: List[str], max_items: int, timeout: float) -> List[bytes]:
+        """Block for the first item, then drain up to max_items, earlier keys first."""
+        try:
+            # BLPOP checks the keys in order and treats 0 as "block forever"
+            first = self._redis.blpop(keys, timeout=max(timeout, 0.01))
+            if first is None:
+                return []
+            items = [first[1]]
+            for key in keys:
+                if len(items) >= max_items:
+                    break
+                items.extend(self._redis.lpop(key, max_items - len(items)) or [])
+            return items
+        except self._error as e:
+            raise JobQueueError(f"Redis job queue unavailable: {str(e)}")
+
+    def put(self, job: DetectionJob) -> None:
+        try:
+            self._redis.rpush(self._jobs_keys[job.kind], job.to_bytes())
+        except self._error as e:
+            raise JobQueueError(f"Redis job queue unavailable: {str(e)}")
+
+    def take(self, max_jobs: int, timeout: float) -> List[DetectionJob]:
+        items = self._pop(list(self._jobs_keys.values()), max_jobs, timeout)
+        return [DetectionJob.from_bytes(item) for item in items]
+
+    def put_result(self, node: str, result: JobResult) -> None:
+        key = self._results_prefix + node
+        try:
+            with self._redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, result.to_bytes())
+                pipe.expire(key, self._config['result_ttl'])
+                pipe.execute()
+        except self._error as e:
+            raise JobQueueError(f"Redis job queue unavailable: {str(e)}")
+
+    def take_results(self, node: str, timeout: float) -> List[JobResult]:
+        return [JobResult.from_bytes(item) for item in self._pop([self._results_prefix + node], RESULT_BATCH, timeout)]
+
+    def cancel(self, job_ids: Iterable[str]) -> None:
+        try:
+            with self._redis.pipeline(transaction=False) as pipe:
+                for job_id in job_ids:
+                    pipe.set(self._cancelled_prefix + job_id, 1, ex=self._config['result_ttl'])
+                pipe.execute()
+        except self._error as e:
+            raise JobQueueError(f"Redis job queue unavailable: {str(e)}")
+
+    def cancelled(self, job_ids: Iterable[str]) -> Set[str]:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        try:
+            flags = self._redis.mget([self._cancelled_prefix + job_id for job_id in job_ids])
+        except self._error as e:
+            raise JobQueueError(f"Redis job queue unavailable: {str(e)}")
+        return {job_id for job_id, flag in zip(job_ids, flags) if flag is not None}
+
+    def depth(self) -> int:
+        try:
+            with self._redis.pipeline(transaction=False) as pipe:
+                for key in self._jobs_keys.values():
+                    pipe.llen(key)
+                return sum(int(length) for length in pipe.execute())
+        except self._error as e:
+            raise JobQueueError(f"Redis job queue unavailable: {str(e)}")
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Jobs and results in one SQLite database file, polled every JOB_QUEUE_POLL_INTERVAL.
+
+    Every web node and worker on the machine opens the same file; WAL mode lets them read
+    while one of them writes. Takes are short IMMEDIATE transactions, so two workers never
+    take the same job.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Open (and create) the queue database.
+
+        Args:
+            config: Overrides for JOB_QUEUE_CONFIG
+
+        Raises:
+            JobQueueError: If the database cannot be opened
+        """
+        self._config = {**JOB_QUEUE_CONFIG, **(config or {})}
+        path = self._config['sqlite_path']
+        prefix = re.sub(r"\W", "_", self._config['prefix'])
+        self._jobs_table = f"{prefix}_jobs"
+        self._results_table = f"{prefix}_results"
+        self._cancelled_table = f"{prefix}_cancelled"
+        self._poll_interval = max(self._config['poll_interval'], 0.001)
+        self._last_purge = 0.0
+        # One connection per process; statements are short and never span a wait
+        self._lock = threading.Lock()
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self._jobs_table} "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, body BLOB NOT NULL, "
+                               "priority INTEGER NOT NULL DEFAULT 0)")
+            columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({self._jobs_table})")]
+            if "priority" not in columns:
+                # Queue files created before job priorities
+                self._conn.execute(f"ALTER TABLE {self._jobs_table} ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self._jobs_table}_priority "
+                               f"ON {self._jobs_table} (priority, id)")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self._results_table} "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, node TEXT NOT NULL, "
+                               "body BLOB NOT NULL, created REAL NOT NULL)")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self._results_table}_node "
+                               f"ON {self._results_table} (node, id)")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self._cancelled_table} "
+                               "(id TEXT PRIMARY KEY, created REAL NOT NULL)")
+        except sqlite3.Error as e:
+            raise JobQueueError(f"Cannot open SQLite job queue {path}: {str(e)}")
+
+    def _pop(self, table: str, max_items: int, where: str = "", params: tuple = (),
+             order: str = "id") -> List[bytes]:
+        """Remove and return up to max_items rows, first in the given order, in one transaction."""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = self._conn.execute(
+                        f"SELECT id, body FROM {table} {where} ORDER BY {order} LIMIT ?", (*params, max_items)
+                    ).fetchall()
+                    if rows:
+                        ids = [row[0] for row in rows]
+                        self._conn.execute(f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(ids))})", ids)
+                    self._conn.execute("COMMIT")
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                raise JobQueueError(f"SQLite job queue unavailable: {str(e)}")
+        return [row[1] for row in rows]
+
+    def _poll(self, pop: Callable[[], List[bytes]], timeout: float) -> List[bytes]:
+        deadline = time.monotonic() + timeout
+        while True:
+            items = pop()
+            remaining = deadline - time.monotonic()
+            if items or remaining <= 0:
+                return items
+            time.sleep(min(self._poll_interval, remaining))
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            try:
+                return self._conn.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                raise JobQueueError(f"SQLite job queue unavailable: {str(e)}")
+
+    def put(self, job: DetectionJob) -> None:
+        self._execute(f"INSERT INTO {self._jobs_table} (body, priority) VALUES (?, ?)",
+                      (job.to_bytes(), JOB_KINDS.index(job.kind)))
+
+    def take(self, max_jobs: int, timeout: float) -> List[DetectionJob]:
+        items = self._poll(lambda: self._pop(self._jobs_table, max_jobs, order="priority, id"), timeout)
+        return [DetectionJob.from_bytes(item) for item in items]
+
+    def put_result(self, node: str, result: JobResult) -> None:
+        now = time.time()
+        self._execute(f"INSERT INTO {self._results_table} (node, body, created) VALUES (?, ?, ?)",
+                      (node, result.to_bytes(), now))
+        # Results of web nodes that went away would otherwise accumulate
+        if now - self._last_purge > self._config['result_ttl']:
+            self._last_purge = now
+            self._execute(f"DELETE FROM {self._results_table} WHERE created < ?", (now - self._config['result_ttl'],))
+            self._execute(f"DELETE FROM {self._cancelled_table} WHERE created < ?", (now - self._config['result_ttl'],))
+
+    def take_results(self, node: str, timeout: float) -> List[JobResult]:
+        items = self._poll(lambda: self._pop(self._results_table, RESULT_BATCH, "WHERE node = ?", (node,)), timeout)
+        return [JobResult.from_bytes(item) for item in items]
+
+    def cancel(self, job_ids: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.executemany(f"INSERT OR IGNORE INTO {self._cancelled_table} (id, created) VALUES (?, ?)",
+                                       [(job_id, now) for job_id in job_ids])
+            except sqlite3.Error as e:
+                raise JobQueueError(f"SQLite job queue unavailable: {str(e)}")
+
+    def cancelled(self, job_ids: Iterable[str]) -> Set[str]:
+        job_ids = list(job_ids)
+        if not job_ids:
+            return set()
+        rows = self._execute(f"SELECT id FROM {self._cancelled_table} WHERE id IN ({','.join('?' * len(job_ids))})",
+                             tuple(job_ids))
+        return {row[0] for row in rows}
+
+    def depth(self) -> int:
+        return int(self._execute(f"SELECT COUNT(*) FROM {self._jobs_table}")[0][0])
+
+
+def create_job_queue(config: Optional[Dict[str, Any]] = None) -> JobQueue:
+    """
+    Build the backend selected by JOB_QUEUE_BACKEND.
+
+    Args:
+        config: Overrides for JOB_QUEUE_CONFIG
+
+    Raises:
+        JobQueueError: For an unknown backend or a missing dependency
+    """
+    config = {**JOB_QUEUE_CONFIG, **(config or {})}
+    if config['backend'] == 'redis':
+        return RedisJobQueue(config)
+    if config['backend'] == 'sqlite':
+        return SQLiteJobQueue(config)
+    raise JobQueueError(f"Unknown job queue backend '{config['backend']}' (use 'redis' or 'sqlite')")
+
+
+class ResultRouter:
+    """
+    Web node side of the queue: enqueues jobs under this node's id and routes their results back.
+
+    Upload requests block in detect() until their result arrives or their deadline passes.
+    Camera frame results are passed to on_camera_result, which emits them to the frame's
+    Socket.IO session; cancel_session() withdraws the frames of a session that disconnected.
+    """
+
+    def __init__(self, job_queue: JobQueue, on_camera_result: Callable[[JobResult], None],
+                 event_factory: Callable[[], Any] = threading.Event, node_id: Optional[str] = None):
+        """
+        Initialize the router.
+
+        Args:
+            job_queue: Shared queue
+            on_camera_result: Called with the result of each camera frame
+            event_factory: Creates the events upload requests wait on; must suit the server's
+                async mode (Flask-SocketIO: socketio.server.eio.create_event)
+            node_id: Address of this node's results (default: host, pid and a random suffix)
+        """
+        self.queue = job_queue
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._on_camera_result = on_camera_result
+        self._event_factory = event_factory
+        self._waiters: Dict[str, List[Any]] = {}  # job id -> [event, result]
+        self._session_jobs: Dict[str, Set[str]] = {}  # Socket.IO session -> its queued frame job ids
+        self._lock = threading.Lock()
+        self._running = False
+
+    def submit(self, kind: str, image: bytes, sid: Optional[str] = None,
+               deadline: Optional[Deadline] = None) -> DetectionJob:
+        """
+        Enqueue a job without waiting; its result goes to on_camera_result.
+
+        Raises:
+            JobQueueError: If the queue cannot be reached
+        """
+        job = DetectionJob(kind=kind, image=image, reply_to=self.node_id, sid=sid,
+                           deadline=deadline.at if deadline is not None else None)
+        if sid is not None:
+            with self._lock:
+                self._session_jobs.setdefault(sid, set()).add(job.id)
+        try:
+            self.queue.put(job)
+        except JobQueueError:
+            self._forget(sid, job.id)
+            JOBS.inc(kind=kind, outcome="unavailable")
+            raise
+        return job
+
+    def detect(self, kind: str, image: bytes, deadline: Deadline) -> Optional[JobResult]:
+        """
+        Enqueue a job and wait for its result until the deadline.
+
+        Returns:
+            The result, or None if none arrived before the deadline
+
+        Raises:
+            JobQueueError: If the queue cannot be reached
+        """
+        job = DetectionJob(kind=kind, image=image, reply_to=self.node_id, deadline=deadline.at)
+        waiter = [self._event_factory(), None]
+        with self._lock:
+            self._waiters[job.id] = waiter
+        try:
+            try:
+                self.queue.put(job)
+            except JobQueueError:
+                JOBS.inc(kind=kind, outcome="unavailable")
+                raise
+            remaining = deadline.remaining()
+            waiter[0].wait(None if remaining is None else max(remaining, 0.0))
+        finally:
+            with self._lock:
+                self._waiters.pop(job.id, None)
+        if waiter[1] is None:
+            JOBS.inc(kind=kind, outcome="timeout")
+        return waiter[1]
+
+    def run(self) -> None:
+        """Deliver results until stop(); start it as a background task of the server's async mode."""
+        self._running = True
+        logger.info(f"Routing detection results for node {self.node_id} ({self.queue.name} queue)")
+        while self._running:
+            try:
+                results = self.queue.take_results(self.node_id, timeout=1.0)
+            except JobQueueError as e:
+                logger.error(f"Result delivery paused: {str(e)}")
+                time.sleep(1.0)
+                continue
+            for result in results:
+                self._deliver(result)
+
+    def stop(self) -> None:
+        self._running = False
+
+    def cancel_session(self, sid: str) -> int:
+        """
+        Withdraw the queued frames of a disconnected Socket.IO session, so workers skip them.
+
+        Returns:
+            Number of jobs cancelled
+        """
+        with self._lock:
+            job_ids = self._session_jobs.pop(sid, set())
+        if job_ids:
+            try:
+                self.queue.cancel(job_ids)
+            except JobQueueError as e:
+                # Their deadlines still bound the wasted work
+                logger.warning(f"Could not cancel {len(job_ids)} jobs of session {sid}: {str(e)}")
+                return 0
+        return len(job_ids)
+
+    def _forget(self, sid: Optional[str], job_id: str) -> None:
+        """Stop tracking a frame job that has been answered or was never queued."""
+        if sid is None:
+            return
+        with self._lock:
+            job_ids = self._session_jobs.get(sid)
+            if job_ids is not None:
+                job_ids.discard(job_id)
+                if not job_ids:
+                    del self._session_jobs[sid]
+
+    def _deliver(self, result: JobResult) -> None:
+        with self._lock:
+            waiter = self._waiters.pop(result.job_id, None)
+        if waiter is None and result.sid is None:
+            # Already counted as a timeout
+            logger.debug(f"Dropping result of job {result.job_id}: its request has timed out")
+            return
+        self._forget(result.sid, result.job_id)
+
+        JOBS.inc(kind=result.kind, outcome=result.outcome)
+        JOB_ROUND_TRIP.observe(time.time() - result.enqueued_at, kind=result.kind)
+        if waiter is not None:
+            waiter[1] = result
+            waiter[0].set()
+            return
+        try:
+            self._on_camera_result(result)
+        except Exception as e:
+            logger.error(f"Failed to deliver result of job {result.job_id}: {str(e)}")
+
+    def readiness(self) -> Dict[str, Any]:
+        """Readiness of this web node: the queue must be reachable."""
+        try:
+            depth = self.queue.depth()
+        except JobQueueError as e:
+            return {'ready': False, 'mode': 'queue', 'backend': self.queue.name, 'error': str(e)}
+        return {'ready': True, 'mode': 'queue', 'backend': self.queue.name, 'queue_depth': depth}
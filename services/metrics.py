@@ -0,0 +1,354 @@
+"""
+Prometheus-style metrics for the detection service.
+Counters and histograms are sharded per thread so concurrent requests
+rarely contend on the same lock; values are merged only at scrape time.
+"""
+import itertools
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import psutil
+
+# Number of independent shards per metric; requests on different threads mostly hit different locks
+SHARD_COUNT = 16
+
+LabelValues = Tuple[str, ...]
+
+# Threads take shard indexes round-robin on first use. Thread idents are aligned
+# addresses, so ident % SHARD_COUNT would put every thread on the same shard.
+_shard_counter = itertools.count()
+_thread_shard = threading.local()
+
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """Render a Prometheus label set, e.g. {route="detect_frame",le="0.5"}."""
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _shard_index() -> int:
+    """Shard index of the calling thread."""
+    try:
+        return _thread_shard.index
+    except AttributeError:
+        # next() on itertools.count is atomic under the GIL
+        _thread_shard.index = next(_shard_counter) % SHARD_COUNT
+        return _thread_shard.index
+
+
+class _Shard:
+    """One lock-protected slice of a metric's samples."""
+
+    __slots__ = ('lock', 'values')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: Dict[LabelValues, object] = {}
+
+
+class _ShardedMetric:
+    """Base class holding the shards and label handling shared by counters and histograms."""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = [_Shard() for _ in range(SHARD_COUNT)]
+
+    def _shard(self) -> _Shard:
+        return self._shards[_shard_index()]
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_ShardedMetric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        shard = self._shard()
+        with shard.lock:
+            shard.values[key] = shard.values.get(key, 0) + amount
+
+    def collect(self) -> Dict[LabelValues, float]:
+        merged: Dict[LabelValues, float] = {}
+        for shard in self._shards:
+            with shard.lock:
+                items = list(shard.values.items())
+            for key, value in items:
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_ShardedMetric):
+    """Cumulative-bucket histogram."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        index = bisect_left(self.buckets, value)
+        shard = self._shard()
+        with shard.lock:
+            sample = shard.values.get(key)
+            if sample is None:
+                # [per-bucket counts..., +Inf count, sum]
+                sample = shard.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+    def collect(self) -> Dict[LabelValues, List[float]]:
+        merged: Dict[LabelValues, List[float]] = {}
+        for shard in self._shards:
+            with shard.lock:
+                items = [(key, list(sample)) for key, sample in shard.values.items()]
+            for key, sample in items:
+                target = merged.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+                for index, value in enumerate(sample):
+                    target[index] += value
+        return merged
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, sample in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), sample[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(sample[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge(_ShardedMetric):
+    """
+    Point-in-time value.
+
+    inc/dec add to the calling thread's shard like a counter, so in-flight gauges on the
+    hot path do not share a lock; the shards are summed at scrape time. set() replaces
+    the value across all shards (only used off the hot path). Alternatively the gauge
+    is computed at scrape time from a callback.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        for index, shard in enumerate(self._shards):
+            with shard.lock:
+                if index == 0:
+                    shard.values[key] = value
+                elif key in shard.values:
+                    shard.values[key] = 0
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        shard = self._shard()
+        with shard.lock:
+            shard.values[key] = shard.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_callback(self, callback: Callable[[], Dict[LabelValues, float]]) -> None:
+        """Compute the gauge at scrape time instead of tracking it."""
+        self._callback = callback
+
+    def collect(self) -> Dict[LabelValues, float]:
+        if self._callback is not None:
+            try:
+                return dict(self._callback())
+            except Exception:
+                return {}
+        merged: Dict[LabelValues, float] = {}
+        for shard in self._shards:
+            with shard.lock:
+                items = list(shard.values.items())
+            for key, value in items:
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds all metrics and renders the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              callback: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+
+# Request metrics
+HTTP_REQUESTS = metrics.counter(
+    "kaong_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+HTTP_LATENCY = metrics.histogram(
+    "kaong_http_request_duration_seconds", "HTTP request latency by route", ("route",))
+SOCKETIO_EVENTS = metrics.counter(
+    "kaong_socketio_events_total", "Socket.IO events handled by event and outcome", ("event", "outcome"))
+SOCKETIO_LATENCY = metrics.histogram(
+    "kaong_socketio_event_duration_seconds", "Socket.IO event handling latency", ("event",))
+OFFLOAD_WAIT = metrics.histogram(
+    "kaong_offload_wait_seconds", "Time blocking work waited for a native worker thread under gevent", ("task",))
+
+# Job queue metrics (INFERENCE_MODE=queue)
+JOBS = metrics.counter(
+    "kaong_jobs_total", "Detection jobs by kind and outcome (ok, invalid, error, expired, timeout, unavailable)",
+    ("kind", "outcome"))
+JOB_ROUND_TRIP = metrics.histogram(
+    "kaong_job_round_trip_seconds", "Time from enqueueing a detection job to receiving its result", ("kind",))
+JOB_QUEUE_WAIT = metrics.histogram(
+    "kaong_job_queue_wait_seconds", "Time detection jobs waited in the queue before a worker took them")
+JOB_QUEUE_DEPTH = metrics.gauge(
+    "kaong_job_queue_depth", "Detection jobs waiting in the shared queue for an inference worker")
+
+# Deadline metrics
+DETECTIONS_DROPPED = metrics.counter(
+    "kaong_detections_dropped_total",
+    "Detections dropped by kind, reason (expired, cancelled) and stage (before_inference, after_inference)",
+    ("kind", "reason", "stage"))
+
+# Admission control metrics
+ADMISSION_REFUSED = metrics.counter(
+    "kaong_admission_refused_total", "Detection requests refused by kind and reason (rate_limited, busy)",
+    ("kind", "reason"))
+ADMISSION_IN_FLIGHT = metrics.gauge(
+    "kaong_admission_in_flight", "Admitted detections in progress on this node")
+
+# Inference metrics
+INFERENCE_BATCH_SIZE = metrics.histogram(
+    "kaong_inference_batch_size", "Images per model predict call", (), buckets=(1, 2, 4, 8, 16, 32, 64))
+INFERENCE_IN_FLIGHT = metrics.gauge(
+    "kaong_inference_queue_depth", "Inferences currently waiting for or running on the model")
+INFERENCE_LATENCY = metrics.histogram(
+    "kaong_inference_duration_seconds", "Model predict latency by model version", ("model_version",))
+MODEL_LOAD_SECONDS = metrics.gauge(
+    "kaong_model_load_seconds", "Load plus warm-up time of each registered model version", ("model_version",))
+DETECTIONS = metrics.counter(
+    "kaong_detections_total", "Detections above the confidence threshold by label", ("label",))
+
+# Database metrics
+DB_POOL_SIZE = metrics.gauge("kaong_db_pool_size", "Configured size of kaong_detection_pool")
+DB_POOL_IN_USE = metrics.gauge("kaong_db_pool_in_use", "Connections currently checked out of kaong_detection_pool")
+DB_POOL_WAIT = metrics.histogram(
+    "kaong_db_pool_wait_seconds", "Time spent acquiring a connection from kaong_detection_pool")
+
+# Storage metrics
+UPLOAD_BYTES = metrics.counter(
+    "kaong_upload_bytes_written_total", "Image bytes written to image storage by kind", ("kind",))
+ARCHIVE_ENCODE_CPU = metrics.histogram(
+    "kaong_archive_encode_cpu_seconds", "CPU time spent encoding stored images by source policy and format",
+    ("source", "format"))
+DERIVATIVES_GENERATED = metrics.counter(
+    "kaong_derivatives_generated_total", "Thumbnail/preview images generated by variant and trigger",
+    ("variant", "trigger"))
+DERIVATIVE_BYTES = metrics.counter(
+    "kaong_derivative_bytes_written_total", "Thumbnail/preview bytes written to the derivative cache", ("variant",))
+DERIVATIVE_REQUESTS = metrics.counter(
+    "kaong_derivative_requests_total", "Derivative requests by variant and outcome", ("variant", "outcome"))
+STORAGE_OPERATIONS = metrics.counter(
+    "kaong_storage_operations_total", "Image storage backend calls by backend, operation and outcome",
+    ("backend", "operation", "outcome"))
+STORAGE_LATENCY = metrics.histogram(
+    "kaong_storage_latency_seconds", "Image storage backend call latency by backend and operation",
+    ("backend", "operation"))
+
+# Retention metrics
+RETENTION_DELETED = metrics.counter(
+    "kaong_retention_deleted_total",
+    "Items removed by the retention job by kind (assessment, image, derivative, orphan_file, orphan_row)", ("kind",))
+RETENTION_EXPIRED_REMAINING = metrics.gauge(
+    "kaong_retention_expired_remaining", "Expired assessments still to be deleted by the running job")
+RETENTION_ORPHANS = metrics.gauge(
+    "kaong_retention_orphans", "Orphans found by the last reconciliation (file: no row, row: no file)", ("kind",))
+RETENTION_LAST_RUN = metrics.gauge(
+    "kaong_retention_last_run_timestamp_seconds", "Unix time the last retention run finished")
+RETENTION_RUN_SECONDS = metrics.histogram(
+    "kaong_retention_run_duration_seconds", "Duration of retention runs", (),
+    buckets=(1, 5, 15, 60, 300, 900, 3600))
+
+# Process metrics (computed at scrape time)
+_process = psutil.Process()
+metrics.gauge(
+    "kaong_process_resident_memory_bytes", "Resident set size of the server process",
+    callback=lambda: {(): _process.memory_info().rss})
+metrics.gauge(
+    "kaong_process_cpu_percent", "CPU utilisation of the server process since the last scrape",
+    callback=lambda: {(): _process.cpu_percent(interval=None)})
+metrics.gauge(
+    "kaong_process_threads", "Threads in the server process",
+    callback=lambda: {(): _process.num_threads()})
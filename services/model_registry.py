@@ -0,0 +1,312 @@
+"""
+Model registry for serving multiple YOLO model versions.
+Supports atomic hot swap, weighted A/B traffic splitting and a polling file watcher.
+"""
+import os
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+from dataclasses import dataclass, field
+
+from services.offload import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistryError(Exception):
+    """Custom exception for model registry errors."""
+    pass
+
+
+@dataclass
+class ModelVersion:
+    """Data class representing a loaded, warmed-up model version."""
+    version: str
+    path: str
+    model: Any
+    loaded_at: datetime = field(default_factory=datetime.now)
+    load_seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert model version metadata to dictionary format (model object excluded)."""
+        return {
+            'version': self.version,
+            'path': self.path,
+            'loaded_at': self.loaded_at.isoformat(),
+            'load_seconds': round(self.load_seconds, 3)
+        }
+
+
+def version_for_path(path: str) -> str:
+    """
+    Derive a version identifier from a model file.
+
+    The identifier combines the file stem and its modification time so that
+    retraining into the same filename still yields a distinct version.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    try:
+        mtime = datetime.fromtimestamp(os.path.getmtime(path))
+        return f"{stem}-{mtime.strftime('%Y%m%d%H%M%S')}"
+    except OSError:
+        # e.g. hub model names such as "yolo11n.pt" that ultralytics downloads on demand
+        return stem
+
+
+class ModelRegistry:
+    """
+    Holds several loaded model versions and routes inference traffic between them.
+
+    Routing state is kept as an immutable tuple of (version, cumulative_weight) pairs
+    that is replaced wholesale on every change, so readers never need the lock and
+    always see a consistent split.
+    """
+
+    def __init__(self, loader: Callable[[str], Any],
+                 on_unload: Optional[Callable[[ModelVersion], None]] = None):
+        """
+        Initialize the registry.
+
+        Args:
+            loader: Callable that loads *and warms up* a model from a path
+            on_unload: Called with each version removed by unload or prune_revisions, to drop
+                per-version state kept outside the registry
+        """
+        self._loader = loader
+        self._on_unload = on_unload
+        self._lock = threading.Lock()
+        self._versions: Dict[str, ModelVersion] = {}
+        self._routes: Tuple[Tuple[ModelVersion, float], ...] = ()
+        self._weights: Dict[str, float] = {}
+
+    def load(self, path: str, version: Optional[str] = None, activate: bool = False) -> ModelVersion:
+        """
+        Load and warm up a model, then register it.
+
+        Loading happens outside the registry lock so live traffic keeps being
+        served by the current versions until the new one is ready.
+
+        Args:
+            path: Path to the model weights
+            version: Optional explicit version name (derived from the file otherwise)
+            activate: Route 100% of traffic to the new version once loaded
+
+        Returns:
+            The registered ModelVersion
+        """
+        version = version or version_for_path(path)
+
+        start = datetime.now()
+        try:
+            # Loading and warm-up are CPU-bound; under gevent they must not hold the event loop
+            model = run_blocking(self._loader, path)
+        except Exception as e:
+            logger.error(f"Failed to load model version {version} from {path}: {str(e)}")
+            raise ModelRegistryError(f"Model loading failed for {version}: {str(e)}")
+        load_seconds = (datetime.now() - start).total_seconds()
+
+        model_version = ModelVersion(version=version, path=path, model=model, load_seconds=load_seconds)
+        with self._lock:
+            self._versions[version] = model_version
+            if version in self._weights:
+                # Reloaded in place: rebuild routes so they point at the new model object
+                self._rebuild_routes()
+        logger.info(f"Registered model version {version} from {path} in {load_seconds:.2f}s")
+
+        if activate:
+            self.activate(version)
+        return model_version
+
+    def activate(self, version: str) -> None:
+        """Atomically route all traffic to a single version."""
+        self.set_traffic_split({version: 100.0})
+
+    def set_traffic_split(self, weights: Dict[str, float]) -> None:
+        """
+        Atomically replace the traffic split.
+
+        Args:
+            weights: Mapping of version -> relative weight (e.g. {"v1": 90, "v2": 10})
+
+        Raises:
+            ModelRegistryError: If a version is unknown or the weights are invalid
+        """
+        weights = {version: float(weight) for version, weight in weights.items() if float(weight) > 0}
+        if not weights:
+            raise ModelRegistryError("Traffic split must contain at least one positive weight")
+
+        with self._lock:
+            unknown = [version for version in weights if version not in self._versions]
+            if unknown:
+                raise ModelRegistryError(f"Unknown model version(s): {', '.join(unknown)}")
+            self._weights = weights
+            self._rebuild_routes()
+
+        logger.info(f"Model traffic split updated: {weights}")
+
+    def unload(self, version: str) -> None:
+        """
+        Remove a version from the registry.
+
+        Raises:
+            ModelRegistryError: If the version is still receiving traffic
+        """
+        with self._lock:
+            if version in self._weights:
+                raise ModelRegistryError(f"Model version {version} is still serving traffic")
+            model_version = self._versions.pop(version, None)
+            if model_version is None:
+                raise ModelRegistryError(f"Unknown model version: {version}")
+        logger.info(f"Unloaded model version {version}")
+        if self._on_unload is not None:
+            self._on_unload(model_version)
+
+    def prune_revisions(self, path: str, keep: str) -> List[str]:
+        """
+        Unload superseded revisions of a model file that no longer receive traffic.
+
+        Every rewrite of a watched file registers a new version; without pruning, the
+        old models would stay in memory for the life of the process.
+
+        Args:
+            path: Model file whose revisions should be pruned
+            keep: Version to retain (normally the newest revision)
+
+        Returns:
+            List of unloaded versions
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            stale = [
+                version for version, model_version in self._versions.items()
+                if version != keep and version not in self._weights
+                and os.path.abspath(model_version.path) == path
+            ]
+            removed = [self._versions.pop(version) for version in stale]
+        for model_version in removed:
+            logger.info(f"Unloaded superseded model version {model_version.version} of {path}")
+            if self._on_unload is not None:
+                self._on_unload(model_version)
+        return stale
+
+    def _rebuild_routes(self) -> None:
+        """Recompute the cumulative routing table. Caller must hold the lock."""
+        total = sum(self._weights.values())
+        cumulative = 0.0
+        routes = []
+        for version, weight in sorted(self._weights.items()):
+            cumulative += weight / total
+            routes.append((self._versions[version], cumulative))
+        self._routes = tuple(routes)
+
+    def select(self) -> ModelVersion:
+        """
+        Pick the model version that should serve the next request.
+
+        Raises:
+            ModelRegistryError: If no version is active
+        """
+        routes = self._routes  # single reference read; swapped atomically by writers
+        if not routes:
+            raise ModelRegistryError("No active model version")
+        if len(routes) == 1:
+            return routes[0][0]
+
+        point = random.random()
+        for model_version, cumulative in routes:
+            if point < cumulative:
+                return model_version
+        return routes[-1][0]
+
+    def get(self, version: str) -> Optional[ModelVersion]:
+        """Get a registered version by name."""
+        return self._versions.get(version)
+
+    def has_path(self, path: str) -> bool:
+        """Check whether the current revision of a model file is already registered."""
+        return version_for_path(path) in self._versions
+
+    @property
+    def primary(self) -> ModelVersion:
+        """The version with the largest traffic share."""
+        routes = self._routes
+        if not routes:
+            raise ModelRegistryError("No active model version")
+        weights = self._weights
+        return max((mv for mv, _ in routes), key=lambda mv: weights.get(mv.version, 0.0))
+
+    def describe(self) -> Dict[str, Any]:
+        """Describe registered versions and the current traffic split."""
+        with self._lock:
+            total = sum(self._weights.values()) or 1.0
+            return {
+                'versions': [mv.to_dict() for mv in self._versions.values()],
+                'traffic_split': {
+                    version: round(100.0 * weight / total, 2)
+                    for version, weight in self._weights.items()
+                }
+            }
+
+
+class ModelFileWatcher:
+    """Polls a directory for new or updated model files and loads them into the registry."""
+
+    def __init__(self, registry: ModelRegistry, watch_dir: str,
+                 interval: float = 10.0, auto_activate: bool = False):
+        self._registry = registry
+        self._watch_dir = watch_dir
+        self._interval = interval
+        self._auto_activate = auto_activate
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the watcher thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="model-file-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Model file watcher started on {self._watch_dir} (every {self._interval}s)")
+
+    def stop(self) -> None:
+        """Stop the watcher thread."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self._interval)
+
+    def _candidate_files(self) -> List[str]:
+        """List model files in the watch directory."""
+        if not os.path.isdir(self._watch_dir):
+            return []
+        with os.scandir(self._watch_dir) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith('.pt'))
+
+    def poll_once(self) -> List[str]:
+        """
+        Load any model files not yet in the registry and unload superseded revisions.
+
+        Returns:
+            List of newly registered versions
+        """
+        loaded = []
+        for path in self._candidate_files():
+            if not self._registry.has_path(path):
+                try:
+                    model_version = self._registry.load(path, activate=self._auto_activate)
+                    loaded.append(model_version.version)
+                except ModelRegistryError as e:
+                    # Typically a file still being written; it will be retried on the next poll
+                    logger.warning(f"Model watcher could not load {path}: {str(e)}")
+                    continue
+            # Older revisions are dropped once no traffic split refers to them any more
+            self._registry.prune_revisions(path, keep=version_for_path(path))
+        return loaded
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f"Model watcher poll failed: {str(e)}")
@@ -0,0 +1,127 @@
+"""
+Keeps CPU-bound work off the event loop of the production server.
+
+Under SERVER_ASYNC_MODE=gevent (serve.py), requests and Socket.IO events are
+greenlets sharing the main thread. Model inference, image decoding and encoding
+never yield, so one slow frame would stall every other socket. run_blocking() sends
+such work to a pool of native threads and lets the event loop run while it waits;
+torch and Pillow release the GIL, so inference and socket I/O overlap.
+
+serve.py leaves threading unpatched, so the services' own worker threads are native
+threads already and call through inline, as does everything under the development
+server and the CLI tools.
+
+run_before_deadline() is run_blocking() for inference: it skips work whose request has
+expired or whose client has gone away, and stops waiting at the request's deadline.
+"""
+import sys
+import time
+import logging
+import threading
+import contextvars
+from typing import Any, Callable, TypeVar
+
+from config import SERVER_CONFIG
+from services.metrics import OFFLOAD_WAIT
+from services.deadline import AFTER_INFERENCE, BEFORE_INFERENCE, Deadline
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_patched() -> bool:
+    """Whether gevent has patched the socket module, i.e. I/O runs on its event loop."""
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def on_event_loop() -> bool:
+    """Whether the caller is a greenlet on the event loop, where blocking stalls every client."""
+    return is_patched() and threading.current_thread() is threading.main_thread()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from gevent.threadpool import ThreadPool
+            _pool = ThreadPool(max(1, SERVER_CONFIG['blocking_workers']))
+            logger.info(f"Blocking work runs on {_pool.maxsize} native threads")
+        return _pool
+
+
+def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Call fn on a native worker thread when called from the event loop, inline otherwise.
+
+    The caller's context (profiling trace) is carried over, and exceptions propagate.
+    """
+    if not on_event_loop():
+        return fn(*args, **kwargs)
+
+    context = contextvars.copy_context()
+    task = getattr(fn, "__name__", "call")
+    submitted = time.perf_counter()
+
+    def call() -> T:
+        OFFLOAD_WAIT.observe(time.perf_counter() - submitted, task=task)
+        return context.run(fn, *args, **kwargs)
+
+    return _get_pool().apply(call)
+
+
+def run_before_deadline(deadline: Deadline, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    run_blocking() for inference that is pointless once its deadline has passed.
+
+    The call is skipped if the deadline has passed or the client has gone away by the time a
+    worker thread picks it up. On the event loop the caller stops waiting at the deadline, so
+    a timed-out request is answered at once; a call already running finishes on its thread
+    and its result is dropped.
+
+    Raises:
+        DeadlineExceeded: If the call was skipped or the deadline passed while waiting for it
+    """
+    deadline.check(BEFORE_INFERENCE)
+    if not on_event_loop():
+        return fn(*args, **kwargs)
+
+    from gevent import Timeout
+
+    context = contextvars.copy_context()
+    task = getattr(fn, "__name__", "call")
+    submitted = time.perf_counter()
+    state = {'started': False, 'abandoned': False}
+    state_lock = threading.Lock()
+
+    def call() -> T:
+        OFFLOAD_WAIT.observe(time.perf_counter() - submitted, task=task)
+        with state_lock:
+            if state['abandoned']:
+                # The caller has answered already and counted the drop
+                return None
+            deadline.check(BEFORE_INFERENCE)
+            state['started'] = True
+        return context.run(fn, *args, **kwargs)
+
+    remaining = deadline.remaining()
+    # Covers the wait for a free thread in spawn() as well as the call itself
+    timer = Timeout.start_new(max(remaining, 0.0)) if remaining is not None else None
+    try:
+        return _get_pool().spawn(call).get()
+    except Timeout as timeout:
+        if timeout is not timer:
+            raise
+        with state_lock:
+            state['abandoned'] = True
+            started = state['started']
+        raise deadline.exceeded("expired", AFTER_INFERENCE if started else BEFORE_INFERENCE)
+    finally:
+        if timer is not None:
+            timer.close()
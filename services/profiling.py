@@ -0,0 +1,215 @@
+"""
+Lightweight span-based profiling for the detection pipeline.
+Records per-stage timings for each request, aggregates them into histograms
+and samples slow requests into a bounded log.
+"""
+import time
+import random
+import logging
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from config import PROFILING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds
+DEFAULT_BUCKETS_MS: Tuple[float, ...] = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class RequestTrace:
+    """Collects the stage timings of a single request."""
+
+    __slots__ = ('name', 'started_at', '_start', 'spans', 'open_stages')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[Tuple[str, float, Optional[str]]] = []  # (stage, ms, enclosing stage)
+        self.open_stages: List[str] = []
+
+    def add(self, stage: str, duration_ms: float, parent: Optional[str] = None) -> None:
+        """Record a completed stage, optionally as a sub-stage of an enclosing one."""
+        self.spans.append((stage, duration_ms, parent))
+
+    @property
+    def elapsed_ms(self) -> float:
+        """Wall time since the trace started."""
+        return (time.perf_counter() - self._start) * 1000
+
+    def stage_totals(self) -> Dict[str, float]:
+        """Sum durations per stage (a stage may run several times per request)."""
+        totals: Dict[str, float] = {}
+        for stage, duration_ms, _ in self.spans:
+            totals[stage] = totals.get(stage, 0.0) + duration_ms
+        return totals
+
+    def server_timing_header(self) -> str:
+        """
+        Format the stage breakdown as a Server-Timing header value.
+
+        Only leaf stages are listed, so the entries add up to the time spent in stages. A stage
+        with sub-stages (e.g. predict) is replaced by its sub-stages plus "<stage>_other" for
+        the time not covered by them.
+        """
+        nested: Dict[str, float] = {}
+        for _, duration_ms, parent in self.spans:
+            if parent is not None:
+                nested[parent] = nested.get(parent, 0.0) + duration_ms
+        parts = []
+        for stage, duration_ms in self.stage_totals().items():
+            if stage in nested:
+                stage, duration_ms = f"{stage}_other", duration_ms - nested[stage]
+                if duration_ms <= 0:
+                    continue
+            parts.append(f"{stage};dur={duration_ms:.1f}")
+        parts.append(f"total;dur={self.elapsed_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the trace to dictionary format."""
+        return {
+            'name': self.name,
+            'started_at': self.started_at,
+            'total_ms': round(self.elapsed_ms, 2),
+            'stages': {stage: round(ms, 2) for stage, ms in self.stage_totals().items()}
+        }
+
+
+class StageHistogram:
+    """Fixed-bucket latency histogram for one stage."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, duration_ms: float) -> None:
+        index = bisect_left(self.buckets, duration_ms)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ms += duration_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self.counts)
+            count, total_ms = self.count, self.total_ms
+        labels = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'count': count,
+            'avg_ms': round(total_ms / count, 2) if count else 0.0,
+            'buckets': dict(zip(labels, counts))
+        }
+
+
+class Profiler:
+    """Aggregates request traces into per-stage histograms and a slow-request log."""
+
+    def __init__(self, enabled: bool, slow_threshold_ms: float, slow_sample_rate: float, slow_log_size: int):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_sample_rate = slow_sample_rate
+        self._histograms: Dict[str, StageHistogram] = {}
+        self._histograms_lock = threading.Lock()
+        self._slow_log: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self._current: ContextVar[Optional[RequestTrace]] = ContextVar('current_trace', default=None)
+
+    def start_trace(self, name: str) -> Optional[Token]:
+        """Begin a trace for the current request/context. Returns a token for finish_trace."""
+        if not self.enabled:
+            return None
+        return self._current.set(RequestTrace(name))
+
+    def current_trace(self) -> Optional[RequestTrace]:
+        """The trace of the current request, if profiling is active."""
+        return self._current.get()
+
+    def finish_trace(self, token: Optional[Token]) -> Optional[RequestTrace]:
+        """
+        Complete the current trace, fold it into the histograms and maybe the slow log.
+
+        Returns:
+            The finished trace, or None when profiling is disabled
+        """
+        if token is None:
+            return None
+        trace = self._current.get()
+        self._current.reset(token)
+        if trace is None:
+            return None
+
+        for stage, duration_ms in trace.stage_totals().items():
+            self._histogram(f"{trace.name}.{stage}").observe(duration_ms)
+        total_ms = trace.elapsed_ms
+        self._histogram(f"{trace.name}.total").observe(total_ms)
+
+        if total_ms >= self.slow_threshold_ms and random.random() < self.slow_sample_rate:
+            entry = trace.to_dict()
+            self._slow_log.append(entry)
+            logger.warning(f"Slow request {trace.name}: {entry['total_ms']}ms {entry['stages']}")
+        return trace
+
+    def _histogram(self, key: str) -> StageHistogram:
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = self._histograms.setdefault(key, StageHistogram())
+        return histogram
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Time a stage of the current request; a no-op when no trace is active."""
+        trace = self._current.get()
+        if trace is None:
+            yield
+            return
+        trace.open_stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace.open_stages.pop()
+            parent = trace.open_stages[-1] if trace.open_stages else None
+            trace.add(stage, (time.perf_counter() - start) * 1000, parent)
+
+    def record(self, stage: str, duration_ms: float, parent: Optional[str] = None) -> None:
+        """
+        Record an externally measured stage (e.g. timings reported by ultralytics).
+
+        Args:
+            stage: Stage name
+            duration_ms: Measured duration
+            parent: Stage this one is part of; defaults to the span currently open
+        """
+        trace = self._current.get()
+        if trace is not None:
+            if parent is None and trace.open_stages:
+                parent = trace.open_stages[-1]
+            trace.add(stage, duration_ms, parent)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Histograms and slow-request samples for the debug endpoint."""
+        with self._histograms_lock:
+            histograms = dict(self._histograms)
+        return {
+            'enabled': self.enabled,
+            'histograms': {key: histogram.to_dict() for key, histogram in sorted(histograms.items())},
+            'slow_requests': list(self._slow_log)
+        }
+
+
+# Process-wide profiler shared by all services
+profiler = Profiler(
+    enabled=PROFILING_CONFIG['enabled'],
+    slow_threshold_ms=PROFILING_CONFIG['slow_threshold_ms'],
+    slow_sample_rate=PROFILING_CONFIG['slow_sample_rate'],
+    slow_log_size=PROFILING_CONFIG['slow_log_size']
+)
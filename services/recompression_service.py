@@ -0,0 +1,180 @@
+"""
+Re-encodes the existing upload backlog under the current archival encoding policy.
+
+Images saved before the policy existed are JPEG quality 100. Each file is decoded,
+re-encoded with the policy of the source it was saved for, and replaced only when
+the result is meaningfully smaller. When the policy changes the format (e.g. to
+WebP), the file gets a new extension and the assessments referencing it are updated
+before the old file is removed.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, Optional, Set
+
+from PIL import Image
+
+from config import ARCHIVE_ENCODING_CONFIG
+from services.database_service import DatabaseService
+from services.image_service import ImageService, ArchivePolicy, get_archive_policy, encode_archival
+from services.storage_backend import StoredObject, content_type_for
+
+logger = logging.getLogger(__name__)
+
+RECOMPRESSIBLE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'bmp', 'avif'}
+
+# <name>_<category>_<YYYYmmdd>_<HHMMSS>.<ext>, written by BoundingBoxService
+CATEGORY_FILENAME = re.compile(r"_(ripe|unripe|rotten)_\d{8}_\d{6}\.\w+$")
+# <prefix>_<source>_<YYYYmmdd>_<HHMMSS>_<microseconds>.<ext>, written by ImageService
+SOURCE_FILENAME = re.compile(r"^[^_]+_(?P<source>.+?)_\d{8}_\d{6}_\d+\.\w+$")
+
+
+def policy_source_for(filename: str) -> str:
+    """Source policy a stored file was saved under, derived from its name."""
+    filename = filename.rsplit("/", 1)[-1]
+    if CATEGORY_FILENAME.search(filename):
+        return "category"
+    match = SOURCE_FILENAME.match(filename)
+    return match.group("source") if match else "upload"
+
+
+class UploadRecompressor:
+    """Walks image storage and re-encodes files that the policy would store smaller."""
+
+    def __init__(self, database_service: DatabaseService, image_service: ImageService,
+                 min_savings: Optional[float] = None, min_age: float = 3600, workers: int = 2,
+                 max_per_second: float = 0, dry_run: bool = False):
+        """
+        Initialize the recompressor.
+
+        Args:
+            database_service: Used to repoint assessments when a file is renamed
+            image_service: Resolves upload paths and URLs
+            min_savings: Required fractional size reduction (default ARCHIVE_RECOMPRESS_MIN_SAVINGS)
+            min_age: Skip files modified less than this many seconds ago, which may not be in the
+                database yet
+            workers: Encoder threads
+            max_per_second: Files started per second (0 = unthrottled), to leave CPU for the web app
+            dry_run: Measure savings without writing anything
+        """
+        self._database_service = database_service
+        self._image_service = image_service
+        self._min_savings = ARCHIVE_ENCODING_CONFIG['recompress_min_savings'] if min_savings is None else min_savings
+        self._min_age = min_age
+        self._workers = max(1, workers)
+        self._max_per_second = max_per_second
+        self._dry_run = dry_run
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {}
+
+    def _count(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + amount
+
+    def _iter_candidates(self) -> Iterator[StoredObject]:
+        cutoff = time.time() - self._min_age
+        for stored in self._image_service.iter_upload_files():
+            if stored.key.rsplit(".", 1)[-1].lower() not in RECOMPRESSIBLE_EXTENSIONS:
+                continue
+            if stored.mtime > cutoff:
+                self._count("skipped_recent")
+                continue
+            yield stored
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Recompress every stored upload.
+
+        Returns:
+            Statistics: files scanned/recompressed/renamed/skipped, bytes before and after for the
+            recompressed files, and decode/encode CPU seconds
+        """
+        self._stats = {'scanned': 0, 'recompressed': 0, 'renamed': 0, 'errors': 0,
+                       'bytes_before': 0, 'bytes_after': 0, 'decode_cpu_seconds': 0.0, 'encode_cpu_seconds': 0.0}
+        interval = 1.0 / self._max_per_second if self._max_per_second > 0 else 0.0
+        start = time.perf_counter()
+        pending: Set[Future] = set()
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="recompress") as executor:
+            for index, stored in enumerate(self._iter_candidates()):
+                if interval:
+                    delay = start + index * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                # Bounded queue, so a large backlog is not listed into memory
+                if len(pending) >= self._workers * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(executor.submit(self._recompress_safely, stored.key, stored.size))
+            wait(pending)
+
+        stats = dict(self._stats)
+        stats['bytes_saved'] = stats['bytes_before'] - stats['bytes_after']
+        stats['elapsed_seconds'] = round(time.perf_counter() - start, 2)
+        stats['decode_cpu_seconds'] = round(stats['decode_cpu_seconds'], 3)
+        stats['encode_cpu_seconds'] = round(stats['encode_cpu_seconds'], 3)
+        stats['dry_run'] = self._dry_run
+        logger.info(f"Recompression finished: {stats}")
+        return stats
+
+    def _recompress_safely(self, filename: str, size: int) -> None:
+        self._count("scanned")
+        try:
+            self._recompress(filename, size)
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"Failed to recompress {filename}: {str(e)}")
+
+    def _recompress(self, filename: str, size: int) -> None:
+        policy = get_archive_policy(policy_source_for(filename))
+        if policy.format == "original":
+            self._count("skipped_original")
+            return
+
+        cpu_start = time.thread_time()
+        with self._image_service.open_image_file(filename) as f, Image.open(f) as image:
+            image = image.convert("RGB")
+        self._count("decode_cpu_seconds", time.thread_time() - cpu_start)
+
+        cpu_start = time.thread_time()
+        data = encode_archival(image, policy)
+        self._count("encode_cpu_seconds", time.thread_time() - cpu_start)
+
+        if len(data) > size * (1 - self._min_savings):
+            self._count("skipped_not_smaller")
+            return
+        if not self._dry_run:
+            if not self._replace(filename, data, policy):
+                return
+        self._count("recompressed")
+        self._count("bytes_before", size)
+        self._count("bytes_after", len(data))
+
+    def _replace(self, filename: str, data: bytes, policy: ArchivePolicy) -> bool:
+        """Swap in the re-encoded bytes, renaming the file (and its references) if the format changed."""
+        storage = self._image_service.storage
+        stored = storage.stat(filename)
+        name, extension = os.path.splitext(filename)
+        new_filename = f"{name}.{policy.extension}"
+        renamed = extension.lower().lstrip(".") != policy.extension
+        if renamed and storage.exists(new_filename):
+            self._count("skipped_name_taken")
+            return False
+
+        # Keep the original timestamp: retention and sorting rely on it
+        storage.save(new_filename, data, content_type_for(new_filename), mtime=stored.mtime)
+        if not renamed:
+            return True
+
+        updated = self._database_service.replace_image_url(
+            self._image_service.get_image_url(filename), self._image_service.get_image_url(new_filename))
+        if updated is None:
+            # Leave the database pointing at the original
+            storage.delete(new_filename)
+            self._count("errors")
+            return False
+        storage.delete(filename)
+        self._count("renamed")
+        return True
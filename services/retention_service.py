@@ -0,0 +1,287 @@
+"""
+Retention and orphan reconciliation for stored assessments and their images.
+
+Expired assessments are found oldest first through the timestamp index and deleted
+in batches: rows first, so the dashboard never shows a missing image, then the
+original, per-category and derivative files. Reconciliation compares one listing of
+image storage with a keyset scan of the image URL columns, which finds
+files no row references and rows whose image is gone. Deletions are throttled to
+RETENTION_MAX_DELETES_PER_SECOND so the job can run inside the web app.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from config import RETENTION_CONFIG
+from services.database_service import DatabaseService, IMAGE_URL_COLUMNS
+from services.image_service import ImageService
+from services.derivative_service import DerivativeService
+from services.storage_backend import StorageError
+from services.metrics import (
+    RETENTION_DELETED, RETENTION_EXPIRED_REMAINING, RETENTION_ORPHANS, RETENTION_LAST_RUN, RETENTION_RUN_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionService:
+    """Deletes expired assessments with their images and reconciles the upload folder with the database."""
+
+    def __init__(self, database_service: DatabaseService, image_service: ImageService,
+                 derivative_service: Optional[DerivativeService] = None, config: Optional[Dict] = None):
+        """
+        Initialize the retention service.
+
+        Args:
+            database_service: Assessment storage
+            image_service: Resolves image URLs to upload files
+            derivative_service: Cached thumbnails/previews to remove with their source
+            config: Overrides for RETENTION_CONFIG
+        """
+        self._database_service = database_service
+        self._image_service = image_service
+        self._derivative_service = derivative_service
+        self._config = {**RETENTION_CONFIG, **(config or {})}
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._progress: Dict[str, Any] = {}
+        self._last_run: Optional[Dict[str, Any]] = None
+        self._window_start = time.monotonic()
+        self._window_deletes = 0
+
+    def _filenames(self, row: Dict[str, Any]) -> List[str]:
+        """Upload filenames referenced by an assessment row."""
+        filenames = []
+        for column in IMAGE_URL_COLUMNS:
+            filename = self._image_service.get_filename_from_url(row.get(column))
+            if filename:
+                filenames.append(filename)
+        return filenames
+
+    def _throttle(self, deletes: int) -> None:
+        """Sleep as needed to stay under max_deletes_per_second."""
+        rate = self._config['max_deletes_per_second']
+        if rate <= 0:
+            return
+        self._window_deletes += deletes
+        ahead = self._window_deletes / rate - (time.monotonic() - self._window_start)
+        if ahead > 0:
+            self._stop_event.wait(ahead)
+
+    def _remove_files(self, filenames: List[str], kind: str) -> int:
+        """Remove stored images and their derivatives; missing images are not an error."""
+        storage = self._image_service.storage
+        try:
+            # One request per 1000 keys on object storage
+            removed = storage.delete_many([self._image_service.resolve_filename(name) for name in filenames])
+        except (OSError, StorageError) as e:
+            logger.warning(f"Failed to delete {len(filenames)} images: {str(e)}")
+            removed = 0
+        if self._derivative_service is not None:
+            for filename in filenames:
+                RETENTION_DELETED.inc(self._derivative_service.delete(filename), kind="derivative")
+        RETENTION_DELETED.inc(removed, kind=kind)
+        return removed
+
+    def expire(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Delete assessments older than the retention period, with their images.
+
+        Args:
+            dry_run: Only count what would be deleted
+
+        Returns:
+            Statistics: cutoff, assessments and files deleted (or expired, for a dry run)
+        """
+        days = self._config['retention_days']
+        if days <= 0:
+            return {'skipped': 'retention disabled (RETENTION_DAYS=0)'}
+        cutoff = datetime.now() - timedelta(days=days)
+        remaining = self._database_service.count_assessments_before(cutoff)
+        stats = {'cutoff': cutoff.isoformat(), 'expired': remaining, 'assessments_deleted': 0, 'files_deleted': 0}
+        if dry_run:
+            return stats
+
+        RETENTION_EXPIRED_REMAINING.set(remaining)
+        while not self._stop_event.is_set():
+            rows = self._database_service.get_expired_assessments(cutoff, self._config['batch_size'])
+            if not rows:
+                break
+            deleted = self._database_service.delete_assessments([row['id'] for row in rows])
+            RETENTION_DELETED.inc(deleted, kind="assessment")
+            files = self._remove_files([name for row in rows for name in self._filenames(row)], kind="image")
+
+            stats['assessments_deleted'] += deleted
+            stats['files_deleted'] += files
+            remaining = max(0, remaining - deleted)
+            RETENTION_EXPIRED_REMAINING.set(remaining)
+            self._progress.update(stage="expire", **stats)
+            self._throttle(deleted + files)
+
+        logger.info(f"Retention removed {stats['assessments_deleted']} assessments and "
+                    f"{stats['files_deleted']} files older than {cutoff:%Y-%m-%d %H:%M}")
+        return stats
+
+    def reconcile(self, delete_orphan_files: Optional[bool] = None, delete_orphan_rows: Optional[bool] = None,
+                  dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Find files without an assessment and assessments without their original image.
+
+        Args:
+            delete_orphan_files: Remove unreferenced files (default RETENTION_DELETE_ORPHAN_FILES)
+            delete_orphan_rows: Remove assessments whose original image is missing
+                (default RETENTION_DELETE_ORPHAN_ROWS)
+            dry_run: Only count orphans
+
+        Returns:
+            Statistics: files scanned, orphans found and deleted in each direction
+        """
+        if delete_orphan_files is None:
+            delete_orphan_files = self._config['delete_orphan_files']
+        if delete_orphan_rows is None:
+            delete_orphan_rows = self._config['delete_orphan_rows']
+
+        # Snapshot the folder before reading references, so a file saved meanwhile is at worst
+        # unlisted (never an orphan) rather than listed without its row
+        grace_cutoff = time.time() - self._config['orphan_grace']
+        on_disk: Dict[str, float] = {stored.key: stored.mtime for stored in self._image_service.iter_upload_files()}
+
+        referenced: Set[str] = set()
+        orphan_rows: List[int] = []
+        for chunk in self._database_service.iter_image_references():
+            for row in chunk:
+                # Flat-layout URLs may point at files migrate_uploads.py has moved into a shard
+                referenced.update(name if name in on_disk else self._image_service.resolve_filename(name)
+                                  for name in self._filenames(row))
+                original = self._image_service.get_filename_from_url(row['image_url'])
+                # Re-check the disk: the file may have been saved after the scan above
+                if original and original not in on_disk and not self._image_service.image_exists(original):
+                    orphan_rows.append(row['id'])
+
+        orphan_files = [name for name, mtime in on_disk.items() if name not in referenced and mtime < grace_cutoff]
+        RETENTION_ORPHANS.set(len(orphan_files), kind="file")
+        RETENTION_ORPHANS.set(len(orphan_rows), kind="row")
+        stats = {'files_scanned': len(on_disk), 'orphan_files': len(orphan_files), 'orphan_rows': len(orphan_rows),
+                 'orphan_files_deleted': 0, 'orphan_rows_deleted': 0, 'orphan_derivatives_deleted': 0}
+        self._progress.update(stage="reconcile", **stats)
+        if dry_run:
+            return stats
+
+        batch_size = self._config['batch_size']
+        if delete_orphan_files:
+            for start in range(0, len(orphan_files), batch_size):
+                if self._stop_event.is_set():
+                    break
+                removed = self._remove_files(orphan_files[start:start + batch_size], kind="orphan_file")
+                stats['orphan_files_deleted'] += removed
+                self._progress.update(stats)
+                self._throttle(removed)
+
+        if delete_orphan_rows:
+            for start in range(0, len(orphan_rows), batch_size):
+                if self._stop_event.is_set():
+                    break
+                batch = orphan_rows[start:start + batch_size]
+                deleted = self._database_service.delete_assessments(batch)
+                RETENTION_DELETED.inc(deleted, kind="orphan_row")
+                stats['orphan_rows_deleted'] += deleted
+                self._progress.update(stats)
+                self._throttle(deleted)
+
+        if self._derivative_service is not None:
+            remaining = set(on_disk) - set(orphan_files) if delete_orphan_files else set(on_disk)
+            pruned = self._derivative_service.prune(remaining, grace=self._config['orphan_grace'])
+            RETENTION_DELETED.inc(pruned, kind="derivative")
+            stats['orphan_derivatives_deleted'] = pruned
+
+        logger.info(f"Reconciliation: {stats}")
+        return stats
+
+    def run_once(self, dry_run: bool = False, reconcile: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        Expire old assessments, then reconcile orphans. Concurrent calls are skipped.
+
+        Args:
+            dry_run: Only count what would be deleted
+            reconcile: Run reconciliation (default RETENTION_RECONCILE)
+
+        Returns:
+            Statistics of both stages, or {'skipped': ...} if a run is already in progress
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return {'skipped': 'a retention run is already in progress'}
+        started = time.perf_counter()
+        self._window_start, self._window_deletes = time.monotonic(), 0
+        self._progress = {'started_at': datetime.now().isoformat(), 'dry_run': dry_run}
+        try:
+            result: Dict[str, Any] = {'expire': self.expire(dry_run=dry_run)}
+            if self._config['reconcile'] if reconcile is None else reconcile:
+                result['reconcile'] = self.reconcile(dry_run=dry_run)
+            result['duration_seconds'] = round(time.perf_counter() - started, 2)
+            result['finished_at'] = datetime.now().isoformat()
+            self._last_run = result
+            return result
+        finally:
+            RETENTION_RUN_SECONDS.observe(time.perf_counter() - started)
+            RETENTION_LAST_RUN.set(time.time())
+            RETENTION_EXPIRED_REMAINING.set(0)
+            self._progress = {}
+            self._run_lock.release()
+
+    def trigger(self) -> bool:
+        """
+        Request a run now: wakes the background thread, or runs once in a new thread.
+
+        Returns:
+            False if a run is already in progress
+        """
+        if self._run_lock.locked():
+            return False
+        if self._thread is not None:
+            self._wake_event.set()
+        else:
+            threading.Thread(target=self._run_safely, name="retention-once", daemon=True).start()
+        return True
+
+    def _run_safely(self) -> None:
+        try:
+            self.run_once()
+        except Exception as e:
+            logger.error(f"Retention run failed: {str(e)}", exc_info=True)
+
+    def status(self) -> Dict[str, Any]:
+        """Configuration, progress of a running job and the result of the last one."""
+        return {
+            'retention_days': self._config['retention_days'],
+            'running': self._run_lock.locked(),
+            'progress': dict(self._progress),
+            'last_run': self._last_run
+        }
+
+    def start(self, interval: Optional[float] = None) -> None:
+        """Run every interval seconds in a daemon thread."""
+        if self._thread is not None:
+            return
+        interval = interval or self._config['interval']
+
+        def run() -> None:
+            while not self._stop_event.is_set():
+                self._run_safely()
+                self._wake_event.wait(interval)
+                self._wake_event.clear()
+
+        self._thread = threading.Thread(target=run, name="retention", daemon=True)
+        self._thread.start()
+        logger.info(f"Retention job started (every {interval}s, keeping {self._config['retention_days']} days)")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
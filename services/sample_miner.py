@@ -0,0 +1,389 @@
+"""
+Active-learning sample miner.
+
+Scores stored assessments by how uncertain the model was (detections just above
+CONFIDENCE_THRESHOLD, or no usable detection at all) and by how different the
+image is from candidates already collected, keeps the best ones in a bounded pool,
+and exports deduplicated labelling batches with YOLO-format pseudo-labels.
+
+Mining is incremental: only assessments with an id above the last mined id are
+read, and only uncertain ones have their image loaded and embedded.
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import CONFIDENCE_THRESHOLD, INFERENCE_DEVICE, KAONG_LABELS_MAP, SAMPLE_MINER_CONFIG
+from services.database_service import Assessment, DatabaseService
+from services.image_service import ImageService
+
+logger = logging.getLogger(__name__)
+
+LABEL_IDS = {label: class_id for class_id, label in KAONG_LABELS_MAP.items()}
+
+# Exported embeddings kept for duplicate rejection; oldest are dropped beyond this
+MAX_EXPORTED_EMBEDDINGS = 20000
+
+
+class SampleMinerError(Exception):
+    """Custom exception for sample mining errors."""
+    pass
+
+
+def assessment_uncertainty(detection_data: Any, threshold: float = CONFIDENCE_THRESHOLD,
+                           band: float = 0.15) -> Optional[float]:
+    """
+    Uncertainty in [0, 1] from stored detections.
+
+    A detection scored exactly at the threshold counts 1.0, falling linearly to 0 at
+    threshold + band. Default/"Unknown" detections (the model found nothing usable)
+    count 1.0. Returns None for rows without model output (e.g. manual saves).
+    """
+    if not isinstance(detection_data, dict) or not detection_data.get('detections'):
+        return None
+
+    uncertainty = 0.0
+    for detection in detection_data['detections']:
+        score = float(detection.get('score') or 0.0)
+        if score <= 0.0 or detection.get('label') not in LABEL_IDS:
+            return 1.0
+        uncertainty = max(uncertainty, 1.0 - (score - threshold) / band)
+    return float(min(1.0, max(0.0, uncertainty)))
+
+
+def yolo_pseudo_labels(detection_data: Dict[str, Any]) -> List[str]:
+    """YOLO label lines ("class cx cy w h") from stored relative boxes; defaults are skipped."""
+    lines = []
+    for detection in detection_data.get('detections', []):
+        if float(detection.get('score') or 0.0) <= 0.0 or detection.get('label') not in LABEL_IDS:
+            continue
+        x1, y1, x2, y2 = (min(1.0, max(0.0, value)) for value in detection['box_relative'])
+        if x2 <= x1 or y2 <= y1:
+            continue
+        lines.append(f"{LABEL_IDS[detection['label']]} {(x1 + x2) / 2:.6f} {(y1 + y2) / 2:.6f} "
+                     f"{x2 - x1:.6f} {y2 - y1:.6f}")
+    return lines
+
+
+class ThumbnailEmbedder:
+    """Cheap perceptual embedding: a mean-centred, L2-normalised 16x16 colour thumbnail."""
+
+    def __init__(self, size: int = 16):
+        self._size = size
+
+    def embed(self, images: List[Image.Image]) -> np.ndarray:
+        vectors = []
+        for image in images:
+            thumbnail = np.asarray(image.convert("RGB").resize((self._size, self._size), Image.Resampling.BILINEAR),
+                                   dtype=np.float32).ravel()
+            vectors.append(thumbnail - thumbnail.mean())
+        return _normalize(np.stack(vectors))
+
+
+class ModelEmbedder:
+    """
+    Pooled YOLO backbone features.
+
+    Uses its own model instance: ultralytics keeps the embed setting on the predictor,
+    so sharing the serving model would change what later predict calls return.
+    """
+
+    def __init__(self, model_path: str):
+        import ultralytics
+        self._model = ultralytics.YOLO(model_path)
+
+    def embed(self, images: List[Image.Image]) -> np.ndarray:
+        features = self._model.embed(images, verbose=False, device=INFERENCE_DEVICE)
+        return _normalize(np.stack([feature.float().cpu().numpy().ravel() for feature in features]))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-9)).astype(np.float32)
+
+
+class SampleMiner:
+    """
+    Maintains the candidate pool on disk (state_dir) and exports labelling batches.
+
+    Only one process should mine a given state_dir at a time: run either the
+    background thread in the web app or mine_samples.py, not both.
+    """
+
+    def __init__(self, database_service: DatabaseService, image_service: Optional[ImageService] = None,
+                 embedder=None, state_dir: Optional[str] = None, pool_size: Optional[int] = None):
+        self._database_service = database_service
+        self._image_service = image_service or ImageService()
+        self._embedder = embedder
+        self._state_dir = state_dir or SAMPLE_MINER_CONFIG['state_dir']
+        self._pool_size = pool_size or SAMPLE_MINER_CONFIG['pool_size']
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(self._state_dir, exist_ok=True)
+        self._load_state()
+
+    # State
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._state_dir, name)
+
+    def _load_state(self) -> None:
+        self.last_id = 0
+        self.pool: List[Dict[str, Any]] = []
+        self.exported_ids: set = set()
+        self.pool_embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.exported_embeddings = np.zeros((0, 0), dtype=np.float32)
+        try:
+            with np.load(self._path("state.npz")) as saved:
+                state = json.loads(str(saved['state']))
+                pool_embeddings = saved['pool']
+                exported_embeddings = saved['exported']
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning(f"Unreadable sample miner state, starting over: {str(e)}")
+            return
+        self.last_id = state['last_id']
+        self.pool = state['pool']
+        self.exported_ids = set(state['exported_ids'])
+        self.pool_embeddings = pool_embeddings
+        self.exported_embeddings = exported_embeddings
+
+    def _save_state(self) -> None:
+        # Pool, last_id and embeddings share one file, so a crash cannot leave them out of step
+        state = json.dumps({'last_id': self.last_id, 'pool': self.pool,
+                            'exported_ids': sorted(self.exported_ids)})
+        tmp_path = self._path("state.tmp.npz")
+        np.savez(tmp_path, state=np.array(state), pool=self.pool_embeddings, exported=self.exported_embeddings)
+        os.replace(tmp_path, self._path("state.npz"))
+
+    def _get_embedder(self):
+        if self._embedder is None:
+            if SAMPLE_MINER_CONFIG['embedding'] == 'model':
+                from config import get_model_path
+                self._embedder = ModelEmbedder(get_model_path())
+            else:
+                self._embedder = ThumbnailEmbedder()
+        return self._embedder
+
+    # Mining
+
+    def _min_pool_score(self) -> float:
+        return min(entry['score'] for entry in self.pool) if len(self.pool) >= self._pool_size else -1.0
+
+    def _max_similarity(self, matrix: np.ndarray, embedding: np.ndarray) -> Tuple[float, int]:
+        if not len(matrix):
+            return 0.0, -1
+        similarities = matrix @ embedding
+        index = int(np.argmax(similarities))
+        return float(similarities[index]), index
+
+    def _consider(self, assessment: Assessment, uncertainty: float, embedding: np.ndarray) -> bool:
+        """Insert one candidate into the pool if it is good enough and not a duplicate."""
+        duplicate_similarity = SAMPLE_MINER_CONFIG['duplicate_similarity']
+        exported_similarity, _ = self._max_similarity(self.exported_embeddings, embedding)
+        if exported_similarity >= duplicate_similarity:
+            return False
+
+        pool_similarity, pool_index = self._max_similarity(self.pool_embeddings, embedding)
+        diversity = 1.0 - max(0.0, pool_similarity, exported_similarity)
+        weight = SAMPLE_MINER_CONFIG['diversity_weight']
+        entry = {
+            'assessment_id': assessment.id,
+            'image_url': assessment.image_url,
+            'source': assessment.source,
+            'timestamp': assessment.timestamp.isoformat() if assessment.timestamp else None,
+            'uncertainty': round(uncertainty, 4),
+            'diversity': round(diversity, 4),
+            'score': round((1 - weight) * uncertainty + weight * diversity, 4),
+            'pseudo_labels': yolo_pseudo_labels(assessment.detection_data)
+        }
+
+        if pool_similarity >= duplicate_similarity:
+            # Near-duplicate of a pooled image: keep whichever is more useful
+            if entry['score'] <= self.pool[pool_index]['score']:
+                return False
+            replace_index = pool_index
+        elif len(self.pool) < self._pool_size:
+            replace_index = None
+        else:
+            replace_index = min(range(len(self.pool)), key=lambda i: self.pool[i]['score'])
+            if entry['score'] <= self.pool[replace_index]['score']:
+                return False
+
+        if replace_index is None:
+            self.pool.append(entry)
+            self.pool_embeddings = (embedding[None, :] if not len(self.pool_embeddings)
+                                    else np.vstack([self.pool_embeddings, embedding]))
+        else:
+            self.pool[replace_index] = entry
+            self.pool_embeddings[replace_index] = embedding
+        return True
+
+    def mine_once(self, chunk_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Score assessments added since the last run.
+
+        Returns:
+            Counts of rows scanned, images embedded and candidates added to the pool
+        """
+        threshold_band = SAMPLE_MINER_CONFIG['uncertainty_band']
+        min_uncertainty = SAMPLE_MINER_CONFIG['min_uncertainty']
+        weight = SAMPLE_MINER_CONFIG['diversity_weight']
+        stats = {'scanned': 0, 'embedded': 0, 'added': 0}
+
+        with self._lock:
+            for chunk in self._database_service.iter_assessments(
+                    after_id=self.last_id, chunk_size=chunk_size or SAMPLE_MINER_CONFIG['chunk_size']):
+                candidates = []
+                for assessment in chunk:
+                    stats['scanned'] += 1
+                    if assessment.id in self.exported_ids:
+                        continue
+                    uncertainty = assessment_uncertainty(assessment.detection_data, band=threshold_band)
+                    if uncertainty is None or uncertainty < min_uncertainty:
+                        continue
+                    # Even a perfectly diverse image cannot beat a full pool's weakest entry
+                    if (1 - weight) * uncertainty + weight <= self._min_pool_score():
+                        continue
+                    filename = self._image_service.get_filename_from_url(assessment.image_url)
+                    if filename and self._image_service.image_exists(filename):
+                        candidates.append((assessment, uncertainty, filename))
+
+                loaded, images = [], []
+                for assessment, uncertainty, filename in candidates:
+                    try:
+                        with self._image_service.open_image_file(filename) as f, Image.open(f) as image:
+                            images.append(image.convert("RGB"))
+                        loaded.append((assessment, uncertainty))
+                    except (OSError, ValueError) as e:
+                        # Corrupt or deleted since it was listed; skip it so the chunk is still checkpointed
+                        logger.warning(f"Skipping image of assessment {assessment.id}: {str(e)}")
+
+                if loaded:
+                    embeddings = self._get_embedder().embed(images)
+                    stats['embedded'] += len(loaded)
+                    for (assessment, uncertainty), embedding in zip(loaded, embeddings):
+                        stats['added'] += self._consider(assessment, uncertainty, embedding)
+
+                self.last_id = chunk[-1].id
+                self._save_state()
+
+        if stats['scanned']:
+            logger.info(f"Sample mining: scanned {stats['scanned']}, embedded {stats['embedded']}, "
+                        f"added {stats['added']}; pool {len(self.pool)}/{self._pool_size}")
+        return stats
+
+    def export_batch(self, output_dir: str, size: int) -> Dict[str, Any]:
+        """
+        Move the best pooled candidates into a labelling batch.
+
+        Writes images/, labels/ (YOLO pseudo-labels to correct rather than draw from
+        scratch), classes.txt and manifest.json into output_dir. Candidates are picked
+        greedily by score, skipping near-duplicates of images already picked.
+
+        Returns:
+            The manifest
+        """
+        with self._lock:
+            order = sorted(range(len(self.pool)), key=lambda i: self.pool[i]['score'], reverse=True)
+            picked: List[int] = []
+            for index in order:
+                if len(picked) >= size:
+                    break
+                if picked:
+                    similarity = float(np.max(self.pool_embeddings[picked] @ self.pool_embeddings[index]))
+                    if similarity >= SAMPLE_MINER_CONFIG['duplicate_similarity']:
+                        continue
+                picked.append(index)
+
+            images_dir = os.path.join(output_dir, "images")
+            labels_dir = os.path.join(output_dir, "labels")
+            os.makedirs(images_dir, exist_ok=True)
+            os.makedirs(labels_dir, exist_ok=True)
+            with open(os.path.join(output_dir, "classes.txt"), "w") as f:
+                f.write("\n".join(KAONG_LABELS_MAP[class_id] for class_id in sorted(KAONG_LABELS_MAP)) + "\n")
+
+            exported = []
+            for index in picked:
+                entry = self.pool[index]
+                filename = self._image_service.get_filename_from_url(entry['image_url'])
+                stem = f"assessment_{entry['assessment_id']}"
+                try:
+                    if not filename:
+                        raise FileNotFoundError(entry['image_url'])
+                    with self._image_service.open_image_file(filename) as source, \
+                            open(os.path.join(images_dir, stem + os.path.splitext(filename)[1]), "wb") as target:
+                        shutil.copyfileobj(source, target)
+                except FileNotFoundError:
+                    logger.warning(f"Image for assessment {entry['assessment_id']} is gone, dropping it")
+                    continue
+                with open(os.path.join(labels_dir, stem + ".txt"), "w") as f:
+                    f.write("".join(line + "\n" for line in entry['pseudo_labels']))
+                exported.append(entry)
+
+            # Everything picked leaves the pool, including entries whose image disappeared
+            self.exported_ids.update(self.pool[index]['assessment_id'] for index in picked)
+            new_exported = self.pool_embeddings[picked] if picked else np.zeros((0, 0), np.float32)
+            if len(new_exported):
+                self.exported_embeddings = (new_exported if not len(self.exported_embeddings)
+                                            else np.vstack([self.exported_embeddings, new_exported]))
+                self.exported_embeddings = self.exported_embeddings[-MAX_EXPORTED_EMBEDDINGS:]
+            keep = [i for i in range(len(self.pool)) if i not in set(picked)]
+            self.pool = [self.pool[i] for i in keep]
+            self.pool_embeddings = self.pool_embeddings[keep] if keep else np.zeros((0, 0), np.float32)
+            self._save_state()
+
+            manifest = {
+                'created_at': datetime.now().isoformat(),
+                'count': len(exported),
+                'samples': exported
+            }
+            with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2)
+            logger.info(f"Exported labelling batch of {len(exported)} images to {output_dir}")
+            return manifest
+
+    def status(self) -> Dict[str, Any]:
+        """Pool size, score range and mining progress."""
+        scores = [entry['score'] for entry in self.pool]
+        return {
+            'last_id': self.last_id,
+            'pool': len(self.pool),
+            'pool_size': self._pool_size,
+            'exported': len(self.exported_ids),
+            'score_max': max(scores) if scores else None,
+            'score_min': min(scores) if scores else None
+        }
+
+    # Background thread
+
+    def start(self, interval: Optional[float] = None) -> None:
+        """Mine new assessments every interval seconds in a daemon thread."""
+        if self._thread is not None:
+            return
+        interval = interval or SAMPLE_MINER_CONFIG['interval']
+
+        def run() -> None:
+            while not self._stop_event.wait(interval):
+                try:
+                    self.mine_once()
+                except Exception as e:
+                    logger.error(f"Sample mining failed: {str(e)}", exc_info=True)
+
+        self._thread = threading.Thread(target=run, name="sample-miner", daemon=True)
+        self._thread.start()
+        logger.info(f"Sample miner started (every {interval}s, state in {self._state_dir})")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
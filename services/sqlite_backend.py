@@ -0,0 +1,175 @@
+"""
+SQLite stand-in for the MySQL connection pool.
+Mimics the subset of the mysql.connector pooling API used by DatabaseService so
+the application, benchmarks and tools can run offline without a MySQL server.
+"""
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# SQLite equivalent of the MySQL assessments table
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS assessments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_url VARCHAR(255) NOT NULL,
+        assessment VARCHAR(100) NOT NULL,
+        confidence REAL NOT NULL,
+        source VARCHAR(50) NOT NULL,
+        detection_data TEXT,
+        ripe_image_url VARCHAR(255),
+        unripe_image_url VARCHAR(255),
+        rotten_image_url VARCHAR(255),
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_timestamp ON assessments (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_source ON assessments (source)",
+    "CREATE INDEX IF NOT EXISTS idx_assessment ON assessments (assessment)",
+    "CREATE INDEX IF NOT EXISTS idx_image_url ON assessments (image_url)",
+    """
+    CREATE TABLE IF NOT EXISTS batch_checkpoints (
+        run_id CHAR(40) NOT NULL,
+        key_hash CHAR(40) NOT NULL,
+        PRIMARY KEY (run_id, key_hash)
+    )
+    """
+]
+
+# Explicit adapters: the implicit datetime ones are deprecated since Python 3.12
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SQLiteCursor:
+    """Cursor adapter translating MySQL-style %s placeholders and dictionary rows."""
+
+    def __init__(self, cursor: sqlite3.Cursor, dictionary: bool = False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @staticmethod
+    def _translate(sql: str) -> str:
+        return sql.replace("%s", "?")
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> None:
+        self._cursor.execute(self._translate(sql), tuple(params or ()))
+
+    def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> None:
+        self._cursor.executemany(self._translate(sql), [tuple(params) for params in seq_of_params])
+
+    def _convert(self, row: Optional[tuple]) -> Any:
+        if row is None or not self._dictionary:
+            return row
+        columns = [description[0] for description in self._cursor.description]
+        return dict(zip(columns, row))
+
+    def fetchone(self) -> Any:
+        return self._convert(self._cursor.fetchone())
+
+    def fetchall(self) -> List[Any]:
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size: int) -> List[Any]:
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Pooled connection; close() returns it to the pool like a mysql PooledMySQLConnection."""
+
+    def __init__(self, connection: sqlite3.Connection, pool: "SQLiteConnectionPool"):
+        self._connection = connection
+        self._pool = pool
+        self._checked_out = True
+
+    def cursor(self, dictionary: bool = False, **kwargs: Any) -> SQLiteCursor:
+        return SQLiteCursor(self._connection.cursor(), dictionary=dictionary)
+
+    def commit(self) -> None:
+        self._connection.commit()
+
+    def rollback(self) -> None:
+        self._connection.rollback()
+
+    def start_transaction(self) -> None:
+        self._connection.execute("BEGIN")
+
+    def is_connected(self) -> bool:
+        return self._checked_out
+
+    def close(self) -> None:
+        if self._checked_out:
+            self._checked_out = False
+            self._connection.rollback()  # like pool_reset_session: never leak an open transaction
+            self._pool._release(self._connection)
+
+
+class SQLiteConnectionPool:
+    """Fixed-size pool of SQLite connections to one database file."""
+
+    def __init__(self, database: str, pool_size: int = 5, timeout: float = 30.0):
+        self.pool_name = "kaong_detection_pool"
+        self.pool_size = pool_size
+        self._database = database
+        self._timeout = timeout
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._lock = threading.Lock()
+        for _ in range(pool_size):
+            self._idle.put(self._connect())
+        logger.info(f"SQLite connection pool initialized for {database} ({pool_size} connections)")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self._database,
+            timeout=self._timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False  # a connection is only used by one thread at a time via the pool
+        )
+        # WAL lets readers proceed while a writer commits
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def get_connection(self) -> SQLiteConnection:
+        """Check out a connection, waiting up to the pool timeout."""
+        try:
+            connection = self._idle.get(timeout=self._timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Failed getting connection; pool exhausted")
+        return SQLiteConnection(connection, self)
+
+    def _release(self, connection: sqlite3.Connection) -> None:
+        self._idle.put(connection)
+
+    def create_schema(self) -> None:
+        """Create the assessments table and indexes."""
+        connection = self.get_connection()
+        try:
+            cursor = connection.cursor()
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            connection.commit()
+            cursor.close()
+        finally:
+            connection.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Pool utilisation snapshot."""
+        idle = self._idle.qsize()
+        return {'size': self.pool_size, 'idle': idle, 'in_use': self.pool_size - idle}
@@ -0,0 +1,72 @@
+"""
+Responses for stored image files: uploads and their cached derivatives.
+
+Upload and derivative names are never reused for a different picture, so responses
+carry a far-future, immutable Cache-Control and the dashboard's 5-second refresh
+does not revalidate images it already has. ETags (mtime, size, path) answer
+conditional requests with 304, and Range requests with 206.
+
+The body is sent through the server's wsgi.file_wrapper, which is sendfile(2) under
+gunicorn and uWSGI. Behind a front proxy, STATIC_OFFLOAD hands the transfer to it:
+'x-sendfile' names the file path (Apache mod_xsendfile, lighttpd), 'x-accel' names
+an nginx internal location. The app still answers conditional requests itself and
+leaves Range requests to the proxy.
+"""
+import os
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+from werkzeug.utils import send_file
+from werkzeug.wrappers import Response
+
+from config import STATIC_FILES_CONFIG
+
+logger = logging.getLogger(__name__)
+
+OFFLOAD_MODES = ('', 'x-sendfile', 'x-accel')
+
+# The proxy applies ranges to the file it sends; answering them here would produce an empty 206
+_PROXY_HANDLED_HEADERS = ('HTTP_RANGE', 'HTTP_IF_RANGE')
+
+
+def send_image_file(environ: Dict[str, Any], path: str, root: str, x_accel_location: str,
+                    mimetype: Optional[str] = None, max_age: Optional[int] = None,
+                    config: Optional[Dict[str, Any]] = None) -> Response:
+    """
+    Build the response for a stored image file.
+
+    Args:
+        environ: WSGI environ of the request
+        path: File to send
+        root: Directory the nginx internal location is aliased to
+        x_accel_location: nginx internal location prefix for root, used with 'x-accel'
+        mimetype: Content type (default: guessed from the path)
+        max_age: Cache lifetime in seconds (default STATIC_MAX_AGE)
+        config: Overrides for STATIC_FILES_CONFIG
+
+    Returns:
+        200, 206 or 304 response; with offloading, headers only
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    config = {**STATIC_FILES_CONFIG, **(config or {})}
+    offload = config['offload']
+    if offload not in OFFLOAD_MODES:
+        logger.warning(f"Unknown STATIC_OFFLOAD '{offload}', sending files from the app")
+        offload = ''
+    # The proxy opens the file itself, from its own working directory
+    path = os.path.abspath(path)
+    if offload:
+        environ = {key: value for key, value in environ.items() if key not in _PROXY_HANDLED_HEADERS}
+
+    response = send_file(path, environ, mimetype=mimetype, conditional=True, use_x_sendfile=bool(offload),
+                         max_age=config['max_age'] if max_age is None else max_age)
+
+    if offload == 'x-accel' and response.headers.pop('X-Sendfile', None) is not None:
+        relative = os.path.relpath(path, os.path.abspath(root)).replace(os.sep, "/")
+        response.headers['X-Accel-Redirect'] = x_accel_location.rstrip("/") + "/" + quote(relative)
+    if config['immutable'] and response.cache_control.max_age:
+        response.cache_control.immutable = True
+    return response
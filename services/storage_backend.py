@@ -0,0 +1,525 @@
+"""
+Storage backends for uploaded images and their annotated renders.
+
+Images are addressed by key, the path relative to the upload folder
+(e.g. 2025/10/19/kaong_upload_20251019_101500_123456.jpg), whichever backend holds
+them. LocalStorage keeps the historical layout under UPLOAD_FOLDER. S3Storage writes
+to any S3-compatible service (AWS S3, or MinIO as a local stand-in), so several app
+instances can share one image store. Large objects are streamed as parallel
+multipart uploads, and reads go out as CDN or presigned URLs instead of through the
+app.
+"""
+import os
+import time
+import logging
+import threading
+from io import BytesIO
+from dataclasses import dataclass
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import STORAGE_CONFIG, UPLOAD_FOLDER
+from services.metrics import STORAGE_OPERATIONS, STORAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# URL prefix of stored images served (or redirected) by the app
+UPLOAD_URL_PREFIX = "/static/uploads/"
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'webp': 'image/webp',
+    'avif': 'image/avif'
+}
+
+# S3 rejects multipart parts below 5 MiB (except the last)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class StorageError(Exception):
+    """Raised when a storage backend cannot be configured or an object cannot be written."""
+    pass
+
+
+@dataclass(frozen=True)
+class StoredObject:
+    """A stored image as listed by a backend."""
+    key: str
+    size: int
+    mtime: float
+
+
+def content_type_for(key: str) -> str:
+    """MIME type of a stored image from its extension."""
+    return CONTENT_TYPES.get(key.rsplit(".", 1)[-1].lower(), 'application/octet-stream')
+
+
+def validate_key(key: str) -> str:
+    """
+    Reject keys that would escape the store.
+
+    Raises:
+        FileNotFoundError: If the key is empty, absolute or contains '..'
+    """
+    normalized = key.replace("\\", "/")
+    if not normalized or normalized.startswith("/") or os.path.isabs(key) or ".." in normalized.split("/"):
+        raise FileNotFoundError(key)
+    return normalized
+
+
+class StorageWriter:
+    """
+    Streaming write of one object. The object only becomes visible when the writer is closed;
+    leaving a `with` block on an exception aborts it.
+    """
+
+    def write(self, data: bytes) -> int:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def abort(self) -> None:
+        raise NotImplementedError
+
+    def __enter__(self) -> "StorageWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class StorageBackend:
+    """Interface shared by the storage backends."""
+
+    name = "base"
+
+    def save(self, key: str, data: bytes, content_type: Optional[str] = None, mtime: Optional[float] = None) -> None:
+        """
+        Store an object, replacing any previous object under the key atomically.
+
+        Args:
+            key: Object key
+            data: Object bytes
+            content_type: MIME type (default: from the key's extension)
+            mtime: Modification time to keep, where the backend supports it (local only)
+        """
+        raise NotImplementedError
+
+    def open_writer(self, key: str, content_type: Optional[str] = None) -> StorageWriter:
+        """Start a streaming write; see StorageWriter."""
+        raise NotImplementedError
+
+    def save_many(self, items: Iterable[Tuple[str, bytes, Optional[str]]]) -> List[Optional[Exception]]:
+        """
+        Store several objects.
+
+        Args:
+            items: (key, data, content_type) tuples
+
+        Returns:
+            Per item, None on success or the exception that failed it, so one failure does not hide
+            the others
+        """
+        errors: List[Optional[Exception]] = []
+        for key, data, content_type in items:
+            try:
+                self.save(key, data, content_type)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def open(self, key: str) -> BinaryIO:
+        """
+        Open an object for reading (seekable).
+
+        Raises:
+            FileNotFoundError: If the object does not exist
+        """
+        raise NotImplementedError
+
+    def stat(self, key: str) -> StoredObject:
+        """
+        Size and modification time of an object.
+
+        Raises:
+            FileNotFoundError: If the object does not exist
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.stat(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key: str) -> bool:
+        """Delete an object; returns False if it did not exist."""
+        raise NotImplementedError
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """Delete objects; returns the number deleted."""
+        return sum(1 for key in keys if self.delete(key))
+
+    def iter_objects(self) -> Iterator[StoredObject]:
+        """Every stored object, streamed rather than listed into memory."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        """Stable URL of an object, as stored in the database."""
+        return UPLOAD_URL_PREFIX + key
+
+    def signed_url(self, key: str, expires: Optional[int] = None) -> str:
+        """URL a browser can fetch the object from directly."""
+        return self.url(key)
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        """Inverse of url(); None for URLs that do not point into this store."""
+        if url and url.startswith(UPLOAD_URL_PREFIX):
+            return url[len(UPLOAD_URL_PREFIX):]
+        return None
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of an object, or None if the backend is not a local filesystem."""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Images as files under a directory (UPLOAD_FOLDER), served by the app at /static/uploads/."""
+
+    name = "local"
+
+    def __init__(self, root: str = UPLOAD_FOLDER):
+        self.root = root
+        try:
+            os.makedirs(root, exist_ok=True)
+        except OSError as e:
+            raise StorageError(f"Upload directory creation failed: {str(e)}")
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, validate_key(key))
+
+    def save(self, key: str, data: bytes, content_type: Optional[str] = None, mtime: Optional[float] = None) -> None:
+        with _LocalWriter(self.local_path(key), mtime) as writer:
+            writer.write(data)
+
+    def open_writer(self, key: str, content_type: Optional[str] = None) -> StorageWriter:
+        return _LocalWriter(self.local_path(key))
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.local_path(key), "rb")
+
+    def stat(self, key: str) -> StoredObject:
+        stat = os.stat(self.local_path(key))
+        return StoredObject(key, stat.st_size, stat.st_mtime)
+
+    def exists(self, key: str) -> bool:
+        try:
+            return os.path.isfile(self.local_path(key))
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self.local_path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_objects(self) -> Iterator[StoredObject]:
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            try:
+                entries = os.scandir(os.path.join(self.root, relative_dir))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    # Hidden files and in-progress writes
+                    if entry.name.startswith(".") or entry.name.endswith(".tmp"):
+                        continue
+                    key = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                    if entry.is_dir():
+                        pending.append(key)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        yield StoredObject(key, stat.st_size, stat.st_mtime)
+
+
+class _LocalWriter(StorageWriter):
+    """Writes to a temporary file renamed into place on close, so readers never see partial images."""
+
+    def __init__(self, path: str, mtime: Optional[float] = None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._path = path
+        self._mtime = mtime
+        self._temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self._temp_path, "wb")
+
+    def write(self, data: bytes) -> int:
+        return self._file.write(data)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.close()
+        if self._mtime is not None:
+            os.utime(self._temp_path, (self._mtime, self._mtime))
+        os.replace(self._temp_path, self._path)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage(StorageBackend):
+    """Images as objects in an S3-compatible bucket (requires boto3)."""
+
+    name = "s3"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the S3 backend.
+
+        Args:
+            config: Overrides for STORAGE_CONFIG
+
+        Raises:
+            StorageError: If boto3 is not installed
+        """
+        self._config = {**STORAGE_CONFIG, **(config or {})}
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise StorageError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        self._client_error = ClientError
+
+        self.bucket = self._config['s3_bucket']
+        self.prefix = self._config['s3_prefix']
+        self.public_url = self._config['public_url']
+        self.max_concurrency = max(1, self._config['max_concurrency'])
+        self._threshold = self._config['multipart_threshold']
+        self.chunk_size = max(S3_MIN_PART_SIZE, self._config['multipart_chunk_size'])
+        credentials = {}
+        if self._config['s3_access_key']:
+            credentials = {'aws_access_key_id': self._config['s3_access_key'],
+                           'aws_secret_access_key': self._config['s3_secret_key']}
+        # boto3 clients are thread-safe; the pool must cover parallel part and object uploads
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=self._config['s3_endpoint_url'] or None,
+            region_name=self._config['s3_region'],
+            # SigV4 also for presigned URLs; botocore otherwise presigns with SigV2 in us-east-1
+            config=Config(max_pool_connections=self.max_concurrency * 4, retries={'max_attempts': 5, 'mode': 'standard'},
+                          s3={'addressing_style': self._config['s3_addressing_style']}, signature_version='s3v4'),
+            **credentials
+        )
+        # Separate pools: an object upload in save_many waits on its own part uploads
+        self.part_executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="s3-part")
+        self._object_executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="s3-object")
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + validate_key(key)
+
+    def _is_not_found(self, error: Exception) -> bool:
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def call(self, operation: str, **kwargs: Any) -> Dict[str, Any]:
+        """Call a client method with metrics; missing objects raise FileNotFoundError."""
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client, operation)(Bucket=self.bucket, **kwargs)
+        except self._client_error as e:
+            if self._is_not_found(e):
+                STORAGE_OPERATIONS.inc(backend=self.name, operation=operation, outcome="not_found")
+                raise FileNotFoundError(kwargs.get('Key', ''))
+            STORAGE_OPERATIONS.inc(backend=self.name, operation=operation, outcome="error")
+            raise StorageError(f"S3 {operation} failed: {str(e)}")
+        STORAGE_LATENCY.observe(time.perf_counter() - start, backend=self.name, operation=operation)
+        STORAGE_OPERATIONS.inc(backend=self.name, operation=operation, outcome="ok")
+        return response
+
+    def put_options(self, key: str, content_type: Optional[str]) -> Dict[str, Any]:
+        return {'Key': self._object_key(key), 'ContentType': content_type or content_type_for(key),
+                'CacheControl': self._config['cache_control']}
+
+    def save(self, key: str, data: bytes, content_type: Optional[str] = None, mtime: Optional[float] = None) -> None:
+        if len(data) <= self._threshold:
+            self.call("put_object", Body=data, **self.put_options(key, content_type))
+            return
+        with self.open_writer(key, content_type) as writer:
+            view = memoryview(data)
+            for offset in range(0, len(data), self.chunk_size):
+                writer.write(view[offset:offset + self.chunk_size])
+
+    def open_writer(self, key: str, content_type: Optional[str] = None) -> StorageWriter:
+        return _S3MultipartWriter(self, key, content_type)
+
+    def save_many(self, items: Iterable[Tuple[str, bytes, Optional[str]]]) -> List[Optional[Exception]]:
+        futures = [self._object_executor.submit(self.save, key, data, content_type)
+                   for key, data, content_type in items]
+        return [future.exception() for future in futures]
+
+    def open(self, key: str) -> BinaryIO:
+        body = self.call("get_object", Key=self._object_key(key))['Body']
+        # PIL needs a seekable file; stored images are a few MB at most
+        return BytesIO(body.read())
+
+    def stat(self, key: str) -> StoredObject:
+        response = self.call("head_object", Key=self._object_key(key))
+        return StoredObject(key, response['ContentLength'], response['LastModified'].timestamp())
+
+    def delete(self, key: str) -> bool:
+        # S3 deletes are idempotent and do not report whether the object existed
+        self.call("delete_object", Key=self._object_key(key))
+        return True
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        keys = list(keys)
+        deleted = 0
+        # DeleteObjects takes up to 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            response = self.call("delete_objects", Delete={
+                'Objects': [{'Key': self._object_key(key)} for key in batch], 'Quiet': True})
+            errors = response.get('Errors', [])
+            for error in errors:
+                logger.warning(f"Failed to delete {error.get('Key')}: {error.get('Message')}")
+            deleted += len(batch) - len(errors)
+        return deleted
+
+    def iter_objects(self) -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield StoredObject(item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp())
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return super().url(key)
+
+    def signed_url(self, key: str, expires: Optional[int] = None) -> str:
+        if self.public_url:
+            return self.url(key)
+        return self.client.generate_presigned_url(
+            "get_object", Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=expires or self._config['signed_url_ttl'])
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        if self.public_url and url and url.startswith(self.public_url + "/"):
+            return url[len(self.public_url) + 1:]
+        return super().key_from_url(url)
+
+
+class _S3MultipartWriter(StorageWriter):
+    """
+    Buffers writes into parts and uploads them in parallel while the caller keeps writing.
+
+    At most max_concurrency parts are in flight, bounding memory to about
+    (max_concurrency + 1) * chunk_size. Objects smaller than one part are sent with a
+    single PutObject on close.
+    """
+
+    def __init__(self, storage: S3Storage, key: str, content_type: Optional[str]):
+        self._storage = storage
+        self._options = storage.put_options(key, content_type)
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Future] = []
+        self._closed = False
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        chunk_size = self._storage.chunk_size
+        while len(self._buffer) >= chunk_size:
+            self._upload_part(bytes(self._buffer[:chunk_size]))
+            del self._buffer[:chunk_size]
+        return len(data)
+
+    def _upload_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            self._upload_id = self._storage.call("create_multipart_upload", **self._options)['UploadId']
+        in_flight = [part for part in self._parts if not part.done()]
+        if len(in_flight) >= self._storage.max_concurrency:
+            wait(in_flight, return_when=FIRST_COMPLETED)
+        part_number = len(self._parts) + 1
+        self._parts.append(self._storage.part_executor.submit(self._send_part, part_number, body))
+
+    def _send_part(self, part_number: int, body: bytes) -> Dict[str, Any]:
+        response = self._storage.call("upload_part", Key=self._options['Key'], UploadId=self._upload_id,
+                                      PartNumber=part_number, Body=body)
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._upload_id is None:
+            self._storage.call("put_object", Body=bytes(self._buffer), **self._options)
+            return
+        try:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            parts = [part.result() for part in self._parts]
+            self._storage.call("complete_multipart_upload", Key=self._options['Key'], UploadId=self._upload_id,
+                               MultipartUpload={'Parts': parts})
+        except Exception:
+            self._abort_upload()
+            raise
+
+    def abort(self) -> None:
+        self._closed = True
+        self._abort_upload()
+
+    def _abort_upload(self) -> None:
+        if self._upload_id is None:
+            return
+        wait(self._parts)
+        try:
+            self._storage.call("abort_multipart_upload", Key=self._options['Key'], UploadId=self._upload_id)
+        except (StorageError, FileNotFoundError) as e:
+            # The bucket's lifecycle rule for incomplete uploads cleans up eventually
+            logger.warning(f"Failed to abort multipart upload of {self._options['Key']}: {str(e)}")
+        self._upload_id = None
+
+
+def create_storage(config: Optional[Dict[str, Any]] = None) -> StorageBackend:
+    """
+    Build the backend selected by STORAGE_BACKEND.
+
+    Args:
+        config: Overrides for STORAGE_CONFIG
+
+    Raises:
+        StorageError: For an unknown backend or a missing dependency
+    """
+    config = {**STORAGE_CONFIG, **(config or {})}
+    if config['backend'] == 'local':
+        return LocalStorage()
+    if config['backend'] == 's3':
+        return S3Storage(config)
+    raise StorageError(f"Unknown storage backend '{config['backend']}' (use 'local' or 's3')")
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> StorageBackend:
+    """The process-wide backend, shared by every service (S3 clients and pools are costly to create)."""
+    return create_storage()
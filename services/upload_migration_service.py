@@ -0,0 +1,243 @@
+"""
+Moves uploads saved in the flat layout into the sharded layout (UPLOAD_LAYOUT).
+
+The migration runs online, next to the serving app. Assessments are read in id
+order. In each batch, every flat file the batch references is hard-linked into its
+shard. The batch's URL columns are then rewritten in one transaction, and only
+after the commit are the flat names unlinked. A failed commit removes the new links,
+so a file is always reachable under the URL the database holds. Files no assessment
+references are moved at the end. Bare filenames keep resolving through
+ImageService.resolve_filename in the meantime. Only local storage is migrated;
+object storage keys are written sharded from the start.
+"""
+import os
+import time
+import shutil
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import UPLOAD_LAYOUT
+from services.database_service import DatabaseService, IMAGE_URL_COLUMNS
+from services.image_service import ImageService, upload_shard
+from services.derivative_service import DerivativeService
+from services.storage_backend import LocalStorage
+
+logger = logging.getLogger(__name__)
+
+
+class UploadMigrator:
+    """Re-homes flat-layout uploads into shard directories and updates the assessments that reference them."""
+
+    def __init__(self, database_service: DatabaseService, image_service: ImageService,
+                 derivative_service: Optional[DerivativeService] = None, layout: str = UPLOAD_LAYOUT,
+                 batch_size: int = 500, min_age: float = 3600, max_per_second: float = 0,
+                 move_unreferenced: bool = True, dry_run: bool = False):
+        """
+        Initialize the migrator.
+
+        Args:
+            database_service: Assessments whose URLs are rewritten
+            image_service: Resolves upload URLs and paths
+            derivative_service: Cached thumbnails/previews, moved along with their source
+            layout: Target layout, 'date' or 'hash'
+            batch_size: Assessments per transaction
+            min_age: Skip files modified less than this many seconds ago, whose assessment may not
+                be saved yet
+            max_per_second: Files moved per second (0 = unthrottled)
+            move_unreferenced: Also move flat files that no assessment references
+            dry_run: Count what would move without touching files or rows
+
+        Raises:
+            ValueError: For an unknown layout, or when uploads are not on local storage
+        """
+        if not isinstance(image_service.storage, LocalStorage):
+            raise ValueError("Upload migration needs local storage (STORAGE_BACKEND=local)")
+        if layout not in ('date', 'hash'):
+            raise ValueError(f"Cannot migrate to layout '{layout}'; use 'date' or 'hash'")
+        self._database_service = database_service
+        self._image_service = image_service
+        self._root = image_service.storage.root
+        self._derivative_service = derivative_service
+        self._layout = layout
+        self._batch_size = max(1, batch_size)
+        self._min_age = min_age
+        self._max_per_second = max_per_second
+        self._move_unreferenced = move_unreferenced
+        self._dry_run = dry_run
+        self._stats: Dict[str, Any] = {}
+        self._start = 0.0
+        # Flat files a dry run would have moved with their rows; they are not unreferenced
+        self._dry_run_moved: Set[str] = set()
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        self._stats[key] = self._stats.get(key, 0) + amount
+
+    def _target(self, filename: str) -> Optional[str]:
+        shard = upload_shard(filename, self._layout)
+        return f"{shard}/{filename}" if shard else None
+
+    def _throttle(self) -> None:
+        if self._max_per_second <= 0:
+            return
+        moved = self._stats['files_moved'] + self._stats['unreferenced_moved']
+        delay = self._start + moved / self._max_per_second - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Migrate every flat-layout upload.
+
+        Returns:
+            Statistics: assessments scanned/updated, files moved, already moved, missing, skipped
+            (recent, no timestamp in the name, target taken) and errors
+        """
+        self._stats = {'rows_scanned': 0, 'rows_updated': 0, 'files_moved': 0, 'unreferenced_moved': 0,
+                       'already_moved': 0, 'missing': 0, 'skipped_recent': 0, 'skipped_unsharded': 0,
+                       'name_conflicts': 0, 'derivatives_moved': 0, 'errors': 0}
+        self._start = time.perf_counter()
+        self._dry_run_moved = set()
+
+        for rows in self._database_service.iter_image_references(chunk_size=self._batch_size):
+            self._stats['rows_scanned'] += len(rows)
+            self._migrate_batch(rows)
+            self._throttle()
+
+        # With failed batches some rows still hold flat URLs; their files must stay put
+        if self._move_unreferenced and not self._stats['errors']:
+            self._move_unreferenced_files()
+
+        stats = dict(self._stats)
+        stats['elapsed_seconds'] = round(time.perf_counter() - self._start, 2)
+        stats['dry_run'] = self._dry_run
+        logger.info(f"Upload migration finished: {stats}")
+        return stats
+
+    def _is_recent(self, path: str) -> bool:
+        return os.stat(path).st_mtime > time.time() - self._min_age
+
+    def _migrate_batch(self, rows: List[Dict[str, Any]]) -> None:
+        """Link the batch's flat files into their shards, commit the new URLs, then drop the flat names."""
+        linked: Dict[str, str] = {}  # flat filename -> sharded filename, linked by this batch
+        updates: List[Dict[str, Any]] = []
+
+        for row in rows:
+            new_row = {'id': row['id'], **{column: row.get(column) for column in IMAGE_URL_COLUMNS}}
+            changed = False
+            for column in IMAGE_URL_COLUMNS:
+                filename = self._image_service.get_filename_from_url(row.get(column))
+                if not filename or "/" in filename:
+                    continue
+                target = linked.get(filename) or self._link(filename)
+                if target is None:
+                    continue
+                if os.path.exists(os.path.join(self._root, filename)):
+                    linked[filename] = target
+                new_row[column] = self._image_service.get_image_url(target)
+                changed = True
+            if changed:
+                updates.append(new_row)
+
+        if self._dry_run:
+            self._stats['rows_updated'] += len(updates)
+            self._stats['files_moved'] += len(linked)
+            self._dry_run_moved.update(linked)
+            return
+
+        if self._database_service.update_image_urls(updates) is None:
+            # The database still points at the flat names, so the new links must go
+            for target in linked.values():
+                os.remove(os.path.join(self._root, target))
+            self._count("errors")
+            return
+
+        self._stats['rows_updated'] += len(updates)
+        for filename, target in linked.items():
+            os.remove(os.path.join(self._root, filename))
+            self._move_derivatives(filename, target)
+            self._stats['files_moved'] += 1
+
+    def _link(self, filename: str) -> Optional[str]:
+        """
+        Make a flat file reachable under its sharded name as well.
+
+        Returns:
+            The sharded filename to store in the database, or None to leave the reference alone
+        """
+        target = self._target(filename)
+        if target is None:
+            self._count("skipped_unsharded")
+            return None
+        source_path = os.path.join(self._root, filename)
+        target_path = os.path.join(self._root, target)
+
+        if not os.path.exists(source_path):
+            # Moved by an earlier batch or run whose rows were updated separately
+            if os.path.exists(target_path):
+                self._count("already_moved")
+                return target
+            self._count("missing")
+            return None
+        if self._is_recent(source_path):
+            self._count("skipped_recent")
+            return None
+        if os.path.exists(target_path):
+            if os.path.samefile(source_path, target_path):
+                # Left linked by an interrupted run
+                return target
+            self._count("name_conflicts")
+            return None
+        if self._dry_run:
+            return target
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        try:
+            os.link(source_path, target_path)
+        except OSError:
+            # Filesystems without hard links: copy, keeping the timestamp retention relies on
+            shutil.copy2(source_path, target_path)
+        return target
+
+    def _move_derivatives(self, filename: str, target: str) -> None:
+        if self._derivative_service is None:
+            return
+        for variant in self._derivative_service.variants:
+            source_path = self._derivative_service.get_derivative_path(filename, variant)
+            target_path = self._derivative_service.get_derivative_path(target, variant)
+            try:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.replace(source_path, target_path)
+                self._count("derivatives_moved")
+            except FileNotFoundError:
+                pass
+
+    def _move_unreferenced_files(self) -> None:
+        """Move the flat files no assessment references (orphans, or rows saved by another layout)."""
+        pending: List[Tuple[str, str]] = []
+        with os.scandir(self._root) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith(".") or entry.name.endswith(".tmp"):
+                    continue
+                if entry.name in self._dry_run_moved:
+                    continue
+                target = self._target(entry.name)
+                if target is None:
+                    self._count("skipped_unsharded")
+                elif entry.stat().st_mtime > time.time() - self._min_age:
+                    self._count("skipped_recent")
+                elif os.path.exists(os.path.join(self._root, target)):
+                    self._count("name_conflicts")
+                else:
+                    pending.append((entry.name, target))
+
+        for filename, target in pending:
+            if not self._dry_run:
+                target_path = os.path.join(self._root, target)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                try:
+                    os.replace(os.path.join(self._root, filename), target_path)
+                except FileNotFoundError:
+                    continue
+                self._move_derivatives(filename, target)
+            self._stats['unreferenced_moved'] += 1
+            self._throttle()
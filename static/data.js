@@ -150,9 +150,11 @@ function displayData(data) {
     data.forEach((item, index) => {
         const clone = template.content.cloneNode(true);
         
-        // Set image - will be updated based on filter
+        // Set image - cards use the small thumbnail, falling back to the full-size upload
         const img = clone.querySelector('img');
-        img.src = item.image_url;
+        img.src = item.thumbnail_url || item.image_url;
+        img.loading = 'lazy';
+        img.decoding = 'async';
         
         // Store original image URL and category-specific image URLs
         const dataItem = clone.querySelector('.data-item');
@@ -711,7 +713,9 @@ function showDetailedModal(item) {
     
     content.innerHTML = `
         <div class="modal-image">
-            <img src="${item.image_url}" alt="Kaong Image" style="max-width: 100%; height: auto;">
+            <a href="${item.image_url}" target="_blank" title="Open full-size image">
+                <img src="${item.preview_url || item.image_url}" alt="Kaong Image" style="max-width: 100%; height: auto;">
+            </a>
         </div>
         <div class="modal-details">
             <h3>Analysis Details</h3>
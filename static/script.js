@@ -62,6 +62,12 @@ function openCamera() {
         // Pwede din idisplay yung error sa user using dialogs or UI elements
     });
 
+    // The server sheds frames when this session or the server is over its limit
+    socket.on('detection_busy', (data) => {
+        const seconds = Math.max(1, Math.ceil((data.retry_after_ms || 1000) / 1000));
+        showWarning(`Detection is busy, please capture again in ${seconds}s.`);
+    });
+
     navigator.mediaDevices.getUserMedia({
         video: {
             width: { ideal: 1280 },
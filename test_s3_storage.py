@@ -0,0 +1,158 @@
+"""
+Tests for the S3 storage backend: single and multipart uploads, parallel save_many,
+presigned URLs and how client errors surface.
+
+They run against an in-process S3 mock and need boto3 and moto:
+    pip install boto3 "moto[s3]"
+    python -m pytest -q test_s3_storage.py
+"""
+import os
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from botocore.exceptions import ClientError
+
+from services.storage_backend import S3_MIN_PART_SIZE, S3Storage, StorageError
+
+BUCKET = "kaong-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    # Never reach a real account, whatever the environment holds
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_storage(**config):
+    return S3Storage({
+        's3_bucket': BUCKET, 's3_prefix': 'uploads/', 's3_endpoint_url': '', 's3_access_key': '',
+        'public_url': '', 'multipart_threshold': S3_MIN_PART_SIZE, 'multipart_chunk_size': S3_MIN_PART_SIZE,
+        'max_concurrency': 2, **config
+    })
+
+
+def read_object(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+
+class TestUploads:
+
+    def test_small_object_is_one_put(self, s3):
+        storage = make_storage()
+        storage.save("2024/06/a.jpg", b"jpeg bytes")
+
+        head = s3.head_object(Bucket=BUCKET, Key="uploads/2024/06/a.jpg")
+        assert head['ContentType'] == "image/jpeg"
+        assert head['CacheControl'] == storage.put_options("a.jpg", None)['CacheControl']
+        assert "-" not in head['ETag']
+        with storage.open("2024/06/a.jpg") as f:
+            assert f.read() == b"jpeg bytes"
+        assert storage.stat("2024/06/a.jpg").size == len(b"jpeg bytes")
+
+    def test_large_object_is_uploaded_in_parts(self, s3):
+        storage = make_storage()
+        data = os.urandom(2 * S3_MIN_PART_SIZE + 1024)
+        storage.save("big.png", data)
+
+        # Multipart ETags end in -<part count>
+        assert s3.head_object(Bucket=BUCKET, Key="uploads/big.png")['ETag'].strip('"').endswith("-3")
+        assert read_object(s3, "uploads/big.png") == data
+        assert not s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads')
+
+    def test_writer_smaller_than_a_part_falls_back_to_put(self, s3):
+        storage = make_storage()
+        with storage.open_writer("small.webp") as writer:
+            writer.write(b"a")
+            writer.write(b"b")
+
+        assert read_object(s3, "uploads/small.webp") == b"ab"
+        assert s3.head_object(Bucket=BUCKET, Key="uploads/small.webp")['ContentType'] == "image/webp"
+
+    def test_abort_discards_the_multipart_upload(self, s3):
+        storage = make_storage()
+        writer = storage.open_writer("partial.jpg")
+        writer.write(os.urandom(S3_MIN_PART_SIZE))
+        assert s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads')
+
+        writer.abort()
+
+        assert not s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads')
+        with pytest.raises(FileNotFoundError):
+            storage.stat("partial.jpg")
+
+    def test_save_many_uploads_in_parallel_and_reports_each_failure(self, s3):
+        storage = make_storage()
+        items = [(f"batch/{index}.jpg", bytes([index]) * 100, None) for index in range(8)]
+        items.append(("../escape.jpg", b"x", None))
+
+        errors = storage.save_many(items)
+
+        assert errors[:8] == [None] * 8
+        assert isinstance(errors[8], FileNotFoundError)
+        assert sorted(obj.key for obj in storage.iter_objects()) == sorted(key for key, _, _ in items[:8])
+        assert read_object(s3, "uploads/batch/3.jpg") == bytes([3]) * 100
+
+    def test_delete_many(self, s3):
+        storage = make_storage()
+        storage.save_many([(f"{index}.jpg", b"x", None) for index in range(3)])
+
+        assert storage.delete_many(["0.jpg", "1.jpg"]) == 2
+        assert [obj.key for obj in storage.iter_objects()] == ["2.jpg"]
+
+
+class TestUrls:
+
+    def test_signed_url_is_presigned_for_the_object(self, s3):
+        storage = make_storage()
+        url = urlparse(storage.signed_url("2024/06/a.jpg", expires=120))
+        query = parse_qs(url.query)
+
+        assert url.path.endswith("/uploads/2024/06/a.jpg")
+        assert query['X-Amz-Expires'] == ["120"]
+        assert 'X-Amz-Signature' in query
+
+    def test_public_url_is_not_signed(self, s3):
+        storage = make_storage(public_url="https://cdn.example.com/kaong")
+
+        assert storage.signed_url("a.jpg") == "https://cdn.example.com/kaong/a.jpg"
+        assert storage.key_from_url("https://cdn.example.com/kaong/a.jpg") == "a.jpg"
+        assert storage.key_from_url(storage.url("a.jpg")) == "a.jpg"
+
+
+class TestClientErrors:
+
+    def test_missing_object_raises_file_not_found(self, s3):
+        storage = make_storage()
+        with pytest.raises(FileNotFoundError):
+            storage.open("missing.jpg")
+        with pytest.raises(FileNotFoundError):
+            storage.stat("missing.jpg")
+
+    def test_other_client_errors_raise_storage_error(self, s3):
+        storage = make_storage(s3_bucket="no-such-bucket")
+        with pytest.raises(StorageError, match="put_object"):
+            storage.save("a.jpg", b"x")
+
+    def test_failed_multipart_upload_is_aborted(self, s3, monkeypatch):
+        storage = make_storage()
+
+        def fail(**kwargs):
+            raise ClientError({'Error': {'Code': 'InternalError', 'Message': 'boom'}}, "CompleteMultipartUpload")
+
+        monkeypatch.setattr(storage.client, "complete_multipart_upload", fail)
+        with pytest.raises(StorageError, match="complete_multipart_upload"):
+            storage.save("big.jpg", os.urandom(S3_MIN_PART_SIZE + 1024))
+
+        assert not s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads')
+        with pytest.raises(FileNotFoundError):
+            storage.stat("big.jpg")
@@ -0,0 +1,295 @@
+"""
+Tests for the jobs that delete, move and rewrite stored uploads: retention and orphan
+reconciliation, the flat-to-sharded migration and the recompression job.
+
+They run against the SQLite backend and a temporary upload folder:
+    python -m pytest -q test_upload_maintenance.py
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+
+from config import DB_CONFIG, ARCHIVE_ENCODING_CONFIG
+from services.database_service import Assessment, DatabaseService
+from services.image_service import ImageService, archive_codec_available, get_archive_policy
+from services.storage_backend import LocalStorage
+from services.retention_service import RetentionService
+from services.upload_migration_service import UploadMigrator
+from services.recompression_service import UploadRecompressor
+
+# Older than every min_age / grace period used below
+OLD = time.time() - 3 * 24 * 3600
+
+
+@pytest.fixture
+def database_service(tmp_path, monkeypatch):
+    monkeypatch.setitem(DB_CONFIG, 'backend', 'sqlite')
+    monkeypatch.setitem(DB_CONFIG, 'sqlite_path', str(tmp_path / "assessments.db"))
+    monkeypatch.setitem(DB_CONFIG, 'pool_size', 2)
+    service = DatabaseService()
+    assert service.create_tables()
+    return service
+
+
+@pytest.fixture
+def image_service(tmp_path):
+    return ImageService(storage=LocalStorage(str(tmp_path / "uploads")))
+
+
+def write_image(image_service, filename, mtime=OLD, quality=95):
+    """Store a small JPEG under filename with the given modification time."""
+    path = os.path.join(image_service.storage.root, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image = Image.linear_gradient("L").convert("RGB").resize((320, 240))
+    image.save(path, "JPEG", quality=quality)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def add_assessment(database_service, image_service, filename, timestamp=None, ripe_filename=None):
+    """Insert an assessment referencing stored images and return its id."""
+    assessment = Assessment(
+        image_url=image_service.storage.url(filename),
+        assessment="Ready for Harvesting",
+        confidence=0.9,
+        source="upload",
+        ripe_image_url=image_service.storage.url(ripe_filename) if ripe_filename else None,
+        timestamp=timestamp or datetime.now()
+    )
+    assert database_service.save_assessments_bulk([assessment]) == 1
+    return max(row['id'] for chunk in database_service.iter_image_references() for row in chunk)
+
+
+def image_urls(database_service):
+    """Map of assessment id -> image_url."""
+    return {row['id']: row['image_url'] for chunk in database_service.iter_image_references() for row in chunk}
+
+
+def retention(database_service, image_service, **config):
+    return RetentionService(database_service, image_service, config={
+        'retention_days': 30, 'max_deletes_per_second': 0, 'batch_size': 2, 'orphan_grace': 3600,
+        'delete_orphan_files': False, 'delete_orphan_rows': False, **config
+    })
+
+
+class TestRetention:
+
+    def test_expire_deletes_old_assessments_and_their_files(self, database_service, image_service):
+        old_paths, old_ids = [], []
+        for index in range(3):
+            original = f"kaong_upload_20240101_12000{index}_000001.jpg"
+            ripe = f"kaong_ripe_20240101_12000{index}.jpg"
+            old_paths += [write_image(image_service, original), write_image(image_service, ripe)]
+            old_ids.append(add_assessment(database_service, image_service, original,
+                                          timestamp=datetime.now() - timedelta(days=60), ripe_filename=ripe))
+        recent_path = write_image(image_service, "kaong_upload_20250101_120000_000001.jpg")
+        recent_id = add_assessment(database_service, image_service, "kaong_upload_20250101_120000_000001.jpg")
+
+        stats = retention(database_service, image_service).expire()
+
+        assert stats['assessments_deleted'] == 3
+        assert stats['files_deleted'] == 6
+        assert list(image_urls(database_service)) == [recent_id]
+        assert not any(os.path.exists(path) for path in old_paths)
+        assert os.path.exists(recent_path)
+
+    def test_expire_dry_run_changes_nothing(self, database_service, image_service):
+        path = write_image(image_service, "kaong_upload_20240101_120000_000001.jpg")
+        add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg",
+                       timestamp=datetime.now() - timedelta(days=60))
+
+        stats = retention(database_service, image_service).expire(dry_run=True)
+
+        assert stats['expired'] == 1
+        assert stats['assessments_deleted'] == 0
+        assert len(image_urls(database_service)) == 1
+        assert os.path.exists(path)
+
+    def test_expire_disabled_without_retention_days(self, database_service, image_service):
+        add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg",
+                       timestamp=datetime.now() - timedelta(days=600))
+
+        stats = retention(database_service, image_service, retention_days=0).expire()
+
+        assert 'skipped' in stats
+        assert len(image_urls(database_service)) == 1
+
+
+class TestReconcile:
+
+    @pytest.fixture
+    def layout(self, database_service, image_service):
+        """One healthy assessment, one whose image is gone, an old and a recent unreferenced file."""
+        files = {
+            'kept': write_image(image_service, "kaong_upload_20240101_120000_000001.jpg"),
+            'old_orphan': write_image(image_service, "2024/01/01/kaong_upload_20240101_130000_000001.jpg"),
+            'recent_orphan': write_image(image_service, "kaong_upload_20240101_140000_000001.jpg",
+                                         mtime=time.time())
+        }
+        ids = {
+            'kept': add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg"),
+            'missing': add_assessment(database_service, image_service, "kaong_upload_20240101_150000_000001.jpg")
+        }
+        return files, ids
+
+    def test_counts_orphans_in_both_directions(self, database_service, image_service, layout):
+        files, ids = layout
+
+        stats = retention(database_service, image_service).reconcile()
+
+        # The recent unreferenced file is inside the grace window: its row may not be committed yet
+        assert stats['files_scanned'] == 3
+        assert stats['orphan_files'] == 1
+        assert stats['orphan_rows'] == 1
+        assert stats['orphan_files_deleted'] == stats['orphan_rows_deleted'] == 0
+        assert all(os.path.exists(path) for path in files.values())
+        assert set(image_urls(database_service)) == set(ids.values())
+
+    def test_deletes_orphans_outside_the_grace_window(self, database_service, image_service, layout):
+        files, ids = layout
+
+        stats = retention(database_service, image_service).reconcile(delete_orphan_files=True,
+                                                                      delete_orphan_rows=True)
+
+        assert stats['orphan_files_deleted'] == 1
+        assert stats['orphan_rows_deleted'] == 1
+        assert not os.path.exists(files['old_orphan'])
+        assert os.path.exists(files['recent_orphan'])
+        assert os.path.exists(files['kept'])
+        assert list(image_urls(database_service)) == [ids['kept']]
+
+    def test_flat_url_of_migrated_file_is_not_an_orphan(self, database_service, image_service):
+        # A row saved before migrate_uploads.py still holds the flat URL of a file now in its shard
+        path = write_image(image_service, "2024/01/01/kaong_upload_20240101_120000_000001.jpg")
+        add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg")
+
+        stats = retention(database_service, image_service).reconcile(delete_orphan_files=True,
+                                                                      delete_orphan_rows=True)
+
+        assert stats['orphan_files'] == stats['orphan_rows'] == 0
+        assert os.path.exists(path)
+
+
+class TestUploadMigration:
+
+    def migrator(self, database_service, image_service, **options):
+        return UploadMigrator(database_service, image_service, layout='date', batch_size=2, min_age=0, **options)
+
+    def test_moves_files_and_rewrites_urls(self, database_service, image_service):
+        root = image_service.storage.root
+        write_image(image_service, "kaong_upload_20240101_120000_000001.jpg")
+        write_image(image_service, "kaong_ripe_20240101_120000.jpg")
+        write_image(image_service, "kaong_upload_20240202_120000_000001.jpg")  # unreferenced
+        assessment_id = add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg",
+                                       ripe_filename="kaong_ripe_20240101_120000.jpg")
+
+        stats = self.migrator(database_service, image_service).run()
+
+        assert stats['files_moved'] == 2
+        assert stats['unreferenced_moved'] == 1
+        assert stats['errors'] == 0
+        assert image_urls(database_service)[assessment_id] == \
+            image_service.storage.url("2024/01/01/kaong_upload_20240101_120000_000001.jpg")
+        assert os.path.exists(os.path.join(root, "2024/01/01/kaong_ripe_20240101_120000.jpg"))
+        assert os.path.exists(os.path.join(root, "2024/02/02/kaong_upload_20240202_120000_000001.jpg"))
+        assert not [entry for entry in os.listdir(root) if os.path.isfile(os.path.join(root, entry))]
+
+    def test_failed_commit_rolls_back_links(self, database_service, image_service, monkeypatch):
+        root = image_service.storage.root
+        flat_path = write_image(image_service, "kaong_upload_20240101_120000_000001.jpg")
+        unreferenced_path = write_image(image_service, "kaong_upload_20240202_120000_000001.jpg")
+        assessment_id = add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg")
+        flat_url = image_urls(database_service)[assessment_id]
+        update_image_urls = database_service.update_image_urls
+        monkeypatch.setattr(database_service, "update_image_urls", lambda rows: None)
+
+        stats = self.migrator(database_service, image_service).run()
+
+        assert stats['errors'] == 1
+        assert stats['files_moved'] == stats['rows_updated'] == 0
+        assert image_urls(database_service)[assessment_id] == flat_url
+        assert os.path.exists(flat_path)
+        assert not os.path.exists(os.path.join(root, "2024/01/01/kaong_upload_20240101_120000_000001.jpg"))
+        # Unreferenced files stay put while any row still holds a flat URL
+        assert os.path.exists(unreferenced_path)
+
+        monkeypatch.setattr(database_service, "update_image_urls", update_image_urls)
+        stats = self.migrator(database_service, image_service).run()
+
+        assert stats['files_moved'] == 1
+        assert not os.path.exists(flat_path)
+        assert image_urls(database_service)[assessment_id] == \
+            image_service.storage.url("2024/01/01/kaong_upload_20240101_120000_000001.jpg")
+
+    def test_skips_recent_files(self, database_service, image_service):
+        flat_path = write_image(image_service, "kaong_upload_20240101_120000_000001.jpg", mtime=time.time())
+        add_assessment(database_service, image_service, "kaong_upload_20240101_120000_000001.jpg")
+
+        stats = UploadMigrator(database_service, image_service, layout='date', min_age=3600).run()
+
+        assert stats['skipped_recent'] >= 1
+        assert stats['files_moved'] == 0
+        assert os.path.exists(flat_path)
+
+
+class TestRecompression:
+
+    @pytest.fixture(autouse=True)
+    def webp_uploads(self, monkeypatch):
+        """Archive uploads as WebP, so recompression renames the quality-100 JPEG backlog."""
+        if not archive_codec_available('webp'):
+            pytest.skip("Pillow cannot write WebP")
+        monkeypatch.setitem(ARCHIVE_ENCODING_CONFIG['policies'], 'upload', {'format': 'webp', 'quality': 80})
+        get_archive_policy.cache_clear()
+        yield
+        get_archive_policy.cache_clear()
+
+    def recompressor(self, database_service, image_service):
+        return UploadRecompressor(database_service, image_service, min_savings=0.1, min_age=0, workers=1)
+
+    def test_renames_file_and_repoints_assessments(self, database_service, image_service):
+        root = image_service.storage.root
+        filename = "2024/01/01/kaong_upload_20240101_120000_000001.jpg"
+        write_image(image_service, filename, quality=100)
+        assessment_id = add_assessment(database_service, image_service, filename)
+
+        stats = self.recompressor(database_service, image_service).run()
+
+        new_filename = filename[:-len("jpg")] + "webp"
+        assert stats['recompressed'] == stats['renamed'] == 1
+        assert stats['bytes_after'] < stats['bytes_before']
+        assert not os.path.exists(os.path.join(root, filename))
+        assert os.path.getmtime(os.path.join(root, new_filename)) == pytest.approx(OLD)
+        assert image_urls(database_service)[assessment_id] == image_service.storage.url(new_filename)
+        with Image.open(os.path.join(root, new_filename)) as image:
+            assert image.format == "WEBP"
+
+    def test_failed_url_update_keeps_original(self, database_service, image_service, monkeypatch):
+        root = image_service.storage.root
+        filename = "2024/01/01/kaong_upload_20240101_120000_000001.jpg"
+        path = write_image(image_service, filename, quality=100)
+        assessment_id = add_assessment(database_service, image_service, filename)
+        monkeypatch.setattr(database_service, "replace_image_url", lambda old_url, new_url: None)
+
+        stats = self.recompressor(database_service, image_service).run()
+
+        assert stats['errors'] == 1
+        assert stats['renamed'] == 0
+        assert os.path.exists(path)
+        assert not os.path.exists(os.path.join(root, filename[:-len("jpg")] + "webp"))
+        assert image_urls(database_service)[assessment_id] == image_service.storage.url(filename)
+
+    def test_dry_run_writes_nothing(self, database_service, image_service):
+        filename = "2024/01/01/kaong_upload_20240101_120000_000001.jpg"
+        path = write_image(image_service, filename, quality=100)
+        size = os.path.getsize(path)
+
+        stats = UploadRecompressor(database_service, image_service, min_savings=0.1, min_age=0,
+                                   workers=1, dry_run=True).run()
+
+        assert stats['recompressed'] == 1
+        assert stats['renamed'] == 0
+        assert os.path.getsize(path) == size
@@ -1,53 +1,306 @@
-import torch
-import torchvision
-import torchvision.transforms as transforms
-import torchvision.models.detection as detection
-from torch.utils.data import DataLoader, Dataset
+"""
+Train or fine-tune the kaong detection model.
+
+Reads a YOLO-format dataset (see training/dataset.py), fine-tunes an ultralytics
+detection model for the Ripe/Rotten/Unripe classes in KAONG_LABELS_MAP, and writes
+a versioned run to models/<version>/ (best.pt, last.pt, metrics.json). The best
+weights are also published as models/<version>.pt, which DetectionService loads
+directly and the model registry's file watcher picks up when MODEL_WATCH_DIR=models.
+
+Usage:
+    python train_model.py --epochs 50
+    python train_model.py --weights best_2.pt --epochs 10 --lr 0.0005
+    python train_model.py --weights yolo11n.pt --batch-size 8 --workers 4 --no-amp
+"""
 import os
-import cv2
-import numpy as np
-from PIL import Image
+import sys
+import copy
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict
+
+import torch
+from torch.utils.data import DataLoader
 
-# Custom Dataset Class for Kaong Images
-class KaongDataset(Dataset):
-    def __init__(self, image_folder, transform=None):
-        self.image_folder = image_folder
-        self.transform = transform
-        self.image_files = [f for f in os.listdir(image_folder) if f.endswith(('.png', '.jpg', '.jpeg'))]
+from config import KAONG_LABELS_MAP, LOGGING_CONFIG, TRAINING_CONFIG, DEFAULT_MODEL_PATH, get_model_path
+from training.dataset import DatasetError, DecodedImageCache, KaongDataset, collate_batch, find_samples
+from training.dataset_cache import CompiledKaongDataset, compile_dataset
 
-    def __len__(self):
-        return len(self.image_files)
+logger = logging.getLogger("train_model")
 
-    def __getitem__(self, idx):
-        img_path = os.path.join(self.image_folder, self.image_files[idx])
-        image = Image.open(img_path).convert("RGB")
 
-        if self.transform:
-            image = self.transform(image)
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train the kaong detection model")
+    parser.add_argument("--data", default=TRAINING_CONFIG['dataset_dir'], help="YOLO-format dataset directory")
+    parser.add_argument("--weights", default=get_model_path(),
+                        help=f"Initial weights (default: served model, falling back to {DEFAULT_MODEL_PATH})")
+    parser.add_argument("--output", default=TRAINING_CONFIG['output_dir'], help="Directory for versioned runs")
+    parser.add_argument("--name", help="Run/version name (default: kaong-<timestamp>)")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--imgsz", type=int, default=TRAINING_CONFIG['imgsz'])
+    parser.add_argument("--lr", type=float, default=0.001, help="Peak AdamW learning rate")
+    parser.add_argument("--weight-decay", type=float, default=0.0005)
+    parser.add_argument("--warmup-epochs", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=min(8, max(1, (os.cpu_count() or 2) - 1)),
+                        help="DataLoader worker processes")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 keeps the default)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--no-amp", dest="amp", action="store_false",
+                        help="Disable mixed precision (bfloat16 on CPU, float16 on CUDA)")
+    parser.add_argument("--cache", choices=["memmap", "disk", "none"], default="memmap",
+                        help="memmap: compile once into a memory-mapped array; disk: per-image .npz cache; "
+                             "none: decode every epoch")
+    parser.add_argument("--patience", type=int, default=10, help="Stop after this many epochs without improvement")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
 
-        return image
 
-# Load a Pretrained RetinaNet Model
-def load_retinanet():
-    model = detection.retinanet_resnet50_fpn(pretrained=True)
-    model.eval()  # Set to evaluation mode (since we're fine-tuning)
+def build_model(weights: str):
+    """
+    Create a 3-class DetectionModel and transfer every compatible tensor from weights.
+
+    The detection head is re-initialised when the source model has a different class
+    count (e.g. the 80-class yolo11n.pt); fine-tuning best_2.pt keeps it.
+    """
+    from ultralytics.cfg import get_cfg
+    from ultralytics.nn.tasks import DetectionModel, attempt_load_one_weight
+
+    source_model, _ = attempt_load_one_weight(weights)
+    model = DetectionModel(source_model.yaml, nc=len(KAONG_LABELS_MAP), verbose=False)
+    model.load(source_model)
+    model.names = dict(KAONG_LABELS_MAP)
+    # Loss gains (box/cls/dfl) come from the ultralytics defaults
+    model.args = get_cfg()
+    for parameter in model.parameters():
+        parameter.requires_grad = True
     return model
 
-# Define Image Transformations
-transform = transforms.Compose([
-    transforms.Resize((400, 400)),  # Smaller resolution for faster processing
-    transforms.ToTensor(),
-])
 
-# Load Dataset
-image_folder = "dataset"  # Change this to your dataset folder
-dataset = KaongDataset(image_folder, transform=transform)
-dataloader = DataLoader(dataset, batch_size=4, shuffle=True)
+def build_dataset(args: argparse.Namespace, split: str, augment: bool, required: bool = True):
+    """
+    KaongDataset or its compiled, memory-mapped equivalent depending on --cache.
+
+    A split that is not required and has no image directory gives an empty dataset.
+    """
+    try:
+        samples = find_samples(args.data, split)
+    except DatasetError:
+        if required:
+            raise
+        print(f"No {split} images found under {args.data}/images/{split}; continuing without them")
+        samples = []
+    if args.cache == "memmap" and samples:
+        compiled = compile_dataset(samples, args.imgsz, TRAINING_CONFIG['cache_dir'], split, workers=args.workers)
+        return CompiledKaongDataset(compiled, augment=augment)
+    cache = DecodedImageCache(TRAINING_CONFIG['cache_dir'], args.imgsz) if args.cache == "disk" else None
+    return KaongDataset(samples, args.imgsz, cache=cache, augment=augment)
+
+
+def build_loader(dataset, batch_size: int, workers: int, shuffle: bool, pin_memory: bool) -> DataLoader:
+    """DataLoader with persistent, prefetching workers so epochs do not pay for worker startup."""
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=workers,
+        persistent_workers=workers > 0,
+        prefetch_factor=4 if workers > 0 else None,
+        pin_memory=pin_memory,
+        collate_fn=collate_batch,
+        drop_last=False
+    )
+
+
+def to_device(batch: Dict[str, Any], device: torch.device) -> Dict[str, Any]:
+    """Move a collated batch to the device and scale images to [0, 1] floats there."""
+    non_blocking = device.type == "cuda"
+    batch = dict(batch)
+    batch['img'] = batch['img'].to(device, non_blocking=non_blocking).float().div_(255)
+    for key in ('batch_idx', 'cls', 'bboxes'):
+        batch[key] = batch[key].to(device, non_blocking=non_blocking)
+    return batch
+
+
+def autocast_context(device: torch.device, enabled: bool):
+    """bfloat16 autocast on CPU (no loss scaling needed), float16 on CUDA."""
+    dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+    return torch.autocast(device_type=device.type, dtype=dtype, enabled=enabled)
+
+
+def save_checkpoint(model, path: str, epoch: int, metrics: Dict[str, Any], train_args: Dict[str, Any]) -> None:
+    """Save in the ultralytics checkpoint layout so YOLO(path) and DetectionService can load it."""
+    from ultralytics import __version__ as ultralytics_version
+
+    checkpoint = {
+        'epoch': epoch,
+        'model': copy.deepcopy(model).half(),
+        'ema': None,
+        'optimizer': None,
+        'train_args': train_args,
+        'train_metrics': metrics,
+        'date': datetime.now().isoformat(),
+        'version': ultralytics_version
+    }
+    tmp_path = path + ".tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def run_epoch(model, loader: DataLoader, device: torch.device, amp: bool, optimizer=None,
+              scheduler=None, scaler=None) -> Dict[str, float]:
+    """One pass over loader; trains when an optimizer is given, otherwise evaluates the loss."""
+    training = optimizer is not None
+    model.train(training)
+    totals = torch.zeros(3)
+    images = 0
+    data_seconds = 0.0
+    start = time.perf_counter()
+    fetch_start = start
+
+    with torch.set_grad_enabled(training):
+        for batch in loader:
+            data_seconds += time.perf_counter() - fetch_start
+            batch = to_device(batch, device)
+            with autocast_context(device, amp):
+                loss, loss_items = model.loss(batch)
+            loss = loss.sum()
+
+            if training:
+                optimizer.zero_grad(set_to_none=True)
+                if scaler is not None:
+                    scaler.scale(loss).backward()
+                    scaler.unscale_(optimizer)
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=10.0)
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    loss.backward()
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=10.0)
+                    optimizer.step()
+                scheduler.step()
+
+            batch_size = batch['img'].shape[0]
+            totals += loss_items.detach().float().cpu() * batch_size
+            images += batch_size
+            fetch_start = time.perf_counter()
+
+    seconds = time.perf_counter() - start
+    box, cls, dfl = (totals / max(images, 1)).tolist()
+    return {
+        'box_loss': round(box, 5),
+        'cls_loss': round(cls, 5),
+        'dfl_loss': round(dfl, 5),
+        'loss': round(box + cls + dfl, 5),
+        'seconds': round(seconds, 2),
+        'images_per_sec': round(images / seconds, 2) if seconds > 0 else 0.0,
+        # Share of the epoch spent waiting on the DataLoader; high values mean input-bound
+        'data_wait_fraction': round(data_seconds / seconds, 3) if seconds > 0 else 0.0
+    }
+
+
+def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=getattr(logging, LOGGING_CONFIG['level']),
+        format=LOGGING_CONFIG['format'],
+        filename=LOGGING_CONFIG['filename'] if LOGGING_CONFIG['filename'] else None
+    )
+    torch.manual_seed(args.seed)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+
+    version = args.name or f"kaong-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    run_dir = os.path.join(args.output, version)
+    os.makedirs(run_dir, exist_ok=True)
+
+    train_set = build_dataset(args, "train", augment=True)
+    val_set = build_dataset(args, "val", augment=False, required=False)
+    if not len(train_set):
+        print(f"No training images found under {args.data}/images/train")
+        return 1
+    print(f"Training on {len(train_set)} images {train_set.class_counts()}, validating on {len(val_set)}")
+
+    pin_memory = device.type == "cuda"
+    train_loader = build_loader(train_set, args.batch_size, args.workers, shuffle=True, pin_memory=pin_memory)
+    val_loader = build_loader(val_set, args.batch_size, args.workers, shuffle=False, pin_memory=pin_memory)
+
+    model = build_model(args.weights).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    total_steps = max(1, args.epochs * len(train_loader))
+    warmup_steps = int(args.warmup_epochs * len(train_loader))
+
+    def lr_factor(step: int) -> float:
+        # Linear warm-up, then cosine decay to 1% of the peak rate
+        if step < warmup_steps:
+            return (step + 1) / warmup_steps
+        progress = (step - warmup_steps) / max(1, total_steps - warmup_steps)
+        return 0.01 + 0.99 * 0.5 * (1 + math.cos(math.pi * progress))
+
+    scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lr_factor)
+    scaler = torch.amp.GradScaler("cuda") if args.amp and device.type == "cuda" else None
+
+    train_args = {'task': 'detect', 'imgsz': args.imgsz, 'data': os.path.abspath(args.data),
+                  'epochs': args.epochs, 'batch': args.batch_size, 'lr0': args.lr,
+                  'weights': args.weights, 'amp': args.amp}
+    history = []
+    best_loss, best_epoch = float("inf"), -1
+
+    try:
+        for epoch in range(1, args.epochs + 1):
+            train_metrics = run_epoch(model, train_loader, device, args.amp, optimizer, scheduler, scaler)
+            val_metrics = run_epoch(model, val_loader, device, args.amp) if len(val_set) else {}
+            epoch_metrics = {'epoch': epoch, 'lr': scheduler.get_last_lr()[0],
+                             'train': train_metrics, 'val': val_metrics}
+            history.append(epoch_metrics)
+
+            monitored = val_metrics.get('loss', train_metrics['loss'])
+            if monitored < best_loss:
+                best_loss, best_epoch = monitored, epoch
+                save_checkpoint(model, os.path.join(run_dir, "best.pt"), epoch, epoch_metrics, train_args)
+            save_checkpoint(model, os.path.join(run_dir, "last.pt"), epoch, epoch_metrics, train_args)
+
+            print(f"epoch {epoch}/{args.epochs}  train loss {train_metrics['loss']:.4f}  "
+                  f"val loss {val_metrics.get('loss', float('nan')):.4f}  "
+                  f"{train_metrics['images_per_sec']:.1f} img/s  data wait {train_metrics['data_wait_fraction']:.0%}")
+
+            if epoch - best_epoch >= args.patience:
+                print(f"No improvement for {args.patience} epochs, stopping")
+                break
+    except KeyboardInterrupt:
+        print("\nInterrupted; keeping the checkpoints written so far")
+
+    report = {
+        'version': version,
+        'weights': args.weights,
+        'best_epoch': best_epoch,
+        'best_loss': best_loss,
+        'train_images': len(train_set),
+        'val_images': len(val_set),
+        'class_counts': train_set.class_counts(),
+        'args': vars(args),
+        'history': history
+    }
+    with open(os.path.join(run_dir, "metrics.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    if best_epoch < 0:
+        print(f"No checkpoint written; metrics in {run_dir}/metrics.json")
+        return 1
+
+    # Publish via copy-then-rename so a watching server never loads a partial file
+    published_path = os.path.join(args.output, f"{version}.pt")
+    shutil.copyfile(os.path.join(run_dir, "best.pt"), published_path + ".tmp")
+    os.replace(published_path + ".tmp", published_path)
+    print(f"Best epoch {best_epoch} (loss {best_loss:.4f}); weights published to {published_path}")
+    return 0
 
-# Load Model
-model = load_retinanet()
 
-# Save Model
-model_path = "model.pth"
-torch.jit.save(torch.jit.script(model), model_path)
-print(f"Model saved to {model_path}")
+if __name__ == "__main__":
+    sys.exit(main())
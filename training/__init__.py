@@ -0,0 +1,4 @@
+"""
+Training and evaluation utilities for the kaong detection model.
+Entry point: `python train_model.py`; see README.md for options.
+"""
@@ -0,0 +1,223 @@
+"""
+Kaong dataset in YOLO format.
+
+Images live under <root>/images/<split>/ and each has a label file under
+<root>/labels/<split>/ with one "class cx cy w h" line per fruit (normalised
+coordinates, class ids from KAONG_LABELS_MAP). Images are letterboxed to a square
+training size; decoded results are cached on disk so only the first epoch pays
+for JPEG decode and resize.
+"""
+import os
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+from torch.utils.data import Dataset
+
+from config import ALLOWED_EXTENSIONS, KAONG_LABELS_MAP
+
+logger = logging.getLogger(__name__)
+
+# Padding colour used by ultralytics letterboxing
+PAD_VALUE = 114
+
+# (image path, label path)
+Sample = Tuple[str, str]
+
+
+class DatasetError(Exception):
+    """Custom exception for dataset errors."""
+    pass
+
+
+def find_samples(dataset_dir: str, split: str) -> List[Sample]:
+    """
+    List image/label pairs for one split.
+
+    Images without a label file are kept as background (no fruit) samples.
+    """
+    images_dir = os.path.join(dataset_dir, "images", split)
+    labels_dir = os.path.join(dataset_dir, "labels", split)
+    if not os.path.isdir(images_dir):
+        raise DatasetError(f"Missing image directory: {images_dir}")
+
+    samples = []
+    for root, dirs, files in os.walk(images_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if "." not in name or name.rsplit(".", 1)[1].lower() not in ALLOWED_EXTENSIONS:
+                continue
+            image_path = os.path.join(root, name)
+            relative = os.path.relpath(image_path, images_dir)
+            samples.append((image_path, os.path.join(labels_dir, os.path.splitext(relative)[0] + ".txt")))
+    return samples
+
+
+def read_yolo_labels(label_path: str) -> np.ndarray:
+    """
+    Read a YOLO label file.
+
+    Returns:
+        float32 array of shape (n, 5): class, cx, cy, w, h (normalised)
+
+    Raises:
+        DatasetError: If a line is malformed or uses an unknown class id
+    """
+    if not os.path.exists(label_path):
+        return np.zeros((0, 5), dtype=np.float32)
+
+    rows = []
+    with open(label_path) as f:
+        for line_number, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 5:
+                raise DatasetError(f"{label_path}:{line_number}: expected 5 values, got {len(parts)}")
+            class_id, *box = float(parts[0]), *map(float, parts[1:])
+            if int(class_id) not in KAONG_LABELS_MAP:
+                raise DatasetError(f"{label_path}:{line_number}: unknown class id {int(class_id)}")
+            rows.append([class_id, *np.clip(box, 0.0, 1.0)])
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def letterbox(image: Image.Image, size: int) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Resize keeping the aspect ratio and pad to a size x size square.
+
+    Returns:
+        (uint8 HxWx3 array, scale, (pad_x, pad_y))
+    """
+    scale = size / max(image.width, image.height)
+    new_width, new_height = round(image.width * scale), round(image.height * scale)
+    resized = image.resize((new_width, new_height), Image.Resampling.BILINEAR)
+
+    canvas = np.full((size, size, 3), PAD_VALUE, dtype=np.uint8)
+    pad_x, pad_y = (size - new_width) // 2, (size - new_height) // 2
+    canvas[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = np.asarray(resized)
+    return canvas, scale, (pad_x, pad_y)
+
+
+def letterbox_labels(labels: np.ndarray, width: int, height: int, size: int,
+                     scale: float, pad: Tuple[int, int]) -> np.ndarray:
+    """Map normalised boxes from the original image onto the letterboxed square."""
+    if not len(labels):
+        return labels
+    mapped = labels.copy()
+    mapped[:, 1] = (labels[:, 1] * width * scale + pad[0]) / size
+    mapped[:, 2] = (labels[:, 2] * height * scale + pad[1]) / size
+    mapped[:, 3] = labels[:, 3] * width * scale / size
+    mapped[:, 4] = labels[:, 4] * height * scale / size
+    return mapped
+
+
+def load_letterboxed(image_path: str, size: int) -> Tuple[np.ndarray, int, int, float, Tuple[int, int]]:
+    """Decode, apply EXIF orientation and letterbox one image."""
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        array, scale, pad = letterbox(image, size)
+        return array, image.width, image.height, scale, pad
+
+
+class DecodedImageCache:
+    """
+    On-disk cache of letterboxed images as .npy files.
+
+    Keys include the source file's size and mtime, so edited images are decoded
+    again. Shared by all DataLoader workers, and persists across runs.
+    """
+
+    def __init__(self, cache_dir: str, size: int):
+        self._cache_dir = os.path.join(cache_dir, f"decoded_{size}")
+        self._size = size
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+    def _key(self, image_path: str) -> str:
+        stat = os.stat(image_path)
+        fingerprint = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{self._size}"
+        return os.path.join(self._cache_dir, hashlib.sha1(fingerprint.encode()).hexdigest() + ".npz")
+
+    def load(self, image_path: str) -> Tuple[np.ndarray, int, int, float, Tuple[int, int]]:
+        path = self._key(image_path)
+        try:
+            with np.load(path) as cached:
+                meta = cached["meta"]
+                return cached["image"], int(meta[0]), int(meta[1]), float(meta[2]), (int(meta[3]), int(meta[4]))
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            pass
+
+        array, width, height, scale, pad = load_letterboxed(image_path, self._size)
+        # Write-then-rename: several workers may decode the same image on the first epoch
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, image=array, meta=np.array([width, height, scale, *pad], dtype=np.float64))
+        os.replace(tmp_path, path)
+        return array, width, height, scale, pad
+
+
+class KaongDataset(Dataset):
+    """
+    Letterboxed kaong images with their YOLO labels.
+
+    Items are (uint8 CHW image tensor, float32 (n, 5) label tensor, image path).
+    Conversion to float happens on the training side, after the batch leaves the
+    worker, so the IPC transfer stays at one byte per pixel.
+    """
+
+    def __init__(self, samples: List[Sample], size: int, cache: Optional[DecodedImageCache] = None,
+                 augment: bool = False):
+        self.samples = samples
+        self.size = size
+        self.cache = cache
+        self.augment = augment
+        # Labels are small; read them once up front so bad files fail before training starts
+        self.labels = [read_yolo_labels(label_path) for _, label_path in samples]
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor, str]:
+        image_path, _ = self.samples[idx]
+        if self.cache is not None:
+            array, width, height, scale, pad = self.cache.load(image_path)
+        else:
+            array, width, height, scale, pad = load_letterboxed(image_path, self.size)
+        labels = letterbox_labels(self.labels[idx], width, height, self.size, scale, pad)
+
+        if self.augment and np.random.random() < 0.5:
+            array = array[:, ::-1]
+            labels = labels.copy()
+            labels[:, 1] = 1.0 - labels[:, 1]
+
+        image = torch.from_numpy(np.ascontiguousarray(array.transpose(2, 0, 1)))
+        return image, torch.from_numpy(labels), image_path
+
+    def class_counts(self) -> Dict[str, int]:
+        """Number of labelled boxes per class."""
+        counts = {label: 0 for label in KAONG_LABELS_MAP.values()}
+        for labels in self.labels:
+            for class_id in labels[:, 0].astype(int):
+                counts[KAONG_LABELS_MAP[class_id]] += 1
+        return counts
+
+
+def collate_batch(items: List[Tuple[torch.Tensor, torch.Tensor, str]]) -> Dict[str, Any]:
+    """
+    Collate into the batch dictionary the ultralytics detection loss expects.
+
+    Returns:
+        Dictionary with img (B,3,H,W uint8), batch_idx (N,), cls (N,1), bboxes (N,4 normalised xywh)
+        and im_file
+    """
+    images, labels, paths = zip(*items)
+    batch_idx = torch.cat([torch.full((len(item),), i, dtype=torch.float32) for i, item in enumerate(labels)])
+    all_labels = torch.cat(labels) if labels else torch.zeros((0, 5))
+    return {
+        'img': torch.stack(images),
+        'batch_idx': batch_idx,
+        'cls': all_labels[:, 0:1],
+        'bboxes': all_labels[:, 1:5],
+        'im_file': list(paths)
+    }
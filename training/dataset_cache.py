@@ -0,0 +1,197 @@
+"""
+Compiled, memory-mapped training dataset.
+
+compile_dataset() decodes and letterboxes every image of a split once into a single
+uint8 array of shape (N, 3, size, size) on disk, plus an index with each sample's
+source fingerprint, letterbox geometry and labels. CompiledKaongDataset then serves
+zero-copy slices of that array, so epochs do no JPEG decode or resize at all.
+
+Re-compiling is incremental: samples whose image or label file changed (size or
+mtime) are decoded again in place; a changed sample list rebuilds the whole array.
+"""
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from config import KAONG_LABELS_MAP
+from training.dataset import Sample, letterbox_labels, load_letterboxed, read_yolo_labels
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def _fingerprint(sample: Sample) -> List[int]:
+    """Size and mtime of the image and its label file (zeros when there is no label file)."""
+    image_stat = os.stat(sample[0])
+    try:
+        label_stat = os.stat(sample[1])
+        label_part = [label_stat.st_size, label_stat.st_mtime_ns]
+    except FileNotFoundError:
+        label_part = [0, 0]
+    return [image_stat.st_size, image_stat.st_mtime_ns, *label_part]
+
+
+def _compile_rows(images_path: str, shape: Tuple[int, ...], size: int,
+                  rows: List[Tuple[int, str]]) -> List[Tuple[int, List[float]]]:
+    """Worker: decode a slice of samples straight into the shared memmap."""
+    images = np.memmap(images_path, dtype=np.uint8, mode="r+", shape=shape)
+    geometry = []
+    for row, image_path in rows:
+        array, width, height, scale, pad = load_letterboxed(image_path, size)
+        images[row] = array.transpose(2, 0, 1)
+        geometry.append((row, [width, height, scale, pad[0], pad[1]]))
+    images.flush()
+    del images
+    return geometry
+
+
+class CompiledSplit:
+    """Paths and in-memory index of one compiled split."""
+
+    def __init__(self, cache_dir: str, name: str, size: int):
+        self.size = size
+        self.images_path = os.path.join(cache_dir, f"{name}_{size}.images.u8")
+        self.index_path = os.path.join(cache_dir, f"{name}_{size}.index.npz")
+
+    def load_index(self) -> Optional[Dict[str, np.ndarray]]:
+        try:
+            with np.load(self.index_path) as index:
+                data = {key: index[key] for key in index.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if int(data.get('version', -1)) != INDEX_VERSION or int(data['size']) != self.size:
+            return None
+        return data
+
+    def save_index(self, index: Dict[str, Any]) -> None:
+        tmp_path = self.index_path + ".tmp.npz"
+        np.savez(tmp_path, **index)
+        os.replace(tmp_path, self.index_path)
+
+
+def compile_dataset(samples: List[Sample], size: int, cache_dir: str, name: str,
+                    workers: int = 0) -> CompiledSplit:
+    """
+    Compile (or incrementally refresh) the memory-mapped array for one split.
+
+    Args:
+        samples: (image path, label path) pairs from find_samples
+        size: Letterbox size
+        cache_dir: Directory for the .images.u8 and .index.npz files
+        name: Split name used in the file names
+        workers: Decode processes (0 decodes in this process)
+
+    Returns:
+        The compiled split, ready for CompiledKaongDataset
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    split = CompiledSplit(cache_dir, name, size)
+    shape = (len(samples), 3, size, size)
+    paths = np.array([image_path for image_path, _ in samples], dtype=np.str_)
+    fingerprints = np.array([_fingerprint(sample) for sample in samples], dtype=np.int64).reshape(-1, 4)
+
+    index = split.load_index()
+    same_samples = (index is not None and os.path.exists(split.images_path)
+                    and index['paths'].shape == paths.shape and bool((index['paths'] == paths).all()))
+    if same_samples:
+        stale = np.flatnonzero((index['fingerprints'] != fingerprints).any(axis=1))
+        geometry = index['geometry'].copy()
+    else:
+        stale = np.arange(len(samples))
+        geometry = np.zeros((len(samples), 5), dtype=np.float64)
+        # Pre-size the file; pages are only allocated as rows are written
+        with open(split.images_path, "wb") as f:
+            f.truncate(int(np.prod(shape)))
+
+    if len(stale):
+        logger.info(f"Compiling {len(stale)}/{len(samples)} images of '{name}' into {split.images_path}")
+        jobs = [(int(row), samples[row][0]) for row in stale]
+        if workers > 0 and len(jobs) > 1:
+            chunk = max(1, len(jobs) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_compile_rows, split.images_path, shape, size, jobs[i:i + chunk])
+                           for i in range(0, len(jobs), chunk)]
+                results = [future.result() for future in futures]
+        else:
+            results = [_compile_rows(split.images_path, shape, size, jobs)]
+        for rows in results:
+            for row, values in rows:
+                geometry[row] = values
+
+    # Labels are re-read every time: they are tiny and this keeps them in step with the fingerprints
+    labels, offsets = [], [0]
+    for row, (_, label_path) in enumerate(samples):
+        width, height, scale, pad_x, pad_y = geometry[row]
+        mapped = letterbox_labels(read_yolo_labels(label_path), int(width), int(height), size,
+                                  float(scale), (int(pad_x), int(pad_y)))
+        labels.append(mapped)
+        offsets.append(offsets[-1] + len(mapped))
+
+    split.save_index({
+        'version': np.array(INDEX_VERSION),
+        'size': np.array(size),
+        'paths': paths,
+        'fingerprints': fingerprints,
+        'geometry': geometry,
+        'labels': np.concatenate(labels).astype(np.float32) if labels else np.zeros((0, 5), np.float32),
+        'label_offsets': np.array(offsets, dtype=np.int64)
+    })
+    return split
+
+
+class CompiledKaongDataset(Dataset):
+    """
+    Dataset over a compiled split; items match KaongDataset's (image, labels, path).
+
+    The memmap is opened lazily in each DataLoader worker (copy-on-write, so tensors
+    are writable without touching the file) and items are views into it.
+    """
+
+    def __init__(self, split: CompiledSplit, augment: bool = False):
+        index = split.load_index()
+        if index is None:
+            raise FileNotFoundError(f"Dataset not compiled: {split.index_path}")
+        self.split = split
+        self.augment = augment
+        self.paths = [str(path) for path in index['paths']]
+        self.labels = index['labels']
+        self.label_offsets = index['label_offsets']
+        self._images: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def _memmap(self) -> np.memmap:
+        if self._images is None:
+            self._images = np.memmap(self.split.images_path, dtype=np.uint8, mode="c",
+                                     shape=(len(self.paths), 3, self.split.size, self.split.size))
+        return self._images
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Workers re-open the file instead of pickling the mapping
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor, str]:
+        image = torch.from_numpy(self._memmap()[idx])
+        labels = torch.from_numpy(self.labels[self.label_offsets[idx]:self.label_offsets[idx + 1]])
+
+        if self.augment and torch.rand(1).item() < 0.5:
+            image = image.flip(-1)
+            labels = labels.clone()
+            labels[:, 1] = 1.0 - labels[:, 1]
+        return image, labels, self.paths[idx]
+
+    def class_counts(self) -> Dict[str, int]:
+        """Number of labelled boxes per class."""
+        counts = {label: 0 for label in KAONG_LABELS_MAP.values()}
+        for class_id in self.labels[:, 0].astype(int):
+            counts[KAONG_LABELS_MAP[class_id]] += 1
+        return counts
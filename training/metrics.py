@@ -0,0 +1,165 @@
+"""
+Detection accuracy metrics: vectorised IoU matching and COCO-style mAP.
+
+Everything works on numpy arrays so an evaluation over thousands of images costs
+one matrix operation per image rather than Python loops over box pairs.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# COCO IoU thresholds 0.50:0.05:0.95
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def box_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Pairwise IoU of two sets of xyxy boxes.
+
+    Returns:
+        (N, M) array
+    """
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float64)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).clip(0).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).clip(0).prod(axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def match_predictions(pred_boxes: np.ndarray, pred_classes: np.ndarray, gt_boxes: np.ndarray,
+                      gt_classes: np.ndarray, iou_thresholds: np.ndarray = IOU_THRESHOLDS) -> np.ndarray:
+    """
+    Mark each prediction as a true positive at each IoU threshold.
+
+    Each ground-truth box matches at most one prediction of the same class, highest IoU
+    first (the same greedy rule as the ultralytics validator).
+
+    Returns:
+        (N, T) boolean array
+    """
+    correct = np.zeros((len(pred_boxes), len(iou_thresholds)), dtype=bool)
+    if not len(pred_boxes) or not len(gt_boxes):
+        return correct
+
+    iou = box_iou(pred_boxes, gt_boxes) * (pred_classes[:, None] == gt_classes[None, :])
+    for t, threshold in enumerate(iou_thresholds):
+        pred_index, gt_index = np.nonzero(iou >= threshold)
+        if not len(pred_index):
+            continue
+        order = np.argsort(-iou[pred_index, gt_index], kind="stable")
+        pred_index, gt_index = pred_index[order], gt_index[order]
+        # Keep the best pair per prediction, then the best remaining pair per ground truth
+        _, first = np.unique(pred_index, return_index=True)
+        pred_index, gt_index = pred_index[first], gt_index[first]
+        order = np.argsort(-iou[pred_index, gt_index], kind="stable")
+        pred_index, gt_index = pred_index[order], gt_index[order]
+        _, first = np.unique(gt_index, return_index=True)
+        correct[pred_index[first], t] = True
+    return correct
+
+
+def average_precision(recall: np.ndarray, precision: np.ndarray) -> float:
+    """Area under the precision envelope, sampled at 101 recall points (COCO)."""
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([1.0], precision, [0.0]))
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision)))
+    points = np.linspace(0, 1, 101)
+    sampled = np.interp(points, recall, envelope)
+    # Trapezoidal integration (np.trapz was renamed in numpy 2)
+    return float(np.sum((sampled[1:] + sampled[:-1]) / 2 * np.diff(points)))
+
+
+class DetectionEvaluator:
+    """Accumulates per-image matches and computes per-class precision, recall and mAP."""
+
+    def __init__(self, class_names: Dict[int, str], iou_thresholds: np.ndarray = IOU_THRESHOLDS):
+        self.class_names = class_names
+        self.iou_thresholds = iou_thresholds
+        self._correct: List[np.ndarray] = []
+        self._scores: List[np.ndarray] = []
+        self._pred_classes: List[np.ndarray] = []
+        self._gt_classes: List[np.ndarray] = []
+        self.images = 0
+
+    def add(self, pred_boxes: np.ndarray, pred_scores: np.ndarray, pred_classes: np.ndarray,
+            gt_boxes: np.ndarray, gt_classes: np.ndarray) -> None:
+        """
+        Record one image.
+
+        Args:
+            pred_boxes: (N, 4) xyxy, in the same coordinate space as gt_boxes
+            pred_scores: (N,) confidences
+            pred_classes: (N,) class ids
+            gt_boxes: (M, 4) xyxy
+            gt_classes: (M,) class ids
+        """
+        self._correct.append(match_predictions(pred_boxes, pred_classes, gt_boxes, gt_classes,
+                                               self.iou_thresholds))
+        self._scores.append(pred_scores)
+        self._pred_classes.append(pred_classes)
+        self._gt_classes.append(gt_classes)
+        self.images += 1
+
+    def compute(self, score_threshold: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Args:
+            score_threshold: Report precision/recall for the predictions scoring above this
+                (all predictions when None). AP always uses every prediction, so record
+                low-confidence predictions to get mAP comparable with ultralytics.
+
+        Returns:
+            Overall and per-class precision/recall (at IoU 0.5), mAP@0.5 and mAP@0.5:0.95
+        """
+        correct = np.concatenate(self._correct) if self._correct else np.zeros((0, len(self.iou_thresholds)), bool)
+        scores = np.concatenate(self._scores) if self._scores else np.zeros(0)
+        pred_classes = np.concatenate(self._pred_classes) if self._pred_classes else np.zeros(0)
+        gt_classes = np.concatenate(self._gt_classes) if self._gt_classes else np.zeros(0)
+
+        order = np.argsort(-scores, kind="stable")
+        correct, scores, pred_classes = correct[order], scores[order], pred_classes[order]
+
+        per_class = {}
+        for class_id, name in self.class_names.items():
+            mask = pred_classes == class_id
+            num_gt = int((gt_classes == class_id).sum())
+            num_pred = int(mask.sum())
+            # Scores are sorted, so the predictions above the threshold are a prefix
+            num_kept = num_pred if score_threshold is None else int((scores[mask] > score_threshold).sum())
+            true_positives = np.cumsum(correct[mask], axis=0)
+            false_positives = np.cumsum(~correct[mask], axis=0)
+
+            if num_pred and num_gt:
+                recall = true_positives / num_gt
+                precision = true_positives / (true_positives + false_positives)
+                ap = np.array([average_precision(recall[:, t], precision[:, t])
+                               for t in range(len(self.iou_thresholds))])
+                final_precision, final_recall = 0.0, 0.0
+                if num_kept:
+                    final_precision = float(precision[num_kept - 1, 0])
+                    final_recall = float(recall[num_kept - 1, 0])
+            else:
+                ap = np.zeros(len(self.iou_thresholds))
+                final_precision, final_recall = 0.0, 0.0
+
+            per_class[name] = {
+                'ground_truth': num_gt,
+                'predictions': num_kept,
+                'precision': round(final_precision, 4),
+                'recall': round(final_recall, 4),
+                'ap50': round(float(ap[0]), 4),
+                'ap50_95': round(float(ap.mean()), 4)
+            }
+
+        # Classes absent from the holdout set would drag the mean to zero; leave them out
+        present = [metrics for metrics in per_class.values() if metrics['ground_truth']]
+        return {
+            'images': self.images,
+            'precision': round(float(np.mean([m['precision'] for m in present])), 4) if present else 0.0,
+            'recall': round(float(np.mean([m['recall'] for m in present])), 4) if present else 0.0,
+            'map50': round(float(np.mean([m['ap50'] for m in present])), 4) if present else 0.0,
+            'map50_95': round(float(np.mean([m['ap50_95'] for m in present])), 4) if present else 0.0,
+            'per_class': per_class
+        }